@@ -0,0 +1,68 @@
+"""
+JWT authentication that resolves the user and their operator record once and
+keeps them in the cache for AUTH_USER_CACHE_TTL seconds, instead of loading the
+User row (and lazily the Operator row) on every request.
+
+Entries are keyed by user id and the token's token_version claim, and dropped
+whenever the User or its Operator is saved or deleted.
+"""
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+
+from notifications.models import Operator
+
+User = get_user_model()
+
+
+def user_cache_key(user_id, token_version):
+    return f'auth-user:{user_id}:{token_version}'
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken('Token contained no recognizable user identification')
+        # Tokens issued before versioning carry no claim and count as version 0
+        token_version = validated_token.get('token_version', 0)
+
+        key = user_cache_key(user_id, token_version)
+        user = cache.get(key)
+        if user is None:
+            try:
+                # select_related also records a missing operator, so hasattr(user, 'operator') needs no query
+                user = User.objects.select_related('operator').get(**{api_settings.USER_ID_FIELD: user_id})
+            except User.DoesNotExist:
+                raise AuthenticationFailed('User not found', code='user_not_found')
+            cache.set(key, user, settings.AUTH_USER_CACHE_TTL)
+
+        if not user.is_active:
+            raise AuthenticationFailed('User is inactive', code='user_inactive')
+        if user.token_version != token_version:
+            raise AuthenticationFailed('Token has been revoked', code='token_revoked')
+        return user
+
+
+def invalidate_user(user_id, token_version):
+    # A save that bumped the version leaves the previous version's entry behind
+    cache.delete_many([user_cache_key(user_id, token_version), user_cache_key(user_id, token_version - 1)])
+
+
+@receiver([post_save, post_delete], sender=User)
+def _invalidate_user(sender, instance, **kwargs):
+    invalidate_user(instance.pk, instance.token_version)
+
+
+@receiver([post_save, post_delete], sender=Operator)
+def _invalidate_operator_user(sender, instance, **kwargs):
+    token_version = User.objects.filter(pk=instance.user_id).values_list('token_version', flat=True).first()
+    if token_version is not None:
+        invalidate_user(instance.user_id, token_version)
@@ -24,6 +24,8 @@ class User(AbstractUser):
     last_name = models.CharField(max_length=150)
     phone = models.CharField(max_length=20, blank=True, null=True)
     is_operator = models.BooleanField(default=False)
+    # Carried in issued tokens; bumping it revokes every token issued before
+    token_version = models.PositiveIntegerField(default=0)
 
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = ['first_name', 'last_name']
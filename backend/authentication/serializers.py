@@ -27,6 +27,8 @@ class UserSerializer(serializers.ModelSerializer):
         password = validated_data.pop('password', None)
         if password:
             instance.set_password(password)
+            # Sessions started with the old password end with their tokens
+            instance.token_version += 1
         
         for attr, value in validated_data.items():
             setattr(instance, attr, value)
@@ -35,6 +37,15 @@ class UserSerializer(serializers.ModelSerializer):
         return instance
 
 class CustomTokenObtainPairSerializer(TokenObtainPairSerializer):
+    @classmethod
+    def get_token(cls, user):
+        token = super().get_token(user)
+        token['token_version'] = user.token_version
+        if user.is_operator and hasattr(user, 'operator'):
+            token['operator_id'] = user.operator.id
+            token['operator_priority'] = user.operator.priority
+        return token
+
     def validate(self, attrs):
         data = super().validate(attrs)
         user = self.user
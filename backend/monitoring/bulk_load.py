@@ -0,0 +1,134 @@
+"""
+Bulk loading helpers for PostgreSQL COPY.
+
+Readings are encoded straight from NumPy column arrays into the binary COPY
+format, so generating or importing millions of rows never builds a Python
+object per row. Other backends fall back to bulk_create. Fixed-width columns
+are read back out the same way (decode_binary_copy).
+"""
+import csv
+import io
+from datetime import datetime, timezone as dt_timezone
+
+import numpy as np
+
+# PostgreSQL timestamps count microseconds from 2000-01-01 UTC
+PG_EPOCH = datetime(2000, 1, 1, tzinfo=dt_timezone.utc)
+UNIX_TO_PG_EPOCH_US = int(PG_EPOCH.timestamp()) * 1_000_000
+
+COPY_HEADER = b'PGCOPY\n\xff\r\n\x00' + (0).to_bytes(4, 'big') + (0).to_bytes(4, 'big')
+COPY_TRAILER = (-1).to_bytes(2, 'big', signed=True)
+
+
+def supports_copy(connection):
+    return connection.vendor == 'postgresql'
+
+
+def unix_us_to_pg(timestamps_us):
+    """Convert int64 microseconds since the Unix epoch to PostgreSQL timestamp microseconds"""
+    return np.asarray(timestamps_us, dtype=np.int64) - UNIX_TO_PG_EPOCH_US
+
+
+def pg_to_unix_us(timestamps_pg):
+    """Convert PostgreSQL timestamp microseconds (as read by decode_binary_copy) to microseconds since the Unix epoch"""
+    return np.asarray(timestamps_pg, dtype=np.int64) + UNIX_TO_PG_EPOCH_US
+
+
+def unix_us_to_datetime(timestamp_us):
+    return datetime.fromtimestamp(int(timestamp_us) / 1_000_000, tz=dt_timezone.utc)
+
+
+def _column_dtype(column, width):
+    if column.dtype.kind == 'S':
+        return f'S{width}', width
+    if column.dtype.kind == 'f':
+        return '>f8', 8
+    if column.dtype.kind in 'iu' and column.dtype.itemsize <= 4:
+        return '>i4', 4
+    return '>i8', 8
+
+
+def encode_binary_copy(columns):
+    """
+    Encode equal-length column arrays as one binary COPY payload.
+
+    Numeric columns become int4/int8/float8 by dtype and bytes ('S') columns
+    become text. Timestamp columns must already be PostgreSQL microseconds
+    (see unix_us_to_pg). Rows are grouped by their text lengths so each group
+    packs into a single fixed-width structured array.
+    """
+    columns = [np.asarray(column) for column in columns]
+    count = len(columns[0])
+    text_indexes = [i for i, column in enumerate(columns) if column.dtype.kind == 'S']
+
+    if text_indexes and count:
+        lengths = np.stack([np.char.str_len(columns[i]) for i in text_indexes], axis=1)
+        groups, inverse = np.unique(lengths, axis=0, return_inverse=True)
+        inverse = inverse.reshape(-1)
+    else:
+        groups, inverse = [()], np.zeros(count, dtype=np.int64)
+
+    parts = [COPY_HEADER]
+    for group_index, text_lengths in enumerate(groups):
+        mask = inverse == group_index
+        widths = dict(zip(text_indexes, (int(length) for length in text_lengths)))
+        fields = [('field_count', '>i2')]
+        for i, column in enumerate(columns):
+            dtype, _ = _column_dtype(column, widths.get(i))
+            fields += [(f'len{i}', '>i4'), (f'val{i}', dtype)]
+
+        packed = np.empty(int(mask.sum()), dtype=np.dtype(fields))
+        packed['field_count'] = len(columns)
+        for i, column in enumerate(columns):
+            _, size = _column_dtype(column, widths.get(i))
+            packed[f'len{i}'] = size
+            packed[f'val{i}'] = column[mask]
+        parts.append(packed.tobytes())
+
+    parts.append(COPY_TRAILER)
+    return b''.join(parts)
+
+
+def copy_binary(cursor, table, column_names, columns):
+    """COPY NumPy column arrays into `table` using the binary protocol"""
+    payload = encode_binary_copy(columns)
+    cursor.copy_expert(
+        f'COPY {table} ({", ".join(column_names)}) FROM STDIN WITH (FORMAT binary)',
+        io.BytesIO(payload)
+    )
+
+
+def copy_rows(cursor, table, column_names, rows):
+    """COPY an iterable of Python tuples into `table` as CSV"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow([r'\N' if value is None else value for value in row])
+    buffer.seek(0)
+    cursor.copy_expert(
+        f"COPY {table} ({', '.join(column_names)}) FROM STDIN WITH (FORMAT csv, NULL '\\N')",
+        buffer
+    )
+
+
+def decode_binary_copy(payload, dtypes):
+    """
+    Decode a binary COPY payload (COPY ... TO STDOUT WITH (FORMAT binary)) of
+    non-null fixed-width columns, e.g. '>i4' for int4, '>f8' for float8 and
+    '>i8' for timestamps (see pg_to_unix_us), into native-endian column arrays
+    without a Python object per row.
+    """
+    extension_length = int.from_bytes(payload[len(COPY_HEADER) - 4:len(COPY_HEADER)], 'big')
+    body = payload[len(COPY_HEADER) + extension_length:-len(COPY_TRAILER)]
+    fields = [('field_count', '>i2')]
+    for i, dtype in enumerate(dtypes):
+        fields += [(f'len{i}', '>i4'), (f'val{i}', dtype)]
+    rows = np.frombuffer(body, dtype=np.dtype(fields))
+    return [rows[f'val{i}'].astype(np.dtype(dtype).newbyteorder('=')) for i, dtype in enumerate(dtypes)]
+
+
+def copy_out_binary(cursor, query):
+    """Run COPY (query) TO STDOUT in binary format and return the payload"""
+    buffer = io.BytesIO()
+    cursor.copy_expert(f'COPY ({query}) TO STDOUT WITH (FORMAT binary)', buffer)
+    return buffer.getvalue()
@@ -0,0 +1,152 @@
+"""
+Conditional GET support for the endpoints the dashboard polls.
+
+Each polled resource has a cheap validator: reading lists use the highest
+reading id, notifications the count and newest updated_at of the caller's
+rows, and incidents a version stamp that is replaced in the shared cache
+whenever one of their rows is saved or deleted. A poll whose If-None-Match /
+If-Modified-Since still matches is answered with 304 before the main query
+runs or anything is serialized.
+
+Version stamps live in Django's default cache. Without REDIS_URL that is a
+per-process memory cache in which other workers' changes never show up, so
+the incidents list is only made conditional when the cache is shared.
+"""
+import time
+from calendar import timegm
+from datetime import datetime, timezone as dt_timezone
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, Max
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
+
+from notifications.models import Notification
+from .models import Device, Incident, IncidentComment, IncidentTimelineEvent
+
+READINGS = 'readings'
+INCIDENTS = 'incidents'
+# Cache backends each worker process keeps to itself
+PROCESS_LOCAL_CACHES = {'django.core.cache.backends.locmem.LocMemCache'}
+
+
+def resource_version(name):
+    """Current version stamp (nanoseconds since the epoch) of a resource, or None without a working cache"""
+    key = f'resource-version:{name}'
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, time.time_ns(), timeout=None)
+        version = cache.get(key)
+    return version
+
+
+def shared_cache():
+    """Whether every worker process sees the same default cache, and so the same version stamps"""
+    return settings.CACHES['default']['BACKEND'] not in PROCESS_LOCAL_CACHES
+
+
+def version_time(version):
+    return datetime.fromtimestamp(version / 1e9, tz=dt_timezone.utc) if version else None
+
+
+def bump_resource_version(*names):
+    """Mark resources as changed once the current transaction commits"""
+    def bump():
+        now = time.time_ns()
+        cache.set_many({f'resource-version:{name}': now for name in names}, timeout=None)
+    transaction.on_commit(bump)
+
+
+@receiver([post_save, post_delete], sender=Incident)
+@receiver([post_save, post_delete], sender=IncidentComment)
+@receiver([post_save, post_delete], sender=IncidentTimelineEvent)
+@receiver([post_save, post_delete], sender=Device)
+# Incidents embed their notifications
+@receiver([post_save, post_delete], sender=Notification)
+def _incidents_changed(sender, **kwargs):
+    bump_resource_version(INCIDENTS)
+
+
+def conditional(etag_func, last_modified_func=None):
+    """
+    Like django.views.decorators.http.condition, for viewset methods: the
+    validator functions get (view, request) and may return None to skip the
+    check. Only successful responses are tagged, and clients are told to
+    revalidate on every poll rather than reuse a cached body.
+    """
+    def decorator(method):
+        @wraps(method)
+        def inner(view, request, *args, **kwargs):
+            etag = etag_func(view, request)
+            last_modified = last_modified_func(view, request) if last_modified_func else None
+            if etag is None and last_modified is None:
+                return method(view, request, *args, **kwargs)
+
+            etag = quote_etag(etag) if etag is not None else None
+            last_modified = timegm(last_modified.utctimetuple()) if last_modified else None
+            response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+            if response is None:
+                response = method(view, request, *args, **kwargs)
+                if response.status_code != 200:
+                    return response
+            if etag:
+                response['ETag'] = etag
+            if last_modified:
+                response['Last-Modified'] = http_date(last_modified)
+            patch_cache_control(response, private=True, no_cache=True)
+            return response
+        return inner
+    return decorator
+
+
+def readings_etag(view, request):
+    version = resource_version(READINGS)
+    if version is None:
+        return None
+    latest_id = view.get_queryset().aggregate(latest=Max('id'))['latest']
+    return f'readings-{latest_id}-{version}'
+
+
+def latest_reading_etag(view, request):
+    version = resource_version(READINGS)
+    if version is None:
+        return None
+    # The response is built from the two newest readings; their ids are one index scan
+    ids = list(view.get_queryset().values_list('id', flat=True)[:2])
+    return f'latest-{"-".join(map(str, ids))}-{version}'
+
+
+def _viewer(request):
+    """Per-user part of a validator: who is asking and whether they may acknowledge"""
+    user = request.user
+    operator = user.operator if hasattr(user, 'operator') else None
+    return f'{user.pk}-{int(bool(operator and operator.is_active))}'
+
+
+def incidents_etag(view, request):
+    version = resource_version(INCIDENTS) if shared_cache() else None
+    return f'incidents-{version}-{_viewer(request)}' if version else None
+
+
+def incidents_last_modified(view, request):
+    return version_time(resource_version(INCIDENTS)) if shared_cache() else None
+
+
+def _notification_changes(view):
+    # Every write to notifications, bulk updates included, sets updated_at
+    return view.get_queryset().order_by().aggregate(count=Count('id'), latest=Max('updated_at'))
+
+
+def notifications_etag(view, request):
+    changes = _notification_changes(view)
+    latest = changes['latest'].timestamp() if changes['latest'] else 0
+    return f'notifications-{changes["count"]}-{latest}-{request.user.pk}'
+
+
+def notifications_last_modified(view, request):
+    return _notification_changes(view)['latest']
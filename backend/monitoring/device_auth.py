@@ -0,0 +1,233 @@
+"""
+Per-device credentials for the ingest endpoints.
+
+A device with an api_key set authenticates every request with its device id
+and either the key itself or an HMAC-SHA256 signature made with the key:
+
+    X-Device-Id:  ESP8266_1
+    X-Device-Key: <api_key>                                  (key mode, TLS only)
+
+    X-Device-Id:  ESP8266_1
+    X-Timestamp:  <unix seconds>
+    X-Signature:  hex(HMAC-SHA256(api_key, "<device id>\\n<timestamp>\\n" + body))
+
+Gateway messages (MQTT, UDP) carry no headers, so the same signature is sent
+in an envelope in front of the body, marked by a leading NUL byte that no JSON
+or packed payload starts with:
+
+    \\0<device id>\\n<unix seconds>\\n<hex signature>\\n<body>
+
+Keys are verified against an in-process copy of every device key, so a
+reading costs one HMAC and no database query. Saving or deleting a Device
+updates the copy in this process straight away. Once a key change commits it
+also bumps a version stamp in the shared cache, as SystemSettings does; every
+process compares its copy with the stamp at most every DEVICE_KEY_CHECK_INTERVAL
+seconds and reloads when it changed, so a rotated-out key stops working
+everywhere within that interval. Copies are reloaded after DEVICE_KEY_CACHE_TTL
+regardless, in case the stamp was evicted.
+"""
+import hashlib
+import hmac
+import threading
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from rest_framework.authentication import BaseAuthentication
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.permissions import BasePermission
+
+from .models import Device
+from .throttling import payload_device_counts
+
+# A failed verification reloads the keys at most this often, so bad signatures cannot hammer the database
+MIN_RELOAD_INTERVAL = 5
+# First byte of a signed gateway message
+SIGNED_PAYLOAD_MARKER = b'\x00'
+# Shared cache key holding the version of the stored keys; changes whenever one is rotated
+VERSION_CACHE_KEY = 'device_keys:version'
+
+
+class DeviceKeys:
+    """device_id -> api_key for every device that has a key"""
+
+    def __init__(self):
+        self.keys = {}
+        self.loaded_at = None
+        # Version stamp the keys were loaded at, and when it was last compared with the shared one
+        self.version = None
+        self.checked_at = None
+        self.lock = threading.Lock()
+
+    def get(self, device_id):
+        now = time.monotonic()
+        if self.loaded_at is None or now - self.loaded_at > settings.DEVICE_KEY_CACHE_TTL:
+            self.load()
+        elif now - self.checked_at >= settings.DEVICE_KEY_CHECK_INTERVAL:
+            self.checked_at = now
+            if cache.get(VERSION_CACHE_KEY) != self.version:
+                # A key was rotated, possibly by another process
+                self.load()
+        return self.keys.get(device_id, '')
+
+    def load(self):
+        # Read the stamp first: a rotation committed during the query bumps it again and is picked up next time
+        version = cache.get(VERSION_CACHE_KEY)
+        if version is None:
+            # Nothing published yet (or evicted): start a version every process will share
+            cache.add(VERSION_CACHE_KEY, time.time_ns(), timeout=None)
+            version = cache.get(VERSION_CACHE_KEY)
+        keys = dict(Device.objects.exclude(api_key='').values_list('device_id', 'api_key'))
+        with self.lock:
+            self.keys = keys
+            self.version = version
+            self.loaded_at = self.checked_at = time.monotonic()
+
+    def reload_if_stale(self):
+        """Reload after a failed verification, in case the key was rotated by another process"""
+        if self.loaded_at is None or time.monotonic() - self.loaded_at > MIN_RELOAD_INTERVAL:
+            self.load()
+            return True
+        return False
+
+    def set(self, device_id, key):
+        """Apply a key change made by this process; returns whether it differs from the copy"""
+        with self.lock:
+            changed = self.keys.get(device_id, '') != key
+            if key:
+                self.keys[device_id] = key
+            else:
+                self.keys.pop(device_id, None)
+        return changed
+
+
+def publish_key_change():
+    """Have every process reload its keys on its next check"""
+    cache.set(VERSION_CACHE_KEY, time.time_ns(), timeout=None)
+
+
+device_keys = DeviceKeys()
+
+
+@receiver(post_save, sender=Device)
+def _update_device_key(sender, instance, update_fields=None, **kwargs):
+    changed = device_keys.set(instance.device_id, instance.api_key)
+    # Rotations always publish: this process' copy may not have held the old key
+    if changed or (update_fields and 'api_key' in update_fields):
+        transaction.on_commit(publish_key_change)
+
+
+@receiver(post_delete, sender=Device)
+def _remove_device_key(sender, instance, **kwargs):
+    if device_keys.set(instance.device_id, '') or instance.api_key:
+        transaction.on_commit(publish_key_change)
+
+
+def sign_request(api_key, device_id, timestamp, body):
+    """Hex signature of one request; used by tooling and device simulators"""
+    message = f'{device_id}\n{timestamp}\n'.encode('utf-8') + body
+    return hmac.new(api_key.encode('utf-8'), message, hashlib.sha256).hexdigest()
+
+
+def sign_payload(api_key, device_id, body, timestamp=None):
+    """Wrap a gateway message body in a signed envelope; used by tooling and device simulators"""
+    timestamp = int(time.time()) if timestamp is None else timestamp
+    signature = sign_request(api_key, device_id, timestamp, body)
+    return SIGNED_PAYLOAD_MARKER + f'{device_id}\n{timestamp}\n{signature}\n'.encode('utf-8') + body
+
+
+def verify_signature(device_id, timestamp, signature, body):
+    """Check a signature made with the device's key; raises AuthenticationFailed"""
+    try:
+        skew = abs(time.time() - int(timestamp))
+    except ValueError:
+        raise AuthenticationFailed('Invalid timestamp')
+    if skew > settings.DEVICE_SIGNATURE_MAX_SKEW:
+        raise AuthenticationFailed('Signature expired, check the device clock')
+    _verify_key(device_id, lambda key: hmac.compare_digest(
+        sign_request(key, device_id, timestamp, body).encode(), signature.encode()
+    ))
+
+
+def _verify_key(device_id, verify):
+    def matches():
+        key = device_keys.get(device_id)
+        return bool(key) and verify(key)
+
+    if not matches():
+        # The key may have been rotated by another process since it was cached
+        if not (device_keys.reload_if_stale() and matches()):
+            raise AuthenticationFailed('Invalid device credentials')
+
+
+def open_signed_payload(payload):
+    """
+    Split a gateway message into (body, device id that signed it). Unsigned
+    messages are returned as they are, with None. Raises AuthenticationFailed
+    for a malformed, expired or forged envelope.
+    """
+    if payload[:1] != SIGNED_PAYLOAD_MARKER:
+        return payload, None
+    try:
+        device_id, timestamp, signature, body = payload[1:].split(b'\n', 3)
+        device_id, timestamp, signature = device_id.decode('utf-8'), timestamp.decode(), signature.decode()
+    except ValueError:
+        raise AuthenticationFailed('Malformed signed payload')
+    verify_signature(device_id, timestamp, signature, body)
+    return body, device_id
+
+
+def device_may_submit(device_id, authenticated):
+    """
+    Whether readings for device_id are accepted from a sender authenticated as
+    the device `authenticated` (None when unauthenticated): they must be the
+    device's own once it has a key, or always with INGEST_REQUIRE_DEVICE_KEY.
+    """
+    if device_id == authenticated:
+        return True
+    return not (settings.INGEST_REQUIRE_DEVICE_KEY or device_keys.get(device_id))
+
+
+class DeviceKeyAuthentication(BaseAuthentication):
+    """
+    Authenticates a device from the X-Device-Id headers. Requests without them
+    are left unauthenticated; DeviceKeyPermission decides whether that is allowed.
+    request.auth is the authenticated device id.
+    """
+
+    def authenticate(self, request):
+        device_id = request.META.get('HTTP_X_DEVICE_ID')
+        if not device_id:
+            return None
+
+        signature = request.META.get('HTTP_X_SIGNATURE')
+        if signature:
+            verify_signature(device_id, request.META.get('HTTP_X_TIMESTAMP', ''), signature, request.body)
+        else:
+            presented = request.META.get('HTTP_X_DEVICE_KEY')
+            if not presented:
+                raise AuthenticationFailed('Missing X-Signature or X-Device-Key')
+            _verify_key(device_id, lambda key: hmac.compare_digest(key.encode(), presented.encode()))
+
+        return AnonymousUser(), device_id
+
+    def authenticate_header(self, request):
+        return 'Device-HMAC'
+
+
+class DeviceKeyPermission(BasePermission):
+    """
+    Readings for a device that has a key (or for any device, with
+    INGEST_REQUIRE_DEVICE_KEY) must come from a request authenticated as that device.
+    """
+    message = 'Readings must be authenticated by the device that took them'
+
+    def has_permission(self, request, view):
+        return all(
+            device_id is None or device_may_submit(device_id, request.auth)
+            for device_id in payload_device_counts(request)
+        )
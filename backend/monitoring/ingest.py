@@ -0,0 +1,216 @@
+"""
+Fast path for device readings.
+
+Devices can post readings as packed little-endian records instead of JSON.
+Each record is:
+
+    uint8   device_id length, followed by that many UTF-8 bytes
+    int16   temperature in hundredths of a degree C
+    uint16  humidity in hundredths of a percent
+    uint8   battery level percent
+    uint8   flags (bit 0 set = running on battery)
+    uint32  unix timestamp in seconds, 0 = use the server time
+
+A batch is simply records back to back. Records are validated against
+precomputed bounds, skipping the DRF serializer, and acknowledged with a
+4 byte (accepted, rejected) pair.
+"""
+import json
+import struct
+from datetime import datetime, timezone as dt_timezone
+
+from django.core.validators import MinValueValidator, MaxValueValidator
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser
+
+from .models import Reading
+
+BINARY_MEDIA_TYPE = 'application/vnd.tempmonitor.reading'
+
+RECORD = struct.Struct('<hHBBI')
+ACK = struct.Struct('<HH')
+FLAG_BATTERY = 0x01
+
+POWER_STATUSES = ('AC', 'BATTERY')
+DEVICE_ID_MAX_LENGTH = Reading._meta.get_field('device_id').max_length
+
+
+def field_range(name):
+    """Min/max allowed by the Reading model validators, so every ingest path agrees"""
+    validators = Reading._meta.get_field(name).validators
+    low = next(v.limit_value for v in validators if isinstance(v, MinValueValidator))
+    high = next(v.limit_value for v in validators if isinstance(v, MaxValueValidator))
+    return low, high
+
+
+TEMPERATURE_RANGE = field_range('temperature')
+HUMIDITY_RANGE = field_range('humidity')
+BATTERY_RANGE = field_range('battery_level')
+
+
+def validate_reading(data):
+    """
+    Validate one JSON reading without going through ReadingSerializer.
+
+    Returns a (device_id, temperature, humidity, power_status, battery_level,
+    timestamp) tuple, or raises ValueError with a short reason. A timestamp of
+    None means the reading is stamped with the server time when stored.
+    """
+    if not isinstance(data, dict):
+        raise ValueError('reading must be an object')
+
+    device_id = data.get('device_id')
+    if not isinstance(device_id, str) or not 0 < len(device_id) <= DEVICE_ID_MAX_LENGTH:
+        raise ValueError('invalid device_id')
+
+    try:
+        temperature = float(data['temperature'])
+        humidity = float(data['humidity'])
+        battery_level = float(data.get('battery_level', 100))
+    except KeyError as e:
+        raise ValueError(f'missing {e.args[0]}')
+    except (TypeError, ValueError):
+        raise ValueError('numeric fields must be numbers')
+
+    if not TEMPERATURE_RANGE[0] <= temperature <= TEMPERATURE_RANGE[1]:
+        raise ValueError('temperature out of range')
+    if not HUMIDITY_RANGE[0] <= humidity <= HUMIDITY_RANGE[1]:
+        raise ValueError('humidity out of range')
+    if not BATTERY_RANGE[0] <= battery_level <= BATTERY_RANGE[1]:
+        raise ValueError('battery_level out of range')
+
+    power_status = data.get('power_status', 'AC')
+    if power_status not in POWER_STATUSES:
+        raise ValueError('invalid power_status')
+
+    timestamp = data.get('timestamp')
+    if timestamp is not None:
+        try:
+            timestamp = datetime.fromisoformat(str(timestamp).replace('Z', '+00:00'))
+        except ValueError:
+            raise ValueError('invalid timestamp')
+        if timestamp.tzinfo is None:
+            timestamp = timestamp.replace(tzinfo=dt_timezone.utc)
+
+    return device_id, temperature, humidity, power_status, battery_level, timestamp
+
+
+def record_from_validated(data):
+    """Reading tuple from ReadingSerializer.validated_data, with model defaults for omitted fields"""
+    def value(name):
+        return data[name] if name in data else Reading._meta.get_field(name).get_default()
+
+    return (
+        value('device_id'), data['temperature'], data['humidity'],
+        value('power_status'), value('battery_level'), data['timestamp']
+    )
+
+
+def decode_readings(payload):
+    """
+    Decode packed records.
+
+    Returns (records, rejected) where records are tuples in the same shape as
+    validate_reading and rejected counts well-framed records with out of range
+    values or an over-long device_id. Raises ValueError if the payload is truncated.
+    """
+    records = []
+    rejected = 0
+    offset = 0
+    size = len(payload)
+    view = memoryview(payload)
+
+    while offset < size:
+        length = payload[offset]
+        start = offset + 1
+        end = start + length + RECORD.size
+        if length == 0 or end > size:
+            raise ValueError(f'truncated record at byte {offset}')
+
+        temperature, humidity, battery_level, flags, timestamp = RECORD.unpack_from(view, start + length)
+        temperature /= 100
+        humidity /= 100
+        offset = end
+
+        if not (TEMPERATURE_RANGE[0] <= temperature <= TEMPERATURE_RANGE[1]
+                and HUMIDITY_RANGE[0] <= humidity <= HUMIDITY_RANGE[1]
+                and battery_level <= BATTERY_RANGE[1]):
+            rejected += 1
+            continue
+        try:
+            device_id = bytes(view[start:start + length]).decode('utf-8')
+        except UnicodeDecodeError:
+            rejected += 1
+            continue
+        # The length prefix allows 255 bytes, more than the device_id column holds
+        if not 0 < len(device_id) <= DEVICE_ID_MAX_LENGTH:
+            rejected += 1
+            continue
+
+        records.append((
+            device_id,
+            temperature,
+            humidity,
+            'BATTERY' if flags & FLAG_BATTERY else 'AC',
+            float(battery_level),
+            datetime.fromtimestamp(timestamp, tz=dt_timezone.utc) if timestamp else None,
+        ))
+
+    return records, rejected
+
+
+def decode_payload(payload, device_id=None):
+    """
+    Decode a message body that is either JSON (one reading or a list) or packed
+    records, for transports without a Content-Type such as MQTT and UDP.
+    device_id fills in JSON readings that omit it (e.g. taken from the topic).
+    Returns (records, rejected).
+    """
+    if payload[:1] not in (b'{', b'['):
+        try:
+            return decode_readings(payload)
+        except ValueError:
+            return [], 1
+
+    try:
+        items = json.loads(payload)
+    except ValueError:
+        return [], 1
+
+    records = []
+    rejected = 0
+    for item in items if isinstance(items, list) else [items]:
+        if device_id and isinstance(item, dict):
+            item.setdefault('device_id', device_id)
+        try:
+            records.append(validate_reading(item))
+        except ValueError:
+            rejected += 1
+    return records, rejected
+
+
+def encode_reading(device_id, temperature, humidity, power_status='AC', battery_level=100, timestamp=0):
+    """Pack one reading; used by the benchmark and gateway tooling to speak the device format"""
+    encoded_id = device_id.encode('utf-8')
+    return bytes([len(encoded_id)]) + encoded_id + RECORD.pack(
+        int(round(temperature * 100)),
+        int(round(humidity * 100)),
+        int(battery_level),
+        FLAG_BATTERY if power_status == 'BATTERY' else 0,
+        int(timestamp),
+    )
+
+
+def encode_ack(accepted, rejected):
+    return ACK.pack(min(accepted, 0xFFFF), min(rejected, 0xFFFF))
+
+
+class BinaryReadingParser(BaseParser):
+    """Parses packed reading records into (records, rejected)"""
+    media_type = BINARY_MEDIA_TYPE
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        try:
+            return decode_readings(stream.read() if stream else b'')
+        except ValueError as e:
+            raise ParseError(str(e))
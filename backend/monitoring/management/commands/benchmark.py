@@ -0,0 +1,390 @@
+import json
+import platform
+import random
+import time
+from datetime import timedelta
+
+import django
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient, APIRequestFactory, force_authenticate
+
+from monitoring.ingest import BINARY_MEDIA_TYPE, encode_reading
+from monitoring.management.utils import percentile
+from monitoring.models import Device, Reading, Alert, Incident, IncidentTimelineEvent
+from monitoring.services.reading_service import ReadingService
+from monitoring.views import ReadingExportView
+
+User = get_user_model()
+
+BENCH_PREFIX = 'BENCH_'
+BENCH_USER_EMAIL = 'benchmark@example.com'
+
+# Metrics where a lower value is better; everything else compared is "higher is better"
+LOWER_IS_BETTER = ('p50_ms', 'p95_ms', 'p99_ms')
+
+
+class Command(BaseCommand):
+    help = (
+        'Runs the in-process ingest and query benchmark suite against the configured '
+        'database and optionally compares the results to a stored baseline'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scenarios', default='all',
+                            help='Comma separated scenarios to run (ingest, evaluation, stats, export, incidents)')
+        parser.add_argument('--iterations', type=int, default=200,
+                            help='Requests per latency scenario')
+        parser.add_argument('--batch-size', type=int, default=100,
+                            help='Readings per batch in the batch ingest scenario')
+        parser.add_argument('--export-rows', default='10000,100000,1000000',
+                            help='Comma separated row counts for the export scenarios')
+        parser.add_argument('--export-formats', default='csv,json,pdf',
+                            help='Comma separated export formats')
+        parser.add_argument('--stats-interval', type=int, default=300,
+                            help='Seconds between seeded readings for the stats scenarios')
+        parser.add_argument('--incidents', type=int, default=200,
+                            help='Incidents seeded for the incident list scenario')
+        parser.add_argument('--output', help='Write results as JSON to this file')
+        parser.add_argument('--baseline', help='Compare results to this JSON results file')
+        parser.add_argument('--tolerance', type=float, default=0.2,
+                            help='Allowed relative slowdown before a metric is flagged (0.2 = 20%%)')
+        parser.add_argument('--fail-on-regression', action='store_true',
+                            help='Exit with an error when a regression is detected')
+        parser.add_argument('--keep-data', action='store_true',
+                            help='Do not delete the seeded benchmark data afterwards')
+
+    def handle(self, *args, **options):
+        scenarios = options['scenarios'].split(',')
+        run_all = 'all' in scenarios
+        self.options = options
+        self.results = {}
+
+        # Benchmarks must not send real notifications or pay for DEBUG query logging
+        with override_settings(
+            DEBUG=False,
+            EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend',
+            ALLOWED_HOSTS=['*'],
+            # Measure the ingest pipeline, not the flood protection in front of it
+            INGEST_RATE_LIMIT={'DEVICE_RATE': 1e9, 'DEVICE_BURST': 1e9, 'IP_RATE': 1e9, 'IP_BURST': 1e9},
+        ):
+            self._cleanup()
+            try:
+                self.user = self._get_bench_user()
+                if run_all or 'ingest' in scenarios:
+                    self.bench_ingest_single()
+                    self.bench_ingest_batch()
+                if run_all or 'evaluation' in scenarios:
+                    self.bench_threshold_evaluation()
+                if run_all or 'stats' in scenarios:
+                    self.bench_stats()
+                if run_all or 'export' in scenarios:
+                    self.bench_export()
+                if run_all or 'incidents' in scenarios:
+                    self.bench_incident_list()
+            finally:
+                if not options['keep_data']:
+                    self._cleanup()
+
+        report = {
+            'meta': {
+                'timestamp': timezone.now().isoformat(),
+                'database': connection.vendor,
+                'django': django.get_version(),
+                'python': platform.python_version(),
+                'iterations': options['iterations'],
+            },
+            'results': self.results,
+        }
+
+        regressions = []
+        if options['baseline']:
+            regressions = self._compare_to_baseline(options['baseline'], options['tolerance'])
+            report['regressions'] = regressions
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(report, f, indent=2)
+            self.stdout.write(f"Results written to {options['output']}")
+
+        if regressions and options['fail_on_regression']:
+            raise CommandError(f'{len(regressions)} benchmark regression(s) detected')
+
+        self.stdout.write(self.style.SUCCESS('Benchmark completed'))
+
+    # Scenarios
+
+    def bench_ingest_single(self):
+        """Single reading POSTed to the ESP endpoint, one request per reading, as JSON and packed"""
+        client = APIClient()
+        device_id = f'{BENCH_PREFIX}INGEST'
+
+        def run(i):
+            return client.post('/api/monitoring/esp/reading/', {
+                'device_id': device_id,
+                'temperature': round(random.uniform(2.5, 7.5), 2),
+                'humidity': round(random.uniform(30, 70), 2),
+                'power_status': 'AC',
+                'battery_level': 100,
+            }, format='json')
+
+        self._measure('ingest_single', run, self.options['iterations'])
+
+        def run_binary(i):
+            return client.generic(
+                'POST', '/api/monitoring/esp/reading/',
+                encode_reading(device_id, random.uniform(2.5, 7.5), random.uniform(30, 70)),
+                content_type=BINARY_MEDIA_TYPE,
+            )
+
+        self._measure('ingest_single_binary', run_binary, self.options['iterations'])
+
+    def bench_ingest_batch(self):
+        """Batches of readings POSTed to the batch endpoint, as JSON and packed"""
+        client = APIClient()
+        batch_size = self.options['batch_size']
+        device_id = f'{BENCH_PREFIX}BATCH'
+        now = timezone.now()
+        iterations = max(1, self.options['iterations'] // 10)
+
+        def timestamp(i, n):
+            # JSON and packed runs write disjoint time ranges
+            return now - timedelta(seconds=(i + 1) * batch_size - n)
+
+        def run(i):
+            return client.post('/api/monitoring/esp/readings/batch/', [
+                {
+                    'device_id': device_id,
+                    'temperature': round(random.uniform(2.5, 7.5), 2),
+                    'humidity': round(random.uniform(30, 70), 2),
+                    'timestamp': timestamp(i, n).isoformat(),
+                }
+                for n in range(batch_size)
+            ], format='json')
+
+        self._measure('ingest_batch', run, iterations, items_per_call=batch_size)
+
+        def run_binary(i):
+            return client.generic(
+                'POST', '/api/monitoring/esp/readings/batch/',
+                b''.join(
+                    encode_reading(
+                        device_id, random.uniform(2.5, 7.5), random.uniform(30, 70),
+                        timestamp=timestamp(i + iterations, n).timestamp()
+                    )
+                    for n in range(batch_size)
+                ),
+                content_type=BINARY_MEDIA_TYPE,
+            )
+
+        self._measure('ingest_batch_binary', run_binary, iterations, items_per_call=batch_size)
+
+    def bench_threshold_evaluation(self):
+        """Threshold evaluation of stored readings, mixing normal and out-of-range values"""
+        device_id = f'{BENCH_PREFIX}EVAL'
+        now = timezone.now()
+        iterations = self.options['iterations']
+        readings = Reading.objects.bulk_create([
+            Reading(
+                device_id=device_id,
+                # Alternate runs of normal and abnormal readings so incidents open and resolve
+                temperature=5.0 if (i // 10) % 2 == 0 else 11.0,
+                humidity=45.0,
+                timestamp=now - timedelta(seconds=iterations - i),
+            )
+            for i in range(iterations)
+        ])
+        service = ReadingService()
+
+        def run(i):
+            service.check_temperature(readings[i])
+
+        self._measure('threshold_evaluation', run, iterations)
+
+    def bench_stats(self):
+        """Temperature statistics endpoint over the 24h, 7d and 30d windows"""
+        device_id = f'{BENCH_PREFIX}STATS'
+        interval = self.options['stats_interval']
+        now = timezone.now()
+        count = int(timedelta(days=30).total_seconds() // interval)
+        self._seed_readings(device_id, count, now - timedelta(seconds=count * interval), interval)
+
+        client = APIClient()
+        client.force_authenticate(user=self.user)
+        iterations = max(1, self.options['iterations'] // 10)
+        for period in ('24h', '7d', '30d'):
+            def run(i, period=period):
+                return client.get('/api/monitoring/temperature/stats/', {
+                    'period': period,
+                    'device_id': device_id,
+                })
+
+            self._measure(f'stats_{period}', run, iterations)
+
+    def bench_export(self):
+        """CSV, JSON and PDF exports of increasingly large reading ranges"""
+        factory = APIRequestFactory()
+        view = ReadingExportView.as_view()
+        formats = self.options['export_formats'].split(',')
+        seeded = 0
+        device_id = f'{BENCH_PREFIX}EXPORT'
+        start = timezone.now() - timedelta(days=365)
+
+        for rows in sorted(int(r) for r in self.options['export_rows'].split(',')):
+            # Top up the export device so it holds exactly `rows` readings
+            self._seed_readings(device_id, rows - seeded, start + timedelta(seconds=seeded), 1)
+            seeded = rows
+            end = start + timedelta(seconds=rows)
+
+            for export_format in formats:
+                def run(i, export_format=export_format):
+                    request = factory.get('/api/monitoring/readings/export/', {
+                        'start_date': start.isoformat(),
+                        'end_date': end.isoformat(),
+                        'device_id': device_id,
+                        'format': export_format,
+                    })
+                    force_authenticate(request, user=self.user)
+                    return view(request)
+
+                self._measure(f'export_{export_format}_{rows}', run, 1, items_per_call=rows)
+
+    def bench_incident_list(self):
+        """Incident list rendering with alerts and timeline events attached"""
+        device, _ = Device.objects.get_or_create(
+            device_id=f'{BENCH_PREFIX}INCIDENTS',
+            defaults={'name': 'Benchmark incidents', 'location': 'Benchmark'}
+        )
+        now = timezone.now()
+        count = self.options['incidents']
+        readings = Reading.objects.bulk_create([
+            Reading(device_id=device.device_id, temperature=11.0, humidity=45.0,
+                    timestamp=now - timedelta(minutes=i))
+            for i in range(count)
+        ])
+        alerts = Alert.objects.bulk_create([
+            Alert(device=device, reading=reading, alert_type='high_temperature', severity='severe',
+                  message=f'Temperature high temperature: {reading.temperature}°C',
+                  timestamp=reading.timestamp)
+            for reading in readings
+        ])
+        incidents = Incident.objects.bulk_create([
+            Incident(device=device, alert=alert, description='Temperature high temperature incident',
+                     status='open', start_time=alert.timestamp)
+            for alert in alerts
+        ])
+        IncidentTimelineEvent.objects.bulk_create([
+            IncidentTimelineEvent(incident=incident, event_type='alert_created',
+                                  description='Initial alert', temperature=11.0)
+            for incident in incidents
+            for _ in range(3)
+        ])
+
+        client = APIClient()
+        client.force_authenticate(user=self.user)
+        iterations = max(1, self.options['iterations'] // 10)
+
+        def run(i):
+            return client.get('/api/monitoring/incidents/')
+
+        self._measure('incident_list', run, iterations)
+
+    # Helpers
+
+    def _measure(self, name, func, iterations, items_per_call=1):
+        """Time `iterations` calls of func and record latency percentiles and throughput"""
+        latencies = []
+        errors = 0
+        started = time.perf_counter()
+        for i in range(iterations):
+            call_started = time.perf_counter()
+            response = func(i)
+            latencies.append((time.perf_counter() - call_started) * 1000)
+            if response is not None and response.status_code >= 400:
+                errors += 1
+        elapsed = time.perf_counter() - started
+
+        latencies.sort()
+        result = {
+            'count': iterations,
+            'items': iterations * items_per_call,
+            'errors': errors,
+            'total_s': round(elapsed, 4),
+            'throughput': round(iterations * items_per_call / elapsed, 2) if elapsed else 0,
+            'mean_ms': round(sum(latencies) / len(latencies), 3),
+            'p50_ms': round(percentile(latencies, 50), 3),
+            'p95_ms': round(percentile(latencies, 95), 3),
+            'p99_ms': round(percentile(latencies, 99), 3),
+            'max_ms': round(latencies[-1], 3),
+        }
+        self.results[name] = result
+        self.stdout.write(
+            f"{name:<28} {result['throughput']:>12.2f} items/s  "
+            f"p50 {result['p50_ms']:>9.3f} ms  p95 {result['p95_ms']:>9.3f} ms  "
+            f"p99 {result['p99_ms']:>9.3f} ms  errors {errors}"
+        )
+
+    def _compare_to_baseline(self, path, tolerance):
+        with open(path) as f:
+            baseline = json.load(f).get('results', {})
+
+        regressions = []
+        for name, result in self.results.items():
+            previous = baseline.get(name)
+            if not previous:
+                continue
+            for metric in LOWER_IS_BETTER + ('throughput',):
+                old, new = previous.get(metric), result.get(metric)
+                if not old or new is None:
+                    continue
+                change = (new - old) / old
+                worse = change > tolerance if metric in LOWER_IS_BETTER else change < -tolerance
+                if worse:
+                    regressions.append({
+                        'scenario': name,
+                        'metric': metric,
+                        'baseline': old,
+                        'current': new,
+                        'change': round(change, 4),
+                    })
+                    self.stdout.write(self.style.ERROR(
+                        f'Regression in {name}.{metric}: {old} -> {new} ({change:+.1%})'
+                    ))
+
+        if not regressions:
+            self.stdout.write(self.style.SUCCESS('No regressions against baseline'))
+        return regressions
+
+    def _seed_readings(self, device_id, count, start, step_seconds, chunk_size=5000):
+        """Bulk insert `count` readings spaced `step_seconds` apart"""
+        for offset in range(0, max(count, 0), chunk_size):
+            Reading.objects.bulk_create([
+                Reading(
+                    device_id=device_id,
+                    temperature=round(random.uniform(1, 11), 2),
+                    humidity=round(random.uniform(30, 70), 2),
+                    timestamp=start + timedelta(seconds=(offset + n) * step_seconds),
+                )
+                for n in range(min(chunk_size, count - offset))
+            ])
+
+    def _get_bench_user(self):
+        user, created = User.objects.get_or_create(
+            email=BENCH_USER_EMAIL,
+            defaults={'first_name': 'Benchmark', 'last_name': 'User', 'is_staff': True}
+        )
+        return user
+
+    def _cleanup(self):
+        """Remove every row created by a benchmark run"""
+        Device.objects.filter(device_id__startswith=BENCH_PREFIX).delete()
+        # Raw delete so large export tables are not loaded through the ORM collector
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"DELETE FROM {Reading._meta.db_table} WHERE device_id LIKE %s ESCAPE '\\'",
+                [BENCH_PREFIX.replace('_', '\\_') + '%']
+            )
+        User.objects.filter(email=BENCH_USER_EMAIL).delete()
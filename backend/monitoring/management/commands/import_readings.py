@@ -0,0 +1,384 @@
+import csv
+import json
+import os
+import time
+from datetime import datetime, timezone as dt_timezone
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from monitoring.bulk_load import supports_copy, copy_binary, unix_us_to_pg, unix_us_to_datetime
+from monitoring.ingest import field_range, POWER_STATUSES
+from monitoring.models import Device, Reading
+from monitoring.services.replay import ReplayService
+from monitoring.services.stats_cache import note_readings_stored
+from monitoring.services.compliance import invalidate_rollups
+from monitoring.services.availability import invalidate_gaps
+
+COLUMNS = ('device_id', 'temperature', 'humidity', 'power_status', 'battery_level', 'timestamp')
+REQUIRED_COLUMNS = ('device_id', 'temperature', 'humidity', 'timestamp')
+DEFAULTS = {'power_status': 'AC', 'battery_level': 100.0}
+STAGING_TABLE = 'reading_import_staging'
+# Readings before 2000 or more than a day in the future are treated as corrupt clocks
+EARLIEST_TIMESTAMP_US = 946684800 * 1_000_000
+MAX_CLOCK_SKEW = 86400
+
+
+def _to_float(values):
+    try:
+        return np.asarray(values, dtype=np.float64)
+    except (TypeError, ValueError):
+        def parse(value):
+            try:
+                return float(value)
+            except (TypeError, ValueError):
+                return np.nan
+        return np.fromiter((parse(v) for v in values), dtype=np.float64, count=len(values))
+
+
+def _parse_datetime_us(value):
+    try:
+        parsed = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+    except ValueError:
+        return np.iinfo(np.int64).min
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=dt_timezone.utc)
+    return int(parsed.timestamp() * 1_000_000)
+
+
+def _to_epoch_us(values):
+    """Timestamps (ISO 8601 strings or epoch seconds) to int64 microseconds; invalid -> int64 min"""
+    invalid = np.iinfo(np.int64).min
+    array = np.asarray(values)
+    if array.dtype.kind not in 'iuf':
+        try:
+            # Epoch seconds read from text columns
+            array = np.asarray(values, dtype=np.float64)
+        except (TypeError, ValueError):
+            pass
+    if array.dtype.kind in 'iuf':
+        return np.where(np.isfinite(array), array * 1_000_000, invalid).astype(np.int64)
+
+    # Fast path: UTC ISO strings parse in one NumPy call once the zone suffix is dropped
+    normalized = [
+        v[:-1] if v.endswith('Z') else v[:-6] if v.endswith('+00:00') else v
+        for v in (str(value) for value in values)
+    ]
+    try:
+        return np.array(normalized, dtype='datetime64[us]').astype(np.int64)
+    except ValueError:
+        return np.fromiter((_parse_datetime_us(v) for v in values), dtype=np.int64, count=len(values))
+
+
+def validate_chunk(columns):
+    """
+    Validate one chunk of raw column lists in vectorized form.
+
+    Returns (valid, rejected_count) where valid is a dict of NumPy arrays holding
+    only the rows that passed every check.
+    """
+    count = len(columns['device_id'])
+    device_ids = np.array([v if isinstance(v, str) else '' for v in columns['device_id']], dtype=object)
+    lengths = np.fromiter((len(v) for v in device_ids), dtype=np.int64, count=count)
+    max_length = Reading._meta.get_field('device_id').max_length
+    ok = (lengths > 0) & (lengths <= max_length)
+
+    numbers = {}
+    for name in ('temperature', 'humidity', 'battery_level'):
+        values = _to_float(columns[name])
+        low, high = field_range(name)
+        ok &= np.isfinite(values) & (values >= low) & (values <= high)
+        numbers[name] = values
+
+    power_status = np.char.upper(np.array([str(v) for v in columns['power_status']]))
+    ok &= np.isin(power_status, POWER_STATUSES)
+
+    timestamps = _to_epoch_us(columns['timestamp'])
+    latest = int((time.time() + MAX_CLOCK_SKEW) * 1_000_000)
+    ok &= (timestamps >= EARLIEST_TIMESTAMP_US) & (timestamps <= latest)
+
+    valid = {
+        'device_id': device_ids[ok],
+        'temperature': numbers['temperature'][ok],
+        'humidity': numbers['humidity'][ok],
+        'power_status': power_status[ok],
+        'battery_level': numbers['battery_level'][ok],
+        'timestamp': timestamps[ok],
+    }
+    return valid, int(count - ok.sum())
+
+
+class Command(BaseCommand):
+    help = (
+        'Bulk imports historical readings from CSV, NDJSON or Parquet with validation, '
+        'deduplication on (device_id, timestamp) and resumable checkpoints'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Input file')
+        parser.add_argument('--format', choices=['csv', 'ndjson', 'parquet'],
+                            help='Input format (default: from the file extension)')
+        parser.add_argument('--chunk-size', type=int, default=100000, help='Rows per load transaction')
+        parser.add_argument('--checkpoint', help='Checkpoint file (default: <path>.checkpoint.json)')
+        parser.add_argument('--restart', action='store_true',
+                            help='Ignore an existing checkpoint and start from the beginning')
+        parser.add_argument('--evaluate', action='store_true',
+                            help='Replay imported readings through threshold evaluation to rebuild '
+                                 'alerts and incidents (notifications are not sent)')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        if not os.path.exists(path):
+            raise CommandError(f'Input file not found: {path}')
+
+        self.input_format = options['format'] or self._detect_format(path)
+        self.chunk_size = options['chunk_size']
+        self.checkpoint_path = options['checkpoint'] or f'{path}.checkpoint.json'
+        self.checkpoint = self._load_checkpoint(path, options['restart'])
+        self.use_copy = supports_copy(connection)
+
+        if not self.checkpoint['import_done']:
+            self._import(path)
+        else:
+            self.stdout.write('Import already completed according to checkpoint')
+
+        if options['evaluate']:
+            self._evaluate()
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {self.checkpoint['inserted']:,} readings "
+            f"({self.checkpoint['duplicates']:,} duplicates skipped, {self.checkpoint['rejected']:,} rejected)"
+        ))
+
+    # Import
+
+    def _import(self, path):
+        readers = {'csv': self._read_csv, 'ndjson': self._read_ndjson, 'parquet': self._read_parquet}
+        started = time.monotonic()
+        rows_at_start = self.checkpoint['rows_read']
+
+        if self.checkpoint['position']:
+            self.stdout.write(f"Resuming after {self.checkpoint['rows_read']:,} rows")
+        if self.use_copy:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f'CREATE TEMP TABLE IF NOT EXISTS {STAGING_TABLE} ('
+                    'device_id varchar(100), temperature double precision, humidity double precision, '
+                    'power_status varchar(20), battery_level double precision, timestamp timestamptz'
+                    ') ON COMMIT DELETE ROWS'
+                )
+
+        for columns, position in readers[self.input_format](path, self.checkpoint['position']):
+            for name, default in DEFAULTS.items():
+                if name not in columns:
+                    columns[name] = [default] * len(columns['device_id'])
+                else:
+                    columns[name] = [default if v in (None, '') else v for v in columns[name]]
+
+            valid, rejected = validate_chunk(columns)
+            with transaction.atomic():
+                self._ensure_devices(valid['device_id'])
+                inserted = self._load_chunk(valid) if len(valid['device_id']) else 0
+            if inserted:
+                # Cached statistics and rollups for past windows covering the chunk are now stale
+                earliest = unix_us_to_datetime(int(valid['timestamp'].min()))
+                latest = unix_us_to_datetime(int(valid['timestamp'].max()))
+                note_readings_stored(earliest, latest)
+                invalidate_rollups(set(valid['device_id']), earliest, latest)
+                invalidate_gaps(set(valid['device_id']), earliest, latest)
+
+            read = len(columns['device_id'])
+            self.checkpoint['position'] = position
+            self.checkpoint['rows_read'] += read
+            self.checkpoint['inserted'] += inserted
+            self.checkpoint['duplicates'] += len(valid['device_id']) - inserted
+            self.checkpoint['rejected'] += rejected
+            self.checkpoint['devices'] = sorted(set(self.checkpoint['devices']) | set(valid['device_id']))
+            self._save_checkpoint()
+
+            elapsed = time.monotonic() - started
+            rate = (self.checkpoint['rows_read'] - rows_at_start) / elapsed if elapsed else 0
+            self.stdout.write(
+                f"  {self.checkpoint['rows_read']:,} rows read, {self.checkpoint['inserted']:,} inserted, "
+                f"{self.checkpoint['duplicates']:,} duplicates, {self.checkpoint['rejected']:,} rejected "
+                f"({rate:,.0f} rows/s)"
+            )
+
+        self.checkpoint['import_done'] = True
+        self._save_checkpoint()
+
+    def _ensure_devices(self, device_ids):
+        """Create Device rows for ids seen for the first time, as live ingest would"""
+        Device.objects.bulk_create([
+            Device(device_id=device_id, name=f'ESP8266 Sensor {device_id}', location='Default Location')
+            for device_id in set(device_ids)
+        ], ignore_conflicts=True)
+
+    def _load_chunk(self, valid):
+        if self.use_copy:
+            table = Reading._meta.db_table
+            with connection.cursor() as cursor:
+                copy_binary(cursor, STAGING_TABLE, COLUMNS, [
+                    np.array([v.encode() for v in valid['device_id']]),
+                    valid['temperature'],
+                    valid['humidity'],
+                    np.char.encode(valid['power_status']),
+                    valid['battery_level'],
+                    unix_us_to_pg(valid['timestamp']),
+                ])
+                # Merge, skipping rows already stored and duplicates inside the chunk. Imported
+                # readings are stored untagged, like bulk_create does on other backends
+                cursor.execute(
+                    f'INSERT INTO {table} ({", ".join(COLUMNS)}, suspect) '
+                    f"SELECT {', '.join(COLUMNS)}, '' FROM {STAGING_TABLE} "
+                    f'ORDER BY device_id, timestamp '
+                    f'ON CONFLICT (device_id, timestamp) DO NOTHING'
+                )
+                return cursor.rowcount
+
+        # Other backends: look up what is already stored for the chunk's devices and time span
+        timestamps = [unix_us_to_datetime(ts) for ts in valid['timestamp']]
+        existing = set(
+            Reading.objects.filter(
+                device_id__in=set(valid['device_id']),
+                timestamp__gte=min(timestamps),
+                timestamp__lte=max(timestamps),
+            ).values_list('device_id', 'timestamp')
+        )
+        readings = []
+        for i, timestamp in enumerate(timestamps):
+            key = (valid['device_id'][i], timestamp)
+            if key in existing:
+                continue
+            existing.add(key)
+            readings.append(Reading(
+                device_id=key[0],
+                temperature=float(valid['temperature'][i]),
+                humidity=float(valid['humidity'][i]),
+                power_status=str(valid['power_status'][i]),
+                battery_level=float(valid['battery_level'][i]),
+                timestamp=timestamp,
+            ))
+        Reading.objects.bulk_create(readings, batch_size=5000)
+        return len(readings)
+
+    # Readers yield (columns, resume_position) per chunk
+
+    def _read_lines(self, path, position, parse):
+        with open(path, 'rb') as f:
+            f.seek(position)
+            while True:
+                lines = []
+                while len(lines) < self.chunk_size:
+                    line = f.readline()
+                    if not line:
+                        break
+                    if line.strip():
+                        lines.append(line.decode('utf-8'))
+                if not lines:
+                    return
+                yield parse(lines), f.tell()
+
+    def _read_csv(self, path, position):
+        with open(path, 'rb') as f:
+            header_line = f.readline()
+            header_end = f.tell()
+        header = [name.strip() for name in next(csv.reader([header_line.decode('utf-8-sig')]))]
+        missing = [name for name in REQUIRED_COLUMNS if name not in header]
+        if missing:
+            raise CommandError(f"CSV is missing required columns: {', '.join(missing)}")
+
+        def parse(lines):
+            rows = list(csv.reader(lines))
+            return {
+                name: [row[index] if index < len(row) else None for row in rows]
+                for index, name in enumerate(header) if name in COLUMNS
+            }
+
+        return self._read_lines(path, max(position, header_end), parse)
+
+    def _read_ndjson(self, path, position):
+        def parse(lines):
+            records = []
+            for line in lines:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    record = {}
+                records.append(record if isinstance(record, dict) else {})
+            return {name: [record.get(name) for record in records] for name in COLUMNS}
+
+        return self._read_lines(path, position, parse)
+
+    def _read_parquet(self, path, position):
+        try:
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise CommandError('Parquet import requires pyarrow (pip install pyarrow)')
+
+        parquet = pq.ParquetFile(path)
+        names = [name for name in COLUMNS if name in parquet.schema_arrow.names]
+        # Resume position is the next row group to load
+        for group in range(position, parquet.num_row_groups):
+            table = parquet.read_row_group(group, columns=names)
+            yield {name: table.column(name).to_pylist() for name in names}, group + 1
+
+    # Replay
+
+    def _evaluate(self):
+        """Run imported readings through threshold evaluation, per device in timestamp order"""
+        service = ReplayService()
+        devices = {d.device_id: d for d in Device.objects.filter(device_id__in=self.checkpoint['devices'])}
+        remaining = [d for d in self.checkpoint['devices'] if d > (self.checkpoint['evaluated_through'] or '')]
+
+        for device_id in remaining:
+            device = devices[device_id]
+            readings = Reading.objects.filter(device_id=device_id, id__gt=self.checkpoint['id_watermark'])
+            evaluated = service.replay(device, readings, service.stored_incident(device))
+
+            self.checkpoint['evaluated_through'] = device_id
+            self._save_checkpoint()
+            self.stdout.write(f'  Evaluated {evaluated:,} readings for {device_id}')
+
+    # Checkpoints
+
+    def _detect_format(self, path):
+        extension = os.path.splitext(path)[1].lower()
+        formats = {'.csv': 'csv', '.ndjson': 'ndjson', '.jsonl': 'ndjson', '.parquet': 'parquet'}
+        if extension not in formats:
+            raise CommandError('Cannot detect input format, pass --format')
+        return formats[extension]
+
+    def _load_checkpoint(self, path, restart):
+        stat = os.stat(path)
+        source = {'path': os.path.abspath(path), 'size': stat.st_size, 'mtime': stat.st_mtime}
+
+        if not restart and os.path.exists(self.checkpoint_path):
+            with open(self.checkpoint_path) as f:
+                checkpoint = json.load(f)
+            if checkpoint['source'] != source:
+                raise CommandError(
+                    f'{path} changed since the checkpoint was written; rerun with --restart'
+                )
+            return checkpoint
+
+        return {
+            'source': source,
+            'position': 0,
+            'rows_read': 0,
+            'inserted': 0,
+            'duplicates': 0,
+            'rejected': 0,
+            'devices': [],
+            'import_done': False,
+            # Readings with a higher id were inserted by this import and are the ones replayed
+            'id_watermark': Reading.objects.order_by('-id').values_list('id', flat=True).first() or 0,
+            'evaluated_through': None,
+        }
+
+    def _save_checkpoint(self):
+        temporary = f'{self.checkpoint_path}.tmp'
+        with open(temporary, 'w') as f:
+            json.dump(self.checkpoint, f, indent=2)
+        os.replace(temporary, self.checkpoint_path)
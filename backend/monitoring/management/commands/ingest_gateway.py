@@ -0,0 +1,373 @@
+import asyncio
+import logging
+import struct
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+
+from rest_framework.exceptions import AuthenticationFailed
+
+from monitoring.device_auth import device_may_submit, open_signed_payload
+from monitoring.ingest import decode_payload
+from monitoring.services.reading_service import ReadingService
+from monitoring.throttling import known_devices
+
+logger = logging.getLogger(__name__)
+
+# MQTT 3.1.1 control packet types (high nibble of the fixed header)
+CONNECT, CONNACK, PUBLISH, PUBACK, SUBSCRIBE, SUBACK, PINGREQ, PINGRESP = 1, 2, 3, 4, 8, 9, 12, 13
+
+
+def _mqtt_string(value):
+    encoded = value.encode('utf-8')
+    return struct.pack('!H', len(encoded)) + encoded
+
+
+def _mqtt_packet(packet_type, flags, body):
+    length = len(body)
+    remaining = bytearray()
+    while True:
+        byte, length = length % 128, length // 128
+        remaining.append(byte | 0x80 if length else byte)
+        if not length:
+            break
+    return bytes([packet_type << 4 | flags]) + bytes(remaining) + body
+
+
+class MqttSubscriber:
+    """
+    Minimal MQTT 3.1.1 subscriber on asyncio streams: CONNECT, SUBSCRIBE,
+    QoS 0/1 PUBLISH delivery and keep-alive pings. QoS 1 messages are only
+    acknowledged once the caller has stored them.
+    """
+
+    def __init__(self, host, port, topic, client_id, qos, keepalive=60, username=None, password=None):
+        self.host = host
+        self.port = port
+        self.topic = topic
+        self.client_id = client_id
+        self.qos = qos
+        self.keepalive = keepalive
+        self.username = username
+        self.password = password
+        self.writer = None
+
+    async def connect(self):
+        reader, writer = await asyncio.open_connection(self.host, self.port)
+        flags = 0x00 if self.qos else 0x02  # keep the session so the broker queues QoS 1 messages
+        payload = _mqtt_string(self.client_id)
+        if self.username:
+            flags |= 0x80
+            payload += _mqtt_string(self.username)
+            if self.password:
+                flags |= 0x40
+                payload += _mqtt_string(self.password)
+        writer.write(_mqtt_packet(
+            CONNECT, 0, _mqtt_string('MQTT') + struct.pack('!BBH', 4, flags, self.keepalive) + payload
+        ))
+
+        packet_type, _, body = await self._read_packet(reader)
+        if packet_type != CONNACK or body[1] != 0:
+            writer.close()
+            raise ConnectionError(f'MQTT connection refused (return code {body[1] if len(body) > 1 else "?"})')
+
+        writer.write(_mqtt_packet(SUBSCRIBE, 0x02, struct.pack('!H', 1) + _mqtt_string(self.topic) + bytes([self.qos])))
+        self.reader, self.writer = reader, writer
+
+    async def messages(self):
+        """Yield (topic, payload, ack) until the connection drops; ack is None for QoS 0"""
+        pinger = asyncio.create_task(self._ping())
+        try:
+            while True:
+                packet_type, flags, body = await self._read_packet(self.reader)
+                if packet_type != PUBLISH:
+                    continue
+                topic_length = struct.unpack_from('!H', body)[0]
+                topic = body[2:2 + topic_length].decode('utf-8', 'replace')
+                offset = 2 + topic_length
+                ack = None
+                if (flags >> 1) & 0x03:
+                    packet_id = body[offset:offset + 2]
+                    offset += 2
+                    ack = self._acker(self.writer, packet_id)
+                yield topic, body[offset:], ack
+        finally:
+            pinger.cancel()
+
+    async def close(self):
+        """Close the connection, sending any acks still buffered"""
+        if self.writer and not self.writer.is_closing():
+            self.writer.close()
+            try:
+                await self.writer.wait_closed()
+            except OSError:
+                pass
+
+    def _acker(self, writer, packet_id):
+        def ack():
+            # Acks for a connection that has since dropped are redelivered by the broker instead
+            if not writer.is_closing():
+                writer.write(_mqtt_packet(PUBACK, 0, packet_id))
+        return ack
+
+    async def _ping(self):
+        while True:
+            await asyncio.sleep(self.keepalive / 2)
+            self.writer.write(_mqtt_packet(PINGREQ, 0, b''))
+
+    async def _read_packet(self, reader):
+        header = await reader.readexactly(1)
+        length, multiplier = 0, 1
+        while True:
+            byte = (await reader.readexactly(1))[0]
+            length += (byte & 0x7F) * multiplier
+            multiplier *= 128
+            if not byte & 0x80:
+                break
+        body = await reader.readexactly(length) if length else b''
+        return header[0] >> 4, header[0] & 0x0F, body
+
+
+class UdpReadingProtocol(asyncio.DatagramProtocol):
+    """Each datagram carries one JSON reading, a JSON list or packed records"""
+
+    def __init__(self, gateway):
+        self.gateway = gateway
+
+    def datagram_received(self, data, addr):
+        self.gateway.submit(data, None, wait=False)
+
+
+class Command(BaseCommand):
+    help = (
+        'Runs an asyncio gateway that receives readings over MQTT and/or UDP, micro-batches '
+        'them and stores them through the same pipeline as the ESP ingest endpoint'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--mqtt-host', help='MQTT broker host (MQTT is disabled when omitted)')
+        parser.add_argument('--mqtt-port', type=int, default=1883)
+        parser.add_argument('--mqtt-topic', default='sensors/+/reading',
+                            help='Topic filter; the "+" level is taken as the device id')
+        parser.add_argument('--mqtt-client-id', default='temp-monitor-gateway')
+        parser.add_argument('--mqtt-username')
+        parser.add_argument('--mqtt-password')
+        parser.add_argument('--mqtt-qos', type=int, choices=[0, 1], default=1,
+                            help='1 acknowledges messages only after they are stored')
+        parser.add_argument('--udp-bind', help='host:port to receive UDP datagrams on, e.g. 0.0.0.0:5684')
+        parser.add_argument('--batch-size', type=int, default=2000, help='Maximum readings per write')
+        parser.add_argument('--max-delay', type=float, default=50,
+                            help='Milliseconds to wait for a batch to fill before writing it')
+        parser.add_argument('--max-pending', type=int, default=100000,
+                            help='Queued messages before UDP datagrams are dropped and MQTT reads pause')
+        parser.add_argument('--report-every', type=float, default=10, help='Seconds between progress lines')
+        parser.add_argument('--duration', type=float, default=0, help='Stop after this many seconds (0 = run forever)')
+
+    def handle(self, *args, **options):
+        if not options['mqtt_host'] and not options['udp_bind']:
+            raise CommandError('Nothing to listen on, pass --mqtt-host and/or --udp-bind')
+        self.options = options
+        try:
+            asyncio.run(self._run())
+        except KeyboardInterrupt:
+            pass
+        self.stdout.write(self.style.SUCCESS(
+            f"Gateway stopped: {self.stats['stored']} stored, {self.stats['duplicates']} duplicates, "
+            f"{self.stats['rejected']} rejected, "
+            f"{self.stats['dropped']} dropped, {self.stats['failed']} failed"
+        ))
+
+    async def _run(self):
+        options = self.options
+        self.queue = asyncio.Queue(maxsize=options['max_pending'])
+        self.stats = {
+            'received': 0, 'stored': 0, 'duplicates': 0, 'rejected': 0, 'dropped': 0, 'failed': 0, 'batches': 0,
+        }
+        self.started = time.monotonic()
+        self.service = ReadingService()
+        self.subscriber = None
+
+        tasks = [asyncio.create_task(self._write_batches()), asyncio.create_task(self._report_progress())]
+        transport = None
+        if options['udp_bind']:
+            host, _, port = options['udp_bind'].rpartition(':')
+            transport, _ = await asyncio.get_running_loop().create_datagram_endpoint(
+                lambda: UdpReadingProtocol(self), local_addr=(host or '0.0.0.0', int(port))
+            )
+            self.stdout.write(f"Listening for UDP readings on {options['udp_bind']}")
+        if options['mqtt_host']:
+            tasks.append(asyncio.create_task(self._consume_mqtt()))
+
+        try:
+            if options['duration']:
+                await asyncio.sleep(options['duration'])
+            else:
+                await asyncio.Event().wait()
+        finally:
+            if transport:
+                transport.close()
+            for task in tasks[1:]:
+                task.cancel()
+            # Let the writer store whatever was already received, then stop
+            await self.queue.put(None)
+            await tasks[0]
+            if self.subscriber:
+                await self.subscriber.close()
+
+    def submit(self, payload, ack, device_id=None, wait=True):
+        """Queue a raw message; returns an awaitable when wait is set so MQTT reads apply backpressure"""
+        self.stats['received'] += 1
+        item = (payload, device_id, ack)
+        if wait:
+            return self.queue.put(item)
+        try:
+            self.queue.put_nowait(item)
+        except asyncio.QueueFull:
+            self.stats['dropped'] += 1
+
+    async def _consume_mqtt(self):
+        options = self.options
+        self.subscriber = subscriber = MqttSubscriber(
+            options['mqtt_host'], options['mqtt_port'], options['mqtt_topic'], options['mqtt_client_id'],
+            options['mqtt_qos'], username=options['mqtt_username'], password=options['mqtt_password'],
+        )
+        levels = options['mqtt_topic'].split('/')
+        device_level = levels.index('+') if '+' in levels else None
+        backoff = 1
+
+        while True:
+            try:
+                await subscriber.connect()
+                self.stdout.write(f"Subscribed to {options['mqtt_topic']} on {options['mqtt_host']}:{options['mqtt_port']}")
+                backoff = 1
+                async for topic, payload, ack in subscriber.messages():
+                    parts = topic.split('/')
+                    device_id = parts[device_level] if device_level is not None and device_level < len(parts) else None
+                    await self.submit(payload, ack, device_id)
+            except (OSError, ConnectionError, asyncio.IncompleteReadError) as e:
+                await subscriber.close()
+                logger.error(f"MQTT connection lost, retrying in {backoff}s: {str(e)}")
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, 30)
+
+    def _drain(self, limit):
+        items = []
+        while len(items) < limit and not self.queue.empty():
+            item = self.queue.get_nowait()
+            if item is None:
+                self.stopping = True
+                break
+            items.append(item)
+        return items
+
+    async def _write_batches(self):
+        batch_size = self.options['batch_size']
+        max_delay = self.options['max_delay'] / 1000
+        self.stopping = False
+        while not self.stopping:
+            item = await self.queue.get()
+            if item is None:
+                return
+            items = [item]
+            if self.queue.qsize() < batch_size - 1:
+                # Give the batch a moment to fill rather than writing readings one by one
+                await asyncio.sleep(max_delay)
+            items += self._drain(batch_size - 1)
+            await self._flush(items)
+
+    async def _flush(self, items):
+        records, rejected = await sync_to_async(self._decode)(items)
+        self.stats['rejected'] += rejected
+        acks = [ack for _, _, ack in items if ack]
+        if not records and not acks:
+            return
+
+        try:
+            await self._write(records)
+        except Exception as e:
+            logger.error(f"Error storing gateway batch: {str(e)}")
+            if not await self._write_one_by_one(records):
+                # Nothing could be stored: the database is the problem, not the readings.
+                # QoS 1 messages stay unacknowledged and are redelivered after reconnecting
+                self.stats['failed'] += len(records)
+                return
+
+        for ack in acks:
+            ack()
+        self.stats['batches'] += 1
+
+    def _decode(self, items):
+        """
+        Decode queued messages into reading tuples, applying the ingest
+        endpoints' device credential rules: readings of a device with a key,
+        or of any device with INGEST_REQUIRE_DEVICE_KEY, must come in a
+        message that device signed (see monitoring.device_auth). Returns
+        (records, rejected). Runs outside the event loop, since device keys
+        may have to be loaded from the database.
+        """
+        records = []
+        rejected = 0
+        for payload, device_id, _ in items:
+            try:
+                payload, signer = open_signed_payload(payload)
+            except AuthenticationFailed as e:
+                logger.warning(f"Rejected gateway message: {e.detail}")
+                rejected += 1
+                continue
+            decoded, invalid = decode_payload(payload, signer or device_id)
+            allowed = [record for record in decoded if device_may_submit(record[0], signer)]
+            records += allowed
+            rejected += invalid + len(decoded) - len(allowed)
+        return records, rejected
+
+    async def _write(self, records):
+        readings = await sync_to_async(self._store)(records)
+        duplicates = sum(reading is None for reading in readings)
+        self.stats['stored'] += len(readings) - duplicates
+        self.stats['duplicates'] += duplicates
+        # Readings from unregistered devices, when auto-registration is off
+        self.stats['rejected'] += len(records) - len(readings)
+
+    async def _write_one_by_one(self, records):
+        """
+        Store the readings of a failed batch separately, so a reading the
+        database refuses does not hold back the rest, the way the HTTP batch
+        endpoint reports bad readings without failing the batch. Those
+        readings are rejected. Returns False, having stored nothing, when
+        every reading fails.
+        """
+        refused = []
+        for record in records:
+            try:
+                await self._write([record])
+            except Exception as e:
+                refused.append((record, e))
+        if len(refused) == len(records):
+            return False
+        for record, e in refused:
+            logger.error(f"Rejected gateway reading from {record[0]}: {str(e)}")
+        self.stats['rejected'] += len(refused)
+        return True
+
+    def _store(self, records):
+        # Long running process: drop connections the database has timed out
+        close_old_connections()
+        if not settings.INGEST_AUTO_REGISTER_DEVICES:
+            records = [record for record in records if known_devices.contains(record[0])]
+        return self.service.ingest(records)
+
+    async def _report_progress(self):
+        last_stored = 0
+        every = self.options['report_every']
+        while True:
+            await asyncio.sleep(every)
+            stats = self.stats
+            self.stdout.write(
+                f"[{time.monotonic() - self.started:7.1f}s] {(stats['stored'] - last_stored) / every:9.1f} readings/s  "
+                f"stored {stats['stored']}  duplicates {stats['duplicates']}  rejected {stats['rejected']}  dropped {stats['dropped']}  "
+                f"failed {stats['failed']}  pending {self.queue.qsize()}"
+            )
+            last_stored = stats['stored']
@@ -1,16 +1,201 @@
 from django.core.management.base import BaseCommand
+from django.core.management.color import no_style
+from django.db import connection, connections, transaction
 from django.utils import timezone
 from django.contrib.auth import get_user_model
-from monitoring.models import Device, Reading, Alert, Incident
-from notifications.models import Operator
+from monitoring.bulk_load import supports_copy, copy_binary, copy_rows, unix_us_to_pg, unix_us_to_datetime
+from monitoring.models import Device, Reading, Alert, Incident, IncidentComment, IncidentTimelineEvent, EscalationDeadline
+from monitoring.services.escalation import MAX_LEVEL, level_reached
+from notifications.models import Operator, Notification
+from settings.models import SystemSettings
+from multiprocessing import Pool
+import numpy as np
+import json
 import random
+import time
 from datetime import timedelta
 
 User = get_user_model()
 
+LOCATIONS = ['Lab A', 'Lab B', 'Storage Room', 'Clean Room']
+
+
+def _episode_mask(rng, size, episodes_per_sample, min_length, max_length):
+    """Boolean mask with randomly placed contiguous episodes (excursions, power cuts)"""
+    mask = np.zeros(size, dtype=bool)
+    for start in rng.integers(0, size, rng.poisson(size * episodes_per_sample)):
+        mask[start:start + rng.integers(min_length, max_length + 1)] = True
+    return mask
+
+
+def _runs(mask):
+    """(start, end) index pairs, end exclusive, of the True runs in mask"""
+    edges = np.diff(np.concatenate(([0], mask.astype(np.int8), [0])))
+    return zip(np.flatnonzero(edges == 1), np.flatnonzero(edges == -1))
+
+
+def generate_device_range(job):
+    """
+    Generate and load the history of a range of devices. Runs in a worker process.
+
+    Ids are derived from the device index so workers never coordinate: reading ids
+    are index * samples + k + 1, and each excursion's alert, incident and initial
+    timeline event reuse the id of its first reading.
+    """
+    rng = np.random.default_rng(job['seed'])
+    samples = job['samples']
+    interval_us = job['interval'] * 1_000_000
+    normal_min, normal_max, critical_min, critical_max = job['thresholds']
+    use_copy = supports_copy(connection)
+    # Generated history ends now; incidents still open have been escalating until then
+    now = unix_us_to_datetime(job['start_us'] + samples * interval_us)
+    loaded = 0
+
+    for device_pk, device_id, index in job['devices']:
+        ids = index * samples + np.arange(1, samples + 1, dtype=np.int64)
+        jitter = rng.integers(0, max(interval_us // 3, 1), samples)
+        timestamps = job['start_us'] + np.arange(samples, dtype=np.int64) * interval_us + jitter
+
+        # Cold room at ~5°C with a daily cycle, noise and occasional excursions
+        hours = (timestamps - timestamps[0]) / 3.6e9
+        temperature = rng.uniform(4, 6) + 0.5 * np.sin(hours * 2 * np.pi / 24) + rng.normal(0, 0.3, samples)
+        excursions = _episode_mask(rng, samples, job['excursion_rate'], 3, 30)
+        temperature[excursions] += np.where(rng.random(int(excursions.sum())) < 0.6, 5.5, -5.0)
+        temperature = np.round(temperature, 2)
+        humidity = np.round(rng.uniform(30, 70, samples), 2)
+
+        on_battery = _episode_mask(rng, samples, job['excursion_rate'] / 4, 5, 60)
+        battery_level = np.full(samples, 100.0)
+        for start, end in _runs(on_battery):
+            battery_level[start:end] = np.maximum(100.0 - 0.5 * np.arange(1, end - start + 1), 0)
+        power_status = np.where(on_battery, b'BATTERY', b'AC')
+
+        # Alerts and incidents follow the same rules as live threshold evaluation:
+        # one of each per excursion
+        out_of_range = (temperature < normal_min) | (temperature > normal_max)
+        excess = np.maximum(normal_min - temperature, temperature - normal_max)
+        alerts, incidents, deadlines = [], [], []
+        for start, end in _runs(out_of_range):
+            ongoing = end == samples
+            label = 'high' if temperature[start] > normal_max else 'low'
+            severe = ((temperature[start:end] < critical_min) | (temperature[start:end] > critical_max)).any()
+            alerts.append((
+                int(ids[start]), device_pk, int(ids[start]),
+                f'{label}_temperature',
+                'severe' if severe else 'critical',
+                f'Temperature {label} temperature: {temperature[start]}°C',
+                unix_us_to_datetime(timestamps[start]),
+                unix_us_to_datetime(timestamps[end - 1]),
+                float(temperature[start + np.argmax(excess[start:end])]),
+                int(end - start),
+            ))
+            # Nobody acknowledges generated incidents
+            level = level_reached(unix_us_to_datetime(timestamps[start]),
+                                  now if ongoing else unix_us_to_datetime(timestamps[end]))
+            if ongoing and level < MAX_LEVEL:
+                deadlines.append((int(ids[start]), level + 1, unix_us_to_datetime(timestamps[start])))
+            incidents.append((
+                int(ids[start]), device_pk, int(ids[start]),
+                f'Temperature {label} temperature incident',
+                unix_us_to_datetime(timestamps[start]),
+                None if ongoing else unix_us_to_datetime(timestamps[end]),
+                'open' if ongoing else 'resolved',
+                1,
+                level,
+                f'Initial alert: Temperature {label} temperature ({temperature[start]}°C)',
+                float(temperature[start]),
+            ))
+
+        with transaction.atomic():
+            if use_copy:
+                with connection.cursor() as cursor:
+                    copy_binary(
+                        cursor, Reading._meta.db_table,
+                        ['id', 'device_id', 'temperature', 'humidity', 'power_status', 'battery_level', 'timestamp',
+                         'suspect'],
+                        [ids, np.full(samples, device_id.encode()), temperature, humidity,
+                         power_status, battery_level, unix_us_to_pg(timestamps), np.full(samples, b'')]
+                    )
+                    copy_rows(
+                        cursor, Alert._meta.db_table,
+                        ['id', 'device_id', 'reading_id', 'alert_type', 'severity', 'message', 'timestamp',
+                         'last_timestamp', 'peak_temperature', 'sample_count', 'resolved', 'resolution_notes'],
+                        (alert + (False, '') for alert in alerts)
+                    )
+                    copy_rows(
+                        cursor, Incident._meta.db_table,
+                        ['id', 'device_id', 'alert_id', 'description', 'start_time', 'end_time',
+                         'status', 'alert_count', 'current_escalation_level'],
+                        (incident[:-2] for incident in incidents)
+                    )
+                    copy_rows(
+                        cursor, IncidentTimelineEvent._meta.db_table,
+                        ['id', 'incident_id', 'timestamp', 'event_type', 'description', 'temperature', 'metadata'],
+                        (
+                            (incident[0], incident[0], incident[4], 'alert_created',
+                             incident[-2], incident[-1], json.dumps({}))
+                            for incident in incidents
+                        )
+                    )
+                    copy_rows(cursor, EscalationDeadline._meta.db_table, ['incident_id', 'level', 'started_at'], deadlines)
+            else:
+                Reading.objects.bulk_create([
+                    Reading(id=int(ids[k]), device_id=device_id, temperature=float(temperature[k]),
+                            humidity=float(humidity[k]), power_status=power_status[k].decode(),
+                            battery_level=float(battery_level[k]), timestamp=unix_us_to_datetime(timestamps[k]))
+                    for k in range(samples)
+                ], batch_size=5000)
+                Alert.objects.bulk_create([
+                    Alert(id=a[0], device_id=a[1], reading_id=a[2], alert_type=a[3], severity=a[4],
+                          message=a[5], timestamp=a[6], last_timestamp=a[7], peak_temperature=a[8],
+                          sample_count=a[9])
+                    for a in alerts
+                ], batch_size=5000)
+                Incident.objects.bulk_create([
+                    Incident(id=i[0], device_id=i[1], alert_id=i[2], description=i[3], start_time=i[4],
+                             end_time=i[5], status=i[6], alert_count=i[7], current_escalation_level=i[8])
+                    for i in incidents
+                ], batch_size=5000)
+                IncidentTimelineEvent.objects.bulk_create([
+                    IncidentTimelineEvent(id=i[0], incident_id=i[0], event_type='alert_created',
+                                          description=i[-2], temperature=i[-1])
+                    for i in incidents
+                ], batch_size=5000)
+                EscalationDeadline.objects.bulk_create([
+                    EscalationDeadline(incident_id=d[0], level=d[1], started_at=d[2]) for d in deadlines
+                ])
+
+        loaded += samples
+    return loaded
+
+
 class Command(BaseCommand):
     help = 'Populates the database with test data'
 
+    def add_arguments(self, parser):
+        parser.add_argument('--devices', type=int,
+                            help='Scale mode: number of devices to generate (e.g. 5000)')
+        parser.add_argument('--days', type=int, default=8, help='Scale mode: days of history per device')
+        parser.add_argument('--interval', type=int, default=3600,
+                            help='Scale mode: seconds between readings')
+        parser.add_argument('--workers', type=int, default=4,
+                            help='Scale mode: parallel worker processes (forced to 1 on SQLite)')
+        parser.add_argument('--devices-per-job', type=int, default=20,
+                            help='Scale mode: devices generated per worker job')
+        parser.add_argument('--excursion-rate', type=float, default=0.002,
+                            help='Scale mode: expected excursions started per reading')
+        parser.add_argument('--seed', type=int, default=0, help='Scale mode: random seed')
+
+    def truncate_tables(self):
+        """Empty the test data tables with TRUNCATE (DELETE on SQLite) instead of ORM cascades"""
+        models = [
+            EscalationDeadline, IncidentTimelineEvent, IncidentComment, Notification, Incident, Alert,
+            Reading, Device, Operator, User,
+        ]
+        tables = [model._meta.db_table for model in models]
+        sql_list = connection.ops.sql_flush(no_style(), tables, reset_sequences=True, allow_cascade=True)
+        connection.ops.execute_sql_flush(sql_list)
+
     def create_test_users(self):
         # Create admin user
         admin = User.objects.create_superuser(
@@ -44,25 +229,25 @@ class Command(BaseCommand):
 
         return operators
 
-    def create_test_devices(self):
-        devices = []
-        locations = ['Lab A', 'Lab B', 'Storage Room', 'Clean Room']
-        
-        for i, location in enumerate(locations, 1):
-            device = Device.objects.create(
+    def create_test_devices(self, count=len(LOCATIONS)):
+        devices = Device.objects.bulk_create([
+            Device(
                 device_id=f'ESP8266_{i}',
                 name=f'Temperature Sensor {i}',
-                location=location,
+                location=LOCATIONS[(i - 1) % len(LOCATIONS)],
                 status='online',
                 reading_interval=20
             )
-            devices.append(device)
-        
+            for i in range(1, count + 1)
+        ], batch_size=1000)
+
         return devices
 
     def generate_readings(self, device, start_time, end_time):
         readings_to_create = []
         alerts_to_create = []
+        # Alert of the excursion the previous reading was part of
+        excursion = None
         
         # Calculate number of days between start and end time
         days = (end_time - start_time).days
@@ -111,16 +296,31 @@ class Command(BaseCommand):
                 if temperature < 2 or temperature > 8:
                     severity = 'critical' if (0 <= temperature <= 2) or (8 <= temperature <= 10) else 'severe'
                     alert_type = 'high_temperature' if temperature > 8 else 'low_temperature'
+
+                    if excursion:
+                        # Still out of range: one alert per excursion
+                        excursion.sample_count += 1
+                        excursion.last_timestamp = timestamp
+                        peak = excursion.peak_temperature
+                        if max(2 - temperature, temperature - 8) > max(2 - peak, peak - 8):
+                            excursion.peak_temperature = reading.temperature
+                        if severity == 'severe':
+                            excursion.severity = severity
+                        continue
                     
-                    alert = Alert(
+                    excursion = Alert(
                         device=device,
                         reading=reading,
                         alert_type=alert_type,
                         severity=severity,
                         message=f'Temperature {alert_type.replace("_", " ")}: {temperature}°C',
-                        timestamp=timestamp
+                        timestamp=timestamp,
+                        last_timestamp=timestamp,
+                        peak_temperature=reading.temperature
                     )
-                    alerts_to_create.append(alert)
+                    alerts_to_create.append(excursion)
+                else:
+                    excursion = None
         
         # Bulk create all readings
         readings = Reading.objects.bulk_create(readings_to_create)
@@ -130,8 +330,8 @@ class Command(BaseCommand):
             alerts = Alert.objects.bulk_create(alerts_to_create)
             
             # Create an incident for each alert
-            for alert in alerts:
-                Incident.objects.create(
+            Incident.objects.bulk_create([
+                Incident(
                     device=device,
                     alert=alert,
                     status='open',
@@ -139,19 +339,75 @@ class Command(BaseCommand):
                     current_escalation_level=1,
                     start_time=alert.timestamp
                 )
+                for alert in alerts
+            ])
+
+
+    def generate_scale_history(self, devices, options):
+        """Generate readings, alerts and incidents for many devices across worker processes"""
+        interval = options['interval']
+        samples = options['days'] * 86400 // interval
+        end_us = int(timezone.now().timestamp() * 1_000_000)
+        settings = SystemSettings.get_settings()
 
-    def handle(self, *args, **kwargs):
+        per_job = options['devices_per_job']
+        jobs = [
+            {
+                'devices': [(d.pk, d.device_id, index) for index, d in enumerate(devices[i:i + per_job], start=i)],
+                'samples': samples,
+                'interval': interval,
+                'start_us': end_us - samples * interval * 1_000_000,
+                'thresholds': (settings.normal_temp_min, settings.normal_temp_max,
+                               settings.critical_temp_min, settings.critical_temp_max),
+                'excursion_rate': options['excursion_rate'],
+                'seed': options['seed'] * 1_000_003 + i,
+            }
+            for i in range(0, len(devices), per_job)
+        ]
+
+        workers = options['workers'] if supports_copy(connection) else 1
+        total = samples * len(devices)
+        self.stdout.write(
+            f'Generating {total:,} readings for {len(devices):,} devices '
+            f'({samples:,} each) with {workers} worker(s)'
+        )
+
+        started = time.monotonic()
+        loaded = 0
+        if workers > 1:
+            # Workers open their own connections; never share the parent's socket across fork
+            connections.close_all()
+            with Pool(workers) as pool:
+                for count in pool.imap_unordered(generate_device_range, jobs):
+                    loaded += count
+                    self._report_progress(loaded, total, started)
+        else:
+            for job in jobs:
+                loaded += generate_device_range(job)
+                self._report_progress(loaded, total, started)
+
+        # Ids were assigned explicitly, so move the sequences past them
+        with connection.cursor() as cursor:
+            for sql in connection.ops.sequence_reset_sql(no_style(), [Reading, Alert, Incident, IncidentTimelineEvent]):
+                cursor.execute(sql)
+
+    def _report_progress(self, loaded, total, started):
+        elapsed = time.monotonic() - started
+        self.stdout.write(f'  {loaded:,}/{total:,} readings ({loaded / elapsed if elapsed else 0:,.0f} rows/s)')
+
+    def handle(self, *args, **options):
         # Clear existing data
-        Reading.objects.all().delete()
-        Alert.objects.all().delete()
-        Incident.objects.all().delete()
-        Device.objects.all().delete()
-        Operator.objects.all().delete()
-        User.objects.all().delete()  # Delete all users including admin
+        self.truncate_tables()
 
         # Create test users and operators
         operators = self.create_test_users()
-        
+
+        if options['devices']:
+            devices = self.create_test_devices(options['devices'])
+            self.generate_scale_history(devices, options)
+            self.stdout.write(self.style.SUCCESS('Successfully populated test data'))
+            return
+
         # Create test devices
         devices = self.create_test_devices()
 
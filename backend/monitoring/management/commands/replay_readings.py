@@ -0,0 +1,106 @@
+import re
+import time
+from multiprocessing import Pool
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from monitoring.bulk_load import supports_copy
+from monitoring.models import Device
+from monitoring.services.replay import create_shadow_schema, replay_devices, use_schema
+
+
+def replay_device_range(job):
+    """Replay a range of devices. Runs in a worker process."""
+    if job['schema']:
+        use_schema(job['schema'], job['real_schema'])
+    try:
+        devices = list(Device.objects.filter(device_id__in=job['device_ids']).order_by('device_id'))
+        return replay_devices(devices, job['start'], job['real_schema'])
+    finally:
+        if job['schema']:
+            use_schema(None, job['real_schema'])
+
+
+class Command(BaseCommand):
+    help = (
+        'Re-evaluates stored readings through the live threshold rules to rebuild temperature alerts '
+        'and incidents, device by device in timestamp order and without notifying anyone. Results '
+        'replace the stored history from --start on, or go to a shadow schema (--schema) for comparison.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--device-id', action='append', dest='device_ids', help='Limit to these devices')
+        parser.add_argument('--start', help='Replay readings from this time on (ISO 8601; default: all)')
+        parser.add_argument('--schema',
+                            help='Write to empty copies of the alert and incident tables in this PostgreSQL '
+                                 'schema instead of replacing the stored history')
+        parser.add_argument('--workers', type=int, default=4,
+                            help='Parallel worker processes (forced to 1 on SQLite)')
+        parser.add_argument('--devices-per-job', type=int, default=20, help='Devices replayed per worker job')
+
+    def handle(self, *args, **options):
+        start = None
+        if options['start']:
+            start = parse_datetime(options['start'])
+            if start is None:
+                raise CommandError(f"Invalid --start: {options['start']}")
+            if timezone.is_naive(start):
+                start = timezone.make_aware(start)
+
+        schema = options['schema']
+        real_schema = None
+        if schema:
+            if connection.vendor != 'postgresql':
+                raise CommandError('--schema requires PostgreSQL')
+            if not re.fullmatch(r'[a-z_][a-z0-9_]*', schema):
+                raise CommandError(f'Invalid schema name: {schema}')
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT current_schema()')
+                real_schema = cursor.fetchone()[0]
+            if schema == real_schema:
+                raise CommandError('--schema must differ from the schema holding the real tables')
+            create_shadow_schema(schema, real_schema)
+
+        devices = Device.objects.order_by('device_id')
+        if options['device_ids']:
+            devices = devices.filter(device_id__in=options['device_ids'])
+        device_ids = list(devices.values_list('device_id', flat=True))
+        per_job = options['devices_per_job']
+        jobs = [
+            {'device_ids': device_ids[i:i + per_job], 'start': start, 'schema': schema, 'real_schema': real_schema}
+            for i in range(0, len(device_ids), per_job)
+        ]
+
+        workers = options['workers'] if supports_copy(connection) else 1
+        self.stdout.write(
+            f"Replaying {len(device_ids):,} devices {'into schema ' + schema if schema else 'in place'} "
+            f'with {workers} worker(s)'
+        )
+
+        started = time.monotonic()
+        totals = {'readings': 0, 'alerts': 0, 'incidents': 0}
+        if workers > 1:
+            # Workers open their own connections; never share the parent's socket across fork
+            connections.close_all()
+            with Pool(workers) as pool:
+                for counts in pool.imap_unordered(replay_device_range, jobs):
+                    self._add(totals, counts, started)
+        else:
+            for job in jobs:
+                self._add(totals, replay_device_range(job), started)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Replayed {totals['readings']:,} readings into {totals['alerts']:,} alerts and "
+            f"{totals['incidents']:,} new incidents in {time.monotonic() - started:.1f}s"
+        ))
+
+    def _add(self, totals, counts, started):
+        for name in totals:
+            totals[name] += counts[name]
+        elapsed = time.monotonic() - started
+        self.stdout.write(
+            f"  {totals['readings']:,} readings ({totals['readings'] / elapsed if elapsed else 0:,.0f} readings/s)"
+        )
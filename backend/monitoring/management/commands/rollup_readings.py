@@ -0,0 +1,36 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from monitoring.services.compliance import ComplianceReport, settled_until
+from settings.models import SystemSettings
+
+
+class Command(BaseCommand):
+    help = (
+        'Builds the daily rollups the compliance report reads, for every device and settled day '
+        'that has none yet (or has one measured against other bounds). Safe to run on a schedule.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=30, help='How many settled days back to cover')
+        parser.add_argument('--device-id', action='append', dest='device_ids', help='Limit to these devices')
+        parser.add_argument('--range-min', type=float, help='Lower bound (default: normal_temp_min)')
+        parser.add_argument('--range-max', type=float, help='Upper bound (default: normal_temp_max)')
+
+    def handle(self, *args, **options):
+        system_settings = SystemSettings.get_settings()
+        range_min = options['range_min'] if options['range_min'] is not None else system_settings.normal_temp_min
+        range_max = options['range_max'] if options['range_max'] is not None else system_settings.normal_temp_max
+
+        last_day = settled_until()
+        first_day = last_day - timedelta(days=options['days'])
+        report = ComplianceReport(first_day, last_day, range_min, range_max, options['device_ids'])
+
+        started = time.monotonic()
+        built = report.ensure_rollups(first_day, last_day)
+        self.stdout.write(self.style.SUCCESS(
+            f"Built {built} rollups for {len(report.devices)} devices, {first_day.date()} to "
+            f"{(last_day - timedelta(days=1)).date()}, in {time.monotonic() - started:.1f}s"
+        ))
@@ -0,0 +1,31 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from monitoring.services.escalation import EscalationScheduler
+from monitoring.services.reading_service import ReadingService
+
+
+class Command(BaseCommand):
+    help = (
+        'Escalates incidents left unacknowledged to level 2 and level 3 operators after '
+        'ESCALATION_LEVEL2_AFTER and ESCALATION_LEVEL3_AFTER minutes. Runs until stopped, '
+        'waking when the next escalation is due; safe to restart at any time. Ingest does not '
+        'escalate, so this must run next to the backend (or --once from cron).'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true',
+                            help='Fire the escalations due now and exit (for running from cron)')
+
+    def handle(self, *args, **options):
+        scheduler = EscalationScheduler(ReadingService())
+        if options['once']:
+            fired = scheduler.run(once=True)
+            self.stdout.write(self.style.SUCCESS(f"Escalated {fired} incidents"))
+            return
+
+        self.stdout.write(
+            f"Escalating unacknowledged incidents after {settings.ESCALATION_LEVEL2_AFTER:g} and "
+            f"{settings.ESCALATION_LEVEL3_AFTER:g} minutes"
+        )
+        scheduler.run()
@@ -0,0 +1,33 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from monitoring.models import ReadingGap, ReadingGapScan
+from monitoring.services.availability import gap_scanner
+
+
+class Command(BaseCommand):
+    help = (
+        'Finds gaps in device readings (readings further apart than READING_GAP_INTERVALS '
+        'reading intervals) and stores them for the availability report. Each run only reads '
+        'readings newer than the previous one. Safe to run on a schedule.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--device-id', action='append', dest='device_ids', help='Limit to these devices')
+        parser.add_argument(
+            '--rescan', action='store_true',
+            help='Forget stored gaps and scan all readings again (after changing READING_GAP_INTERVALS)'
+        )
+
+    def handle(self, *args, **options):
+        if options['rescan']:
+            for model in (ReadingGap, ReadingGapScan):
+                stored = model.objects.all()
+                if options['device_ids']:
+                    stored = stored.filter(device_id__in=options['device_ids'])
+                stored.delete()
+
+        started = time.monotonic()
+        found = gap_scanner.scan(options['device_ids'])
+        self.stdout.write(self.style.SUCCESS(f"Found {found} gaps in {time.monotonic() - started:.1f}s"))
@@ -0,0 +1,395 @@
+import asyncio
+import json
+import math
+import random
+import time
+from collections import Counter, deque
+from urllib.parse import urlsplit
+
+from asgiref.sync import sync_to_async
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.utils import timezone
+
+from monitoring.management.utils import percentile
+from monitoring.models import Alert
+from monitoring.services.reading_service import ReadingService
+from settings.models import SystemSettings
+
+PROFILES = ('stable', 'drifting', 'hvac_failure', 'power_loss')
+AMBIENT_TEMPERATURE = 22.0
+
+
+class VirtualDevice:
+    """
+    One simulated ESP8266 + DHT11. Physics run on simulated time so a short soak
+    can cover hours of drift, HVAC failure or battery drain.
+    """
+
+    def __init__(self, device_id, profile, rng, sim_duration):
+        self.device_id = device_id
+        self.profile = profile
+        self.rng = rng
+        self.base_temperature = rng.uniform(4.0, 6.0)
+        self.base_humidity = rng.uniform(35.0, 55.0)
+        # Profile parameters, in simulated seconds
+        self.drift_per_hour = rng.choice([-1, 1]) * rng.uniform(0.5, 2.0)
+        self.event_at = rng.uniform(0, 0.5) * sim_duration
+        self.warmup_tau = 1800 if profile == 'hvac_failure' else 4 * 3600
+        self.drain_per_hour = rng.uniform(10, 25)
+        self.dropout_until = 0.0
+        self.buffer = None
+        self.excursion_sent_at = None
+        self.alert_seen = False
+
+    def sample(self, sim_elapsed):
+        """Return the reading for this point in simulated time, or None once the battery is flat"""
+        temperature = self.base_temperature
+        power_status = 'AC'
+        battery_level = 100.0
+
+        if self.profile == 'drifting':
+            temperature += self.drift_per_hour * sim_elapsed / 3600
+        elif self.profile in ('hvac_failure', 'power_loss') and sim_elapsed >= self.event_at:
+            since = sim_elapsed - self.event_at
+            # Newton cooling in reverse: the cabinet warms toward ambient
+            temperature = AMBIENT_TEMPERATURE - (AMBIENT_TEMPERATURE - temperature) * math.exp(-since / self.warmup_tau)
+            if self.profile == 'power_loss':
+                power_status = 'BATTERY'
+                battery_level = 100.0 - self.drain_per_hour * since / 3600
+                if battery_level <= 0:
+                    return None
+
+        return {
+            'device_id': self.device_id,
+            'temperature': round(temperature + self.rng.gauss(0, 0.15), 2),
+            'humidity': round(min(100.0, max(0.0, self.base_humidity + self.rng.gauss(0, 1.0))), 2),
+            'power_status': power_status,
+            'battery_level': round(battery_level, 1),
+            'timestamp': timezone.now().isoformat(),
+        }
+
+
+class RateLimiter:
+    """Token bucket shared by all devices to cap the aggregate send rate"""
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.tokens = rate
+        self.updated = time.monotonic()
+
+    async def acquire(self):
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class HttpClient:
+    """Minimal keep-alive HTTP/1.1 client on asyncio streams, pooled up to `size` connections"""
+
+    def __init__(self, base_url, size):
+        parts = urlsplit(base_url)
+        if parts.scheme not in ('http', 'https'):
+            raise CommandError(f'Unsupported URL scheme: {base_url}')
+        self.host = parts.hostname
+        self.port = parts.port or (443 if parts.scheme == 'https' else 80)
+        self.ssl = parts.scheme == 'https'
+        self.prefix = parts.path.rstrip('/')
+        self.slots = asyncio.Semaphore(size)
+        self.idle = []
+
+    async def post_json(self, path, payload):
+        body = json.dumps(payload).encode()
+        request = (
+            f'POST {self.prefix}{path} HTTP/1.1\r\n'
+            f'Host: {self.host}:{self.port}\r\n'
+            'Content-Type: application/json\r\n'
+            f'Content-Length: {len(body)}\r\n'
+            'Connection: keep-alive\r\n\r\n'
+        ).encode() + body
+
+        async with self.slots:
+            reader, writer = self.idle.pop() if self.idle else await asyncio.open_connection(
+                self.host, self.port, ssl=self.ssl
+            )
+            try:
+                writer.write(request)
+                await writer.drain()
+                status, keep_alive = await self._read_response(reader)
+            except Exception:
+                writer.close()
+                raise
+            if keep_alive:
+                self.idle.append((reader, writer))
+            else:
+                writer.close()
+            return status
+
+    async def _read_response(self, reader):
+        status_line = await reader.readline()
+        if not status_line:
+            raise ConnectionError('Connection closed by server')
+        status = int(status_line.split()[1])
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip().lower()
+
+        if 'content-length' in headers:
+            await reader.readexactly(int(headers['content-length']))
+            return status, headers.get('connection') != 'close'
+        # No length: the body runs until the server closes the connection
+        await reader.read()
+        return status, False
+
+    def close(self):
+        for _, writer in self.idle:
+            writer.close()
+        self.idle = []
+
+
+class Command(BaseCommand):
+    help = (
+        'Simulates a fleet of ESP8266 sensors with asyncio and drives the ingest endpoint '
+        'to measure throughput, error rates and end-to-end alert latency'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--base-url', default='http://localhost:8000/api/monitoring',
+                            help='Base URL of the monitoring API')
+        parser.add_argument('--devices', type=int, default=1000, help='Number of virtual devices')
+        parser.add_argument('--interval', type=float, default=20.0,
+                            help='Seconds between readings per device')
+        parser.add_argument('--jitter', type=float, default=0.1,
+                            help='Relative jitter applied to each interval (0.1 = +/-10%%)')
+        parser.add_argument('--duration', type=float, default=300.0, help='Soak duration in seconds')
+        parser.add_argument('--time-scale', type=float, default=60.0,
+                            help='Simulated seconds per wall-clock second for temperature profiles')
+        parser.add_argument('--profiles', default='stable=70,drifting=15,hvac_failure=10,power_loss=5',
+                            help='Weighted profile mix, e.g. stable=70,drifting=15,hvac_failure=10,power_loss=5')
+        parser.add_argument('--dropout-rate', type=float, default=0.01,
+                            help='Probability per interval that a device loses Wi-Fi')
+        parser.add_argument('--dropout-max', type=float, default=120.0,
+                            help='Maximum Wi-Fi dropout length in seconds')
+        parser.add_argument('--buffer-size', type=int, default=50,
+                            help='Readings a device buffers while offline before dropping the oldest')
+        parser.add_argument('--target-rate', type=float, default=0,
+                            help='Cap on aggregate readings per second (0 = unlimited)')
+        parser.add_argument('--concurrency', type=int, default=200, help='Maximum in-flight requests')
+        parser.add_argument('--device-prefix', default='SIM_', help='Prefix for virtual device ids')
+        parser.add_argument('--report-every', type=float, default=10.0,
+                            help='Seconds between progress reports')
+        parser.add_argument('--no-alert-latency', action='store_true',
+                            help='Skip alert latency tracking (use when the database is not shared with the server)')
+        parser.add_argument('--seed', type=int, help='Random seed for reproducible fleets')
+        parser.add_argument('--output', help='Write the final report as JSON to this file')
+
+    def handle(self, *args, **options):
+        self.options = options
+        rng = random.Random(options['seed'])
+        profiles, weights = self._parse_profiles(options['profiles'])
+        sim_duration = options['duration'] * options['time_scale']
+
+        self.devices = [
+            VirtualDevice(f"{options['device_prefix']}{i:05d}", rng.choices(profiles, weights)[0],
+                          random.Random(rng.random()), sim_duration)
+            for i in range(options['devices'])
+        ]
+        for device in self.devices:
+            device.buffer = deque(maxlen=options['buffer_size'])
+
+        self.track_alerts = not options['no_alert_latency']
+        if self.track_alerts:
+            settings = SystemSettings.get_settings()
+            self.normal_range = (settings.normal_temp_min, settings.normal_temp_max)
+            self.alert_watermark = Alert.objects.order_by('-id').values_list('id', flat=True).first() or 0
+
+        self.stdout.write(
+            f"Simulating {len(self.devices)} devices every {options['interval']}s for {options['duration']}s "
+            f"({dict(Counter(d.profile for d in self.devices))})"
+        )
+        report = asyncio.run(self._run())
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(report, f, indent=2)
+            self.stdout.write(f"Report written to {options['output']}")
+        self.stdout.write(self.style.SUCCESS('Simulation completed'))
+
+    async def _run(self):
+        options = self.options
+        self.client = HttpClient(options['base_url'], options['concurrency'])
+        self.limiter = RateLimiter(options['target_rate']) if options['target_rate'] else None
+        self.stats = {
+            'sent': 0, 'ok': 0, 'exceptions': 0, 'catch_up': 0, 'dropped': 0,
+            'status_codes': Counter(), 'latencies': [], 'alert_latencies': [],
+        }
+        self.started = time.monotonic()
+        self.deadline = self.started + options['duration']
+
+        tasks = [asyncio.create_task(self._run_device(device)) for device in self.devices]
+        reporter = asyncio.create_task(self._report_progress())
+        watcher = asyncio.create_task(self._watch_alerts()) if self.track_alerts else None
+
+        await asyncio.gather(*tasks)
+        reporter.cancel()
+        if watcher:
+            # One last sweep so alerts for the final readings are counted
+            watcher.cancel()
+            await self._collect_alerts()
+            # The sweeps ran on a worker thread with a database connection of its own
+            await sync_to_async(connections.close_all)()
+        self.client.close()
+        return self._final_report()
+
+    async def _run_device(self, device):
+        options = self.options
+        interval = options['interval']
+        rng = device.rng
+        # Spread the first readings over one interval, like devices booting at random times
+        await asyncio.sleep(rng.uniform(0, interval))
+
+        while time.monotonic() < self.deadline:
+            now = time.monotonic()
+            reading = device.sample((now - self.started) * options['time_scale'])
+            if reading is None:
+                break  # Battery exhausted, the device goes silent
+
+            if now < device.dropout_until:
+                if len(device.buffer) == device.buffer.maxlen:
+                    self.stats['dropped'] += 1
+                device.buffer.append(reading)
+            else:
+                # Burst catch-up: flush everything buffered during the dropout, oldest first
+                while device.buffer:
+                    await self._send(device, device.buffer.popleft(), catch_up=True)
+                await self._send(device, reading)
+                if rng.random() < options['dropout_rate']:
+                    device.dropout_until = now + rng.uniform(interval, options['dropout_max'])
+
+            await asyncio.sleep(interval * rng.uniform(1 - options['jitter'], 1 + options['jitter']))
+
+    async def _send(self, device, reading, catch_up=False):
+        if self.limiter:
+            await self.limiter.acquire()
+        started = time.monotonic()
+        # Marked before sending: a sweep may see the alert before the response arrives
+        excursion = self.track_alerts and device.excursion_sent_at is None and not (
+            self.normal_range[0] <= reading['temperature'] <= self.normal_range[1]
+        )
+        if excursion:
+            device.excursion_sent_at = started
+        try:
+            status = await self.client.post_json('/esp/reading/', reading)
+        except (OSError, ConnectionError, asyncio.IncompleteReadError, ValueError):
+            self.stats['exceptions'] += 1
+            if excursion:
+                device.excursion_sent_at = None
+            return
+
+        self.stats['sent'] += 1
+        self.stats['latencies'].append((time.monotonic() - started) * 1000)
+        self.stats['status_codes'][status] += 1
+        if catch_up:
+            self.stats['catch_up'] += 1
+        if 200 <= status < 300:
+            self.stats['ok'] += 1
+        elif excursion:
+            device.excursion_sent_at = None
+
+    async def _watch_alerts(self):
+        while True:
+            await asyncio.sleep(0.5)
+            await self._collect_alerts()
+
+    async def _collect_alerts(self):
+        """Pick up alerts created since the last sweep and time them against the first excursion sent"""
+        rows = await sync_to_async(self._new_alerts)()
+        seen_at = time.monotonic()
+        by_id = {device.device_id: device for device in self.devices}
+        for alert_id, device_id in rows:
+            self.alert_watermark = max(self.alert_watermark, alert_id)
+            device = by_id.get(device_id)
+            if device and device.excursion_sent_at is not None and not device.alert_seen:
+                device.alert_seen = True
+                self.stats['alert_latencies'].append((seen_at - device.excursion_sent_at) * 1000)
+
+    def _new_alerts(self):
+        return list(
+            Alert.objects.filter(
+                id__gt=self.alert_watermark,
+                device__device_id__startswith=self.options['device_prefix'],
+                # Raised by the out-of-range reading itself; pre-alerts and sensor faults are not timed
+                alert_type__in=ReadingService.EXCURSION_ALERT_TYPES
+            ).order_by('id').values_list('id', 'device__device_id')
+        )
+
+    async def _report_progress(self):
+        last_sent = 0
+        every = self.options['report_every']
+        while True:
+            await asyncio.sleep(every)
+            sent = self.stats['sent']
+            errors = sent - self.stats['ok'] + self.stats['exceptions']
+            self.stdout.write(
+                f"[{time.monotonic() - self.started:7.1f}s] {(sent - last_sent) / every:9.1f} readings/s  "
+                f"sent {sent}  errors {errors}  catch-up {self.stats['catch_up']}"
+            )
+            last_sent = sent
+
+    def _final_report(self):
+        stats = self.stats
+        elapsed = time.monotonic() - self.started
+        latencies = sorted(stats['latencies'])
+        alert_latencies = sorted(stats['alert_latencies'])
+        attempted = stats['sent'] + stats['exceptions']
+        excursions = sum(1 for d in self.devices if d.excursion_sent_at is not None)
+
+        report = {
+            'devices': len(self.devices),
+            'elapsed_s': round(elapsed, 2),
+            'offered_rate': round(len(self.devices) / self.options['interval'], 2),
+            'achieved_rate': round(stats['ok'] / elapsed, 2) if elapsed else 0,
+            'sent': stats['sent'],
+            'ok': stats['ok'],
+            'error_rate': round((attempted - stats['ok']) / attempted, 4) if attempted else 0,
+            'exceptions': stats['exceptions'],
+            'status_codes': {str(code): count for code, count in sorted(stats['status_codes'].items())},
+            'catch_up_readings': stats['catch_up'],
+            'dropped_readings': stats['dropped'],
+            'latency_ms': {
+                'p50': round(percentile(latencies, 50), 2),
+                'p95': round(percentile(latencies, 95), 2),
+                'p99': round(percentile(latencies, 99), 2),
+            },
+        }
+        if self.track_alerts:
+            report['alert_latency_ms'] = {
+                'excursions': excursions,
+                'alerted': len(alert_latencies),
+                'p50': round(percentile(alert_latencies, 50), 2),
+                'p95': round(percentile(alert_latencies, 95), 2),
+                'max': round(alert_latencies[-1], 2) if alert_latencies else 0,
+            }
+
+        self.stdout.write(json.dumps(report, indent=2))
+        return report
+
+    def _parse_profiles(self, spec):
+        profiles, weights = [], []
+        for part in spec.split(','):
+            name, _, weight = part.partition('=')
+            name = name.strip()
+            if name not in PROFILES:
+                raise CommandError(f"Unknown profile '{name}'. Choose from {', '.join(PROFILES)}")
+            profiles.append(name)
+            weights.append(float(weight or 1))
+        return profiles, weights
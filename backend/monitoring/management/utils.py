@@ -0,0 +1,6 @@
+def percentile(sorted_values, percent):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0
+    rank = max(0, int(round(percent / 100 * len(sorted_values))) - 1)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
@@ -0,0 +1,39 @@
+# Generated by Django 4.2 on 2026-10-19 03:26
+
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+
+def remove_duplicate_readings(apps, schema_editor):
+    """Keep the first copy of each (device_id, timestamp) and move alerts onto it"""
+    Reading = apps.get_model('monitoring', 'Reading')
+    Alert = apps.get_model('monitoring', 'Alert')
+    duplicates = Reading.objects.values('device_id', 'timestamp').annotate(
+        keep=Min('id'), copies=Count('id')
+    ).filter(copies__gt=1).order_by()
+
+    for group in duplicates.iterator():
+        extra = Reading.objects.filter(
+            device_id=group['device_id'], timestamp=group['timestamp']
+        ).exclude(id=group['keep'])
+        Alert.objects.filter(reading__in=extra).update(reading_id=group['keep'])
+        extra.delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('monitoring', '0008_incidentcomment_is_read_and_more'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_readings, migrations.RunPython.noop),
+        migrations.RemoveIndex(
+            model_name='reading',
+            name='monitoring__device__6c85a9_idx',
+        ),
+        migrations.AddConstraint(
+            model_name='reading',
+            constraint=models.UniqueConstraint(fields=('device_id', 'timestamp'), name='unique_reading_device_timestamp'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2 on 2026-10-19 03:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('monitoring', '0009_reading_unique_device_timestamp'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='device',
+            name='api_key',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+    ]
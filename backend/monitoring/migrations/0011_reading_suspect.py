@@ -0,0 +1,23 @@
+# Generated by Django 4.2 on 2026-10-19 03:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('monitoring', '0010_device_api_key'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='reading',
+            name='suspect',
+            field=models.CharField(blank=True, choices=[('spike', 'Spike'), ('flatline', 'Flatline'), ('drift', 'Drift')], default='', max_length=10),
+        ),
+        migrations.AlterField(
+            model_name='alert',
+            name='alert_type',
+            field=models.CharField(choices=[('high_temperature', 'High Temperature'), ('low_temperature', 'Low Temperature'), ('power_failure', 'Power Failure'), ('low_battery', 'Low Battery'), ('connection_lost', 'Connection Lost'), ('sensor_fault', 'Sensor Fault')], max_length=20),
+        ),
+    ]
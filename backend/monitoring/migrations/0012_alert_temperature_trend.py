@@ -0,0 +1,18 @@
+# Generated by Django 4.2 on 2026-10-19 03:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('monitoring', '0011_reading_suspect'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='alert',
+            name='alert_type',
+            field=models.CharField(choices=[('high_temperature', 'High Temperature'), ('low_temperature', 'Low Temperature'), ('power_failure', 'Power Failure'), ('low_battery', 'Low Battery'), ('connection_lost', 'Connection Lost'), ('sensor_fault', 'Sensor Fault'), ('temperature_trend', 'Temperature Trend')], max_length=20),
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 4.2 on 2026-10-19 04:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('monitoring', '0012_alert_temperature_trend'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyReadingRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('device_id', models.CharField(max_length=100)),
+                ('day', models.DateField()),
+                ('range_min', models.FloatField()),
+                ('range_max', models.FloatField()),
+                ('sample_count', models.IntegerField(default=0)),
+                ('covered_seconds', models.FloatField(default=0)),
+                ('arrhenius_sum', models.FloatField(default=0)),
+                ('min_temperature', models.FloatField(blank=True, null=True)),
+                ('max_temperature', models.FloatField(blank=True, null=True)),
+                ('seconds_above', models.FloatField(default=0)),
+                ('seconds_below', models.FloatField(default=0)),
+                ('longest_excursion', models.FloatField(default=0)),
+                ('leading_excursion', models.FloatField(default=0)),
+                ('trailing_excursion', models.FloatField(default=0)),
+                ('computed_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='dailyreadingrollup',
+            index=models.Index(condition=models.Q(('leading_excursion__gt', 0), ('trailing_excursion__gt', 0), _connector='OR'), fields=['device_id', 'day'], name='rollup_edge_excursion_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='dailyreadingrollup',
+            constraint=models.UniqueConstraint(fields=('device_id', 'day'), name='unique_rollup_device_day'),
+        ),
+    ]
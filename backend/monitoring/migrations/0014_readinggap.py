@@ -0,0 +1,45 @@
+# Generated by Django 4.2 on 2026-10-19 04:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('monitoring', '0013_dailyreadingrollup'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReadingGap',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('device_id', models.CharField(max_length=100)),
+                ('started_at', models.DateTimeField()),
+                ('ended_at', models.DateTimeField()),
+            ],
+            options={
+                'ordering': ['device_id', 'started_at'],
+            },
+        ),
+        migrations.CreateModel(
+            name='ReadingGapScan',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('device_id', models.CharField(max_length=100, unique=True)),
+                ('first_reading', models.DateTimeField()),
+                ('last_reading', models.DateTimeField()),
+                ('scan_from', models.DateTimeField()),
+                ('rescan_from', models.DateTimeField(blank=True, null=True)),
+                ('scanned_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='readinggap',
+            index=models.Index(fields=['device_id', 'ended_at'], name='monitoring__device__95a558_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='readinggap',
+            constraint=models.UniqueConstraint(fields=('device_id', 'started_at'), name='unique_gap_device_start'),
+        ),
+    ]
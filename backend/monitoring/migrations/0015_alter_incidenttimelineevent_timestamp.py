@@ -0,0 +1,19 @@
+# Generated by Django 4.2 on 2026-10-19 04:45
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('monitoring', '0014_readinggap'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='incidenttimelineevent',
+            name='timestamp',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 4.2 on 2026-10-19 05:03
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('monitoring', '0015_alter_incidenttimelineevent_timestamp'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EscalationDeadline',
+            fields=[
+                ('incident', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='escalation_deadline', serialize=False, to='monitoring.incident')),
+                ('level', models.IntegerField()),
+                ('started_at', models.DateTimeField()),
+            ],
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 4.2 on 2026-10-19 05:12
+
+from django.db import migrations, models
+from django.db.models import F, OuterRef, Subquery
+
+
+def fill_single_reading_excursions(apps, schema_editor):
+    """Existing temperature alerts each stand for one reading"""
+    Alert = apps.get_model('monitoring', 'Alert')
+    Reading = apps.get_model('monitoring', 'Reading')
+    Alert.objects.filter(alert_type__in=['high_temperature', 'low_temperature']).update(
+        last_timestamp=F('timestamp'),
+        peak_temperature=Subquery(Reading.objects.filter(pk=OuterRef('reading_id')).values('temperature')[:1])
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('monitoring', '0016_escalationdeadline'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='alert',
+            name='last_timestamp',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='alert',
+            name='peak_temperature',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='alert',
+            name='sample_count',
+            field=models.IntegerField(default=1),
+        ),
+        migrations.RunPython(fill_single_reading_excursions, migrations.RunPython.noop),
+    ]
@@ -1,4 +1,5 @@
 from django.db import models
+import secrets
 from django.core.validators import MinValueValidator, MaxValueValidator
 from django.contrib.auth import get_user_model
 from django.utils import timezone
@@ -19,12 +20,20 @@ class Device(models.Model):
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='offline')
     reading_interval = models.IntegerField(default=300)  # in seconds
     last_reading = models.DateTimeField(null=True, blank=True)
+    # Shared secret the device uses to sign or authenticate readings (monitoring.device_auth)
+    api_key = models.CharField(max_length=64, blank=True, default='')
     created_at = models.DateTimeField(default=timezone.now)
     updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return f"{self.name} ({self.device_id})"
 
+    def rotate_api_key(self):
+        """Issue a new key, replacing the old one immediately; returns the new key"""
+        self.api_key = secrets.token_hex(32)
+        self.save(update_fields=['api_key', 'updated_at'])
+        return self.api_key
+
 class Reading(models.Model):
     device_id = models.CharField(max_length=100, default='ESP8266_1')  # Default for migration
     temperature = models.FloatField(
@@ -47,13 +56,28 @@ class Reading(models.Model):
         default=100
     )
     timestamp = models.DateTimeField()
+    # Set by the ingest anomaly detector (monitoring.services.anomaly); blank for plausible readings
+    suspect = models.CharField(
+        max_length=10,
+        choices=[
+            ('spike', 'Spike'),
+            ('flatline', 'Flatline'),
+            ('drift', 'Drift')
+        ],
+        blank=True,
+        default=''
+    )
 
     class Meta:
         ordering = ['-timestamp']
         indexes = [
-            models.Index(fields=['device_id', '-timestamp']),
             models.Index(fields=['-timestamp']),
         ]
+        constraints = [
+            # Device retries and overlapping catch-up batches resend readings;
+            # the unique index also serves per-device time range scans
+            models.UniqueConstraint(fields=['device_id', 'timestamp'], name='unique_reading_device_timestamp'),
+        ]
 
     def __str__(self):
         return f"{self.device_id} - {self.temperature}°C at {self.timestamp}"
@@ -65,6 +89,8 @@ class Alert(models.Model):
         ('power_failure', 'Power Failure'),
         ('low_battery', 'Low Battery'),
         ('connection_lost', 'Connection Lost'),
+        ('sensor_fault', 'Sensor Fault'),
+        ('temperature_trend', 'Temperature Trend'),
     ]
     
     SEVERITY_LEVELS = [
@@ -74,6 +100,7 @@ class Alert(models.Model):
     ]
     
     device = models.ForeignKey(Device, on_delete=models.CASCADE, related_name='alerts')
+    # For temperature alerts, the first reading of the excursion
     reading = models.ForeignKey(Reading, on_delete=models.CASCADE, related_name='alerts')
     alert_type = models.CharField(max_length=20, choices=ALERT_TYPES)
     severity = models.CharField(max_length=20, choices=SEVERITY_LEVELS)
@@ -89,6 +116,11 @@ class Alert(models.Model):
     )
     resolution_notes = models.TextField(blank=True)
     timestamp = models.DateTimeField()
+    # A temperature alert covers a whole excursion, the consecutive readings outside the
+    # normal range, and is updated as it continues; the readings themselves stay in Reading
+    last_timestamp = models.DateTimeField(null=True, blank=True)
+    peak_temperature = models.FloatField(null=True, blank=True)
+    sample_count = models.IntegerField(default=1)
     
     class Meta:
         ordering = ['-timestamp']
@@ -96,6 +128,11 @@ class Alert(models.Model):
             models.Index(fields=['device', '-timestamp']),
             models.Index(fields=['-timestamp']),
         ]
+
+    @property
+    def duration(self):
+        """Time from the first to the last reading of the excursion"""
+        return (self.last_timestamp or self.timestamp) - self.timestamp
     
     def __str__(self):
         return f"{self.device.name} - {self.get_alert_type_display()} at {self.timestamp}"
@@ -132,26 +169,6 @@ class Incident(models.Model):
         related_name='resolved_incidents'
     )
     
-    def check_escalation(self):
-        """Check and handle alert escalation based on alert count"""
-        if self.alert_count == 4 and self.current_escalation_level < 2:
-            self.current_escalation_level = 2
-            self._create_escalation_event(2)
-            
-        elif self.alert_count == 7 and self.current_escalation_level < 3:
-            self.current_escalation_level = 3
-            self._create_escalation_event(3)
-            
-        self.save()
-    
-    def _create_escalation_event(self, new_level):
-        IncidentTimelineEvent.objects.create(
-            incident=self,
-            event_type='escalation_changed',
-            description=f'Escalated to level {new_level} operators after {self.alert_count} alerts',
-            metadata={'new_level': new_level}
-        )
-
     class Meta:
         ordering = ['-start_time']
         indexes = [
@@ -186,7 +203,8 @@ class IncidentTimelineEvent(models.Model):
     ]
 
     incident = models.ForeignKey(Incident, on_delete=models.CASCADE, related_name='timeline_events')
-    timestamp = models.DateTimeField(auto_now_add=True)
+    # Set explicitly when history is replayed (monitoring.services.replay)
+    timestamp = models.DateTimeField(default=timezone.now)
     event_type = models.CharField(max_length=20, choices=EVENT_TYPES)
     description = models.TextField()
     temperature = models.FloatField(null=True, blank=True)
@@ -196,4 +214,95 @@ class IncidentTimelineEvent(models.Model):
         null=True,
         blank=True
     )
-    metadata = models.JSONField(default=dict, blank=True)
\ No newline at end of file
+    metadata = models.JSONField(default=dict, blank=True)
+
+class DailyReadingRollup(models.Model):
+    """
+    One device's readings over one UTC day, reduced to what the compliance
+    report needs (monitoring.services.compliance). Readings are time weighted:
+    each holds until the next one, for at most a few reading intervals.
+    """
+    device_id = models.CharField(max_length=100)
+    day = models.DateField()
+    # Bounds the time outside range and excursions were measured against
+    range_min = models.FloatField()
+    range_max = models.FloatField()
+    sample_count = models.IntegerField(default=0)
+    covered_seconds = models.FloatField(default=0)
+    # Sum of seconds * exp(-ΔH / RT), the time-weighted Arrhenius term of Mean Kinetic Temperature
+    arrhenius_sum = models.FloatField(default=0)
+    min_temperature = models.FloatField(null=True, blank=True)
+    max_temperature = models.FloatField(null=True, blank=True)
+    seconds_above = models.FloatField(default=0)
+    seconds_below = models.FloatField(default=0)
+    # Longest excursion inside the day, and the ones running into and out of it
+    longest_excursion = models.FloatField(default=0)
+    leading_excursion = models.FloatField(default=0)
+    trailing_excursion = models.FloatField(default=0)
+    computed_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['device_id', 'day'], name='unique_rollup_device_day'),
+        ]
+        indexes = [
+            # Days whose excursions may join their neighbours' are fetched on their own
+            models.Index(
+                fields=['device_id', 'day'],
+                condition=models.Q(leading_excursion__gt=0) | models.Q(trailing_excursion__gt=0),
+                name='rollup_edge_excursion_idx'
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.device_id} - {self.day}"
+
+class ReadingGap(models.Model):
+    """
+    A stretch between two consecutive readings of a device longer than
+    READING_GAP_INTERVALS reading intervals (monitoring.services.availability).
+    """
+    device_id = models.CharField(max_length=100)
+    # The readings either side of the gap
+    started_at = models.DateTimeField()
+    ended_at = models.DateTimeField()
+
+    class Meta:
+        ordering = ['device_id', 'started_at']
+        constraints = [
+            models.UniqueConstraint(fields=['device_id', 'started_at'], name='unique_gap_device_start'),
+        ]
+        indexes = [
+            models.Index(fields=['device_id', 'ended_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.device_id} - no readings {self.started_at} to {self.ended_at}"
+
+class ReadingGapScan(models.Model):
+    """How far the gap scan has read each device's readings, so the next scan only reads newer ones"""
+    device_id = models.CharField(max_length=100, unique=True)
+    first_reading = models.DateTimeField()
+    last_reading = models.DateTimeField()
+    # The next scan reads readings from here on
+    scan_from = models.DateTimeField()
+    # Set when readings older than scan_from are back-filled, edited or deleted
+    rescan_from = models.DateTimeField(null=True, blank=True)
+    scanned_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.device_id} - scanned to {self.last_reading}"
+
+class EscalationDeadline(models.Model):
+    """
+    The next escalation pending for an open incident (monitoring.services.escalation).
+    It is due ESCALATION_LEVEL<level>_AFTER minutes after started_at.
+    """
+    incident = models.OneToOneField(Incident, on_delete=models.CASCADE, primary_key=True,
+                                    related_name='escalation_deadline')
+    level = models.IntegerField()
+    # When the incident's escalation clock started: the start of the excursion
+    started_at = models.DateTimeField()
+
+    def __str__(self):
+        return f"Incident {self.incident_id} - level {self.level} pending since {self.started_at}"
@@ -2,20 +2,42 @@ from rest_framework import serializers
 from .models import Reading, Alert, Incident, IncidentComment, IncidentTimelineEvent, Device
 from notifications.models import Notification
 from django.utils import timezone
+from .services.power import battery_forecasts
+
+class BatteryForecastListSerializer(serializers.ListSerializer):
+    """
+    Forecasts the battery of every device in a list in one pass, for the
+    DeviceSerializers nested in its items, instead of one query per item.
+    device_path names the attributes leading from an item to its Device.
+    """
+    device_path = ()
+
+    def to_representation(self, data):
+        items = list(data.all() if hasattr(data, 'all') else data)
+        device_ids = set()
+        for item in items:
+            for attribute in self.device_path:
+                item = getattr(item, attribute, None)
+            if item is not None:
+                device_ids.add(item.device_id)
+        self.context['battery_forecasts'] = battery_forecasts(device_ids)
+        return super().to_representation(items)
 
 class DeviceSerializer(serializers.ModelSerializer):
     status_display = serializers.CharField(source='get_status_display', read_only=True)
     last_reading_temperature = serializers.SerializerMethodField()
     last_reading_humidity = serializers.SerializerMethodField()
+    battery = serializers.SerializerMethodField()
 
     class Meta:
         model = Device
         fields = [
             'device_id', 'name', 'location', 'status', 'status_display',
             'reading_interval', 'last_reading', 'last_reading_temperature',
-            'last_reading_humidity', 'created_at', 'updated_at'
+            'last_reading_humidity', 'battery', 'created_at', 'updated_at'
         ]
         read_only_fields = ['status_display', 'last_reading', 'created_at', 'updated_at']
+        list_serializer_class = BatteryForecastListSerializer
 
     def get_last_reading_temperature(self, obj):
         if hasattr(obj, 'last_reading'):
@@ -35,6 +57,12 @@ class DeviceSerializer(serializers.ModelSerializer):
             return reading.humidity if reading else None
         return None
 
+    def get_battery(self, obj):
+        forecasts = self.context.get('battery_forecasts')
+        if forecasts is None:
+            forecasts = battery_forecasts([obj.device_id])
+        return forecasts.get(obj.device_id)
+
 class ReadingSerializer(serializers.ModelSerializer):
     battery_level = serializers.FloatField(
         min_value=0,
@@ -46,8 +74,9 @@ class ReadingSerializer(serializers.ModelSerializer):
         model = Reading
         fields = [
             'id', 'device_id', 'temperature', 'humidity', 
-            'power_status', 'battery_level', 'timestamp'
+            'power_status', 'battery_level', 'timestamp', 'suspect'
         ]
+        read_only_fields = ['suspect']
 
     def validate_battery_level(self, value):
         """Ensure battery level is a valid percentage"""
@@ -57,25 +86,30 @@ class ReadingSerializer(serializers.ModelSerializer):
             )
         return value
 
+class AlertListSerializer(BatteryForecastListSerializer):
+    device_path = ('device',)
+
 class AlertSerializer(serializers.ModelSerializer):
     type_display = serializers.CharField(source='get_alert_type_display', read_only=True)
     severity_display = serializers.CharField(source='get_severity_display', read_only=True)
     temperature = serializers.FloatField(source='reading.temperature', read_only=True)
     device = DeviceSerializer(read_only=True)
-    consecutive_count = serializers.SerializerMethodField()
+    # Kept for older clients; same as sample_count
+    consecutive_count = serializers.IntegerField(source='sample_count', read_only=True)
+    duration_seconds = serializers.SerializerMethodField()
 
     class Meta:
         model = Alert
         fields = [
             'id', 'alert_type', 'type_display', 'severity', 'severity_display',
             'message', 'timestamp', 'resolved', 'resolved_at', 'device',
-            'temperature', 'consecutive_count'
+            'temperature', 'consecutive_count', 'sample_count', 'last_timestamp',
+            'peak_temperature', 'duration_seconds'
         ]
+        list_serializer_class = AlertListSerializer
 
-    def get_consecutive_count(self, obj):
-        if hasattr(obj, 'incidents') and obj.incidents.exists():
-            return obj.incidents.first().alert_count
-        return 1
+    def get_duration_seconds(self, obj):
+        return round(obj.duration.total_seconds())
 
 class IncidentCommentSerializer(serializers.ModelSerializer):
     operator_name = serializers.CharField(source='operator.name', read_only=True)
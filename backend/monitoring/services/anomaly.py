@@ -0,0 +1,151 @@
+import math
+import threading
+
+from django.conf import settings
+
+SPIKE = 'spike'
+FLATLINE = 'flatline'
+DRIFT = 'drift'
+# Readings with these tags are not believed: they raise a sensor fault instead of a temperature alert
+FAULTS = (SPIKE, FLATLINE)
+
+RING_SIZE = 5
+FAST_ALPHA = 0.1
+SLOW_ALPHA = 0.01
+# Readings a device needs before drift between the fast and slow averages means anything
+DRIFT_WARMUP = 100
+
+
+class _DeviceState:
+    __slots__ = (
+        'last_timestamp', 'count', 'mean', 'variance', 'slow_mean',
+        'ring', 'ring_position', 'flat_value', 'flat_since', 'flatlined',
+    )
+
+    def __init__(self, temperature, timestamp):
+        self.last_timestamp = timestamp
+        self.count = 1
+        self.mean = self.slow_mean = temperature
+        self.variance = 0.0
+        self.ring = [temperature]
+        self.ring_position = 1
+        self.flat_value = temperature
+        self.flat_since = timestamp
+        self.flatlined = False
+
+    def copy(self):
+        state = _DeviceState.__new__(_DeviceState)
+        for name in self.__slots__:
+            setattr(state, name, getattr(self, name))
+        state.ring = list(self.ring)
+        return state
+
+
+class AnomalyDetector:
+    """
+    Streaming plausibility check of each device's temperatures, fed from the
+    ingest path with the readings it stores. Per device it keeps a fixed amount
+    of state: exponentially weighted mean and variance, a slower mean, the
+    last RING_SIZE values and the current run of identical values. No query
+    is made.
+
+    - spike: far from the median of the last few values, by SPIKE_DELTA °C
+      and SPIKE_SIGMAS standard deviations. A real step change moves the
+      median after RING_SIZE // 2 + 1 readings and stops being flagged.
+    - flatline: the exact same value for FLATLINE_SECONDS or longer.
+    - drift: the fast and slow averages are more than DRIFT_DELTA °C apart.
+      Drifting readings are only tagged; they still go through threshold alerting.
+    """
+
+    def __init__(self):
+        self.states = {}
+        self.lock = threading.Lock()
+
+    def observe(self, records):
+        """
+        Tag reading tuples (device_id, temperature, ..., timestamp). Returns the
+        tags aligned with records ('' for plausible readings) and (index, started)
+        for each reading that started or ended a flatline. Readings not newer than
+        the last one seen from their device (resends, late arrivals) are left untagged.
+        """
+        tags, flatlines, staged = self.stage(records)
+        self.commit(staged)
+        return tags, flatlines
+
+    def stage(self, records):
+        """
+        Tag records like observe, on copies of the device states: returns tags,
+        flatlines and the updated states, which count only once passed to commit
+        """
+        config = settings.SENSOR_FAULT_DETECTION
+        tags = [''] * len(records)
+        flatlines = []
+        staged = {}
+        with self.lock:
+            for index in sorted(range(len(records)), key=lambda i: records[i][5]):
+                device_id, temperature, timestamp = records[index][0], records[index][1], records[index][5]
+                state = staged.get(device_id)
+                if state is None and device_id in self.states:
+                    state = staged[device_id] = self.states[device_id].copy()
+                if state is None:
+                    staged[device_id] = _DeviceState(temperature, timestamp)
+                    continue
+                if timestamp <= state.last_timestamp:
+                    continue
+                was_flatlined = state.flatlined
+                tags[index] = self._update(state, temperature, timestamp, config)
+                if state.flatlined != was_flatlined:
+                    flatlines.append((index, state.flatlined))
+        return tags, flatlines, staged
+
+    def commit(self, staged):
+        """
+        Keep states from stage. A state staged concurrently from the same
+        starting point replaces the current one only if it saw newer readings.
+        """
+        with self.lock:
+            for device_id, state in staged.items():
+                current = self.states.get(device_id)
+                if current is None or state.last_timestamp > current.last_timestamp:
+                    self.states[device_id] = state
+
+    def _update(self, state, temperature, timestamp, config):
+        state.last_timestamp = timestamp
+        state.count += 1
+        tag = ''
+
+        # Flatline: the sensor keeps reporting the exact same value
+        if temperature == state.flat_value:
+            if (timestamp - state.flat_since).total_seconds() >= config['FLATLINE_SECONDS']:
+                state.flatlined = True
+                tag = FLATLINE
+        else:
+            state.flat_value, state.flat_since, state.flatlined = temperature, timestamp, False
+
+        # Spike: judged against the median, which a single glitch cannot move
+        if not tag and len(state.ring) == RING_SIZE:
+            median = sorted(state.ring)[RING_SIZE // 2]
+            limit = max(config['SPIKE_DELTA'], config['SPIKE_SIGMAS'] * math.sqrt(state.variance))
+            if abs(temperature - median) > limit:
+                tag = SPIKE
+
+        if len(state.ring) < RING_SIZE:
+            state.ring.append(temperature)
+        else:
+            state.ring[state.ring_position] = temperature
+        state.ring_position = (state.ring_position + 1) % RING_SIZE
+
+        if tag:
+            # Keep implausible values out of the averages
+            return tag
+
+        difference = temperature - state.mean
+        state.mean += FAST_ALPHA * difference
+        state.variance = (1 - FAST_ALPHA) * (state.variance + FAST_ALPHA * difference * difference)
+        state.slow_mean += SLOW_ALPHA * (temperature - state.slow_mean)
+        if state.count >= DRIFT_WARMUP and abs(state.mean - state.slow_mean) > config['DRIFT_DELTA']:
+            tag = DRIFT
+        return tag
+
+
+anomaly_detector = AnomalyDetector()
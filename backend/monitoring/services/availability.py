@@ -0,0 +1,259 @@
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+import numpy as np
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from ..models import Device, Reading, ReadingGap, ReadingGapScan
+from .compliance import DAY_SECONDS, epoch_sql
+from .stats_cache import BACKFILL_MARGIN
+
+
+def _datetime(epoch):
+    return datetime.fromtimestamp(epoch, tz=dt_timezone.utc)
+
+
+def _interval(reading_interval):
+    return reading_interval or 300
+
+
+def invalidate_gaps(device_ids, earliest, latest):
+    """Have the next gap scan re-read readings from earliest on (just stored, updated or deleted)"""
+    if earliest >= timezone.now() - BACKFILL_MARGIN:
+        # Newer than every scan's starting point; the case for every live reading
+        return
+    ReadingGapScan.objects.filter(device_id__in=list(device_ids), scan_from__gt=earliest).filter(
+        Q(rescan_from__isnull=True) | Q(rescan_from__gt=earliest)
+    ).update(rescan_from=earliest)
+
+
+class GapScanner:
+    """
+    Finds the gaps in each device's readings: consecutive readings further
+    apart than READING_GAP_INTERVALS reading intervals. The database pairs
+    every reading with the one before it using LAG() and returns only the
+    gaps, so a scan costs one pass over the readings it reads.
+
+    Gaps are stored (ReadingGap) along with how far each device was scanned
+    (ReadingGapScan). Later scans read only readings newer than the previous
+    scan less BACKFILL_MARGIN, which catches readings arriving late; older
+    back-fills, edits and deletions move the device's starting point back
+    through invalidate_gaps.
+    """
+
+    def scan(self, device_ids=None):
+        """Bring the stored gaps of the given devices (all by default) up to date; returns the gaps found"""
+        started = timezone.now()
+        devices = Device.objects.all()
+        if device_ids:
+            devices = devices.filter(device_id__in=device_ids)
+        device_ids = list(devices.values_list('device_id', flat=True))
+        scans = {scan.device_id: scan for scan in ReadingGapScan.objects.filter(device_id__in=device_ids)}
+
+        # Reading a device from further back than needed is only slower, so devices
+        # scanned within the last day share one query from the earliest of their
+        # starting points. Devices never scanned, or back-filled further back, get
+        # a query of their own.
+        recent = started - timedelta(days=1)
+        groups = {}
+        for device_id in device_ids:
+            scan = scans.get(device_id)
+            start = None
+            if scan:
+                start = min(scan.scan_from, scan.rescan_from) if scan.rescan_from else scan.scan_from
+            key = 'recent' if start is not None and start >= recent else device_id
+            group = groups.setdefault(key, [start, []])
+            group[0] = min(group[0], start) if key == 'recent' else start
+            group[1].append(device_id)
+
+        found = 0
+        for start, group in groups.values():
+            found += self._scan_group(group, start, scans, started)
+        return found
+
+    def _scan_group(self, device_ids, start, scans, started):
+        rows = self._query(device_ids, start)
+        gaps, first, last = [], {}, {}
+        for device_id, previous, taken, is_last, is_gap in rows:
+            if previous is None:
+                first[device_id] = taken
+            if is_last:
+                last[device_id] = taken
+            if is_gap:
+                gaps.append(ReadingGap(device_id=device_id, started_at=_datetime(previous), ended_at=_datetime(taken)))
+
+        with transaction.atomic():
+            if start is not None:
+                # Gaps ending at a reading read again are found again
+                ReadingGap.objects.filter(device_id__in=device_ids, ended_at__gte=start).delete()
+            ReadingGap.objects.bulk_create(gaps, ignore_conflicts=True)
+
+            scan_from = started - BACKFILL_MARGIN
+            updated, created = [], []
+            for device_id in device_ids:
+                scan = scans.get(device_id)
+                if scan is None:
+                    if device_id not in first:
+                        # No readings yet
+                        continue
+                    created.append(ReadingGapScan(
+                        device_id=device_id,
+                        first_reading=_datetime(first[device_id]),
+                        last_reading=_datetime(last[device_id]),
+                        scan_from=scan_from
+                    ))
+                    continue
+                if device_id in last:
+                    scan.last_reading = _datetime(last[device_id])
+                if device_id in first:
+                    scan.first_reading = _datetime(first[device_id])
+                scan.scan_from = scan_from
+                updated.append(scan)
+            ReadingGapScan.objects.bulk_create(created, ignore_conflicts=True)
+            ReadingGapScan.objects.bulk_update(updated, ['first_reading', 'last_reading', 'scan_from'])
+
+            # Clear rescan requests this scan covered; newer ones made meanwhile stay
+            for device_id in device_ids:
+                scan = scans.get(device_id)
+                if scan and scan.rescan_from:
+                    ReadingGapScan.objects.filter(device_id=device_id, rescan_from=scan.rescan_from).update(rescan_from=None)
+        return len(gaps)
+
+    def _query(self, device_ids, start):
+        """
+        (device_id, previous, taken, is_last, is_gap) for every reading from
+        start on that ends a gap, is its device's first ever or is the newest
+        read. Times are epoch seconds; previous is None for a first reading.
+        """
+        readings = Reading._meta.db_table
+        placeholders = ', '.join(['%s'] * len(device_ids))
+        params = list(device_ids)
+        since = ''
+        if start is not None:
+            since = 'AND r.timestamp >= %s'
+            params.append(connection.ops.adapt_datetimefield_value(start))
+        # The first reading read has no previous one in the window: look it up
+        previous = (
+            f'COALESCE(o.previous, (SELECT MAX(p.timestamp) FROM {readings} p '
+            f'WHERE p.device_id = o.device_id AND p.timestamp < o.timestamp))'
+        )
+        sql = f"""
+            SELECT g.device_id, g.previous, g.taken, g.is_last,
+                   g.previous IS NOT NULL AND g.taken - g.previous > %s * g.reading_interval AS is_gap
+            FROM (
+                SELECT o.device_id, {epoch_sql('o.timestamp')} AS taken, {epoch_sql(previous)} AS previous,
+                       o.following IS NULL AS is_last,
+                       COALESCE(NULLIF(d.reading_interval, 0), 300) AS reading_interval
+                FROM (
+                    SELECT r.device_id, r.timestamp,
+                           LAG(r.timestamp) OVER (PARTITION BY r.device_id ORDER BY r.timestamp) AS previous,
+                           LEAD(r.timestamp) OVER (PARTITION BY r.device_id ORDER BY r.timestamp) AS following
+                    FROM {readings} r
+                    WHERE r.device_id IN ({placeholders}) {since}
+                ) o
+                JOIN {Device._meta.db_table} d ON d.device_id = o.device_id
+            ) g
+            WHERE g.previous IS NULL OR g.is_last OR g.taken - g.previous > %s * g.reading_interval
+        """
+        threshold = settings.READING_GAP_INTERVALS
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [threshold] + params + [threshold])
+            return cursor.fetchall()
+
+
+gap_scanner = GapScanner()
+
+
+class AvailabilityReport:
+    """
+    Uptime of each device between start and end, per UTC day and overall,
+    and the gaps in its readings. Downtime is the time covered by gaps, plus
+    the time since the newest reading once that is itself a gap. Time before
+    a device's first reading is not counted.
+
+    Stored gaps are brought up to date first, so only readings newer than the
+    previous scan are read.
+    """
+
+    def __init__(self, start, end, device_ids=None):
+        self.start = start
+        self.end = end
+        devices = Device.objects.order_by('device_id')
+        if device_ids:
+            devices = devices.filter(device_id__in=device_ids)
+        self.devices = list(devices.values_list('device_id', 'reading_interval'))
+
+    def run(self):
+        device_ids = [device_id for device_id, _ in self.devices]
+        gap_scanner.scan(device_ids)
+        now = timezone.now()
+        end = min(self.end, now)
+        scans = {scan.device_id: scan for scan in ReadingGapScan.objects.filter(device_id__in=device_ids)}
+
+        gaps = {device_id: [] for device_id in device_ids}
+        for gap in ReadingGap.objects.filter(
+            device_id__in=device_ids, started_at__lt=end, ended_at__gt=self.start
+        ).order_by('device_id', 'started_at'):
+            gaps[gap.device_id].append((gap.started_at, gap.ended_at))
+        threshold = settings.READING_GAP_INTERVALS
+        open_gaps = {}
+        for device_id, interval in self.devices:
+            scan = scans.get(device_id)
+            if scan and (now - scan.last_reading).total_seconds() > threshold * _interval(interval) and scan.last_reading < end:
+                # Silent since its newest reading
+                open_gaps[device_id] = scan.last_reading
+                gaps[device_id].append((scan.last_reading, None))
+
+        # Day edges from the start of the first day; the first and last days are clipped to the period
+        first_day = datetime.combine(self.start.astimezone(dt_timezone.utc).date(), datetime.min.time(), tzinfo=dt_timezone.utc)
+        days = max(1, int(np.ceil((self.end - first_day).total_seconds() / DAY_SECONDS)))
+        edges = np.clip(first_day.timestamp() + DAY_SECONDS * np.arange(days + 1), self.start.timestamp(), end.timestamp())
+        downtime = self._downtime(device_ids, gaps, edges, now)
+
+        results = []
+        for i, (device_id, interval) in enumerate(self.devices):
+            scan = scans.get(device_id)
+            # Observed from the first reading on
+            observed = np.diff(np.maximum(edges, scan.first_reading.timestamp())) if scan else np.zeros(days)
+            results.append({
+                'device_id': device_id,
+                'reading_interval': interval,
+                'uptime': self._uptime(observed.sum(), downtime[i].sum()),
+                'downtime_seconds': round(float(downtime[i].sum())),
+                'days': [
+                    {
+                        'date': (first_day + timedelta(days=day)).date(),
+                        'uptime': self._uptime(observed[day], downtime[i, day]),
+                    }
+                    for day in range(days)
+                ],
+                'gaps': [
+                    {
+                        'started_at': started_at,
+                        'ended_at': ended_at,
+                        'seconds': round(((ended_at or now) - started_at).total_seconds()),
+                        'missed_readings': max(0, round(((ended_at or now) - started_at).total_seconds() / _interval(interval)) - 1),
+                    }
+                    for started_at, ended_at in gaps[device_id]
+                ],
+            })
+        return results
+
+    def _downtime(self, device_ids, gaps, edges, now):
+        """Seconds of gap in each (device, day) cell: differences of the gap time before each edge"""
+        downtime = np.zeros((len(device_ids), len(edges) - 1))
+        for i, device_id in enumerate(device_ids):
+            if not gaps[device_id]:
+                continue
+            starts = np.array([started_at.timestamp() for started_at, _ in gaps[device_id]])
+            ends = np.array([(ended_at or now).timestamp() for _, ended_at in gaps[device_id]])
+            before = np.clip(edges[None, :] - starts[:, None], 0, (ends - starts)[:, None]).sum(axis=0)
+            downtime[i] = np.diff(before)
+        return downtime
+
+    def _uptime(self, observed, down):
+        if observed <= 0:
+            return None
+        return round(100 * max(0.0, 1 - float(down) / float(observed)), 2)
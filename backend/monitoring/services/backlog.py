@@ -0,0 +1,78 @@
+import os
+import socket
+import threading
+import time
+
+from django.core.cache import cache
+
+# Seconds a worker's published depth keeps counting after its last change, so a worker killed mid-request stops
+BACKLOG_TTL = 60
+# Seconds the other workers' depths are reused before they are read from the cache again
+CHECK_INTERVAL = 0.5
+# Shared cache key listing the workers that have published a depth
+REGISTRY_KEY = 'ingest-backlog:workers'
+
+
+class IngestBacklog:
+    """
+    Readings in flight across every worker, for load shedding
+    (IngestBacklogThrottle): being written or evaluated by ReadingService.ingest,
+    or waiting for a group commit.
+
+    Each process publishes its own depth to the shared cache under a key of its
+    own whenever it changes, and lists that key in a registry; the fleet-wide
+    depth is the sum of the registered keys. Keys expire BACKLOG_TTL seconds
+    after their last change, so the depth of a worker that died mid-request
+    stops counting instead of shedding load forever, as a shared counter would.
+    """
+
+    def __init__(self):
+        self.depth = 0
+        self.lock = threading.Lock()
+        self.pid = None
+        self.key = None
+        self.registered_at = None
+        # Other workers' depth, and when it was read
+        self.others = 0
+        self.checked_at = None
+
+    def add(self, count):
+        with self.lock:
+            self.depth += count
+            # Published under the lock, so concurrent threads cannot leave an older depth in the cache
+            cache.set(self._key(), self.depth, timeout=BACKLOG_TTL)
+        self._register()
+
+    def total(self):
+        """Readings in flight in every worker"""
+        now = time.monotonic()
+        if self.checked_at is None or now - self.checked_at >= CHECK_INTERVAL:
+            key = self._key()
+            workers = [worker for worker in cache.get(REGISTRY_KEY) or [] if worker != key]
+            self.others = sum(cache.get_many(workers).values()) if workers else 0
+            self.checked_at = now
+        return self.depth + self.others
+
+    def _key(self):
+        pid = os.getpid()
+        if pid != self.pid:
+            # A forked worker publishes and registers a key of its own
+            self.pid, self.registered_at = pid, None
+            self.key = f'ingest-backlog:{socket.gethostname()}:{pid}'
+        return self.key
+
+    def _register(self):
+        """(Re-)list this worker in the registry, dropping workers whose depth has expired"""
+        now = time.monotonic()
+        if self.registered_at is not None and now - self.registered_at < BACKLOG_TTL / 2:
+            return
+        self.registered_at = now
+        key = self._key()
+        workers = cache.get(REGISTRY_KEY) or []
+        live = cache.get_many(workers) if workers else {}
+        # Read-modify-write: a worker lost to a concurrent update registers again within BACKLOG_TTL / 2
+        cache.set(REGISTRY_KEY, [worker for worker in workers if worker in live and worker != key] + [key],
+                  timeout=None)
+
+
+ingest_backlog = IngestBacklog()
@@ -0,0 +1,364 @@
+from datetime import datetime, time as dt_time, timedelta, timezone as dt_timezone
+
+import numpy as np
+from django.db import connection
+from django.db.models import Count, Max, Min, Q, Sum
+from django.db.models.expressions import RawSQL
+from django.utils import timezone
+
+from ..models import DailyReadingRollup, Device, Reading
+from .stats_cache import BACKFILL_MARGIN
+
+# Activation energy over the gas constant (ΔH = 83.144 kJ/mol, the USP <1079.2> default), in kelvin
+ACTIVATION_ENERGY_OVER_R = 10000.0
+KELVIN = 273.15
+# A reading stands for the time until the next one, but no longer than this many
+# reading intervals (and never more than MAX_HOLD); longer gaps count as no data
+HOLD_INTERVALS = 3
+MAX_HOLD = timedelta(hours=1)
+# Missing rollups are built this many days at a time
+ROLLUP_CHUNK_DAYS = 7
+DAY_SECONDS = 86400
+
+ROLLUP_SUMS = ('sample_count', 'covered_seconds', 'arrhenius_sum', 'seconds_above', 'seconds_below')
+
+
+def _day_start(value):
+    return datetime.combine(value.astimezone(dt_timezone.utc).date(), dt_time.min, tzinfo=dt_timezone.utc)
+
+
+def _next_day_start(value):
+    start = _day_start(value)
+    return start if start == value else start + timedelta(days=1)
+
+
+def settled_until():
+    """Days before this boundary can no longer change from live readings, so they may be rolled up"""
+    return _day_start(timezone.now() - MAX_HOLD - BACKFILL_MARGIN)
+
+
+def invalidate_rollups(device_ids, earliest, latest):
+    """Drop stored rollups that readings between earliest and latest (just stored, updated or deleted) change"""
+    if earliest - MAX_HOLD >= settled_until():
+        # Too recent to be in any stored day; the case for every live reading
+        return
+    DailyReadingRollup.objects.filter(
+        device_id__in=list(device_ids),
+        day__gte=(earliest - MAX_HOLD).astimezone(dt_timezone.utc).date(),
+        day__lte=(latest + MAX_HOLD).astimezone(dt_timezone.utc).date()
+    ).delete()
+
+
+def epoch_sql(column):
+    """SQL for a timestamp column as float seconds since the epoch"""
+    if connection.vendor == 'postgresql':
+        return f'EXTRACT(EPOCH FROM {column})::float8'
+    # julianday() is off by up to tens of microseconds: round it to whole seconds and
+    # take the fraction from the stored text ('YYYY-MM-DD HH:MM:SS.ffffff')
+    return (
+        f"(ROUND((julianday(substr({column}, 1, 19)) - 2440587.5) * 86400.0)"
+        f" + CAST(substr({column}, 20) AS REAL))"
+    )
+
+
+def _epoch(column):
+    return RawSQL(epoch_sql(column), [])
+
+
+def bucket_stats(devices, start, end, edges, range_min, range_max):
+    """
+    Time-weighted statistics of every device's readings in each bucket between
+    consecutive `edges` (datetimes, start to end). devices is a list of
+    (device_id, reading_interval). Returns a dict of (len(devices), buckets)
+    arrays keyed like the DailyReadingRollup fields.
+
+    Each reading holds its temperature until the next reading, or for
+    HOLD_INTERVALS reading intervals, whichever is sooner, so irregular
+    spacing is weighted correctly and gaps are not invented data. Holds are
+    split where they cross a bucket edge.
+    """
+    count, buckets = len(devices), len(edges) - 1
+    edges = np.array([edge.timestamp() for edge in edges])
+    positions = {device_id: i for i, (device_id, _) in enumerate(devices)}
+    holds = np.array([
+        min(HOLD_INTERVALS * (interval or 300), MAX_HOLD.total_seconds()) for _, interval in devices
+    ], dtype=np.float64)
+
+    rows = list(Reading.objects.filter(
+        device_id__in=list(positions),
+        timestamp__gte=start - MAX_HOLD,
+        timestamp__lt=end
+    ).exclude(suspect='spike').annotate(epoch=_epoch(f'{Reading._meta.db_table}.timestamp')).order_by(
+        'device_id', 'timestamp'
+    ).values_list('device_id', 'epoch', 'temperature'))
+
+    shape = (count, buckets)
+    stats = {field: np.zeros(shape) for field in ROLLUP_SUMS + ('longest_excursion', 'leading_excursion', 'trailing_excursion')}
+    stats['min_temperature'] = np.full(shape, np.inf)
+    stats['max_temperature'] = np.full(shape, -np.inf)
+    if not rows:
+        return stats
+
+    ids, times, temperatures = zip(*rows)
+    device = np.array([positions[device_id] for device_id in ids])
+    times = np.array(times, dtype=np.float64)
+    temperatures = np.array(temperatures, dtype=np.float64)
+
+    # Readings themselves: counts and extremes by the bucket they were taken in
+    taken = (times >= edges[0]) & (times < edges[-1])
+    bucket = np.searchsorted(edges, times[taken], side='right') - 1
+    key = device[taken] * buckets + bucket
+    stats['sample_count'] = np.bincount(key, minlength=count * buckets).reshape(shape).astype(np.float64)
+    np.minimum.at(stats['min_temperature'].reshape(-1), key, temperatures[taken])
+    np.maximum.at(stats['max_temperature'].reshape(-1), key, temperatures[taken])
+
+    # Held intervals, clipped to the edges
+    same_device = np.r_[device[1:] == device[:-1], False]
+    next_time = np.where(same_device, np.r_[times[1:], np.inf], np.inf)
+    seg_start = np.maximum(times, edges[0])
+    seg_end = np.minimum(np.minimum(next_time, times + holds[device]), edges[-1])
+    keep = seg_end > seg_start
+    seg_start, seg_end, seg_device, seg_temperature = seg_start[keep], seg_end[keep], device[keep], temperatures[keep]
+
+    # Split intervals crossing a bucket edge; an interval is at most MAX_HOLD long, so this loops a few times at most
+    while True:
+        bucket = np.searchsorted(edges, seg_start, side='right') - 1
+        bucket_end = edges[bucket + 1]
+        crossing = seg_end > bucket_end
+        if not crossing.any():
+            break
+        seg_start = np.r_[seg_start, bucket_end[crossing]]
+        seg_end = np.r_[np.where(crossing, bucket_end, seg_end), seg_end[crossing]]
+        seg_device = np.r_[seg_device, seg_device[crossing]]
+        seg_temperature = np.r_[seg_temperature, seg_temperature[crossing]]
+    order = np.lexsort((seg_start, seg_device))
+    seg_start, seg_end, seg_device, seg_temperature, bucket = (
+        seg_start[order], seg_end[order], seg_device[order], seg_temperature[order], bucket[order]
+    )
+
+    duration = seg_end - seg_start
+    key = seg_device * buckets + bucket
+    size = count * buckets
+    above = seg_temperature > range_max
+    below = seg_temperature < range_min
+    stats['covered_seconds'] = np.bincount(key, duration, size).reshape(shape)
+    stats['arrhenius_sum'] = np.bincount(
+        key, duration * np.exp(-ACTIVATION_ENERGY_OVER_R / (seg_temperature + KELVIN)), size
+    ).reshape(shape)
+    stats['seconds_above'] = np.bincount(key, duration * above, size).reshape(shape)
+    stats['seconds_below'] = np.bincount(key, duration * below, size).reshape(shape)
+
+    # Excursions: runs of contiguous out-of-range intervals within a bucket
+    outside = above | below
+    if outside.any():
+        continues = np.r_[False, (key[1:] == key[:-1]) & outside[:-1] & (seg_start[1:] == seg_end[:-1])]
+        first = outside & ~continues
+        run = np.cumsum(first) - 1
+        lengths = np.bincount(run[outside], duration[outside])
+        run_key = key[first]
+        run_start = seg_start[first]
+        run_end = np.zeros(len(lengths))
+        np.maximum.at(run_end, run[outside], seg_end[outside])
+        bucket_of_run = run_key % buckets
+        np.maximum.at(stats['longest_excursion'].reshape(-1), run_key, lengths)
+        leading = run_start == edges[bucket_of_run]
+        trailing = run_end == edges[bucket_of_run + 1]
+        stats['leading_excursion'].reshape(-1)[run_key[leading]] = lengths[leading]
+        stats['trailing_excursion'].reshape(-1)[run_key[trailing]] = lengths[trailing]
+    return stats
+
+
+class ComplianceReport:
+    """
+    Mean Kinetic Temperature, time outside [range_min, range_max] and longest
+    excursion of each device between start and end.
+
+    Whole settled days come from DailyReadingRollup: their sums are added up
+    in one aggregate query and only days with an excursion touching midnight
+    are fetched, to join excursions running across days. Missing days are
+    rolled up first. The partial days at either end, and days still
+    receiving readings, are computed from raw readings.
+    """
+
+    def __init__(self, start, end, range_min, range_max, device_ids=None):
+        self.start = start
+        self.end = end
+        self.range_min = range_min
+        self.range_max = range_max
+        devices = Device.objects.order_by('device_id')
+        if device_ids:
+            devices = devices.filter(device_id__in=device_ids)
+        self.devices = list(devices.values_list('device_id', 'reading_interval'))
+
+    def run(self):
+        first_day = _next_day_start(self.start)
+        last_day = min(_day_start(self.end), settled_until())
+        totals = {device_id: self._empty() for device_id, _ in self.devices}
+        # Per device, (start, end, leading, trailing) of every bucket with an excursion at an edge, in time order
+        chains = {device_id: [] for device_id, _ in self.devices}
+        longest = {device_id: 0.0 for device_id, _ in self.devices}
+
+        if first_day < last_day:
+            self._add_raw(self.start, first_day, totals, chains, longest)
+            self._add_rollups(first_day, last_day, totals, chains, longest)
+            self._add_raw(last_day, self.end, totals, chains, longest)
+        else:
+            self._add_raw(self.start, self.end, totals, chains, longest)
+
+        period = (self.end - self.start).total_seconds()
+        return [
+            self._result(device_id, totals[device_id], max(longest[device_id], self._longest_chain(chains[device_id])), period)
+            for device_id, _ in self.devices
+        ]
+
+    def _empty(self):
+        totals = dict.fromkeys(ROLLUP_SUMS, 0.0)
+        totals.update(min_temperature=None, max_temperature=None)
+        return totals
+
+    def _merge(self, totals, values):
+        for field in ROLLUP_SUMS:
+            totals[field] += values[field] or 0
+        for field, pick in (('min_temperature', min), ('max_temperature', max)):
+            if values[field] is not None:
+                totals[field] = values[field] if totals[field] is None else pick(totals[field], values[field])
+
+    def _add_raw(self, start, end, totals, chains, longest):
+        if start >= end or not self.devices:
+            return
+        stats = bucket_stats(self.devices, start, end, [start, end], self.range_min, self.range_max)
+        for i, (device_id, _) in enumerate(self.devices):
+            values = {field: float(stats[field][i, 0]) for field in ROLLUP_SUMS}
+            values['min_temperature'] = float(stats['min_temperature'][i, 0]) if stats['sample_count'][i, 0] else None
+            values['max_temperature'] = float(stats['max_temperature'][i, 0]) if stats['sample_count'][i, 0] else None
+            self._merge(totals[device_id], values)
+            longest[device_id] = max(longest[device_id], float(stats['longest_excursion'][i, 0]))
+            leading, trailing = float(stats['leading_excursion'][i, 0]), float(stats['trailing_excursion'][i, 0])
+            if leading or trailing:
+                chains[device_id].append((start.timestamp(), end.timestamp(), leading, trailing))
+
+    def _rollups(self, first_day, last_day):
+        return DailyReadingRollup.objects.filter(
+            device_id__in=[device_id for device_id, _ in self.devices],
+            day__gte=first_day.date(),
+            day__lt=last_day.date(),
+            range_min=self.range_min,
+            range_max=self.range_max
+        )
+
+    def _add_rollups(self, first_day, last_day, totals, chains, longest):
+        days = (last_day - first_day).days
+        rows = self._aggregate(first_day, last_day)
+        if any(row['days'] < days for row in rows) or len(rows) < len(self.devices):
+            self.ensure_rollups(first_day, last_day)
+            rows = self._aggregate(first_day, last_day)
+        for row in rows:
+            self._merge(totals[row['device_id']], row)
+            longest[row['device_id']] = max(longest[row['device_id']], row['longest_excursion'] or 0)
+
+        edge_days = self._rollups(first_day, last_day).filter(
+            Q(leading_excursion__gt=0) | Q(trailing_excursion__gt=0)
+        ).order_by('device_id', 'day').values_list('device_id', 'day', 'leading_excursion', 'trailing_excursion')
+        for device_id, day, leading, trailing in edge_days:
+            start = datetime.combine(day, dt_time.min, tzinfo=dt_timezone.utc).timestamp()
+            chains[device_id].append((start, start + DAY_SECONDS, leading, trailing))
+
+    def _aggregate(self, first_day, last_day):
+        return list(self._rollups(first_day, last_day).values('device_id').annotate(
+            **{field: Sum(field) for field in ROLLUP_SUMS},
+            days=Count('id'),
+            min_temperature=Min('min_temperature'),
+            max_temperature=Max('max_temperature'),
+            longest_excursion=Max('longest_excursion')
+        ))
+
+    def ensure_rollups(self, first_day, last_day):
+        """Build the rollups missing between the two day boundaries, or stored for other bounds"""
+        days = (last_day - first_day).days
+        counts = dict(self._rollups(first_day, last_day).values('device_id').annotate(
+            count=Count('id')
+        ).values_list('device_id', 'count'))
+        incomplete = [device for device in self.devices if counts.get(device[0], 0) < days]
+        if not incomplete:
+            return 0
+
+        stored = set(self._rollups(first_day, last_day).filter(
+            device_id__in=[device_id for device_id, _ in incomplete]
+        ).values_list('device_id', 'day'))
+        built = 0
+        for offset in range(0, days, ROLLUP_CHUNK_DAYS):
+            chunk_start = first_day + timedelta(days=offset)
+            chunk_end = min(chunk_start + timedelta(days=ROLLUP_CHUNK_DAYS), last_day)
+            edges = [chunk_start + timedelta(days=i) for i in range((chunk_end - chunk_start).days + 1)]
+            missing = [
+                device for device in incomplete
+                if any((device[0], edge.date()) not in stored for edge in edges[:-1])
+            ]
+            if not missing:
+                continue
+            stats = bucket_stats(missing, chunk_start, chunk_end, edges, self.range_min, self.range_max)
+            rollups = []
+            for i, (device_id, _) in enumerate(missing):
+                for j, edge in enumerate(edges[:-1]):
+                    if (device_id, edge.date()) in stored:
+                        continue
+                    sampled = stats['sample_count'][i, j] > 0
+                    rollups.append(DailyReadingRollup(
+                        device_id=device_id,
+                        day=edge.date(),
+                        range_min=self.range_min,
+                        range_max=self.range_max,
+                        min_temperature=float(stats['min_temperature'][i, j]) if sampled else None,
+                        max_temperature=float(stats['max_temperature'][i, j]) if sampled else None,
+                        **{
+                            field: float(stats[field][i, j])
+                            for field in ROLLUP_SUMS + ('longest_excursion', 'leading_excursion', 'trailing_excursion')
+                        }
+                    ))
+            DailyReadingRollup.objects.bulk_create(
+                rollups,
+                update_conflicts=True,
+                unique_fields=['device_id', 'day'],
+                update_fields=[
+                    field.name for field in DailyReadingRollup._meta.concrete_fields
+                    if field.name not in ('id', 'device_id', 'day')
+                ]
+            )
+            built += len(rollups)
+        return built
+
+    def _longest_chain(self, chain):
+        """Longest excursion made of buckets joined at their edges: a trailing run, whole buckets, a leading run"""
+        longest = 0.0
+        running, running_end = 0.0, None
+        for start, end, leading, trailing in chain:
+            if running and start == running_end and leading:
+                running += leading
+                if leading >= end - start:
+                    # Out of range for the whole bucket: the run goes on
+                    running_end = end
+                    continue
+                longest = max(longest, running)
+            elif running:
+                longest = max(longest, running)
+            running, running_end = trailing, end
+        return max(longest, running)
+
+    def _result(self, device_id, totals, longest, period):
+        covered = totals['covered_seconds']
+        mkt = None
+        if covered and totals['arrhenius_sum']:
+            mkt = ACTIVATION_ENERGY_OVER_R / -np.log(totals['arrhenius_sum'] / covered) - KELVIN
+        return {
+            'device_id': device_id,
+            'samples': int(totals['sample_count']),
+            'covered_seconds': round(covered),
+            'coverage': round(100 * covered / period, 2) if period else None,
+            'mean_kinetic_temperature': round(float(mkt), 2) if mkt is not None else None,
+            'min_temperature': totals['min_temperature'],
+            'max_temperature': totals['max_temperature'],
+            'seconds_above': round(totals['seconds_above']),
+            'seconds_below': round(totals['seconds_below']),
+            'seconds_outside': round(totals['seconds_above'] + totals['seconds_below']),
+            'longest_excursion_seconds': round(longest),
+        }
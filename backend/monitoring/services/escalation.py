@@ -0,0 +1,195 @@
+import heapq
+import logging
+import select
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import DatabaseError, InterfaceError, connection, transaction
+from django.utils import timezone
+
+from ..models import EscalationDeadline, Incident
+
+logger = logging.getLogger(__name__)
+
+# Tertiary operators; nothing escalates further
+MAX_LEVEL = 3
+# PostgreSQL channel new deadlines are announced on as they commit
+CHANNEL = 'escalation_deadlines'
+# Seconds between reloads on backends without LISTEN, where reloading is the only way to see new deadlines
+UNLISTENED_RESYNC_INTERVAL = 30
+
+
+def escalation_delays():
+    """Time after the escalation clock starts at which an incident reaches each level above 1"""
+    return {
+        2: timedelta(minutes=settings.ESCALATION_LEVEL2_AFTER),
+        3: timedelta(minutes=settings.ESCALATION_LEVEL3_AFTER),
+    }
+
+
+def level_reached(started_at, until):
+    """Escalation level of an incident left unacknowledged from started_at until `until`"""
+    return 1 + sum(1 for delay in escalation_delays().values() if until - started_at >= delay)
+
+
+def escalation_description(level):
+    """Timeline description of an escalation to level"""
+    minutes = escalation_delays()[level].total_seconds() / 60
+    return f"Escalated to level {level} operators: unacknowledged for {minutes:g} minutes"
+
+
+def schedule_escalation(incident, started_at, level=2):
+    """
+    Have the scheduler escalate an open incident to `level` once it has been
+    unacknowledged for that level's delay from started_at, and on to the
+    levels after it, unless cancel_escalation is called first.
+    """
+    EscalationDeadline.objects.update_or_create(
+        incident=incident, defaults={'level': level, 'started_at': started_at}
+    )
+    if connection.vendor == 'postgresql':
+        # Delivered when the surrounding transaction commits, not before
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_notify(%s, %s)', [CHANNEL, f'{incident.pk} {level} {started_at.timestamp()}'])
+
+
+def cancel_escalation(incident):
+    """Stop escalating an incident (acknowledged or resolved)"""
+    EscalationDeadline.objects.filter(incident=incident).delete()
+
+
+class EscalationScheduler:
+    """
+    Escalates incidents whose deadlines (EscalationDeadline) fall due while
+    they are still open, i.e. neither acknowledged nor resolved: level 2 and
+    3 operators are notified, the incident's level is raised and the deadline
+    moves on to the next level.
+
+    Pending deadlines are kept in a heap ordered by due time, so the scheduler
+    sleeps until the earliest one instead of polling incidents. The heap is
+    loaded from the deadline table at start, which makes restarts safe, and
+    again every ESCALATION_RESYNC_INTERVAL seconds. On PostgreSQL deadlines
+    scheduled meanwhile arrive by LISTEN/NOTIFY; elsewhere the heap is
+    reloaded every UNLISTENED_RESYNC_INTERVAL seconds instead. Each deadline
+    is fired in its own transaction with the row locked, so running more than
+    one scheduler never escalates an incident twice.
+
+    notifier is the ReadingService whose escalate() raises the incident's
+    level and pages operators.
+    """
+
+    def __init__(self, notifier):
+        self.notifier = notifier
+        self.heap = []
+        self.loaded_at = None
+        self.listening = False
+
+    def run(self, once=False):
+        """Fire deadlines as they fall due until stopped; with once=True fire those due now and return the count"""
+        backoff = 1
+        while True:
+            try:
+                self._listen()
+                self.load()
+                if once:
+                    return self.fire_due()
+                backoff = 1
+                while True:
+                    self.fire_due()
+                    self._wait()
+                    if time.monotonic() - self.loaded_at >= self._resync_interval():
+                        self.load()
+            except (DatabaseError, InterfaceError, OSError) as e:
+                if once:
+                    raise
+                logger.error(f"Escalation scheduler lost its database connection, retrying in {backoff}s: {str(e)}")
+                connection.close()
+                self.listening = False
+                time.sleep(backoff)
+                backoff = min(backoff * 2, 30)
+
+    def load(self):
+        """Replace the heap with every stored deadline"""
+        delays = escalation_delays()
+        self.heap = [
+            (started_at + delays[level], pk, level)
+            for pk, level, started_at in EscalationDeadline.objects.values_list('incident_id', 'level', 'started_at')
+            if level in delays
+        ]
+        heapq.heapify(self.heap)
+        self.loaded_at = time.monotonic()
+
+    def fire_due(self):
+        """Escalate every incident whose deadline has passed; returns the number escalated"""
+        fired = 0
+        while self.heap and self.heap[0][0] <= timezone.now():
+            _, pk, level = heapq.heappop(self.heap)
+            if self._fire(pk, level):
+                fired += 1
+        return fired
+
+    def _fire(self, pk, level):
+        with transaction.atomic():
+            deadline = EscalationDeadline.objects.select_for_update(skip_locked=True).filter(
+                incident_id=pk, level=level
+            ).first()
+            if deadline is None:
+                # Cancelled, fired by another scheduler, or a duplicate heap entry
+                return False
+            delays = escalation_delays()
+            due = deadline.started_at + delays[level]
+            if due > timezone.now():
+                # Rescheduled since it was queued
+                heapq.heappush(self.heap, (due, pk, level))
+                return False
+
+            # Locked and read afresh: escalate() writes the whole incident back, which must not undo an acknowledgement
+            incident = Incident.objects.select_for_update().select_related('device').get(pk=pk)
+            if incident.status != 'open':
+                deadline.delete()
+                return False
+            if level < MAX_LEVEL:
+                deadline.level = level + 1
+                deadline.save(update_fields=['level'])
+                heapq.heappush(self.heap, (deadline.started_at + delays[level + 1], pk, level + 1))
+            else:
+                deadline.delete()
+            # Stored with the timeline event in bulk; notifications are delivered once the escalation commits
+            self.notifier.escalate(incident, level)
+        return True
+
+    def _resync_interval(self):
+        if self.listening:
+            return settings.ESCALATION_RESYNC_INTERVAL
+        return min(settings.ESCALATION_RESYNC_INTERVAL, UNLISTENED_RESYNC_INTERVAL)
+
+    def _listen(self):
+        if self.listening or connection.vendor != 'postgresql':
+            return
+        with connection.cursor() as cursor:
+            cursor.execute(f'LISTEN {CHANNEL}')
+        self.listening = True
+
+    def _wait(self):
+        """Sleep until the earliest deadline, the next reload or, on PostgreSQL, a new deadline"""
+        timeout = self._resync_interval() - (time.monotonic() - self.loaded_at)
+        if self.heap:
+            timeout = min(timeout, (self.heap[0][0] - timezone.now()).total_seconds())
+        timeout = max(0, timeout)
+        if not self.listening:
+            time.sleep(timeout)
+            return
+
+        raw = connection.connection
+        # Notifications can arrive with the results of any query, not only while waiting
+        if not raw.notifies and select.select([raw], [], [], timeout)[0]:
+            raw.poll()
+        while raw.notifies:
+            payload = raw.notifies.pop(0).payload
+            try:
+                pk, level, started = payload.split()
+                started_at = datetime.fromtimestamp(float(started), tz=dt_timezone.utc)
+                heapq.heappush(self.heap, (started_at + escalation_delays()[int(level)], int(pk), int(level)))
+            except (ValueError, KeyError):
+                logger.warning(f"Ignoring malformed escalation notification: {payload}")
@@ -0,0 +1,109 @@
+from django.db import connection
+from django.db.models import OuterRef, Subquery
+from django.utils import timezone
+
+from ..models import Device, Incident, Reading
+from .reading_service import ReadingService
+
+READING_FIELDS = ('id', 'temperature', 'humidity', 'power_status', 'battery_level', 'timestamp')
+INCIDENT_FIELDS = ('id', 'status', 'current_escalation_level', 'alert_count', 'start_time')
+
+
+class FleetSnapshotService:
+    """
+    Current state of every device: latest and previous reading, trend, active
+    incident and time since last contact, fetched in one query.
+
+    On PostgreSQL each device is joined LATERAL to its two newest readings,
+    one index probe per device regardless of how many readings are stored,
+    and to its newest active incident picked with DISTINCT ON.
+    """
+
+    def snapshot(self):
+        now = timezone.now()
+        rows = self._fetch_postgresql() if connection.vendor == 'postgresql' else self._fetch_portable()
+        devices = [self._device_state(row, now) for row in rows]
+        return {'generated_at': now, 'count': len(devices), 'devices': devices}
+
+    def _fetch_postgresql(self):
+        reading_columns = ', '.join(READING_FIELDS)
+        sql = f'''
+            SELECT d.device_id, d.name, d.location, d.status, d.last_reading,
+                   {', '.join(f'r.{field}' for field in READING_FIELDS)},
+                   r.previous_temperature, r.previous_timestamp,
+                   {', '.join(f'i.{field}' for field in INCIDENT_FIELDS)}
+            FROM {Device._meta.db_table} d
+            LEFT JOIN LATERAL (
+                -- One backward scan of the (device_id, timestamp) index yields both readings
+                SELECT *,
+                       LEAD(temperature) OVER newest_first AS previous_temperature,
+                       LEAD(timestamp) OVER newest_first AS previous_timestamp
+                FROM (
+                    SELECT {reading_columns} FROM {Reading._meta.db_table}
+                    WHERE device_id = d.device_id ORDER BY timestamp DESC LIMIT 2
+                ) newest
+                WINDOW newest_first AS (ORDER BY timestamp DESC)
+                ORDER BY timestamp DESC LIMIT 1
+            ) r ON true
+            LEFT JOIN (
+                SELECT DISTINCT ON (device_id) device_id, {', '.join(INCIDENT_FIELDS)}
+                FROM {Incident._meta.db_table}
+                WHERE status = ANY(%s)
+                ORDER BY device_id, start_time DESC
+            ) i ON i.device_id = d.id
+            ORDER BY d.device_id
+        '''
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [ReadingService.ACTIVE_INCIDENT_STATUSES])
+            return cursor.fetchall()
+
+    def _fetch_portable(self):
+        """Same columns through correlated subqueries, for backends without LATERAL"""
+        readings = Reading.objects.filter(device_id=OuterRef('device_id')).order_by('-timestamp')
+        incidents = Incident.objects.filter(
+            device=OuterRef('pk'), status__in=ReadingService.ACTIVE_INCIDENT_STATUSES
+        ).order_by('-start_time')
+        annotations = {f'r_{field}': Subquery(readings.values(field)[:1]) for field in READING_FIELDS}
+        annotations['p_temperature'] = Subquery(readings.values('temperature')[1:2])
+        annotations['p_timestamp'] = Subquery(readings.values('timestamp')[1:2])
+        annotations.update({f'i_{field}': Subquery(incidents.values(field)[:1]) for field in INCIDENT_FIELDS})
+        return Device.objects.annotate(**annotations).order_by('device_id').values_list(
+            'device_id', 'name', 'location', 'status', 'last_reading', *annotations
+        )
+
+    def _device_state(self, row, now):
+        device_id, name, location, device_status, last_reading = row[:5]
+        latest = dict(zip(READING_FIELDS, row[5:11]))
+        previous_temperature, previous_timestamp = row[11:13]
+        incident = dict(zip(INCIDENT_FIELDS, row[13:18]))
+
+        trend = 'stable'
+        if latest['id'] is None:
+            latest = None
+        elif previous_temperature is not None:
+            if latest['temperature'] > previous_temperature:
+                trend = 'increasing'
+            elif latest['temperature'] < previous_temperature:
+                trend = 'decreasing'
+
+        last_contact = last_reading or (latest and latest['timestamp'])
+        return {
+            'device_id': device_id,
+            'name': name,
+            'location': location,
+            'status': device_status,
+            'last_contact': last_contact,
+            'seconds_since_contact': round((now - last_contact).total_seconds()) if last_contact else None,
+            'latest': latest,
+            'previous': {
+                'temperature': previous_temperature, 'timestamp': previous_timestamp
+            } if previous_timestamp else None,
+            'trend': trend,
+            'incident': {
+                'id': incident['id'],
+                'status': incident['status'],
+                'escalation_level': incident['current_escalation_level'],
+                'alert_count': incident['alert_count'],
+                'start_time': incident['start_time'],
+            } if incident['id'] else None,
+        }
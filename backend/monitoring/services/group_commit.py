@@ -0,0 +1,87 @@
+import threading
+from django.conf import settings
+from .backlog import ingest_backlog
+from .reading_service import ReadingService
+
+
+class _Slot:
+    """One waiting request: its record and, once written, its reading or error"""
+
+    def __init__(self, record):
+        self.record = record
+        self.done = threading.Event()
+        self.reading = None
+        self.error = None
+
+
+class GroupCommitter:
+    """
+    Collects readings submitted concurrently by request threads and writes them
+    together through ReadingService.ingest, i.e. one multi-row insert and one
+    heartbeat update in a single transaction.
+
+    The first thread to submit into an empty group becomes its leader: it waits
+    up to max_delay seconds (or until max_batch readings are pending), writes the
+    group on its own database connection and wakes the other submitters with
+    their results. Meanwhile the next submitter starts a new group.
+    """
+
+    def __init__(self, max_delay, max_batch):
+        self.max_delay = max_delay
+        self.max_batch = max_batch
+        self.lock = threading.Lock()
+        self.filled = threading.Condition(self.lock)
+        self.pending = []
+
+    def submit(self, record):
+        """Store one validated reading tuple; returns the created Reading, or None for a duplicate"""
+        slot = _Slot(record)
+        # Waiting readings count in the backlog until ingest() takes them over
+        ingest_backlog.add(1)
+        with self.lock:
+            self.pending.append(slot)
+            leader = len(self.pending) == 1
+            if len(self.pending) >= self.max_batch:
+                self.filled.notify()
+
+        if leader:
+            with self.lock:
+                self.filled.wait_for(lambda: len(self.pending) >= self.max_batch, timeout=self.max_delay)
+                group, self.pending = self.pending, []
+            ingest_backlog.add(-len(group))
+            self._write(group)
+
+        slot.done.wait()
+        if slot.error:
+            raise slot.error
+        return slot.reading
+
+    def _write(self, group):
+        try:
+            readings = ReadingService().ingest([slot.record for slot in group])
+            for slot, reading in zip(group, readings):
+                slot.reading = reading
+        except Exception as e:
+            for slot in group:
+                slot.error = e
+        finally:
+            for slot in group:
+                slot.done.set()
+
+
+_committer = None
+_committer_lock = threading.Lock()
+
+
+def get_group_committer():
+    """The process-wide committer, or None unless READING_GROUP_COMMIT is enabled"""
+    global _committer
+    if not getattr(settings, 'READING_GROUP_COMMIT', False):
+        return None
+    with _committer_lock:
+        if _committer is None:
+            _committer = GroupCommitter(
+                max_delay=settings.READING_GROUP_COMMIT_DELAY_MS / 1000,
+                max_batch=settings.READING_GROUP_COMMIT_MAX_BATCH
+            )
+    return _committer
@@ -0,0 +1,112 @@
+import logging
+
+from django.db import transaction
+from django.utils import timezone
+
+from notifications.models import Notification
+from notifications.services.notification_service import NotificationService
+from ..conditional import bump_resource_version, INCIDENTS
+from ..models import Incident, IncidentTimelineEvent
+
+logger = logging.getLogger(__name__)
+
+# Incident fields threshold evaluation changes
+INCIDENT_FIELDS = ('alert', 'description', 'status', 'end_time', 'alert_count', 'current_escalation_level')
+# Notification fields set by delivery
+DELIVERY_FIELDS = ('status', 'sent_at', 'retry_count', 'updated_at')
+
+
+class IncidentEventWriter:
+    """
+    Collects what one evaluation step (a reading checked, an incident
+    escalated) does to incidents: changes to stored incidents, timeline events
+    and operator notifications. write() stores them in one transaction, with a
+    bulk_update for the incidents and a bulk_create each for the notifications
+    and the events, instead of a save or insert per row.
+
+    Incident notifications are stored PENDING and only sent once that
+    transaction commits, so nobody is paged about a change that was rolled
+    back and no locks are held while the mail server answers; the
+    notification_sent timeline events are added once delivery succeeds.
+    Notifications about alerts without an incident (power, battery) are stored
+    PENDING for NotificationService, as process_alert does. Bulk writes send
+    no post_save signals, so the resource versions are bumped here.
+    """
+
+    def __init__(self):
+        self.incidents = {}
+        self.events = []
+        # (incident notification, its escalation level)
+        self.notifications = []
+        self.alert_notifications = []
+
+    def save_incident(self, incident):
+        self.incidents[incident.pk] = incident
+
+    def add_event(self, incident, **fields):
+        event = IncidentTimelineEvent(incident=incident, **fields)
+        self.events.append(event)
+        return event
+
+    def notify(self, incident, operator, message, level):
+        """Page an operator about an incident; the timeline records it once it was sent"""
+        self.notifications.append((Notification(
+            operator=operator,
+            incident=incident,
+            message=message,
+            notification_type='EMAIL',
+            status='PENDING'
+        ), level))
+
+    def notify_alert(self, alert):
+        """Notify the operators NotificationService picks for an alert that opens no incident"""
+        self.alert_notifications += NotificationService().alert_notifications(alert)
+
+    def write(self):
+        if not (self.incidents or self.events or self.notifications or self.alert_notifications):
+            return
+        deliveries = self.notifications
+        with transaction.atomic():
+            Incident.objects.bulk_update(list(self.incidents.values()), INCIDENT_FIELDS)
+            Notification.objects.bulk_create(
+                [notification for notification, _ in deliveries] + self.alert_notifications
+            )
+            IncidentTimelineEvent.objects.bulk_create(self.events)
+            bump_resource_version(INCIDENTS)
+            if deliveries:
+                transaction.on_commit(lambda: deliver_notifications(deliveries))
+        self.incidents = {}
+        self.events = []
+        self.notifications = []
+        self.alert_notifications = []
+
+
+def deliver_notifications(deliveries):
+    """
+    Send stored PENDING incident notifications, given as (notification, level)
+    pairs, record the outcomes with one bulk update and add a timeline event
+    for each one that was sent
+    """
+    service = NotificationService()
+    events = []
+    for notification, level in deliveries:
+        try:
+            service.deliver(notification)
+        except Exception as e:
+            logger.error(f"Failed to notify operator {notification.operator_id}: {str(e)}")
+            notification.status = 'FAILED'
+            notification.retry_count = 1
+        # bulk_update does not apply auto_now
+        notification.updated_at = timezone.now()
+        if notification.status == 'SENT':
+            events.append(IncidentTimelineEvent(
+                incident=notification.incident,
+                timestamp=notification.sent_at,
+                event_type='notification_sent',
+                description=f"Notification sent to {notification.operator.name} (Level {level})",
+                operator=notification.operator
+            ))
+    with transaction.atomic():
+        Notification.objects.bulk_update([notification for notification, _ in deliveries], DELIVERY_FIELDS)
+        IncidentTimelineEvent.objects.bulk_create(events)
+        bump_resource_version(INCIDENTS)
@@ -0,0 +1,247 @@
+import logging
+import threading
+from datetime import timedelta
+
+import numpy as np
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+
+from ..models import Alert, Reading
+
+logger = logging.getLogger(__name__)
+
+# A low battery warning clears once the level is this far back above LOW_BATTERY_LEVEL
+LOW_BATTERY_HYSTERESIS = 5.0
+# Fewest battery readings, and shortest span, a drain rate is fitted to
+MIN_FORECAST_READINGS = 3
+MIN_FORECAST_SPAN = timedelta(minutes=10)
+
+
+class PowerStateTracker:
+    """
+    Last known power state of every device seen by this process: the
+    timestamp of its newest reading, whether it runs on battery and whether
+    its battery is low. Readings are compared with that state so alerts are
+    raised only on transitions, without looking up the previous reading.
+
+    The state of a device is reloaded from its newest stored reading when the
+    process has not seen it before, or has not seen it for longer than two
+    reading intervals (its readings may have gone to another worker meanwhile).
+    """
+
+    def __init__(self):
+        self.states = {}
+        self.lock = threading.Lock()
+
+    def observe(self, readings, devices, writer=None):
+        """
+        Evaluate newly stored readings (sorted by timestamp); returns the alerts
+        raised. Operators are notified through writer, the IncidentEventWriter
+        of the evaluation step, or not at all without one.
+        """
+        first = {}
+        for reading in readings:
+            first.setdefault(reading.device_id, reading)
+        for device_id, reading in first.items():
+            state = self.states.get(device_id)
+            gap = timedelta(seconds=2 * devices[device_id].reading_interval)
+            if state is None or reading.timestamp - state[0] > gap:
+                self._load(device_id, reading)
+
+        alerts = []
+        for reading in readings:
+            alerts += self._transition(reading, devices[reading.device_id])
+
+        if writer is not None:
+            for alert in alerts:
+                writer.notify_alert(alert)
+        return alerts
+
+    def _load(self, device_id, reading):
+        previous = Reading.objects.filter(
+            device_id=device_id, timestamp__lt=reading.timestamp
+        ).order_by('-timestamp').values_list('timestamp', 'power_status', 'battery_level').first()
+        with self.lock:
+            if previous:
+                on_battery = previous[1] == 'BATTERY'
+                self.states[device_id] = (previous[0], on_battery, self._is_low(on_battery, previous[2], False))
+            else:
+                # First reading of the device: treat it as coming from a healthy state
+                self.states.pop(device_id, None)
+
+    def _is_low(self, on_battery, level, was_low):
+        if not on_battery:
+            return False
+        threshold = settings.LOW_BATTERY_LEVEL
+        return level < threshold + LOW_BATTERY_HYSTERESIS if was_low else level < threshold
+
+    def _transition(self, reading, device):
+        state = self.states.get(reading.device_id)
+        if state and reading.timestamp <= state[0]:
+            # Late reading: the current state is already newer
+            return []
+        was_on_battery, was_low = (state[1], state[2]) if state else (False, False)
+        on_battery = reading.power_status == 'BATTERY'
+        low = self._is_low(on_battery, reading.battery_level, was_low)
+        with self.lock:
+            self.states[reading.device_id] = (reading.timestamp, on_battery, low)
+
+        alerts = []
+        if on_battery and not was_on_battery:
+            alerts.append(self._raise(
+                device, reading, 'power_failure', 'critical',
+                f"Power failure: running on battery ({reading.battery_level:.0f}%)"
+            ))
+        elif was_on_battery and not on_battery:
+            self._resolve(device, reading, 'power_failure', 'Mains power restored')
+
+        if low and not was_low:
+            alerts.append(self._raise(
+                device, reading, 'low_battery', 'warning',
+                f"Low battery: {reading.battery_level:.0f}%"
+            ))
+        elif was_low and not low:
+            self._resolve(
+                device, reading, 'low_battery',
+                'Mains power restored' if not on_battery else f"Battery back at {reading.battery_level:.0f}%"
+            )
+        return [alert for alert in alerts if alert]
+
+    def _raise(self, device, reading, alert_type, severity, message):
+        # Another worker may already have raised it for the same transition
+        if Alert.objects.filter(device=device, alert_type=alert_type, resolved=False).exists():
+            return None
+        return Alert.objects.create(
+            device=device,
+            reading=reading,
+            alert_type=alert_type,
+            severity=severity,
+            message=message,
+            timestamp=reading.timestamp
+        )
+
+    def _resolve(self, device, reading, alert_type, notes):
+        Alert.objects.filter(device=device, alert_type=alert_type, resolved=False).update(
+            resolved=True, resolved_at=reading.timestamp, resolution_notes=notes
+        )
+
+
+power_states = PowerStateTracker()
+
+
+def battery_forecasts(device_ids, now=None):
+    """
+    Power status, battery level and predicted time to empty for each device.
+
+    The drain rate is the least-squares slope of battery level over time,
+    fitted to a device's trailing run of battery readings: those since its
+    last mains reading, within BATTERY_FORECAST_WINDOW hours. Only the
+    regression sums per device are needed, which PostgreSQL computes while
+    walking back the (device_id, timestamp) index from the newest reading, so
+    a device costs a scan of its current battery run rather than of the whole
+    window. Devices without readings in the window are left out.
+    """
+    now = now or timezone.now()
+    since = now - timedelta(hours=settings.BATTERY_FORECAST_WINDOW)
+    device_ids = list(device_ids)
+    if not device_ids:
+        return {}
+    fetch = _battery_sums_postgresql if connection.vendor == 'postgresql' else _battery_sums_portable
+
+    forecasts = {}
+    for device_id, newest, status, level, n, sum_t, sum_y, sum_tt, sum_ty, span in fetch(device_ids, since, now):
+        forecast = {
+            'power_status': status,
+            'battery_level': level,
+            'drain_per_hour': None,
+            'hours_remaining': None,
+            'empty_at': None,
+        }
+        # Times are hours before the newest reading, which keeps the sums well conditioned
+        denominator = n * sum_tt - sum_t ** 2
+        if n >= MIN_FORECAST_READINGS and span >= MIN_FORECAST_SPAN.total_seconds() / 3600 and denominator > 0:
+            slope = (n * sum_ty - sum_t * sum_y) / denominator
+            if slope < 0:
+                remaining = level / -slope
+                forecast['drain_per_hour'] = round(-slope, 3)
+                forecast['hours_remaining'] = round(remaining, 2)
+                forecast['empty_at'] = newest + timedelta(hours=remaining)
+        forecasts[device_id] = forecast
+    return forecasts
+
+
+def _battery_sums_postgresql(device_ids, since, now):
+    """(device_id, newest timestamp, power status, battery level, n, Σt, Σy, Σt², Σty, span) per device"""
+    table = Reading._meta.db_table
+    sql = f'''
+        SELECT d.device_id, latest.timestamp, latest.power_status, latest.battery_level,
+               run.n, run.sum_t, run.sum_y, run.sum_tt, run.sum_ty, run.span
+        FROM unnest(%(device_ids)s::varchar[]) AS d(device_id)
+        JOIN LATERAL (
+            SELECT timestamp, power_status, battery_level FROM {table}
+            WHERE device_id = d.device_id AND timestamp BETWEEN %(since)s AND %(now)s
+            ORDER BY timestamp DESC LIMIT 1
+        ) latest ON true
+        LEFT JOIN LATERAL (
+            SELECT COUNT(*) AS n, SUM(t) AS sum_t, SUM(y) AS sum_y, SUM(t * t) AS sum_tt,
+                   SUM(t * y) AS sum_ty, -MIN(t) AS span
+            FROM (
+                SELECT EXTRACT(EPOCH FROM r.timestamp - latest.timestamp)::float8 / 3600 AS t, r.battery_level AS y
+                FROM {table} r
+                WHERE r.device_id = d.device_id AND r.timestamp BETWEEN %(since)s AND latest.timestamp
+                  -- Stops at the device's last mains reading, the first non-battery row walking back
+                  AND r.timestamp > COALESCE((
+                      SELECT timestamp FROM {table}
+                      WHERE device_id = d.device_id AND timestamp BETWEEN %(since)s AND latest.timestamp
+                        AND power_status <> 'BATTERY'
+                      ORDER BY timestamp DESC LIMIT 1
+                  ), '-infinity')
+            ) battery_run
+        ) run ON true
+    '''
+    with connection.cursor() as cursor:
+        cursor.execute(sql, {'device_ids': device_ids, 'since': since, 'now': now})
+        return [
+            (device_id, newest, status, level, n, *(float(value or 0) for value in sums))
+            for device_id, newest, status, level, n, *sums in cursor.fetchall()
+        ]
+
+
+def _battery_sums_portable(device_ids, since, now):
+    """Same sums from the window's readings, for backends without LATERAL"""
+    rows = list(Reading.objects.filter(
+        device_id__in=device_ids, timestamp__gte=since, timestamp__lte=now
+    ).order_by('device_id', 'timestamp').values_list('device_id', 'timestamp', 'power_status', 'battery_level'))
+    if not rows:
+        return []
+
+    ids, timestamps, statuses, levels = zip(*rows)
+    hours = np.array([timestamp.timestamp() for timestamp in timestamps]) / 3600
+    levels = np.array(levels, dtype=np.float64)
+    on_battery = np.array([status == 'BATTERY' for status in statuses])
+    index = np.arange(len(rows))
+
+    starts = np.flatnonzero(np.r_[True, np.array(ids[1:]) != np.array(ids[:-1])])
+    ends = np.r_[starts[1:], len(rows)] - 1
+    group = np.repeat(np.arange(len(starts)), np.diff(np.r_[starts, len(rows)]))
+
+    # Keep each device's trailing run of battery readings: rows after its last AC reading
+    last_ac = np.maximum.accumulate(np.where(on_battery, -1, index))
+    run = index > last_ac[ends][group]
+
+    t = hours - hours[ends][group]
+    weights = run.astype(np.float64)
+    sums = [
+        np.bincount(group, weights, len(starts)),
+        np.bincount(group, weights * t, len(starts)),
+        np.bincount(group, weights * levels, len(starts)),
+        np.bincount(group, weights * t * t, len(starts)),
+        np.bincount(group, weights * t * levels, len(starts)),
+        -np.minimum.reduceat(np.where(run, t, 0.0), starts),
+    ]
+    return [
+        (ids[end], timestamps[end], statuses[end], float(levels[end]), int(sums[0][position]),
+         *(float(values[position]) for values in sums[1:]))
+        for position, end in enumerate(ends)
+    ]
@@ -0,0 +1,577 @@
+import logging
+from contextlib import contextmanager
+import numpy as np
+from django.db import connection, transaction
+from django.utils import timezone
+from ..bulk_load import copy_binary, unix_us_to_pg
+from .stats_cache import note_readings_stored
+from .compliance import invalidate_rollups
+from .availability import invalidate_gaps
+from .power import power_states
+from .anomaly import anomaly_detector, FAULTS, FLATLINE
+from .trend import trend_predictor
+from .escalation import cancel_escalation, escalation_description, schedule_escalation
+from .incident_events import IncidentEventWriter
+from .backlog import ingest_backlog
+from ..models import Alert, Incident, Device, Reading
+from notifications.models import Operator
+from settings.models import SystemSettings
+
+logger = logging.getLogger(__name__)
+
+INSERT_COLUMNS = ('device_id', 'temperature', 'humidity', 'power_status', 'battery_level', 'timestamp')
+STAGING_TABLE = 'reading_ingest_staging'
+# Alert fields that change while an excursion continues
+EXCURSION_FIELDS = ('severity', 'last_timestamp', 'peak_temperature', 'sample_count')
+
+class ReadingService:
+    """
+    Threshold evaluation for stored readings, shared by the ingest views and the
+    import/replay management commands.
+    """
+
+    ACTIVE_INCIDENT_STATUSES = ['open', 'acknowledged', 'investigating']
+    # Alerts that cover a whole excursion (see _extend_excursion)
+    EXCURSION_ALERT_TYPES = ('high_temperature', 'low_temperature')
+
+    def __init__(self, notify=True):
+        # Replays rebuild history and must not page operators about old excursions
+        self.notify = notify
+        # Collects the writes of the evaluation step in progress (see _evaluation)
+        self.event_writer = None
+
+    def thresholds(self):
+        """
+        (normal_min, normal_max, critical_min, critical_max) from SystemSettings,
+        read through the same cached accessor as the trend predictor and the
+        threshold simulator
+        """
+        settings = SystemSettings.get_settings()
+        return (
+            settings.normal_temp_min, settings.normal_temp_max,
+            settings.critical_temp_min, settings.critical_temp_max
+        )
+
+    def ingest(self, records):
+        """
+        Store validated reading tuples (see monitoring.ingest.validate_reading) with
+        one bulk insert, refresh each device's heartbeat once and evaluate the
+        new readings in timestamp order.
+
+        Returns a list aligned with records holding the created Reading, or None
+        where a reading for the same (device_id, timestamp) was already stored.
+        Such duplicates (device retries, overlapping batches) are not evaluated
+        again.
+        """
+        if not records:
+            return []
+
+        # Counted in the backlog every worker sheds load on
+        ingest_backlog.add(len(records))
+        try:
+            return self._ingest(records)
+        finally:
+            ingest_backlog.add(-len(records))
+
+    def _ingest(self, records):
+        now = timezone.now()
+        devices = self._get_devices({record[0] for record in records})
+        records = [record[:5] + (record[5] or now,) for record in records]
+
+        with transaction.atomic():
+            ids = self._insert(records)
+            # Only stored readings feed the detector: duplicates and failed writes must not move its baseline
+            stored = [index for index, reading_id in enumerate(ids) if reading_id]
+            stored_tags, stored_flatlines, staged = anomaly_detector.stage([records[index] for index in stored])
+            tags = [''] * len(records)
+            suspect = {}
+            for index, tag in zip(stored, stored_tags):
+                tags[index] = tag
+                if tag:
+                    suspect.setdefault(tag, []).append(ids[index])
+            for tag, reading_ids in suspect.items():
+                Reading.objects.filter(id__in=reading_ids).update(suspect=tag)
+            flatlines = [(stored[index], started) for index, started in stored_flatlines]
+            Device.objects.filter(device_id__in=devices).update(status='online', last_reading=now)
+        anomaly_detector.commit(staged)
+
+        readings = [
+            Reading(
+                id=reading_id,
+                device_id=device_id,
+                temperature=temperature,
+                humidity=humidity,
+                power_status=power_status,
+                battery_level=battery_level,
+                timestamp=timestamp,
+                suspect=tag
+            ) if reading_id else None
+            for reading_id, tag, (device_id, temperature, humidity, power_status, battery_level, timestamp)
+            in zip(ids, tags, records)
+        ]
+        created = [reading for reading in readings if reading]
+        if created:
+            earliest, latest = min(r.timestamp for r in created), max(r.timestamp for r in created)
+            note_readings_stored(earliest, latest)
+            device_ids = {r.device_id for r in created}
+            invalidate_rollups(device_ids, earliest, latest)
+            invalidate_gaps(device_ids, earliest, latest)
+
+        # Power and battery alerts are raised on state changes, checked for every new reading
+        created.sort(key=lambda r: r.timestamp)
+        if created:
+            with self._evaluation():
+                power_states.observe(created, devices, self.event_writer if self.notify else None)
+
+        # Flatlines are reported when they start and resolved when they end, not on every reading
+        flatline_starts = set()
+        for index, started in flatlines:
+            reading = readings[index]
+            if reading and started:
+                flatline_starts.add(reading.id)
+            elif reading:
+                self.resolve_flatline(reading, devices[reading.device_id])
+
+        # Normal readings only matter for devices with an incident to resolve
+        normal_min, normal_max = self.thresholds()[:2]
+        with_incident = set(self._temperature_incidents(predicted=False).filter(
+            device__in=devices.values()
+        ).values_list('device__device_id', flat=True)) if created else set()
+
+        for reading in created:
+            if reading.suspect in FAULTS:
+                # Not a believable temperature: report the sensor, not the fridge
+                if reading.suspect != FLATLINE or reading.id in flatline_starts:
+                    self.raise_sensor_fault(reading, devices[reading.device_id])
+                continue
+            normal = normal_min <= reading.temperature <= normal_max
+            if normal and reading.device_id not in with_incident:
+                continue
+            self.check_temperature(reading, device=devices[reading.device_id], heartbeat=False)
+            if normal:
+                with_incident.discard(reading.device_id)
+            else:
+                with_incident.add(reading.device_id)
+
+        if created:
+            warn, clear = trend_predictor.observe(
+                [reading for reading in created if reading.suspect not in FAULTS], normal_min, normal_max
+            )
+            for device_id, (bound, seconds, reading) in warn.items():
+                self.raise_trend_alert(reading, devices[device_id], bound, seconds)
+            for device_id, reading in clear:
+                self.withdraw_trend_alert(reading, devices[device_id])
+
+        return readings
+
+    def _insert(self, records):
+        """
+        Insert reading tuples, not yet tagged by the anomaly detector, skipping (device_id,
+        timestamp) pairs already stored. Returns ids aligned with records, None for skipped duplicates.
+        """
+        if connection.vendor == 'postgresql':
+            device_ids, temperatures, humidities, power_statuses, battery_levels, timestamps = zip(*records)
+            with connection.cursor() as cursor:
+                # COPY into a per-connection staging table, then let the unique index decide what is new
+                cursor.execute(
+                    f'CREATE TEMP TABLE IF NOT EXISTS {STAGING_TABLE} ('
+                    'device_id varchar(100), temperature double precision, humidity double precision, '
+                    'power_status varchar(20), battery_level double precision, timestamp timestamptz'
+                    ') ON COMMIT DELETE ROWS'
+                )
+                copy_binary(cursor, STAGING_TABLE, INSERT_COLUMNS, [
+                    np.array([device_id.encode() for device_id in device_ids]),
+                    np.array(temperatures, dtype=np.float64),
+                    np.array(humidities, dtype=np.float64),
+                    np.array([status.encode() for status in power_statuses]),
+                    np.array(battery_levels, dtype=np.float64),
+                    unix_us_to_pg([int(timestamp.timestamp() * 1_000_000) for timestamp in timestamps]),
+                ])
+                cursor.execute(
+                    f'INSERT INTO {Reading._meta.db_table} ({", ".join(INSERT_COLUMNS)}, suspect) '
+                    f"SELECT {', '.join(INSERT_COLUMNS)}, '' FROM {STAGING_TABLE} "
+                    'ON CONFLICT (device_id, timestamp) DO NOTHING '
+                    'RETURNING id, device_id, timestamp'
+                )
+                inserted = {(device_id, timestamp): reading_id for reading_id, device_id, timestamp in cursor.fetchall()}
+            # pop() so a pair repeated inside the batch is only reported as new once
+            return [inserted.pop((record[0], record[5]), None) for record in records]
+
+        # Other backends: look up which pairs exist, then insert the rest
+        existing = set(Reading.objects.filter(
+            device_id__in={record[0] for record in records},
+            timestamp__gte=min(record[5] for record in records),
+            timestamp__lte=max(record[5] for record in records)
+        ).values_list('device_id', 'timestamp'))
+        new = []
+        for record in records:
+            key = (record[0], record[5])
+            if key not in existing:
+                existing.add(key)
+                new.append(record)
+
+        created = Reading.objects.bulk_create([
+            Reading(
+                device_id=device_id,
+                temperature=temperature,
+                humidity=humidity,
+                power_status=power_status,
+                battery_level=battery_level,
+                timestamp=timestamp
+            )
+            for device_id, temperature, humidity, power_status, battery_level, timestamp in new
+        ])
+        ids = {(reading.device_id, reading.timestamp): reading.id for reading in created}
+        return [ids.pop((record[0], record[5]), None) for record in records]
+
+    def _get_devices(self, device_ids):
+        """Devices by device_id, registering unknown ones the way the ESP endpoint does"""
+        devices = Device.objects.in_bulk(device_ids, field_name='device_id')
+        missing = device_ids - devices.keys()
+        if missing:
+            Device.objects.bulk_create([
+                Device(device_id=device_id, name=f'ESP8266 Sensor {device_id}', location='Default Location')
+                for device_id in missing
+            ], ignore_conflicts=True)
+            devices.update(Device.objects.in_bulk(missing, field_name='device_id'))
+        return devices
+
+    def check_temperature(self, reading, device=None, replay=False, heartbeat=True):
+        """
+        Check temperature against the SystemSettings thresholds (see thresholds)
+        and create alerts if needed:
+        - Normal: normal_temp_min to normal_temp_max (2°C to 8°C by default)
+        - Critical: outside the normal range but within critical_temp_min to
+          critical_temp_max (0°C to 10°C by default)
+        - Severe: Outside these ranges
+
+        The first reading outside the normal range creates an alert; the
+        readings after it that stay outside extend that alert (one per excursion).
+        """
+        try:
+            temperature = reading.temperature
+            NORMAL_MIN, NORMAL_MAX, CRITICAL_MIN, CRITICAL_MAX = self.thresholds()
+
+            if device is None:
+                # Get or create device
+                device, created = Device.objects.get_or_create(
+                    device_id=reading.device_id,
+                    defaults={
+                        'name': f'Device {reading.device_id}',
+                        'location': 'Unknown',
+                        'status': 'online'
+                    }
+                )
+
+            if heartbeat and not replay:
+                # Update device status and last reading
+                device.status = 'online'
+                device.last_reading = timezone.now()
+                device.save()
+
+            # Determine alert type and severity
+            if NORMAL_MIN <= temperature <= NORMAL_MAX:
+                # Temperature is normal, resolve any active incidents
+                with self._evaluation():
+                    active_incidents = self._incidents_to_resolve(device)
+
+                    for incident in active_incidents:
+                        incident.status = 'resolved'
+                        incident.end_time = reading.timestamp if replay else timezone.now()
+                        self._cancel_escalation(incident)
+                        self._save_incident(incident)
+
+                        self._add_event(
+                            incident,
+                            event_type='status_changed',
+                            description=f"Temperature returned to normal range: {temperature}°C",
+                            temperature=temperature
+                        )
+
+                return  # No need to create alert for normal temperature
+
+            # Temperature is outside normal range
+            severity = 'critical' if CRITICAL_MIN <= temperature <= CRITICAL_MAX else 'severe'
+            alert_type = 'high_temperature' if temperature > NORMAL_MAX else 'low_temperature'
+
+            with self._evaluation():
+                active_incident = self._active_incident(device)
+
+                if active_incident and active_incident.alert.alert_type in self.EXCURSION_ALERT_TYPES:
+                    # The excursion continues: its alert is updated instead of adding one per reading.
+                    # Escalation is time-based (EscalationScheduler)
+                    self._extend_excursion(active_incident.alert, reading, severity)
+                    return
+
+                alert = self._create_alert(
+                    device=device,
+                    reading=reading,
+                    alert_type=alert_type,
+                    severity=severity,
+                    message=f"Temperature {alert_type.replace('_', ' ')}: {temperature}°C",
+                    timestamp=reading.timestamp,
+                    last_timestamp=reading.timestamp,
+                    peak_temperature=temperature
+                )
+
+                if active_incident and active_incident.alert.alert_type == 'temperature_trend':
+                    # The predicted excursion has begun: it becomes the incident's alert
+                    active_incident.alert = alert
+                    active_incident.alert_count += 1
+                    active_incident.description = f"Temperature {alert_type.replace('_', ' ')} incident"
+                    self._save_incident(active_incident)
+                    self.notify_operators(active_incident, level=1)
+                    # Escalation runs from the start of the excursion, not of the prediction
+                    self._schedule_escalation(active_incident, reading.timestamp if replay else timezone.now())
+                    self._add_event(
+                        active_incident,
+                        event_type='alert_created',
+                        description=f"Predicted excursion began: Temperature {alert_type.replace('_', ' ')} ({temperature}°C)",
+                        temperature=temperature
+                    )
+                elif active_incident:
+                    # An incident raised about something else
+                    active_incident.alert_count += 1
+                    self._save_incident(active_incident)
+                else:
+                    # Create new incident
+                    incident = self._create_incident(
+                        device=device,
+                        alert=alert,
+                        description=f"Temperature {alert_type.replace('_', ' ')} incident",
+                        status='open',
+                        start_time=reading.timestamp,
+                        current_escalation_level=1
+                    )
+
+                    # Notify primary operators, then secondary and tertiary ones if nobody acknowledges
+                    self.notify_operators(incident, level=1)
+                    self._schedule_escalation(incident, reading.timestamp if replay else timezone.now())
+
+                    # Create initial timeline event
+                    self._add_event(
+                        incident,
+                        event_type='alert_created',
+                        description=f"Initial alert: Temperature {alert_type.replace('_', ' ')} ({temperature}°C)",
+                        temperature=temperature
+                    )
+
+        except Exception as e:
+            logger.error(f"Error processing ESP8266 data: {str(e)}")
+            raise
+
+    def _extend_excursion(self, alert, reading, severity):
+        """Add an out-of-range reading to the excursion alert it continues"""
+        alert.sample_count += 1
+        alert.last_timestamp = reading.timestamp
+        if alert.peak_temperature is None or self._excess(reading.temperature) > self._excess(alert.peak_temperature):
+            alert.peak_temperature = reading.temperature
+        if severity == 'severe':
+            alert.severity = severity
+        self._save_alert(alert)
+
+    def _excess(self, temperature):
+        """How far a temperature is outside the normal range"""
+        normal_min, normal_max = self.thresholds()[:2]
+        return max(normal_min - temperature, temperature - normal_max)
+
+    # Storage used by check_temperature; ReplayService keeps it in memory and writes in bulk
+
+    @contextmanager
+    def _evaluation(self):
+        """
+        One evaluation step, in a transaction: the incident saves, timeline
+        events and notifications made inside it are collected by an
+        IncidentEventWriter and written together on the way out. Nested
+        steps join the one in progress.
+        """
+        if self.event_writer is not None:
+            yield
+            return
+        self.event_writer = IncidentEventWriter()
+        try:
+            with transaction.atomic():
+                yield
+                self.event_writer.write()
+        finally:
+            self.event_writer = None
+
+    def _incidents_to_resolve(self, device):
+        return self._temperature_incidents(predicted=False).filter(device=device)
+
+    def _active_incident(self, device):
+        return self._temperature_incidents().select_related('alert').filter(device=device).first()
+
+    def _create_alert(self, **fields):
+        return Alert.objects.create(**fields)
+
+    def _create_incident(self, **fields):
+        return Incident.objects.create(**fields)
+
+    def _save_incident(self, incident):
+        self.event_writer.save_incident(incident)
+
+    def _save_alert(self, alert):
+        alert.save(update_fields=EXCURSION_FIELDS)
+
+    def _add_event(self, incident, **fields):
+        return self.event_writer.add_event(incident, **fields)
+
+    def _schedule_escalation(self, incident, started_at):
+        schedule_escalation(incident, started_at)
+
+    def _cancel_escalation(self, incident):
+        cancel_escalation(incident)
+
+    def _temperature_incidents(self, predicted=True):
+        """
+        Active incidents about temperature, as opposed to faulty sensors. With
+        predicted=False, incidents that are still only a predicted excursion
+        are left out too: normal readings do not resolve those.
+        """
+        excluded = ['sensor_fault'] if predicted else ['sensor_fault', 'temperature_trend']
+        return Incident.objects.filter(
+            status__in=self.ACTIVE_INCIDENT_STATUSES
+        ).exclude(alert__alert_type__in=excluded)
+
+    def raise_trend_alert(self, reading, device, bound, seconds):
+        """Open a low-severity incident for a device expected to leave the normal range soon"""
+        direction = 'above' if bound > reading.temperature else 'below'
+        minutes = max(1, round(seconds / 60))
+        message = f"Temperature {reading.temperature}°C trending {direction} {bound}°C within {minutes} min"
+        with self._evaluation():
+            if self._temperature_incidents().filter(device=device).exists():
+                # Already an incident (or a prediction from another worker)
+                return
+            alert = self._create_alert(
+                device=device,
+                reading=reading,
+                alert_type='temperature_trend',
+                severity='warning',
+                message=message,
+                timestamp=reading.timestamp
+            )
+            incident = self._create_incident(
+                device=device,
+                alert=alert,
+                description=f"Predicted temperature excursion on {device.name}",
+                status='open',
+                start_time=reading.timestamp,
+                current_escalation_level=1
+            )
+            self._add_event(
+                incident,
+                event_type='alert_created',
+                description=f"Pre-alert: {message}",
+                temperature=reading.temperature
+            )
+            self.notify_operators(incident, level=1, message=f"Pre-alert for {device.name}: {message}")
+
+    def withdraw_trend_alert(self, reading, device):
+        """Resolve a predicted excursion whose trend has levelled off or reversed"""
+        with self._evaluation():
+            for incident in self._temperature_incidents().filter(device=device, alert__alert_type='temperature_trend'):
+                incident.status = 'resolved'
+                incident.end_time = reading.timestamp
+                self._save_incident(incident)
+                self._add_event(
+                    incident,
+                    event_type='status_changed',
+                    description=f"Trend no longer heading out of range: {reading.temperature}°C",
+                    temperature=reading.temperature
+                )
+
+    def _sensor_fault_incident(self, device):
+        return Incident.objects.select_related('alert__reading').filter(
+            device=device,
+            status__in=self.ACTIVE_INCIDENT_STATUSES,
+            alert__alert_type='sensor_fault'
+        ).first()
+
+    def raise_sensor_fault(self, reading, device):
+        """
+        Report a spike, or the start of a flatline. The first one opens a
+        sensor-fault incident; later ones while it is active are added to it.
+        """
+        description = f"Sensor fault: {reading.get_suspect_display().lower()} ({reading.temperature}°C)"
+        with self._evaluation():
+            incident = self._sensor_fault_incident(device)
+            if incident:
+                incident.alert_count += 1
+                self._save_incident(incident)
+                self._add_event(
+                    incident,
+                    event_type='alert_created',
+                    description=description,
+                    temperature=reading.temperature
+                )
+                return
+
+            alert = self._create_alert(
+                device=device,
+                reading=reading,
+                alert_type='sensor_fault',
+                severity='warning',
+                message=description,
+                timestamp=reading.timestamp
+            )
+            incident = self._create_incident(
+                device=device,
+                alert=alert,
+                description=f"Sensor fault on {device.name}",
+                status='open',
+                start_time=reading.timestamp,
+                current_escalation_level=1
+            )
+            self._add_event(
+                incident,
+                event_type='alert_created',
+                description=description,
+                temperature=reading.temperature
+            )
+            self.notify_operators(incident, level=1, message=f"Sensor fault on {device.name}: check the probe")
+
+    def resolve_flatline(self, reading, device):
+        """Close a sensor-fault incident opened by a flatline once the values change again"""
+        with self._evaluation():
+            incident = self._sensor_fault_incident(device)
+            if not incident or incident.alert.reading.suspect != FLATLINE:
+                return
+            incident.status = 'resolved'
+            incident.end_time = reading.timestamp
+            self._save_incident(incident)
+            self._add_event(
+                incident,
+                event_type='status_changed',
+                description=f"Sensor reporting changing values again: {reading.temperature}°C",
+                temperature=reading.temperature
+            )
+
+    def escalate(self, incident, level):
+        """Raise an open incident to `level` and page that level's operators (see EscalationScheduler)"""
+        with self._evaluation():
+            incident.current_escalation_level = level
+            self._save_incident(incident)
+            self._add_event(
+                incident,
+                event_type='escalation_changed',
+                description=escalation_description(level),
+                metadata={'new_level': level}
+            )
+            self.notify_operators(incident, level=level)
+
+    def notify_operators(self, incident, level, message=None):
+        """Notify operators based on escalation level, once the evaluation step commits"""
+        if not self.notify:
+            return
+
+        operators = Operator.objects.filter(priority=level, is_active=True)
+
+        with self._evaluation():
+            for operator in operators:
+                self.event_writer.notify(
+                    incident,
+                    operator,
+                    message or f"Temperature alert - Level {level} escalation",
+                    level
+                )
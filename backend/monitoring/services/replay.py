@@ -0,0 +1,405 @@
+import json
+from contextlib import nullcontext
+
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from notifications.models import Notification
+from ..bulk_load import copy_rows, supports_copy
+from ..conditional import bump_resource_version, INCIDENTS
+from ..models import Alert, EscalationDeadline, Incident, IncidentComment, IncidentTimelineEvent, Reading
+from .anomaly import FAULTS
+from .escalation import (
+    MAX_LEVEL, cancel_escalation, escalation_delays, escalation_description, level_reached, schedule_escalation
+)
+from .incident_events import INCIDENT_FIELDS
+from .reading_service import EXCURSION_FIELDS, ReadingService
+
+# Alerts and incidents check_temperature owns, and so a replay rebuilds
+TEMPERATURE_ALERT_TYPES = ('high_temperature', 'low_temperature')
+# Buffered alerts and timeline events written per bulk insert
+FLUSH_SIZE = 5000
+# Readings fetched per round trip while streaming a device's history
+STREAM_CHUNK = 5000
+REPLAYED_TABLES = (Alert, Incident, IncidentTimelineEvent)
+# Columns written by COPY on PostgreSQL
+ALERT_COLUMNS = ('id', 'device_id', 'reading_id', 'alert_type', 'severity', 'message', 'timestamp',
+                 'last_timestamp', 'peak_temperature', 'sample_count', 'resolved', 'resolution_notes')
+INCIDENT_COLUMNS = ('id', 'device_id', 'alert_id', 'description', 'start_time', 'end_time',
+                    'status', 'alert_count', 'current_escalation_level')
+EVENT_COLUMNS = ('id', 'incident_id', 'timestamp', 'event_type', 'description', 'temperature', 'metadata')
+
+
+class ReplayService(ReadingService):
+    """
+    Runs stored readings through ReadingService.check_temperature, so history
+    is evaluated by exactly the rules live ingest uses, without notifying
+    anyone. Only the storage differs: the device's active incident is kept in
+    memory instead of being queried for every reading, and alerts, incidents
+    and timeline events are buffered and written every FLUSH_SIZE objects:
+    with COPY on PostgreSQL, numbered from the tables' id sequences up front,
+    and with bulk_create elsewhere. Incidents and excursion alerts stored by
+    an earlier flush are brought up to date with bulk updates.
+
+    Timeline events carry the time of the reading that caused them. Nobody
+    acknowledges a replayed incident, so it escalates at the times
+    EscalationScheduler would have escalated it, up to its resolution or, for
+    an incident still open, the present; an open incident below the top level
+    is left a deadline for the scheduler. Sensor fault readings are skipped as
+    on ingest; trend pre-alerts depend on live state and are not replayed.
+
+    The thresholds are those of ingest (ReadingService.thresholds), read once
+    when the service is created so a whole run is judged by the same ones.
+    """
+
+    def __init__(self, flush_size=FLUSH_SIZE, real_schema=None):
+        super().__init__(notify=False)
+        self.replay_thresholds = super().thresholds()
+        self.flush_size = flush_size
+        # Writing to a shadow schema: new rows still take ids from the real tables' sequences
+        self.real_schema = real_schema
+        self.sequences = {}
+        self.active = None
+        self.reading_time = None
+        self.alerts, self.incidents, self.events = [], [], []
+        self.changed = {}
+        # Excursion alerts written by an earlier flush that have been extended since
+        self.changed_alerts = {}
+        # (incident, when its escalation clock started) for the active incident, if it escalates
+        self.escalation = None
+        # Stored incidents whose deadlines are removed by the next flush
+        self.cancelled = []
+        self.counts = {'readings': 0, 'alerts': 0, 'incidents': 0}
+
+    def replay(self, device, readings, active=None):
+        """
+        Evaluate a device's readings (a Reading queryset) in timestamp order,
+        continuing the incident active before the first of them, if any (see
+        stored_incident). Returns the number of readings evaluated.
+        """
+        self.active = active
+        self.escalation = None
+        if active is not None and active.pk:
+            # Reopened by stored_incident
+            self.changed[active.pk] = active
+            if active.alert.alert_type in TEMPERATURE_ALERT_TYPES:
+                self.changed_alerts[active.alert.pk] = active.alert
+            if active.status == 'open' and active.alert.alert_type in TEMPERATURE_ALERT_TYPES:
+                deadline = EscalationDeadline.objects.filter(incident=active).first()
+                self.escalation = (active, deadline.started_at if deadline else active.start_time)
+        # Tuples, not instances: most readings are normal and need no Reading built
+        readings = readings.exclude(suspect__in=FAULTS).order_by('timestamp').values_list(
+            'id', 'temperature', 'timestamp'
+        )
+
+        normal_min, normal_max = self.thresholds()[:2]
+        evaluated = 0
+        for reading_id, temperature, timestamp in readings.iterator(chunk_size=STREAM_CHUNK):
+            evaluated += 1
+            if self.active is None and normal_min <= temperature <= normal_max:
+                # Nothing to resolve
+                continue
+            reading = Reading(id=reading_id, device_id=device.device_id, temperature=temperature, timestamp=timestamp)
+            self.check_temperature(reading, device=device, replay=True)
+            if len(self.alerts) + len(self.events) >= self.flush_size:
+                self.flush()
+
+        pending = self.escalation
+        if pending:
+            # Still open: escalated as far as it would have been by now
+            self._escalate(*pending, timezone.now())
+            self.escalation = None
+        self.flush()
+        if pending and self.real_schema is None:
+            incident, started_at = pending
+            if incident.current_escalation_level < MAX_LEVEL:
+                schedule_escalation(incident, started_at, incident.current_escalation_level + 1)
+            else:
+                cancel_escalation(incident)
+        self.active = None
+        self.counts['readings'] += evaluated
+        return evaluated
+
+    def stored_incident(self, device, at=None):
+        """
+        The stored temperature incident a replay of the device continues. With
+        at=None that is its active incident, as check_temperature would find
+        it. Otherwise history from `at` on is being rebuilt (see clear_history):
+        the incident that was active at that time is returned reopened, with
+        the alert count and escalation level it had then and its excursion
+        alert cut back to the readings before `at`.
+        """
+        if at is None:
+            return self._temperature_incidents().select_related('alert').filter(device=device).first()
+
+        incident = Incident.objects.select_related('alert').filter(
+            device=device,
+            alert__alert_type__in=TEMPERATURE_ALERT_TYPES,
+            start_time__lt=at
+        ).filter(
+            Q(end_time__gte=at) | Q(end_time__isnull=True, status__in=self.ACTIVE_INCIDENT_STATUSES)
+        ).order_by('-start_time').first()
+        if incident is None:
+            return None
+        if incident.status not in self.ACTIVE_INCIDENT_STATUSES:
+            incident.status = 'open'
+        if incident.status == 'open':
+            # Escalations from `at` on are replayed
+            incident.current_escalation_level = level_reached(incident.start_time, at)
+        incident.end_time = None
+        incident.alert_count = Alert.objects.filter(
+            device=device,
+            alert_type__in=TEMPERATURE_ALERT_TYPES + ('temperature_trend',),
+            timestamp__gte=incident.start_time,
+            timestamp__lt=at
+        ).count()
+        if incident.alert.alert_type in TEMPERATURE_ALERT_TYPES:
+            self._truncate_excursion(device, incident.alert, at)
+        return incident
+
+    def _truncate_excursion(self, device, alert, at):
+        """Recompute an excursion alert from its readings before `at`"""
+        readings = Reading.objects.filter(
+            device_id=device.device_id, timestamp__gte=alert.timestamp, timestamp__lt=at
+        ).exclude(suspect__in=FAULTS).order_by('timestamp').values_list('temperature', 'timestamp')
+        alert.severity = 'critical'
+        alert.sample_count = 0
+        alert.peak_temperature = None
+        critical_min, critical_max = self.thresholds()[2:]
+        for temperature, timestamp in readings:
+            alert.sample_count += 1
+            alert.last_timestamp = timestamp
+            if alert.peak_temperature is None or self._excess(temperature) > self._excess(alert.peak_temperature):
+                alert.peak_temperature = temperature
+            if not critical_min <= temperature <= critical_max:
+                alert.severity = 'severe'
+
+    def thresholds(self):
+        return self.replay_thresholds
+
+    def check_temperature(self, reading, device=None, replay=True, heartbeat=False):
+        self.reading_time = reading.timestamp
+        return super().check_temperature(reading, device=device, replay=replay, heartbeat=heartbeat)
+
+    def flush(self):
+        """Write buffered alerts, incidents and timeline events, and changes to incidents already written"""
+        if not (self.alerts or self.incidents or self.events or self.changed or self.changed_alerts):
+            return
+        with transaction.atomic():
+            if supports_copy(connection):
+                self._copy()
+            else:
+                # In dependency order: bulk_create fills in the ids the next table refers to
+                Alert.objects.bulk_create(self.alerts, batch_size=self.flush_size)
+                Incident.objects.bulk_create(self.incidents, batch_size=self.flush_size)
+                IncidentTimelineEvent.objects.bulk_create(self.events, batch_size=self.flush_size)
+            Incident.objects.bulk_update(list(self.changed.values()), INCIDENT_FIELDS, batch_size=self.flush_size)
+            Alert.objects.bulk_update(list(self.changed_alerts.values()), EXCURSION_FIELDS, batch_size=self.flush_size)
+            if self.cancelled:
+                EscalationDeadline.objects.filter(incident_id__in=self.cancelled).delete()
+            # Bulk writes send no post_save signals
+            bump_resource_version(INCIDENTS)
+        self.counts['alerts'] += len(self.alerts)
+        self.counts['incidents'] += len(self.incidents)
+        self.alerts, self.incidents, self.events = [], [], []
+        self.changed = {}
+        self.changed_alerts = {}
+        self.cancelled = []
+
+    def _copy(self):
+        with connection.cursor() as cursor:
+            for objects in (self.alerts, self.incidents, self.events):
+                self._number(cursor, objects)
+            copy_rows(cursor, Alert._meta.db_table, ALERT_COLUMNS, (
+                (alert.pk, alert.device_id, alert.reading_id, alert.alert_type, alert.severity, alert.message,
+                 alert.timestamp, alert.last_timestamp, alert.peak_temperature, alert.sample_count, False, '')
+                for alert in self.alerts
+            ))
+            copy_rows(cursor, Incident._meta.db_table, INCIDENT_COLUMNS, (
+                (incident.pk, incident.device_id, incident.alert.pk, incident.description, incident.start_time,
+                 incident.end_time, incident.status, incident.alert_count, incident.current_escalation_level)
+                for incident in self.incidents
+            ))
+            copy_rows(cursor, IncidentTimelineEvent._meta.db_table, EVENT_COLUMNS, (
+                (event.pk, event.incident.pk, event.timestamp, event.event_type, event.description,
+                 event.temperature, json.dumps(event.metadata))
+                for event in self.events
+            ))
+
+    def _number(self, cursor, objects):
+        """Give unsaved objects of one model ids from the model's sequence"""
+        if not objects:
+            return
+        table = objects[0]._meta.db_table
+        if table not in self.sequences:
+            cursor.execute(
+                "SELECT pg_get_serial_sequence(%s, 'id')",
+                [f'{self.real_schema}.{table}' if self.real_schema else table]
+            )
+            self.sequences[table] = cursor.fetchone()[0]
+        cursor.execute('SELECT nextval(%s) FROM generate_series(1, %s)', [self.sequences[table], len(objects)])
+        for obj, (pk,) in zip(objects, cursor.fetchall()):
+            obj.pk = pk
+
+    # Storage for check_temperature
+
+    def _evaluation(self):
+        # Nothing is written until flush(), which has its own transaction
+        return nullcontext()
+
+    def _incidents_to_resolve(self, device):
+        if self.active is None or self.active.alert.alert_type == 'temperature_trend':
+            return []
+        return [self.active]
+
+    def _active_incident(self, device):
+        return self.active
+
+    def _create_alert(self, **fields):
+        alert = Alert(**fields)
+        self.alerts.append(alert)
+        return alert
+
+    def _create_incident(self, **fields):
+        incident = Incident(**fields)
+        self.incidents.append(incident)
+        self.active = incident
+        return incident
+
+    def _save_alert(self, alert):
+        if alert.pk:
+            self.changed_alerts[alert.pk] = alert
+
+    def _save_incident(self, incident):
+        if incident.pk:
+            self.changed[incident.pk] = incident
+        if incident.status not in self.ACTIVE_INCIDENT_STATUSES:
+            self.active = None
+
+    def _add_event(self, incident, **fields):
+        event = IncidentTimelineEvent(incident=incident, timestamp=self.reading_time, **fields)
+        self.events.append(event)
+        return event
+
+    def _schedule_escalation(self, incident, started_at):
+        self.escalation = (incident, started_at)
+
+    def _cancel_escalation(self, incident):
+        if self.escalation and self.escalation[0] is incident:
+            self._escalate(incident, self.escalation[1], self.reading_time)
+            self.escalation = None
+        if incident.pk and self.real_schema is None:
+            self.cancelled.append(incident.pk)
+
+    def _escalate(self, incident, started_at, until):
+        """Raise the incident to the level it reached by `until`, with the events the scheduler would have added"""
+        delays = escalation_delays()
+        level = level_reached(started_at, until)
+        for new_level in range(incident.current_escalation_level + 1, level + 1):
+            self.events.append(IncidentTimelineEvent(
+                incident=incident,
+                timestamp=started_at + delays[new_level],
+                event_type='escalation_changed',
+                description=escalation_description(new_level),
+                metadata={'new_level': new_level}
+            ))
+        if level > incident.current_escalation_level:
+            incident.current_escalation_level = level
+            if incident.pk:
+                self.changed[incident.pk] = incident
+
+
+def _delete_rows(queryset):
+    """Delete a queryset's rows in one statement, without loading them to send signals"""
+    meta = queryset.model._meta
+    sql, params = queryset.order_by().values('pk').query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {meta.db_table} WHERE {meta.pk.column} IN ({sql})', params)
+
+
+def clear_history(devices, start=None):
+    """
+    Delete the temperature alerts of devices (Device instances) from start
+    on (all by default) ahead of a replay, with the incidents they opened and
+    those incidents' timeline events, comments, notifications and pending
+    escalations. Incidents opened earlier lose their timeline from start on;
+    the replay continues them.
+
+    Rows are deleted table by table with single statements rather than through
+    ORM cascades, which would load every incident and event to send signals.
+    """
+    alerts = Alert.objects.filter(device__in=devices, alert_type__in=TEMPERATURE_ALERT_TYPES)
+    if start is not None:
+        alerts = alerts.filter(timestamp__gte=start)
+    incidents = Incident.objects.filter(alert__in=alerts)
+    with transaction.atomic():
+        _delete_rows(Notification.objects.filter(Q(incident__in=incidents) | Q(alert__in=alerts)))
+        _delete_rows(IncidentComment.objects.filter(incident__in=incidents))
+        _delete_rows(EscalationDeadline.objects.filter(incident__in=incidents))
+        events = IncidentTimelineEvent.objects.filter(incident__in=incidents)
+        if start is not None:
+            events = IncidentTimelineEvent.objects.filter(
+                Q(incident__in=incidents) | Q(
+                    incident__device__in=devices,
+                    incident__alert__alert_type__in=TEMPERATURE_ALERT_TYPES,
+                    timestamp__gte=start
+                )
+            )
+        _delete_rows(events)
+        _delete_rows(incidents)
+        _delete_rows(alerts)
+        bump_resource_version(INCIDENTS)
+
+
+def create_shadow_schema(schema, real):
+    """
+    (Re)create empty copies of the alert, incident and timeline tables of
+    schema `real` in a PostgreSQL schema. New rows take their ids from the
+    real tables' sequences, so shadow rows can be compared with, or copied
+    into, the real ones.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(f'CREATE SCHEMA IF NOT EXISTS {schema}')
+        for model in REPLAYED_TABLES:
+            table = model._meta.db_table
+            cursor.execute(f'DROP TABLE IF EXISTS {schema}.{table}')
+            cursor.execute(
+                f'CREATE TABLE {schema}.{table} (LIKE {real}.{table} INCLUDING DEFAULTS INCLUDING INDEXES)'
+            )
+            cursor.execute(
+                f'ALTER TABLE {schema}.{table} ALTER COLUMN id '
+                f"SET DEFAULT nextval(pg_get_serial_sequence('{real}.{table}', 'id'))"
+            )
+
+
+def use_schema(schema, real):
+    """Have this connection find the replayed tables in schema and everything else in real"""
+    with connection.cursor() as cursor:
+        cursor.execute(f'SET search_path TO {schema}, {real}' if schema else f'SET search_path TO {real}')
+
+
+def replay_devices(devices, start=None, real_schema=None):
+    """
+    Replay the readings of devices (Device instances) from start on (all by
+    default). The devices' stored temperature history over that period is
+    deleted first and incidents active at start are continued. With
+    real_schema the connection writes to a shadow schema instead (see
+    use_schema), whose tables are assumed to hold nothing of the period.
+    Returns the replay counts.
+
+    Each flush commits on its own rather than a device at a time, so a replay
+    cut short is completed by running it again.
+    """
+    service = ReplayService(real_schema=real_schema)
+    for device in devices:
+        readings = Reading.objects.filter(device_id=device.device_id)
+        if start is not None:
+            readings = readings.filter(timestamp__gte=start)
+        active = None
+        if real_schema is None:
+            clear_history([device], start)
+            if start is not None:
+                active = service.stored_incident(device, at=start)
+        service.replay(device, readings, active)
+    return service.counts
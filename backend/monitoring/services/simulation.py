@@ -0,0 +1,173 @@
+from datetime import timedelta
+
+import numpy as np
+from django.db import connection
+from django.db.models.expressions import RawSQL
+from django.utils import timezone
+
+from ..bulk_load import copy_out_binary, decode_binary_copy, pg_to_unix_us, supports_copy
+from ..models import Device, Reading
+from .anomaly import FAULTS
+from .compliance import epoch_sql
+from .escalation import escalation_delays
+
+# Devices whose readings are pulled and evaluated together
+CHUNK_DEVICES = 200
+
+SETTINGS_FIELDS = ('normal_temp_min', 'normal_temp_max', 'critical_temp_min', 'critical_temp_max')
+COUNTS = ('readings', 'alerts', 'severe_alerts', 'incidents', 'escalations', 'open_incidents')
+
+
+def _thresholds(settings):
+    """Dict of SETTINGS_FIELDS from a SystemSettings instance or a dict"""
+    if isinstance(settings, dict):
+        return {field: settings[field] for field in SETTINGS_FIELDS}
+    return {field: getattr(settings, field) for field in SETTINGS_FIELDS}
+
+
+class ThresholdSimulator:
+    """
+    Replays stored readings through the threshold and escalation rules of
+    ReadingService.check_temperature under any number of candidate settings,
+    without touching alerts or incidents:
+
+    - every run of consecutive readings outside [normal_temp_min,
+      normal_temp_max] is one alert (an excursion), severe if any of them is
+      outside [critical_temp_min, critical_temp_max];
+    - an alert with no active incident opens one and the first normal reading
+      resolves it;
+    - an incident escalates to levels 2 and 3 once its excursion has lasted
+      ESCALATION_LEVEL2_AFTER and ESCALATION_LEVEL3_AFTER minutes, as if
+      nobody acknowledged it (EscalationScheduler).
+
+    Since the first normal reading resolves an incident, every excursion
+    opens an incident of its own, as on ingest. alert_reset_time plays no
+    part in check_temperature and so none here either.
+
+    Readings are pulled CHUNK_DEVICES devices at a time as column arrays
+    (binary COPY on PostgreSQL) and every candidate is evaluated on the same
+    arrays with vectorized run detection, so a month of fleet data takes
+    seconds. Sensor-fault readings are skipped as on ingest; every device is
+    assumed to start the period without an incident.
+    """
+
+    def __init__(self, start, end, device_ids=None):
+        self.start = start
+        self.end = end
+        devices = Device.objects.order_by('device_id')
+        if device_ids:
+            devices = devices.filter(device_id__in=device_ids)
+        self.devices = list(devices.values_list('id', 'device_id'))
+
+    def run(self, candidates):
+        """
+        Evaluate candidates, a dict of name to settings (SystemSettings or a dict
+        of SETTINGS_FIELDS). Returns (totals, per_device): totals maps name to
+        COUNTS, per_device maps device_id to name to COUNTS.
+        """
+        candidates = {name: _thresholds(settings) for name, settings in candidates.items()}
+        totals = {name: dict.fromkeys(COUNTS, 0) for name in candidates}
+        per_device = {}
+        for offset in range(0, len(self.devices), CHUNK_DEVICES):
+            chunk = self.devices[offset:offset + CHUNK_DEVICES]
+            pks, times, temperatures = self._pull(chunk)
+            # Position of each reading's device in the chunk
+            chunk_pks = np.array([pk for pk, _ in chunk], dtype=np.int64)
+            sorter = np.argsort(chunk_pks)
+            device = sorter[np.searchsorted(chunk_pks, pks, sorter=sorter)]
+
+            results = {name: self._evaluate(device, times, temperatures, len(chunk), thresholds)
+                       for name, thresholds in candidates.items()}
+            for i, (_, device_id) in enumerate(chunk):
+                per_device[device_id] = {
+                    name: {count: int(counts[count][i]) for count in COUNTS} for name, counts in results.items()
+                }
+            for name, counts in results.items():
+                for count in COUNTS:
+                    totals[name][count] += int(counts[count].sum())
+        return totals, per_device
+
+    def _pull(self, chunk):
+        """(device pk, epoch seconds, temperature) arrays of the chunk's readings, by device and time"""
+        device_ids = [device_id for _, device_id in chunk]
+        if supports_copy(connection):
+            sql = (
+                'SELECT d.id::int8, r.timestamp, r.temperature::float8 '
+                f'FROM {Reading._meta.db_table} r JOIN {Device._meta.db_table} d ON d.device_id = r.device_id '
+                f'WHERE r.device_id IN ({", ".join(["%s"] * len(device_ids))}) '
+                f'AND r.timestamp >= %s AND r.timestamp < %s AND r.suspect NOT IN ({", ".join(["%s"] * len(FAULTS))}) '
+                'ORDER BY r.device_id, r.timestamp'
+            )
+            with connection.cursor() as cursor:
+                query = cursor.mogrify(sql, device_ids + [self.start, self.end] + list(FAULTS)).decode()
+                pks, timestamps, temperatures = decode_binary_copy(copy_out_binary(cursor, query), ('>i8', '>i8', '>f8'))
+            return pks, pg_to_unix_us(timestamps) / 1_000_000, temperatures
+
+        rows = list(Reading.objects.filter(
+            device_id__in=device_ids,
+            timestamp__gte=self.start,
+            timestamp__lt=self.end
+        ).exclude(suspect__in=FAULTS).annotate(epoch=RawSQL(epoch_sql(f'{Reading._meta.db_table}.timestamp'), [])).order_by(
+            'device_id', 'timestamp'
+        ).values_list('device_id', 'epoch', 'temperature'))
+        if not rows:
+            return np.zeros(0, dtype=np.int64), np.zeros(0), np.zeros(0)
+        pks = {device_id: pk for pk, device_id in chunk}
+        ids, times, temperatures = zip(*rows)
+        return (
+            np.array([pks[device_id] for device_id in ids], dtype=np.int64),
+            np.array(times, dtype=np.float64),
+            np.array(temperatures, dtype=np.float64),
+        )
+
+    def _evaluate(self, device, times, temperatures, count, thresholds):
+        """COUNTS per device (arrays of length count) for one candidate; device holds positions in the chunk"""
+        counts = {name: np.zeros(count, dtype=np.int64) for name in COUNTS}
+        counts['readings'] = np.bincount(device, minlength=count)
+        if not len(device):
+            return counts
+
+        out = (temperatures < thresholds['normal_temp_min']) | (temperatures > thresholds['normal_temp_max'])
+        severe = out & ((temperatures < thresholds['critical_temp_min']) | (temperatures > thresholds['critical_temp_max']))
+        if not out.any():
+            return counts
+
+        # Runs of consecutive alerts of a device
+        same_as_previous = np.r_[False, device[1:] == device[:-1]]
+        same_as_next = np.r_[same_as_previous[1:], False]
+        run_start = out & ~(np.r_[False, out[:-1]] & same_as_previous)
+        run_end = out & ~(np.r_[out[1:], False] & same_as_next)
+        run_device = device[run_start]
+        run_severe = np.bincount(np.cumsum(run_start)[out] - 1, severe[out]) > 0
+        counts['alerts'] = np.bincount(run_device, minlength=count)
+        counts['severe_alerts'] = np.bincount(run_device[run_severe], minlength=count)
+        # A run is resolved by the device's next reading, which is normal
+        end_index = np.flatnonzero(run_end)
+        resolved = same_as_next[end_index]
+        resolved_at = np.where(resolved, times[np.minimum(end_index + 1, len(times) - 1)], np.inf)
+
+        # Each run is an incident of its own. Runs still unresolved at the end of the period escalate until then
+        run_seconds = np.minimum(resolved_at, self.end.timestamp()) - times[run_start]
+        escalations = sum((run_seconds >= delay.total_seconds()).astype(np.int64) for delay in escalation_delays().values())
+
+        counts['incidents'] = counts['alerts']
+        counts['escalations'] = np.bincount(run_device, escalations, minlength=count).astype(np.int64)
+        counts['open_incidents'] = np.bincount(run_device[~resolved], minlength=count)
+        return counts
+
+
+def simulate_settings(proposed, current, days=30, device_ids=None):
+    """Counts for current and proposed settings over the last `days` days, in total and per device"""
+    end = timezone.now()
+    simulator = ThresholdSimulator(end - timedelta(days=days), end, device_ids)
+    totals, per_device = simulator.run({'current': current, 'proposed': proposed})
+    return {
+        'start': simulator.start,
+        'end': simulator.end,
+        'current': {'settings': _thresholds(current), 'totals': totals['current']},
+        'proposed': {'settings': _thresholds(proposed), 'totals': totals['proposed']},
+        'devices': [
+            {'device_id': device_id, 'current': counts['current'], 'proposed': counts['proposed']}
+            for device_id, counts in per_device.items()
+        ],
+    }
@@ -0,0 +1,205 @@
+import time
+import uuid
+from bisect import bisect_left, bisect_right
+from datetime import timedelta
+
+from django.core.cache import cache
+from django.utils import timezone
+
+from ..conditional import READINGS, resource_version
+from ..models import Reading
+from ..serializers import ReadingSerializer
+
+PERIODS = {'24h': timedelta(hours=24), '7d': timedelta(days=7), '30d': timedelta(days=30)}
+
+# Readings older than this when stored are back-fills, which can change past windows
+BACKFILL_MARGIN = timedelta(minutes=10)
+# Ids committed out of order are caught by re-reading ids above one settled this long ago
+SETTLE_SECONDS = 30
+
+ENTRY_TIMEOUT = 24 * 3600
+LOCK_TIMEOUT = 60
+BACKFILL_LOG_KEY = 'stats-backfills'
+BACKFILL_LOG_SIZE = 100
+
+
+def note_readings_stored(earliest, latest):
+    """
+    Record that readings with timestamps between earliest and latest were just
+    stored. Only back-fills are logged; live readings are newer than every past
+    window and are picked up incrementally by the now-anchored ones.
+    """
+    if earliest >= timezone.now() - BACKFILL_MARGIN:
+        return
+    now = time.time()
+    log = [entry for entry in cache.get(BACKFILL_LOG_KEY, []) if entry[0] > now - ENTRY_TIMEOUT]
+    log.append((now, earliest, latest))
+    if len(log) > BACKFILL_LOG_SIZE:
+        # Collapse into one span: invalidates more than needed, never less
+        log = [(now, min(entry[1] for entry in log), max(entry[2] for entry in log))]
+    cache.set(BACKFILL_LOG_KEY, log, timeout=ENTRY_TIMEOUT)
+
+
+def _response(readings):
+    if not readings:
+        return {'readings': [], 'average_temperature': 0, 'max_temperature': 0, 'min_temperature': 0}
+    temperatures = [reading['temperature'] for reading in readings]
+    average = sum(temperatures) / len(temperatures)
+    return {
+        'readings': readings,
+        'average_temperature': round(average, 2) if average else 0,
+        'max_temperature': round(max(temperatures), 2) if max(temperatures) else 0,
+        'min_temperature': round(min(temperatures), 2) if min(temperatures) else 0,
+    }
+
+
+class StatsCache:
+    """
+    Response cache for TemperatureStatsView, keyed by (device, period) for
+    windows ending now and by (device, start, end) for past windows.
+
+    Windows ending now keep their serialized readings and are brought up to
+    date by fetching only readings with a higher id. Past windows are served
+    as stored until a back-fill overlapping them is logged by ingest. A
+    missing entry is computed by one worker while the others wait for it.
+    """
+
+    def __init__(self, device_id=None):
+        self.device_id = device_id
+
+    def for_period(self, period):
+        now = timezone.now()
+        start = now - PERIODS[period]
+        key = f'stats:{self.device_id or "*"}:{period}'
+        version = resource_version(READINGS)
+
+        entry = cache.get(key)
+        if not entry or entry['version'] != version:
+            entry = self._single_flight(
+                key, lambda: self._compute_live(start, version), lambda entry: entry['version'] == version
+            )
+        elif self._refresh(entry, start):
+            cache.set(key, entry, timeout=ENTRY_TIMEOUT)
+
+        # Entries keep readings that have since left the window, and any from the future
+        times = entry['times']
+        return _response(entry['readings'][bisect_left(times, start.timestamp()):bisect_right(times, now.timestamp())])
+
+    def for_range(self, start, end):
+        if end >= timezone.now() - BACKFILL_MARGIN:
+            # Still receiving readings; not worth caching
+            return _response(self._serialize(self._queryset(start, end)))
+
+        key = f'stats:{self.device_id or "*"}:{start.isoformat()}:{end.isoformat()}'
+        version = resource_version(READINGS)
+        entry = cache.get(key)
+        if entry and (entry['version'] != version or self._backfilled(entry, start, end)):
+            entry = None
+        if not entry:
+            entry = self._single_flight(
+                key,
+                lambda: {
+                    'version': version,
+                    'computed_at': time.time(),
+                    'response': _response(self._serialize(self._queryset(start, end))),
+                },
+                lambda entry: entry['version'] == version and not self._backfilled(entry, start, end)
+            )
+        return entry['response']
+
+    def _queryset(self, start, end=None):
+        readings = Reading.objects.filter(timestamp__gte=start)
+        if end:
+            readings = readings.filter(timestamp__lte=end)
+        if self.device_id:
+            readings = readings.filter(device_id=self.device_id)
+        return readings.order_by('timestamp')
+
+    def _serialize(self, readings):
+        return [dict(item) for item in ReadingSerializer(readings, many=True).data]
+
+    def _compute_live(self, start, version):
+        now = time.time()
+        readings = list(self._queryset(start))
+        times = [reading.timestamp.timestamp() for reading in readings]
+        max_id = max((reading.id for reading in readings), default=0)
+        # Readings from the last few seconds may still have lower ids committing behind them
+        floor_id = max((reading.id for reading, t in zip(readings, times) if t <= now - SETTLE_SECONDS), default=0)
+        return {
+            'version': version,
+            'readings': self._serialize(readings),
+            'times': times,
+            'max_id': max_id,
+            # Ids above floor_id are re-read on refresh; recent_ids are the ones already merged
+            'floor_id': floor_id,
+            'recent_ids': {reading.id for reading in readings if reading.id > floor_id},
+            'checkpoints': [(now, max_id)],
+        }
+
+    def _refresh(self, entry, start):
+        """Merge readings stored since the entry was built; returns True if the entry changed"""
+        changed = False
+        new = [
+            reading for reading in self._queryset(start).filter(id__gt=entry['floor_id'])
+            if reading.id not in entry['recent_ids']
+        ]
+        if new:
+            for reading, data in zip(new, self._serialize(new)):
+                timestamp = reading.timestamp.timestamp()
+                if entry['times'] and timestamp < entry['times'][-1]:
+                    # Late reading: keep both lists ordered by timestamp
+                    index = bisect_right(entry['times'], timestamp)
+                    entry['times'].insert(index, timestamp)
+                    entry['readings'].insert(index, data)
+                else:
+                    entry['times'].append(timestamp)
+                    entry['readings'].append(data)
+                entry['recent_ids'].add(reading.id)
+            entry['max_id'] = max(entry['max_id'], max(reading.id for reading in new))
+            changed = True
+
+        # Once nothing below an id can still commit, stop re-reading up to it
+        now = time.time()
+        if entry['checkpoints'][-1][1] != entry['max_id']:
+            entry['checkpoints'].append((now, entry['max_id']))
+        settled = [checkpoint for checkpoint in entry['checkpoints'] if checkpoint[0] <= now - SETTLE_SECONDS]
+        if settled and settled[-1][1] > entry['floor_id']:
+            entry['floor_id'] = settled[-1][1]
+            entry['recent_ids'] = {i for i in entry['recent_ids'] if i > entry['floor_id']}
+            entry['checkpoints'] = entry['checkpoints'][len(settled) - 1:]
+            changed = True
+
+        # Drop readings that slid out of the window before they pile up
+        cut = bisect_left(entry['times'], start.timestamp())
+        if cut > len(entry['times']) // 10:
+            del entry['times'][:cut]
+            del entry['readings'][:cut]
+            changed = True
+        return changed
+
+    def _backfilled(self, entry, start, end):
+        return any(
+            stored_at >= entry['computed_at'] and earliest <= end and latest >= start
+            for stored_at, earliest, latest in cache.get(BACKFILL_LOG_KEY, [])
+        )
+
+    def _single_flight(self, key, compute, is_current):
+        """Compute a missing entry in one worker; the others wait for it rather than run the same query"""
+        lock_key = f'{key}:lock'
+        token = uuid.uuid4().hex
+        deadline = time.monotonic() + LOCK_TIMEOUT
+        while not cache.add(lock_key, token, timeout=LOCK_TIMEOUT):
+            time.sleep(0.05)
+            entry = cache.get(key)
+            if entry and is_current(entry):
+                return entry
+            if time.monotonic() > deadline:
+                # The computing worker died or is stuck; do the work here
+                return compute()
+        try:
+            entry = compute()
+            cache.set(key, entry, timeout=ENTRY_TIMEOUT)
+            return entry
+        finally:
+            if cache.get(lock_key) == token:
+                cache.delete(lock_key)
@@ -0,0 +1,127 @@
+import threading
+
+import numpy as np
+from django.conf import settings
+
+# Newest readings of each device the trend is fitted to, and how many it needs
+WINDOW = 12
+MIN_SAMPLES = 6
+# A slope must be this many standard errors from zero to be believed
+MIN_T_STATISTIC = 3.0
+# A pre-alert is withdrawn once the predicted crossing is this many horizons away, or no longer predicted
+CLEAR_FACTOR = 2.0
+
+
+class TrendPredictor:
+    """
+    Predicts when each device will leave the normal temperature range from the
+    trend of its last WINDOW readings, held in memory as fixed-size arrays.
+
+    All devices of an ingest batch are fitted together: their windows are
+    stacked into one matrix and the least-squares slopes come from a handful
+    of row-wise sums, so a batch costs a few NumPy operations whatever its size.
+    """
+
+    def __init__(self):
+        self.times = {}
+        self.temperatures = {}
+        self.counts = {}
+        self.warned = set()
+        self.lock = threading.Lock()
+
+    def observe(self, readings, normal_min, normal_max):
+        """
+        Add readings (sorted by timestamp) and predict a crossing for each device
+        that sent one. Returns (warn, clear): warn maps device_id to (bound,
+        seconds until crossing, reading) for devices newly expected to cross
+        within PREDICTIVE_ALERT_HORIZON; clear lists (device_id, reading) for
+        devices whose earlier prediction no longer holds.
+        """
+        latest = {}
+        with self.lock:
+            for reading in readings:
+                if not normal_min <= reading.temperature <= normal_max:
+                    # Out of range: the threshold alerts take over, and the trend
+                    # is fitted afresh once the device is back in range
+                    self.counts[reading.device_id] = 0
+                    self.warned.discard(reading.device_id)
+                    latest.pop(reading.device_id, None)
+                elif self._add(reading):
+                    latest[reading.device_id] = reading
+            if not latest:
+                return {}, []
+
+            device_ids = list(latest)
+            counts = np.array([min(self.counts[device_id], WINDOW) for device_id in device_ids])
+            times = np.stack([self.times[device_id] for device_id in device_ids])
+            temperatures = np.stack([self.temperatures[device_id] for device_id in device_ids])
+
+        horizon = settings.PREDICTIVE_ALERT_HORIZON * 60
+        seconds, estimates, bounds = self._time_to_cross(times, temperatures, counts, normal_min, normal_max)
+
+        warn, clear = {}, []
+        # Checked and updated in one step, so concurrent ingests cannot both warn about (or clear) a device
+        with self.lock:
+            for device_id, remaining, estimate, bound in zip(device_ids, seconds, estimates, bounds):
+                if remaining <= horizon and device_id not in self.warned:
+                    self.warned.add(device_id)
+                    warn[device_id] = (float(bound), float(remaining), latest[device_id])
+                elif estimate > CLEAR_FACTOR * horizon and device_id in self.warned:
+                    # Judged on the fitted slope whether significant or not: noise alone
+                    # must not withdraw a warning the trend still supports
+                    self.warned.discard(device_id)
+                    clear.append((device_id, latest[device_id]))
+        return warn, clear
+
+    def _add(self, reading):
+        device_id = reading.device_id
+        timestamp = reading.timestamp.timestamp()
+        if device_id not in self.times:
+            self.times[device_id] = np.zeros(WINDOW)
+            self.temperatures[device_id] = np.zeros(WINDOW)
+            self.counts[device_id] = 0
+        count = self.counts[device_id]
+        if count and timestamp <= self.times[device_id][(count - 1) % WINDOW]:
+            # Late or resent reading: the window only moves forward
+            return False
+        self.times[device_id][count % WINDOW] = timestamp
+        self.temperatures[device_id][count % WINDOW] = reading.temperature
+        self.counts[device_id] = count + 1
+        return True
+
+    def _time_to_cross(self, times, temperatures, counts, normal_min, normal_max):
+        """
+        Seconds until each row's fitted trend leaves [normal_min, normal_max]:
+        for significant trends only (inf otherwise), for any fitted slope, and
+        the bound it heads for.
+        """
+        valid = np.arange(WINDOW)[None, :] < counts[:, None]
+        weights = valid.astype(np.float64)
+        # Seconds before each device's newest reading, so the intercept is the fitted value now
+        t = np.where(valid, times - np.max(np.where(valid, times, -np.inf), axis=1)[:, None], 0.0)
+        y = np.where(valid, temperatures, 0.0)
+
+        n = counts.astype(np.float64)
+        mean_t = (weights * t).sum(axis=1) / np.maximum(n, 1)
+        mean_y = (weights * y).sum(axis=1) / np.maximum(n, 1)
+        dt = np.where(valid, t - mean_t[:, None], 0.0)
+        dy = np.where(valid, y - mean_y[:, None], 0.0)
+        sxx = (dt * dt).sum(axis=1)
+        fitted = sxx > 0
+        slope = np.divide((dt * dy).sum(axis=1), sxx, out=np.zeros_like(sxx), where=fitted)
+        now = mean_y - slope * mean_t
+
+        residuals = np.where(valid, dy - slope[:, None] * dt, 0.0)
+        variance = (residuals * residuals).sum(axis=1) / np.maximum(n - 2, 1)
+        standard_error = np.sqrt(np.divide(variance, sxx, out=np.full_like(sxx, np.inf), where=fitted))
+        significant = fitted & (n >= MIN_SAMPLES) & (np.abs(slope) > MIN_T_STATISTIC * standard_error)
+
+        bounds = np.where(slope > 0, normal_max, normal_min)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            estimates = (bounds - now) / slope
+        # A fitted value already past the bound it heads for means the crossing is due now
+        estimates = np.where(fitted & (n >= MIN_SAMPLES) & (slope != 0), np.maximum(estimates, 0), np.inf)
+        return np.where(significant, estimates, np.inf), estimates, bounds
+
+
+trend_predictor = TrendPredictor()
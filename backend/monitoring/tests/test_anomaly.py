@@ -0,0 +1,117 @@
+from datetime import datetime, timedelta, timezone as dt_timezone
+from unittest import mock
+
+from django.db import DatabaseError
+from django.test import SimpleTestCase, TestCase
+
+from monitoring.models import Alert, Device, Incident, Reading
+from monitoring.services.anomaly import DRIFT, FLATLINE, SPIKE, AnomalyDetector, anomaly_detector
+from monitoring.services.reading_service import ReadingService
+
+T0 = datetime(2024, 1, 1, tzinfo=dt_timezone.utc)
+
+
+def series(device_id, temperatures, start=T0, step=timedelta(minutes=5)):
+    return [(device_id, temperature, 40.0, 'AC', 100.0, start + step * i) for i, temperature in enumerate(temperatures)]
+
+
+class AnomalyDetectorTests(SimpleTestCase):
+    def setUp(self):
+        self.detector = AnomalyDetector()
+
+    def tags(self, records):
+        return self.detector.observe(records)[0]
+
+    def test_single_spike_is_flagged_and_a_step_change_is_not(self):
+        tags = self.tags(series('A', [5.0, 5.1, 4.9, 5.0, 5.1, 15.0, 5.0]))
+        self.assertEqual(tags, ['', '', '', '', '', SPIKE, ''])
+
+        # A door left open: the new level moves the median after three readings
+        tags = self.tags(series('B', [5.0, 5.1, 4.9, 5.0, 5.1, 12.0, 12.1, 12.0, 12.2, 12.1]))
+        self.assertEqual(tags[5:8], [SPIKE, SPIKE, SPIKE])
+        self.assertEqual(tags[8:], ['', ''])
+
+    def test_flatline_starts_after_the_configured_time_and_ends_on_a_change(self):
+        records = series('C', [5.0] * 8 + [5.2], step=timedelta(minutes=30))
+        tags, flatlines = self.detector.observe(records)
+        # Six half hours after the first 5.0
+        self.assertEqual(tags[:6], [''] * 6)
+        self.assertEqual(tags[6:8], [FLATLINE, FLATLINE])
+        self.assertEqual(tags[8], '')
+        self.assertEqual(flatlines, [(6, True), (8, False)])
+
+    def test_drift_is_tagged_after_warmup(self):
+        steady = [5.0 + 0.1 * (i % 2) for i in range(100)]
+        ramp = [5.1 + 0.2 * i for i in range(1, 30)]
+        tags = self.tags(series('D', steady + ramp, step=timedelta(minutes=1)))
+        self.assertEqual(set(tags[:100]), {''})
+        self.assertIn(DRIFT, tags[100:])
+        self.assertNotIn(SPIKE, tags)
+
+    def test_resent_and_late_readings_are_not_tagged(self):
+        records = series('E', [5.0, 5.1, 4.9, 5.0, 5.1])
+        self.detector.observe(records)
+        late = [('E', 30.0, 40.0, 'AC', 100.0, T0 + timedelta(minutes=1))]
+        self.assertEqual(self.tags(late + records[-1:]), ['', ''])
+
+    def test_staged_states_only_count_once_committed(self):
+        records = series('G', [5.0, 5.1, 4.9, 5.0, 5.1])
+        self.detector.stage(records)
+        self.assertNotIn('G', self.detector.states)
+
+        tags, flatlines, staged = self.detector.stage(records)
+        self.detector.commit(staged)
+        self.assertEqual(self.detector.states['G'].count, 5)
+        # A state staged from an older starting point does not overwrite newer readings
+        self.detector.commit(self.detector.stage(records[:2])[2])
+        self.assertEqual(self.detector.states['G'].count, 5)
+
+    def test_batches_are_judged_in_timestamp_order(self):
+        records = series('F', [5.0, 5.1, 4.9, 5.0, 5.1, 15.0])
+        self.assertEqual(self.tags(records[::-1]), [SPIKE, '', '', '', '', ''])
+
+
+class SensorFaultTests(TestCase):
+    def test_spike_raises_a_sensor_fault_instead_of_a_temperature_alert(self):
+        service = ReadingService(notify=False)
+        service.ingest(series('FAULT_1', [5.0, 5.1, 4.9, 5.0, 5.1]))
+        service.ingest(series('FAULT_1', [30.0, 5.0, -20.0], start=T0 + timedelta(minutes=25)))
+
+        spikes = Reading.objects.filter(device_id='FAULT_1', suspect=SPIKE).order_by('timestamp')
+        self.assertEqual(list(spikes.values_list('temperature', flat=True)), [30.0, -20.0])
+        alerts = Alert.objects.filter(device__device_id='FAULT_1')
+        self.assertEqual(list(alerts.values_list('alert_type', flat=True)), ['sensor_fault'])
+        incident = Incident.objects.get(device__device_id='FAULT_1')
+        self.assertEqual((incident.status, incident.alert_count), ('open', 2))
+
+    def test_flatline_opens_one_incident_and_closes_it_when_values_change(self):
+        service = ReadingService(notify=False)
+        service.ingest(series('FAULT_2', [5.0] * 10, step=timedelta(minutes=30)))
+        incident = Incident.objects.get(device__device_id='FAULT_2')
+        self.assertEqual((incident.alert.alert_type, incident.status, incident.alert_count), ('sensor_fault', 'open', 1))
+
+        service.ingest(series('FAULT_2', [5.3], start=T0 + timedelta(hours=5)))
+        incident.refresh_from_db()
+        self.assertEqual(incident.status, 'resolved')
+        self.assertEqual(incident.end_time, T0 + timedelta(hours=5))
+
+    def test_duplicates_do_not_feed_the_detector(self):
+        # Stored before this process saw them, e.g. by another worker
+        for reading in series('FAULT_3', [20.0] * 5):
+            Reading.objects.create(device_id=reading[0], temperature=reading[1], humidity=40.0, timestamp=reading[5])
+        service = ReadingService(notify=False)
+        service.ingest(series('FAULT_3', [20.0] * 5) + series('FAULT_3', [5.0, 5.1, 4.9, 5.0, 5.1, 5.0],
+                                                               start=T0 + timedelta(minutes=25)))
+
+        self.assertFalse(Reading.objects.filter(device_id='FAULT_3').exclude(suspect='').exists())
+        self.assertEqual(anomaly_detector.states['FAULT_3'].count, 6)
+
+    def test_failed_write_does_not_feed_the_detector(self):
+        service = ReadingService(notify=False)
+        with mock.patch.object(Device.objects, 'filter', side_effect=DatabaseError('database is down')):
+            with self.assertRaises(DatabaseError):
+                service.ingest(series('FAULT_4', [5.0, 5.1]))
+        self.assertNotIn('FAULT_4', anomaly_detector.states)
+
+        service.ingest(series('FAULT_4', [5.0, 5.1]))
+        self.assertEqual(anomaly_detector.states['FAULT_4'].count, 2)
@@ -0,0 +1,60 @@
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APITestCase
+
+from authentication.serializers import CustomTokenObtainPairSerializer
+from notifications.models import Operator
+
+User = get_user_model()
+
+
+class CachedJWTAuthenticationTests(APITestCase):
+    url = '/api/auth/users/me/'
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('auth-cache@example.com', 'secret', first_name='Ada')
+        self.user.is_operator = True
+        self.user.save()
+        self.operator = Operator.objects.create(user=self.user, name='Ada', priority=1)
+
+    def get(self, user=None):
+        token = CustomTokenObtainPairSerializer.get_token(user or self.user).access_token
+        return self.client.get(self.url, HTTP_AUTHORIZATION=f'Bearer {token}')
+
+    def test_user_and_operator_are_loaded_once(self):
+        self.assertEqual(self.get().status_code, 200)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.get()
+        self.assertEqual(response.data['operator_priority'], 1)
+        self.assertEqual(len(queries), 0)
+
+    def test_saving_the_user_or_operator_refreshes_the_cache(self):
+        self.get()
+        self.user.first_name = 'Grace'
+        self.user.save()
+        self.assertEqual(self.get().data['first_name'], 'Grace')
+
+        self.operator.priority = 2
+        self.operator.save()
+        self.assertEqual(self.get().data['operator_priority'], 2)
+
+    def test_changing_the_password_revokes_earlier_tokens(self):
+        old_token = CustomTokenObtainPairSerializer.get_token(self.user).access_token
+        self.assertEqual(self.client.get(self.url, HTTP_AUTHORIZATION=f'Bearer {old_token}').status_code, 200)
+
+        self.client.force_authenticate(self.user)
+        self.client.patch(self.url, {'password': 'changed'}, format='json')
+        self.client.force_authenticate(None)
+
+        self.assertEqual(self.client.get(self.url, HTTP_AUTHORIZATION=f'Bearer {old_token}').status_code, 401)
+        self.user.refresh_from_db()
+        self.assertEqual(self.get().status_code, 200)
+
+    def test_deactivated_user_is_refused(self):
+        self.get()
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.get().status_code, 401)
@@ -0,0 +1,135 @@
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import TestCase
+from rest_framework.test import APITestCase
+
+from monitoring.models import Device, Reading, ReadingGap, ReadingGapScan
+from monitoring.services.availability import AvailabilityReport, gap_scanner
+from monitoring.services.reading_service import ReadingService
+
+DAY = datetime(2024, 1, 1, tzinfo=dt_timezone.utc)
+STEP = timedelta(minutes=5)
+
+
+def store(device_id, start, end):
+    """A reading every 5 minutes from start to end inclusive"""
+    count = int((end - start) / STEP) + 1
+    Reading.objects.bulk_create(
+        Reading(device_id=device_id, temperature=5.0, humidity=40.0, timestamp=start + STEP * i)
+        for i in range(count)
+    )
+
+
+def gaps(device_id):
+    return list(ReadingGap.objects.filter(device_id=device_id).values_list('started_at', 'ended_at'))
+
+
+class GapScannerTests(TestCase):
+    def setUp(self):
+        Device.objects.create(device_id='GAP_1', name='x', location='x')
+
+    def test_gaps_longer_than_the_threshold_are_found(self):
+        store('GAP_1', DAY, DAY + timedelta(hours=1))
+        # Three intervals apart is not yet a gap
+        store('GAP_1', DAY + timedelta(hours=1, minutes=15), DAY + timedelta(hours=2))
+        store('GAP_1', DAY + timedelta(hours=3), DAY + timedelta(hours=4))
+        self.assertEqual(gap_scanner.scan(['GAP_1']), 1)
+        self.assertEqual(gaps('GAP_1'), [(DAY + timedelta(hours=2), DAY + timedelta(hours=3))])
+
+        scan = ReadingGapScan.objects.get(device_id='GAP_1')
+        self.assertEqual((scan.first_reading, scan.last_reading), (DAY, DAY + timedelta(hours=4)))
+
+    def test_later_scans_read_only_new_readings(self):
+        store('GAP_1', DAY, DAY + timedelta(hours=1))
+        gap_scanner.scan(['GAP_1'])
+        store('GAP_1', DAY + timedelta(hours=2), DAY + timedelta(hours=3))
+        # The new readings are older than the first scan's starting point: nothing read
+        self.assertEqual(gap_scanner.scan(['GAP_1']), 0)
+
+        ReadingGapScan.objects.filter(device_id='GAP_1').update(scan_from=DAY + timedelta(minutes=30))
+        self.assertEqual(gap_scanner.scan(['GAP_1']), 1)
+        self.assertEqual(gaps('GAP_1'), [(DAY + timedelta(hours=1), DAY + timedelta(hours=2))])
+
+    def test_backfill_closes_a_stored_gap(self):
+        store('GAP_1', DAY, DAY + timedelta(hours=1))
+        store('GAP_1', DAY + timedelta(hours=2), DAY + timedelta(hours=3))
+        gap_scanner.scan(['GAP_1'])
+
+        # Arriving through ingest, back-fills move the next scan's starting point back
+        ReadingService(notify=False).ingest([
+            ('GAP_1', 5.0, 40.0, 'AC', 100.0, DAY + timedelta(hours=1) + STEP * i) for i in range(1, 12)
+        ])
+        self.assertIsNotNone(ReadingGapScan.objects.get(device_id='GAP_1').rescan_from)
+        gap_scanner.scan(['GAP_1'])
+        self.assertEqual(gaps('GAP_1'), [])
+        self.assertIsNone(ReadingGapScan.objects.get(device_id='GAP_1').rescan_from)
+
+    def test_command_rescans_from_scratch(self):
+        store('GAP_1', DAY, DAY + timedelta(hours=1))
+        store('GAP_1', DAY + timedelta(hours=2), DAY + timedelta(hours=3))
+        gap_scanner.scan(['GAP_1'])
+        with self.settings(READING_GAP_INTERVALS=20):
+            out = StringIO()
+            call_command('scan_reading_gaps', '--rescan', '--device-id', 'GAP_1', stdout=out)
+        self.assertIn('Found 0 gaps', out.getvalue())
+        self.assertEqual(gaps('GAP_1'), [])
+
+
+class AvailabilityReportTests(TestCase):
+    def setUp(self):
+        Device.objects.create(device_id='UP_1', name='x', location='x')
+
+    def report(self, start, end):
+        return AvailabilityReport(start, end, ['UP_1']).run()[0]
+
+    def test_uptime_per_day_and_overall(self):
+        # Two hours without readings on the second day
+        store('UP_1', DAY, DAY + timedelta(days=1, hours=10))
+        store('UP_1', DAY + timedelta(days=1, hours=12), DAY + timedelta(days=2))
+        result = self.report(DAY, DAY + timedelta(days=2))
+        self.assertEqual(result['downtime_seconds'], 7200)
+        self.assertEqual(result['uptime'], round(100 * (1 - 7200 / (2 * 86400)), 2))
+        self.assertEqual(
+            [(day['date'], day['uptime']) for day in result['days']],
+            [(date(2024, 1, 1), 100.0), (date(2024, 1, 2), round(100 * (1 - 7200 / 86400), 2))]
+        )
+        self.assertEqual(result['gaps'], [{
+            'started_at': DAY + timedelta(days=1, hours=10),
+            'ended_at': DAY + timedelta(days=1, hours=12),
+            'seconds': 7200,
+            'missed_readings': 23,
+        }])
+
+    def test_silence_since_the_newest_reading_is_downtime(self):
+        store('UP_1', DAY, DAY + timedelta(hours=12))
+        result = self.report(DAY, DAY + timedelta(days=1))
+        self.assertEqual(result['downtime_seconds'], 12 * 3600)
+        self.assertEqual(result['gaps'][0]['ended_at'], None)
+
+    def test_time_before_the_first_reading_is_not_counted(self):
+        store('UP_1', DAY + timedelta(hours=12), DAY + timedelta(days=1))
+        result = self.report(DAY, DAY + timedelta(days=1))
+        self.assertEqual((result['uptime'], result['downtime_seconds']), (100.0, 0))
+
+    def test_device_without_readings(self):
+        result = self.report(DAY, DAY + timedelta(days=1))
+        self.assertEqual((result['uptime'], result['gaps']), (None, []))
+
+
+class AvailabilityReportViewTests(APITestCase):
+    url = '/api/monitoring/analytics/availability/'
+
+    def test_report(self):
+        self.client.force_authenticate(get_user_model().objects.create_user('viewer@example.com', 'password'))
+        Device.objects.create(device_id='UP_2', name='x', location='x')
+        store('UP_2', DAY, DAY + timedelta(days=1))
+        response = self.client.get(self.url, {
+            'start': DAY.isoformat(), 'end': (DAY + timedelta(days=1)).isoformat(), 'device_id': 'UP_2'
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['gap_intervals'], 3)
+        self.assertEqual(response.data['devices'][0]['uptime'], 100.0)
+        self.assertEqual(self.client.get(self.url, {'start': DAY.isoformat()}).status_code, 400)
@@ -0,0 +1,118 @@
+from datetime import timedelta
+from unittest import mock, skipUnless
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import TestCase
+from django.utils import timezone
+from rest_framework.test import APITestCase
+
+from monitoring import serializers
+from monitoring.models import Alert, Device, Reading
+from monitoring.services import power
+from monitoring.services.power import battery_forecasts
+from notifications.models import Notification, Operator
+
+
+def store(device_id, end, levels, status='BATTERY', step=timedelta(minutes=5)):
+    """Readings every `step` with the given battery levels, the last one at `end`"""
+    Reading.objects.bulk_create(
+        Reading(
+            device_id=device_id, temperature=5.0, humidity=40.0, power_status=status,
+            battery_level=level, timestamp=end - step * (len(levels) - 1 - i)
+        )
+        for i, level in enumerate(levels)
+    )
+
+
+class BatteryForecastTests(TestCase):
+    def setUp(self):
+        self.now = timezone.now().replace(microsecond=0)
+
+    def test_drain_is_fitted_to_the_battery_run(self):
+        # 0.5 points every 5 minutes: 6 per hour
+        store('BAT_1', self.now, [90.0, 89.5, 89.0, 88.5, 88.0])
+        forecast = battery_forecasts(['BAT_1'], now=self.now)['BAT_1']
+        self.assertEqual((forecast['power_status'], forecast['battery_level']), ('BATTERY', 88.0))
+        self.assertAlmostEqual(forecast['drain_per_hour'], 6.0)
+        self.assertAlmostEqual(forecast['hours_remaining'], 88.0 / 6, places=2)
+        self.assertAlmostEqual(
+            (forecast['empty_at'] - self.now).total_seconds(), 88.0 / 6 * 3600, delta=60
+        )
+
+    def test_readings_before_the_last_mains_reading_are_ignored(self):
+        # An earlier outage drained fast; the current one drains 6 per hour
+        store('BAT_2', self.now - timedelta(hours=3), [80.0, 60.0, 40.0, 20.0])
+        store('BAT_2', self.now - timedelta(minutes=25), [100.0], status='AC')
+        store('BAT_2', self.now, [99.5, 99.0, 98.5, 98.0, 97.5])
+        self.assertAlmostEqual(battery_forecasts(['BAT_2'], now=self.now)['BAT_2']['drain_per_hour'], 6.0)
+
+    def test_no_drain_on_mains_or_from_too_few_readings(self):
+        store('BAT_3', self.now, [100.0, 100.0, 100.0], status='AC')
+        store('BAT_4', self.now, [90.0, 89.0])
+        forecasts = battery_forecasts(['BAT_3', 'BAT_4'], now=self.now)
+        self.assertEqual(forecasts['BAT_3']['power_status'], 'AC')
+        self.assertIsNone(forecasts['BAT_3']['drain_per_hour'])
+        self.assertEqual(forecasts['BAT_4']['battery_level'], 89.0)
+        self.assertIsNone(forecasts['BAT_4']['hours_remaining'])
+
+    def test_devices_without_readings_in_the_window_are_left_out(self):
+        store('BAT_5', self.now - timedelta(hours=30), [90.0, 89.0, 88.0])
+        self.assertEqual(battery_forecasts(['BAT_5', 'BAT_MISSING'], now=self.now), {})
+        self.assertEqual(battery_forecasts([], now=self.now), {})
+
+    @skipUnless(connection.vendor == 'postgresql', 'LATERAL query runs on PostgreSQL only')
+    def test_postgresql_sums_match_the_portable_ones(self):
+        store('BAT_6', self.now - timedelta(hours=2), [70.0, 65.0, 61.0])
+        store('BAT_6', self.now - timedelta(minutes=40), [100.0], status='AC')
+        store('BAT_6', self.now, [99.0, 98.2, 97.9, 96.5, 95.0, 94.7, 93.1, 92.0])
+        store('BAT_7', self.now, [100.0, 100.0], status='AC')
+        since = self.now - timedelta(hours=24)
+        expected = power._battery_sums_portable(['BAT_6', 'BAT_7'], since, self.now)
+        actual = sorted(power._battery_sums_postgresql(['BAT_6', 'BAT_7'], since, self.now))
+        self.assertEqual([row[:5] for row in actual], [row[:5] for row in expected])
+        for row, expected_row in zip(actual, expected):
+            for value, expected_value in zip(row[5:], expected_row[5:]):
+                self.assertAlmostEqual(value, expected_value, places=6)
+
+
+class NestedBatteryForecastTests(APITestCase):
+    """Lists forecast the batteries of all their devices together"""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user('operator@example.com', 'password')
+        self.operator = Operator.objects.create(user=self.user, name='Operator')
+        self.client.force_authenticate(self.user)
+        now = timezone.now()
+        for i in range(3):
+            device = Device.objects.create(device_id=f'NEST_{i}', name='x', location='x')
+            store(device.device_id, now, [90.0, 89.5, 89.0, 88.5])
+            alert = Alert.objects.create(
+                device=device, reading=Reading.objects.filter(device_id=device.device_id).last(),
+                alert_type='power_failure', severity='critical', message='x', timestamp=now
+            )
+            Notification.objects.create(operator=self.operator, alert=alert, notification_type='EMAIL', message='x')
+
+    def get(self, url):
+        with mock.patch.object(serializers, 'battery_forecasts', wraps=battery_forecasts) as forecasts:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response, forecasts
+
+    def test_alert_list(self):
+        response, forecasts = self.get('/api/monitoring/alerts/')
+        forecasts.assert_called_once()
+        self.assertEqual(set(forecasts.call_args[0][0]), {'NEST_0', 'NEST_1', 'NEST_2'})
+        self.assertAlmostEqual(response.data[0]['device']['battery']['drain_per_hour'], 6.0)
+
+    def test_notification_list(self):
+        response, forecasts = self.get('/api/notifications/')
+        forecasts.assert_called_once()
+        self.assertEqual(response.data[0]['alert']['device']['battery']['power_status'], 'BATTERY')
+
+    def test_device_list_and_detail(self):
+        response, forecasts = self.get('/api/monitoring/devices/')
+        forecasts.assert_called_once()
+        device = Device.objects.get(device_id='NEST_0')
+        response, forecasts = self.get(f'/api/monitoring/devices/{device.pk}/')
+        forecasts.assert_called_once_with(['NEST_0'])
@@ -0,0 +1,59 @@
+import json
+import os
+import tempfile
+from io import StringIO
+
+from django.core.management import CommandError, call_command
+from django.test import TestCase
+
+from monitoring.models import Device, Reading
+
+SMALL = ['--iterations', '10', '--batch-size', '5', '--export-rows', '20,40', '--export-formats', 'csv,json',
+         '--stats-interval', '86400', '--incidents', '3']
+
+
+class BenchmarkCommandTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.output = os.path.join(directory.name, 'results.json')
+
+    def run_benchmark(self, *args):
+        out = StringIO()
+        call_command('benchmark', *SMALL, '--output', self.output, *args, stdout=out)
+        with open(self.output) as f:
+            return json.load(f), out.getvalue()
+
+    def test_every_scenario_runs_without_errors_and_cleans_up(self):
+        report, out = self.run_benchmark()
+        self.assertEqual(set(report['results']), {
+            'ingest_single', 'ingest_single_binary', 'ingest_batch', 'ingest_batch_binary',
+            'threshold_evaluation', 'stats_24h', 'stats_7d', 'stats_30d',
+            'export_csv_20', 'export_json_20', 'export_csv_40', 'export_json_40', 'incident_list',
+        })
+        for name, result in report['results'].items():
+            self.assertEqual(result['errors'], 0, name)
+        self.assertEqual(report['results']['ingest_batch']['items'], 5)
+        self.assertIn('Benchmark completed', out)
+        self.assertFalse(Device.objects.filter(device_id__startswith='BENCH_').exists())
+        self.assertFalse(Reading.objects.filter(device_id__startswith='BENCH_').exists())
+
+    def test_slower_results_than_the_baseline_are_regressions(self):
+        self.run_benchmark('--scenarios', 'evaluation')
+        with open(self.output) as f:
+            baseline = json.load(f)
+        # A baseline a hundred times faster than anything measured
+        for result in baseline['results'].values():
+            result['p50_ms'] = result['p95_ms'] = result['p99_ms'] = 1e-6
+            result['throughput'] *= 100
+        baseline_path = self.output + '.baseline'
+        with open(baseline_path, 'w') as f:
+            json.dump(baseline, f)
+
+        report, out = self.run_benchmark('--scenarios', 'evaluation', '--baseline', baseline_path)
+        self.assertEqual(
+            {(regression['scenario'], regression['metric']) for regression in report['regressions']},
+            {('threshold_evaluation', metric) for metric in ('p50_ms', 'p95_ms', 'p99_ms', 'throughput')}
+        )
+        with self.assertRaises(CommandError):
+            self.run_benchmark('--scenarios', 'evaluation', '--baseline', baseline_path, '--fail-on-regression')
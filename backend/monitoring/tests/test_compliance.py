@@ -0,0 +1,134 @@
+from datetime import datetime, timedelta, timezone as dt_timezone
+from unittest import mock
+
+import numpy as np
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+from rest_framework.test import APITestCase
+
+from monitoring.models import DailyReadingRollup, Device, Reading
+from monitoring.services import compliance
+from monitoring.services.compliance import ACTIVATION_ENERGY_OVER_R, KELVIN, ComplianceReport
+from monitoring.services.reading_service import ReadingService
+
+DAY = datetime(2024, 1, 1, tzinfo=dt_timezone.utc)
+STEP = timedelta(minutes=5)
+
+
+def store(device_id, start, temperatures, suspect=''):
+    Reading.objects.bulk_create(
+        Reading(device_id=device_id, temperature=temperature, humidity=40.0,
+                timestamp=start + STEP * i, suspect=suspect)
+        for i, temperature in enumerate(temperatures)
+    )
+
+
+def report(device_id, start, end, range_min=2.0, range_max=8.0):
+    return ComplianceReport(start, end, range_min, range_max, [device_id]).run()[0]
+
+
+class ComplianceReportTests(TestCase):
+    def test_constant_temperature(self):
+        Device.objects.create(device_id='MKT_1', name='x', location='x')
+        store('MKT_1', DAY, [5.0] * 12)
+        result = report('MKT_1', DAY, DAY + timedelta(hours=1))
+        self.assertEqual(result['mean_kinetic_temperature'], 5.0)
+        self.assertEqual((result['samples'], result['covered_seconds'], result['coverage']), (12, 3600, 100.0))
+        self.assertEqual(result['seconds_outside'], 0)
+
+    def test_mkt_weights_warm_periods_more_than_the_mean(self):
+        Device.objects.create(device_id='MKT_2', name='x', location='x')
+        store('MKT_2', DAY, [5.0] * 6 + [15.0] * 6)
+        result = report('MKT_2', DAY, DAY + timedelta(hours=1))
+        kelvin = np.array([5.0, 15.0]) + KELVIN
+        expected = ACTIVATION_ENERGY_OVER_R / -np.log(np.mean(np.exp(-ACTIVATION_ENERGY_OVER_R / kelvin))) - KELVIN
+        self.assertAlmostEqual(result['mean_kinetic_temperature'], expected, places=2)
+        self.assertGreater(result['mean_kinetic_temperature'], 10.0)
+        self.assertEqual((result['seconds_above'], result['longest_excursion_seconds']), (1800, 1800))
+
+    def test_gaps_are_not_filled_and_spikes_are_ignored(self):
+        Device.objects.create(device_id='MKT_3', name='x', location='x')
+        # The reading before a two hour gap stands for three reading intervals only
+        store('MKT_3', DAY, [5.0])
+        store('MKT_3', DAY + timedelta(hours=2), [5.0])
+        store('MKT_3', DAY + timedelta(hours=2, minutes=1), [40.0], suspect='spike')
+        result = report('MKT_3', DAY, DAY + timedelta(hours=3))
+        self.assertEqual((result['samples'], result['covered_seconds']), (2, 1800))
+        self.assertEqual((result['max_temperature'], result['seconds_above']), (5.0, 0))
+
+
+class ComplianceRollupTests(TestCase):
+    """Reports over settled days are assembled from daily rollups and must match the raw computation"""
+
+    def setUp(self):
+        Device.objects.create(device_id='ROLL_1', name='x', location='x')
+        # Three days at 5 °C with an excursion from 23:00 on the first day to 01:00 on the second
+        temperatures = [5.0] * (3 * 288)
+        temperatures[276:300] = [9.0] * 24
+        store('ROLL_1', DAY, temperatures)
+
+    def raw(self, start, end):
+        # With no day settled yet, the whole period is computed from readings
+        long_ago = datetime(2000, 1, 1, tzinfo=dt_timezone.utc)
+        with mock.patch.object(compliance, 'settled_until', return_value=long_ago):
+            return report('ROLL_1', start, end)
+
+    def test_excursion_across_midnight_is_joined(self):
+        result = report('ROLL_1', DAY, DAY + timedelta(days=3))
+        self.assertEqual(DailyReadingRollup.objects.filter(device_id='ROLL_1').count(), 3)
+        self.assertEqual((result['seconds_above'], result['longest_excursion_seconds']), (7200, 7200))
+        self.assertEqual(result, self.raw(DAY, DAY + timedelta(days=3)))
+
+    def test_partial_days_at_either_end_match_the_raw_computation(self):
+        start, end = DAY + timedelta(hours=23, minutes=30), DAY + timedelta(days=2, hours=12)
+        result = report('ROLL_1', start, end)
+        self.assertEqual(result['longest_excursion_seconds'], 5400)
+        self.assertEqual(result, self.raw(start, end))
+
+    def test_stored_rollups_are_reused(self):
+        report('ROLL_1', DAY, DAY + timedelta(days=3))
+        built = ComplianceReport(DAY, DAY + timedelta(days=3), 2.0, 8.0, ['ROLL_1'])
+        self.assertEqual(built.ensure_rollups(DAY, DAY + timedelta(days=3)), 0)
+        # Rollups stored for other range bounds are rebuilt in place
+        result = report('ROLL_1', DAY, DAY + timedelta(days=3), range_max=4.0)
+        self.assertEqual(result['seconds_above'], 3 * 86400)
+        rollups = DailyReadingRollup.objects.filter(device_id='ROLL_1')
+        self.assertEqual(list(rollups.values_list('range_max', flat=True)), [4.0] * 3)
+
+    def test_backfilled_reading_replaces_the_rollup_of_its_day(self):
+        report('ROLL_1', DAY, DAY + timedelta(days=3))
+        ReadingService(notify=False).ingest([
+            ('ROLL_1', 20.0, 40.0, 'AC', 100.0, DAY + timedelta(days=1, hours=12, minutes=2))
+        ])
+        self.assertEqual(DailyReadingRollup.objects.filter(device_id='ROLL_1').count(), 2)
+        result = report('ROLL_1', DAY, DAY + timedelta(days=3))
+        self.assertEqual(result['max_temperature'], 20.0)
+        self.assertEqual(result, self.raw(DAY, DAY + timedelta(days=3)))
+
+
+class ComplianceReportViewTests(APITestCase):
+    url = '/api/monitoring/analytics/compliance/'
+
+    def setUp(self):
+        self.client.force_authenticate(get_user_model().objects.create_user('viewer@example.com', 'password'))
+
+    def test_report(self):
+        Device.objects.create(device_id='VIEW_1', name='x', location='x')
+        Device.objects.create(device_id='VIEW_2', name='x', location='x')
+        store('VIEW_1', DAY, [5.0] * 12)
+        response = self.client.get(self.url, {
+            'start': DAY.isoformat(), 'end': (DAY + timedelta(hours=1)).isoformat(), 'device_id': 'VIEW_1',
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.data['range_min'], response.data['range_max']), (2.0, 8.0))
+        self.assertEqual([device['device_id'] for device in response.data['devices']], ['VIEW_1'])
+
+    def test_invalid_parameters(self):
+        self.assertEqual(self.client.get(self.url).status_code, 400)
+        self.assertEqual(self.client.get(self.url, {'start': 'x', 'end': 'y'}).status_code, 400)
+        self.assertEqual(self.client.get(self.url, {
+            'start': DAY.isoformat(), 'end': DAY.isoformat()
+        }).status_code, 400)
+        self.assertEqual(self.client.get(self.url, {
+            'start': DAY.isoformat(), 'end': (DAY + timedelta(hours=1)).isoformat(), 'range_min': 'cold'
+        }).status_code, 400)
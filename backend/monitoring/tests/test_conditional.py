@@ -0,0 +1,127 @@
+from datetime import datetime, timedelta, timezone as dt_timezone
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import SimpleTestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APITestCase
+
+from monitoring import conditional
+from monitoring.models import Incident
+from monitoring.services.reading_service import ReadingService
+from notifications.models import Notification, Operator
+
+T0 = datetime(2024, 1, 1, tzinfo=dt_timezone.utc)
+
+
+class SharedCacheTests(SimpleTestCase):
+    def test_memory_cache_is_not_shared(self):
+        with override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}):
+            self.assertFalse(conditional.shared_cache())
+        with override_settings(CACHES={'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': 'redis://localhost:6379',
+        }}):
+            self.assertTrue(conditional.shared_cache())
+
+
+class ConditionalGetTestCase(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = get_user_model().objects.create_user('operator@example.com', 'password')
+        self.operator = Operator.objects.create(user=self.user, name='Operator')
+        self.client.force_authenticate(self.user)
+
+    def revalidate(self, url, response):
+        return self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+
+
+class ReadingsConditionalTests(ConditionalGetTestCase):
+    url = '/api/monitoring/readings/'
+
+    def test_unchanged_readings_get_304_and_a_new_reading_200(self):
+        service = ReadingService(notify=False)
+        service.ingest([('COND_1', 5.0, 40.0, 'AC', 100.0, T0)])
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Cache-Control'], 'private, no-cache')
+
+        not_modified = self.revalidate(self.url, response)
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(not_modified.content, b'')
+
+        service.ingest([('COND_1', 5.0, 40.0, 'AC', 100.0, T0 + timedelta(minutes=1))])
+        self.assertEqual(self.revalidate(self.url, response).status_code, 200)
+
+
+class IncidentsConditionalTests(ConditionalGetTestCase):
+    url = '/api/monitoring/incidents/'
+
+    def setUp(self):
+        super().setUp()
+        with self.captureOnCommitCallbacks(execute=True):
+            ReadingService(notify=False).ingest([('COND_2', 12.0, 40.0, 'AC', 100.0, T0)])
+        self.incident = Incident.objects.get(device__device_id='COND_2')
+
+    def test_not_conditional_without_a_shared_cache(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('ETag', response)
+        self.assertNotIn('Last-Modified', response)
+
+    @mock.patch.object(conditional, 'shared_cache', return_value=True)
+    def test_unchanged_incidents_get_304_until_one_is_saved(self, shared_cache):
+        response = self.client.get(self.url)
+        self.assertIn('Last-Modified', response)
+        self.assertEqual(self.revalidate(self.url, response).status_code, 304)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.incident.status = 'acknowledged'
+            self.incident.save()
+        changed = self.revalidate(self.url, response)
+        self.assertEqual(changed.status_code, 200)
+        self.assertEqual(changed.data[0]['status'], 'acknowledged')
+
+    @mock.patch.object(conditional, 'shared_cache', return_value=True)
+    def test_validator_is_per_user(self, shared_cache):
+        response = self.client.get(self.url)
+        other = get_user_model().objects.create_user('viewer@example.com', 'password')
+        self.client.force_authenticate(other)
+        self.assertEqual(self.revalidate(self.url, response).status_code, 200)
+
+
+class NotificationsConditionalTests(ConditionalGetTestCase):
+    url = '/api/notifications/'
+
+    def setUp(self):
+        super().setUp()
+        self.notification = Notification.objects.create(
+            operator=self.operator, notification_type='EMAIL', message='Temperature out of range'
+        )
+
+    def test_unchanged_notifications_get_304(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('Last-Modified', response)
+        self.assertEqual(self.revalidate(self.url, response).status_code, 304)
+
+    def test_changes_show_without_a_cache_version_bump(self):
+        # Another worker's write: nothing reaches this process's cache
+        response = self.client.get(self.url)
+        Notification.objects.filter(pk=self.notification.pk).update(
+            status='READ', updated_at=timezone.now() + timedelta(seconds=1)
+        )
+        changed = self.revalidate(self.url, response)
+        self.assertEqual(changed.status_code, 200)
+        self.assertEqual(changed.data[0]['status'], 'READ')
+
+        Notification.objects.filter(pk=self.notification.pk).delete()
+        self.assertEqual(self.revalidate(self.url, changed).status_code, 200)
+
+    def test_other_operators_notifications_do_not_change_the_validator(self):
+        response = self.client.get(self.url)
+        other = Operator.objects.create(
+            user=get_user_model().objects.create_user('other@example.com', 'password'), name='Other'
+        )
+        Notification.objects.create(operator=other, notification_type='EMAIL', message='x')
+        self.assertEqual(self.revalidate(self.url, response).status_code, 304)
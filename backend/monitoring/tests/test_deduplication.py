@@ -0,0 +1,51 @@
+from datetime import datetime, timezone as dt_timezone
+
+from rest_framework.test import APITestCase
+
+from monitoring.models import Alert, Incident, Reading
+from monitoring.services.reading_service import ReadingService
+
+T0 = datetime(2024, 1, 1, tzinfo=dt_timezone.utc)
+
+
+def record(device_id, temperature, timestamp=T0):
+    return (device_id, temperature, 40.0, 'AC', 100.0, timestamp)
+
+
+class ReadingDeduplicationTests(APITestCase):
+    def test_ingest_skips_readings_already_stored(self):
+        service = ReadingService(notify=False)
+        first = service.ingest([record('DUP_1', 5.0)])
+        again = service.ingest([record('DUP_1', 5.0), record('DUP_1', 5.0, T0.replace(minute=1))])
+        self.assertIsNotNone(first[0])
+        self.assertIsNone(again[0])
+        self.assertIsNotNone(again[1])
+        self.assertEqual(Reading.objects.filter(device_id='DUP_1').count(), 2)
+
+    def test_a_pair_repeated_within_a_batch_is_stored_once(self):
+        readings = ReadingService(notify=False).ingest([record('DUP_2', 5.0), record('DUP_2', 5.0)])
+        self.assertEqual(sum(reading is not None for reading in readings), 1)
+        self.assertEqual(Reading.objects.filter(device_id='DUP_2').count(), 1)
+
+    def test_a_resent_reading_is_not_evaluated_again(self):
+        service = ReadingService(notify=False)
+        service.ingest([record('DUP_3', 12.0)])
+        service.ingest([record('DUP_3', 12.0)])
+        incident = Incident.objects.get(device__device_id='DUP_3')
+        self.assertEqual(incident.alert_count, 1)
+        self.assertEqual(Alert.objects.get(device__device_id='DUP_3').sample_count, 1)
+
+    def test_esp_endpoint_acknowledges_a_retry_with_200(self):
+        body = {'device_id': 'DUP_4', 'temperature': 5.0, 'humidity': 40.0, 'timestamp': T0.isoformat()}
+        first = self.client.post('/api/monitoring/esp/reading/', body, format='json')
+        retry = self.client.post('/api/monitoring/esp/reading/', body, format='json')
+        self.assertEqual((first.status_code, retry.status_code), (201, 200))
+        self.assertEqual(retry.data['id'], first.data['id'])
+        self.assertEqual(Reading.objects.filter(device_id='DUP_4').count(), 1)
+
+    def test_batch_endpoint_counts_duplicates(self):
+        readings = [{'device_id': 'DUP_5', 'temperature': 5.0, 'humidity': 40.0, 'timestamp': T0.isoformat()}]
+        self.client.post('/api/monitoring/esp/readings/batch/', readings, format='json')
+        response = self.client.post('/api/monitoring/esp/readings/batch/', readings, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual((response.data['accepted'], response.data['duplicates']), (1, 1))
@@ -0,0 +1,160 @@
+import json
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+from django.test import TestCase, override_settings
+from rest_framework.test import APITestCase
+
+from monitoring.device_auth import DeviceKeys, device_keys, publish_key_change, sign_payload, sign_request
+from monitoring.ingest import encode_reading
+from monitoring.management.commands.ingest_gateway import Command
+from monitoring.models import Device, Reading
+
+KEY = 'k' * 40
+
+
+def reading(device_id, temperature=5.0):
+    return {'device_id': device_id, 'temperature': temperature, 'humidity': 40.0}
+
+
+class DeviceAuthTestCase(TestCase):
+    def setUp(self):
+        self.device = Device.objects.create(device_id='AUTH_1', name='x', location='x', api_key=KEY)
+        # Keys are cached per process; test databases are rolled back without delete signals
+        self.addCleanup(device_keys.set, 'AUTH_1', '')
+
+
+class DeviceCredentialEndpointTests(DeviceAuthTestCase, APITestCase):
+    url = '/api/monitoring/esp/reading/'
+
+    def post(self, data, **headers):
+        return self.client.post(self.url, json.dumps(data), content_type='application/json', **headers)
+
+    def signed_headers(self, body, device_id='AUTH_1', key=KEY, timestamp=None):
+        timestamp = int(time.time()) if timestamp is None else timestamp
+        return {
+            'HTTP_X_DEVICE_ID': device_id,
+            'HTTP_X_TIMESTAMP': str(timestamp),
+            'HTTP_X_SIGNATURE': sign_request(key, device_id, timestamp, json.dumps(body).encode()),
+        }
+
+    def test_signed_request_is_accepted(self):
+        body = reading('AUTH_1')
+        self.assertEqual(self.post(body, **self.signed_headers(body)).status_code, 201)
+
+    def test_key_header_is_accepted(self):
+        response = self.post(reading('AUTH_1'), HTTP_X_DEVICE_ID='AUTH_1', HTTP_X_DEVICE_KEY=KEY)
+        self.assertEqual(response.status_code, 201)
+
+    def test_keyed_device_without_credentials_is_refused(self):
+        self.assertEqual(self.post(reading('AUTH_1')).status_code, 401)
+        self.assertFalse(Reading.objects.exists())
+
+    def test_wrong_key_and_tampered_body_are_refused(self):
+        body = reading('AUTH_1')
+        self.assertEqual(self.post(body, **self.signed_headers(body, key='x' * 40)).status_code, 401)
+        self.assertEqual(self.post(reading('AUTH_1', 9.0), **self.signed_headers(body)).status_code, 401)
+
+    def test_expired_signature_is_refused(self):
+        body = reading('AUTH_1')
+        headers = self.signed_headers(body, timestamp=int(time.time()) - 3600)
+        self.assertEqual(self.post(body, **headers).status_code, 401)
+
+    def test_device_cannot_post_for_another_keyed_device(self):
+        Device.objects.create(device_id='AUTH_2', name='x', location='x', api_key='o' * 40)
+        self.addCleanup(device_keys.set, 'AUTH_2', '')
+        body = reading('AUTH_2')
+        self.assertEqual(self.post(body, **self.signed_headers(body)).status_code, 403)
+
+    def test_devices_without_keys_are_accepted_unless_keys_are_required(self):
+        self.assertEqual(self.post(reading('OPEN_1')).status_code, 201)
+        with override_settings(INGEST_REQUIRE_DEVICE_KEY=True):
+            self.assertEqual(self.post(reading('OPEN_1')).status_code, 401)
+
+    def test_rotating_the_key_invalidates_the_old_one(self):
+        self.device.api_key = 'n' * 40
+        self.device.save()
+        response = self.post(reading('AUTH_1'), HTTP_X_DEVICE_ID='AUTH_1', HTTP_X_DEVICE_KEY=KEY)
+        self.assertEqual(response.status_code, 401)
+
+
+class GatewayCredentialTests(DeviceAuthTestCase):
+    """The gateway applies the endpoints' rules to signed MQTT/UDP messages"""
+
+    def decode(self, *payloads, topic_device_id=None):
+        return Command()._decode([(payload, topic_device_id, None) for payload in payloads])
+
+    def test_signed_message_is_accepted(self):
+        body = json.dumps({'temperature': 5.0, 'humidity': 40.0}).encode()
+        records, rejected = self.decode(sign_payload(KEY, 'AUTH_1', body))
+        self.assertEqual(([record[0] for record in records], rejected), (['AUTH_1'], 0))
+
+    def test_signed_packed_records_are_accepted(self):
+        records, rejected = self.decode(sign_payload(KEY, 'AUTH_1', encode_reading('AUTH_1', 5.0, 40.0)))
+        self.assertEqual((len(records), rejected), (1, 0))
+
+    def test_unsigned_readings_of_a_keyed_device_are_rejected(self):
+        records, rejected = self.decode(json.dumps(reading('AUTH_1')).encode(), encode_reading('AUTH_1', 5.0, 40.0))
+        self.assertEqual((records, rejected), ([], 2))
+
+    def test_forged_and_expired_envelopes_are_rejected(self):
+        body = json.dumps(reading('AUTH_1')).encode()
+        forged = sign_payload('x' * 40, 'AUTH_1', body)
+        expired = sign_payload(KEY, 'AUTH_1', body, timestamp=int(time.time()) - 3600)
+        self.assertEqual(self.decode(forged, expired, b'\x00garbage'), ([], 3))
+
+    def test_a_device_cannot_sign_for_another_keyed_device(self):
+        Device.objects.create(device_id='AUTH_3', name='x', location='x', api_key='o' * 40)
+        self.addCleanup(device_keys.set, 'AUTH_3', '')
+        body = json.dumps([reading('AUTH_3'), reading('AUTH_1')]).encode()
+        records, rejected = self.decode(sign_payload(KEY, 'AUTH_1', body))
+        self.assertEqual(([record[0] for record in records], rejected), (['AUTH_1'], 1))
+
+    def test_unsigned_messages_are_refused_when_keys_are_required(self):
+        body = json.dumps({'temperature': 5.0, 'humidity': 40.0}).encode()
+        self.assertEqual(len(self.decode(body, topic_device_id='OPEN_2')[0]), 1)
+        with override_settings(INGEST_REQUIRE_DEVICE_KEY=True):
+            self.assertEqual(self.decode(body, topic_device_id='OPEN_2'), ([], 1))
+
+
+class KeyRotationTests(DeviceAuthTestCase):
+    """Other processes stop accepting a rotated-out key, not only the one that rotated it"""
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.addCleanup(cache.clear)
+        # Another worker's copy of the keys
+        self.worker = DeviceKeys()
+        self.assertEqual(self.worker.get('AUTH_1'), KEY)
+
+    def test_rotation_reaches_other_processes(self):
+        with self.assertNumQueries(0):
+            self.assertEqual(self.worker.get('AUTH_1'), KEY)
+        with self.captureOnCommitCallbacks(execute=True):
+            new_key = self.device.rotate_api_key()
+        # The copy is trusted until the next check against the shared version stamp
+        self.assertEqual(self.worker.get('AUTH_1'), KEY)
+        with override_settings(DEVICE_KEY_CHECK_INTERVAL=0):
+            self.assertEqual(self.worker.get('AUTH_1'), new_key)
+            with self.assertNumQueries(0):
+                self.worker.get('AUTH_1')
+
+    def test_saves_that_keep_the_key_publish_nothing(self):
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            self.device.status = 'online'
+            self.device.save()
+        self.assertNotIn(publish_key_change, callbacks)
+
+    def test_rolled_back_rotation_publishes_nothing(self):
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            try:
+                with transaction.atomic():
+                    self.device.rotate_api_key()
+                    raise RuntimeError
+            except RuntimeError:
+                pass
+        self.assertEqual(callbacks, [])
+        with override_settings(DEVICE_KEY_CHECK_INTERVAL=0), self.assertNumQueries(0):
+            self.assertEqual(self.worker.get('AUTH_1'), KEY)
@@ -0,0 +1,178 @@
+from datetime import timedelta
+from io import StringIO
+from unittest import skipUnless
+
+from django.contrib.auth import get_user_model
+from django.core import mail
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APITestCase
+
+from monitoring.models import Alert, Device, EscalationDeadline, Incident, IncidentTimelineEvent, Reading
+from monitoring.services.escalation import (
+    EscalationScheduler, escalation_delays, level_reached, schedule_escalation
+)
+from monitoring.services.reading_service import ReadingService
+from notifications.models import Notification, Operator
+
+
+def open_incident(device_id, minutes_ago, status='open'):
+    """An incident whose escalation clock started minutes_ago, with its level 2 deadline"""
+    device = Device.objects.create(device_id=device_id, name='x', location='x')
+    started_at = timezone.now() - timedelta(minutes=minutes_ago)
+    reading = Reading.objects.create(device_id=device_id, temperature=12.0, humidity=40.0, timestamp=started_at)
+    alert = Alert.objects.create(
+        device=device, reading=reading, alert_type='high_temperature', severity='critical', message='x',
+        timestamp=started_at
+    )
+    incident = Incident.objects.create(
+        device=device, alert=alert, description='x', status=status, start_time=started_at,
+        current_escalation_level=1
+    )
+    schedule_escalation(incident, started_at)
+    return incident
+
+
+def operator(email, priority):
+    return Operator.objects.create(
+        user=get_user_model().objects.create_user(email, 'password'), name=email, priority=priority
+    )
+
+
+class EscalationLevelTests(TestCase):
+    def test_level_reached(self):
+        start = timezone.now()
+        delays = escalation_delays()
+        self.assertEqual(level_reached(start, start + delays[2] - timedelta(seconds=1)), 1)
+        self.assertEqual(level_reached(start, start + delays[2]), 2)
+        self.assertEqual(level_reached(start, start + delays[3] + timedelta(days=1)), 3)
+
+
+class EscalationSchedulerTests(TestCase):
+    def setUp(self):
+        self.secondary = operator('secondary@example.com', 2)
+        self.tertiary = operator('tertiary@example.com', 3)
+
+    def run_once(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            return EscalationScheduler(ReadingService()).run(once=True)
+
+    def test_out_of_range_reading_schedules_level_2(self):
+        ReadingService(notify=False).ingest([('ESC_1', 12.0, 40.0, 'AC', 100.0, timezone.now())])
+        deadline = EscalationDeadline.objects.get(incident__device__device_id='ESC_1')
+        self.assertEqual(deadline.level, 2)
+
+    def test_unacknowledged_incident_escalates_level_by_level(self):
+        incident = open_incident('ESC_2', minutes_ago=20)
+        self.assertEqual(self.run_once(), 1)
+        incident.refresh_from_db()
+        self.assertEqual(incident.current_escalation_level, 2)
+        self.assertEqual(EscalationDeadline.objects.get(incident=incident).level, 3)
+        self.assertEqual(
+            list(Notification.objects.filter(incident=incident).values_list('operator', 'status')),
+            [(self.secondary.pk, 'SENT')]
+        )
+        self.assertEqual([message.to for message in mail.outbox], [['secondary@example.com']])
+        self.assertTrue(IncidentTimelineEvent.objects.filter(
+            incident=incident, event_type='escalation_changed', metadata__new_level=2
+        ).exists())
+
+        # Level 3 is not due yet
+        self.assertEqual(self.run_once(), 0)
+
+    def test_overdue_levels_fire_in_one_run(self):
+        incident = open_incident('ESC_3', minutes_ago=60)
+        self.assertEqual(self.run_once(), 2)
+        incident.refresh_from_db()
+        self.assertEqual(incident.current_escalation_level, 3)
+        self.assertFalse(EscalationDeadline.objects.filter(incident=incident).exists())
+        self.assertEqual(
+            set(Notification.objects.filter(incident=incident).values_list('operator', flat=True)),
+            {self.secondary.pk, self.tertiary.pk}
+        )
+
+    def test_incident_no_longer_open_is_not_escalated(self):
+        incident = open_incident('ESC_4', minutes_ago=20, status='resolved')
+        self.assertEqual(self.run_once(), 0)
+        incident.refresh_from_db()
+        self.assertEqual(incident.current_escalation_level, 1)
+        self.assertFalse(EscalationDeadline.objects.filter(incident=incident).exists())
+
+    def test_rescheduled_deadline_waits_for_its_new_time(self):
+        incident = open_incident('ESC_5', minutes_ago=20)
+        scheduler = EscalationScheduler(ReadingService())
+        scheduler.load()
+        EscalationDeadline.objects.filter(incident=incident).update(started_at=timezone.now())
+        self.assertEqual(scheduler.fire_due(), 0)
+        self.assertEqual(len(scheduler.heap), 1)
+        incident.refresh_from_db()
+        self.assertEqual(incident.current_escalation_level, 1)
+
+    def test_a_deadline_is_fired_by_one_scheduler_only(self):
+        incident = open_incident('ESC_6', minutes_ago=20)
+        first, second = EscalationScheduler(ReadingService()), EscalationScheduler(ReadingService())
+        first.load()
+        second.load()
+        self.assertEqual((first.fire_due(), second.fire_due()), (1, 0))
+        self.assertEqual(IncidentTimelineEvent.objects.filter(
+            incident=incident, event_type='escalation_changed'
+        ).count(), 1)
+
+    def test_incident_acknowledged_after_loading_keeps_its_status(self):
+        incident = open_incident('ESC_10', minutes_ago=20)
+        scheduler = EscalationScheduler(ReadingService())
+        scheduler.load()
+        Incident.objects.filter(pk=incident.pk).update(status='acknowledged')
+        self.assertEqual(scheduler.fire_due(), 0)
+        incident.refresh_from_db()
+        self.assertEqual((incident.status, incident.current_escalation_level), ('acknowledged', 1))
+
+    def test_escalation_is_written_in_bulk(self):
+        incident = open_incident('ESC_11', minutes_ago=20)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.run_once(), 1)
+        event_table = f'"{IncidentTimelineEvent._meta.db_table}"'
+        self.assertEqual(sum(
+            query['sql'].startswith('INSERT') and event_table in query['sql'].split('(')[0] for query in queries
+        ), 2)  # The escalation, then the notification once it was sent
+        self.assertEqual(
+            list(IncidentTimelineEvent.objects.filter(incident=incident).order_by('id').values_list(
+                'event_type', flat=True
+            )),
+            ['escalation_changed', 'notification_sent']
+        )
+
+    def test_command(self):
+        open_incident('ESC_7', minutes_ago=20)
+        out = StringIO()
+        call_command('run_escalations', '--once', stdout=out)
+        self.assertIn('Escalated 1 incidents', out.getvalue())
+
+
+class AcknowledgementTests(APITestCase):
+    def test_acknowledging_stops_escalation(self):
+        primary = operator('primary@example.com', 1)
+        self.client.force_authenticate(primary.user)
+        incident = open_incident('ESC_8', minutes_ago=20)
+        response = self.client.post(f'/api/monitoring/incidents/{incident.pk}/acknowledge/')
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(EscalationDeadline.objects.filter(incident=incident).exists())
+        self.assertEqual(EscalationScheduler(ReadingService()).run(once=True), 0)
+
+
+@skipUnless(connection.vendor == 'postgresql', 'LISTEN/NOTIFY runs on PostgreSQL only')
+class EscalationNotifyTests(TransactionTestCase):
+    def test_committed_deadlines_reach_a_waiting_scheduler(self):
+        scheduler = EscalationScheduler(ReadingService())
+        scheduler._listen()
+        scheduler.load()
+        self.assertEqual(scheduler.heap, [])
+
+        with transaction.atomic():
+            incident = open_incident('ESC_9', minutes_ago=0)
+        started_at = EscalationDeadline.objects.get(incident=incident).started_at
+        scheduler._wait()
+        self.assertEqual(scheduler.heap, [(started_at + escalation_delays()[2], incident.pk, 2)])
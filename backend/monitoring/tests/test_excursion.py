@@ -0,0 +1,89 @@
+import json
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+from rest_framework.test import APIRequestFactory, APITestCase, force_authenticate
+
+from monitoring.models import Alert, Incident
+from monitoring.services.reading_service import ReadingService
+from monitoring.views import ReadingExportView
+
+T0 = datetime(2024, 1, 1, tzinfo=dt_timezone.utc)
+STEP = timedelta(minutes=5)
+
+
+def series(device_id, temperatures, start=T0):
+    return [(device_id, temperature, 40.0, 'AC', 100.0, start + STEP * i) for i, temperature in enumerate(temperatures)]
+
+
+class ExcursionAlertTests(TestCase):
+    def alerts(self, device_id):
+        return Alert.objects.filter(device__device_id=device_id).order_by('timestamp')
+
+    def test_one_alert_covers_the_whole_excursion(self):
+        ReadingService(notify=False).ingest(series('EXC_1', [5.0, 8.5, 9.2, 9.8, 8.9, 5.0]))
+        alert = self.alerts('EXC_1').get()
+        self.assertEqual((alert.alert_type, alert.severity), ('high_temperature', 'critical'))
+        self.assertEqual((alert.timestamp, alert.last_timestamp), (T0 + STEP, T0 + STEP * 4))
+        self.assertEqual((alert.sample_count, alert.peak_temperature), (4, 9.8))
+        self.assertEqual(alert.duration, STEP * 3)
+
+        incident = Incident.objects.get(device__device_id='EXC_1')
+        self.assertEqual((incident.alert, incident.alert_count, incident.status), (alert, 1, 'resolved'))
+
+    def test_readings_arriving_one_by_one_extend_the_same_alert(self):
+        service = ReadingService(notify=False)
+        for record in series('EXC_2', [5.0, 1.5, 0.8, 1.2]):
+            service.ingest([record])
+        alert = self.alerts('EXC_2').get()
+        # The peak of a low excursion is its lowest reading
+        self.assertEqual((alert.alert_type, alert.sample_count, alert.peak_temperature), ('low_temperature', 3, 0.8))
+        self.assertEqual(Incident.objects.get(device__device_id='EXC_2').status, 'open')
+
+    def test_severity_is_raised_and_never_lowered(self):
+        ReadingService(notify=False).ingest(series('EXC_3', [5.0, 9.0, 10.5, 9.0]))
+        alert = self.alerts('EXC_3').get()
+        self.assertEqual((alert.severity, alert.peak_temperature), ('severe', 10.5))
+
+    def test_each_excursion_gets_its_own_alert_and_incident(self):
+        ReadingService(notify=False).ingest(series('EXC_4', [5.0, 9.0, 9.1, 5.0, 5.1, 1.0, 5.0]))
+        alerts = self.alerts('EXC_4')
+        self.assertEqual(
+            list(alerts.values_list('alert_type', 'sample_count')),
+            [('high_temperature', 2), ('low_temperature', 1)]
+        )
+        self.assertEqual(Incident.objects.filter(device__device_id='EXC_4').count(), 2)
+
+
+class ExcursionViewTests(APITestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user('viewer@example.com', 'password')
+        self.client.force_authenticate(self.user)
+        ReadingService(notify=False).ingest(series('EXC_5', [5.0, 8.5, 9.0, 8.7, 5.0]))
+        self.alert = Alert.objects.get(device__device_id='EXC_5')
+
+    def test_alert_lists_its_excursion(self):
+        response = self.client.get(f'/api/monitoring/alerts/{self.alert.pk}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            (response.data['sample_count'], response.data['consecutive_count'], response.data['peak_temperature']),
+            (3, 3, 9.0)
+        )
+        self.assertEqual(response.data['duration_seconds'], 600)
+
+        response = self.client.get(f'/api/monitoring/alerts/{self.alert.pk}/readings/')
+        self.assertEqual([reading['temperature'] for reading in response.data], [8.5, 9.0, 8.7])
+
+    def test_export_marks_every_reading_of_the_excursion(self):
+        request = APIRequestFactory().get('/', {
+            'start_date': T0.isoformat(), 'end_date': (T0 + timedelta(hours=1)).isoformat(),
+            'device_id': 'EXC_5', 'format': 'json',
+        })
+        force_authenticate(request, self.user)
+        response = ReadingExportView.as_view()(request)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [row['alert_status'] for row in json.loads(response.content)],
+            ['Normal'] + ['High Temperature'] * 3 + ['Normal']
+        )
@@ -0,0 +1,84 @@
+from datetime import timedelta
+from unittest import skipUnless
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import TestCase
+from django.utils import timezone
+from rest_framework.test import APITestCase
+
+from monitoring.models import Device, Incident
+from monitoring.services.fleet import FleetSnapshotService
+from monitoring.services.reading_service import ReadingService
+
+
+class FleetSnapshotTests(TestCase):
+    def setUp(self):
+        self.now = timezone.now()
+        service = ReadingService(notify=False)
+        service.ingest([
+            ('FLEET_A', 4.5, 40.0, 'AC', 100.0, self.now - timedelta(minutes=10)),
+            ('FLEET_A', 4.0, 40.0, 'AC', 100.0, self.now - timedelta(minutes=5)),
+            ('FLEET_B', 6.0, 40.0, 'AC', 100.0, self.now - timedelta(minutes=20)),
+            ('FLEET_B', 12.0, 40.0, 'AC', 100.0, self.now - timedelta(minutes=15)),
+            ('FLEET_C', 5.0, 40.0, 'AC', 100.0, self.now - timedelta(minutes=3)),
+        ])
+        Device.objects.create(device_id='FLEET_D', name='Spare', location='Store')
+
+    def devices(self):
+        return {device['device_id']: device for device in FleetSnapshotService().snapshot()['devices']}
+
+    def test_one_query_for_the_whole_fleet(self):
+        with self.assertNumQueries(1):
+            snapshot = FleetSnapshotService().snapshot()
+        self.assertEqual(snapshot['count'], 4)
+        self.assertEqual([device['device_id'] for device in snapshot['devices']],
+                         ['FLEET_A', 'FLEET_B', 'FLEET_C', 'FLEET_D'])
+
+    def test_latest_previous_and_trend(self):
+        devices = self.devices()
+        self.assertEqual(devices['FLEET_A']['latest']['temperature'], 4.0)
+        self.assertEqual(devices['FLEET_A']['previous']['temperature'], 4.5)
+        self.assertEqual(devices['FLEET_A']['trend'], 'decreasing')
+        self.assertEqual(devices['FLEET_B']['trend'], 'increasing')
+        self.assertEqual((devices['FLEET_C']['previous'], devices['FLEET_C']['trend']), (None, 'stable'))
+
+    def test_last_contact_is_when_the_device_last_reported(self):
+        Device.objects.filter(device_id='FLEET_A').update(last_reading=self.now - timedelta(minutes=2))
+        self.assertAlmostEqual(self.devices()['FLEET_A']['seconds_since_contact'], 120, delta=5)
+
+    def test_device_without_readings(self):
+        device = self.devices()['FLEET_D']
+        self.assertEqual(
+            (device['latest'], device['previous'], device['incident'], device['last_contact']),
+            (None, None, None, None)
+        )
+
+    def test_only_active_incidents_are_shown(self):
+        incident = Incident.objects.get(device__device_id='FLEET_B')
+        state = self.devices()['FLEET_B']['incident']
+        self.assertEqual((state['id'], state['status'], state['alert_count']), (incident.id, 'open', 1))
+        self.assertIsNone(self.devices()['FLEET_C']['incident'])
+
+        incident.status = 'resolved'
+        incident.save()
+        self.assertIsNone(self.devices()['FLEET_B']['incident'])
+
+    @skipUnless(connection.vendor == 'postgresql', 'LATERAL query runs on PostgreSQL only')
+    def test_postgresql_query_matches_the_portable_one(self):
+        service = FleetSnapshotService()
+        self.assertEqual(
+            [service._device_state(row, self.now) for row in service._fetch_postgresql()],
+            [service._device_state(row, self.now) for row in service._fetch_portable()],
+        )
+
+
+class FleetSnapshotViewTests(APITestCase):
+    url = '/api/monitoring/fleet/snapshot/'
+
+    def test_requires_authentication(self):
+        self.assertEqual(self.client.get(self.url).status_code, 401)
+        self.client.force_authenticate(get_user_model().objects.create_user('viewer@example.com', 'password'))
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['count'], 0)
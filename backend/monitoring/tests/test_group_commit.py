@@ -0,0 +1,66 @@
+import threading
+import time
+from unittest import mock
+
+from django.test import SimpleTestCase, override_settings
+
+from monitoring.services import group_commit
+from monitoring.services.group_commit import GroupCommitter, get_group_committer
+from monitoring.services.reading_service import ReadingService
+
+
+class GroupCommitterTests(SimpleTestCase):
+    def submit_concurrently(self, committer, records):
+        results = {}
+
+        def submit(record):
+            try:
+                results[record] = committer.submit(record)
+            except Exception as e:
+                results[record] = e
+
+        threads = [threading.Thread(target=submit, args=(record,)) for record in records]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(5)
+        return results
+
+    def test_concurrent_submissions_are_written_together(self):
+        calls = []
+
+        def ingest(service, records):
+            calls.append(list(records))
+            return [f'reading {record}' for record in records]
+
+        with mock.patch.object(ReadingService, 'ingest', autospec=True, side_effect=ingest):
+            results = self.submit_concurrently(GroupCommitter(max_delay=0.5, max_batch=4), ['a', 'b', 'c', 'd'])
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(sorted(calls[0]), ['a', 'b', 'c', 'd'])
+        self.assertEqual(results, {record: f'reading {record}' for record in 'abcd'})
+
+    def test_a_full_group_is_written_without_waiting_for_the_delay(self):
+        with mock.patch.object(ReadingService, 'ingest', autospec=True, side_effect=lambda s, records: records):
+            started = time.monotonic()
+            self.submit_concurrently(GroupCommitter(max_delay=10, max_batch=3), ['a', 'b', 'c'])
+        self.assertLess(time.monotonic() - started, 5)
+
+    def test_a_lone_submission_is_written_after_the_delay(self):
+        with mock.patch.object(ReadingService, 'ingest', autospec=True, side_effect=lambda s, records: [None]):
+            self.assertIsNone(GroupCommitter(max_delay=0.01, max_batch=100).submit('a'))
+
+    def test_every_submitter_sees_a_failed_write(self):
+        with mock.patch.object(ReadingService, 'ingest', autospec=True, side_effect=RuntimeError('down')):
+            results = self.submit_concurrently(GroupCommitter(max_delay=0.5, max_batch=2), ['a', 'b'])
+        self.assertTrue(all(isinstance(result, RuntimeError) for result in results.values()))
+
+    def test_disabled_unless_configured(self):
+        with mock.patch.object(group_commit, '_committer', None):
+            with override_settings(READING_GROUP_COMMIT=False):
+                self.assertIsNone(get_group_committer())
+            with override_settings(READING_GROUP_COMMIT=True, READING_GROUP_COMMIT_DELAY_MS=7,
+                                   READING_GROUP_COMMIT_MAX_BATCH=9):
+                committer = get_group_committer()
+                self.assertIs(get_group_committer(), committer)
+                self.assertEqual((committer.max_delay, committer.max_batch), (0.007, 9))
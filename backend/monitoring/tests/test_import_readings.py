@@ -0,0 +1,171 @@
+import json
+import os
+import tempfile
+from datetime import datetime, timedelta, timezone as dt_timezone
+from io import StringIO
+from unittest import mock
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase
+
+from monitoring.management.commands.import_readings import Command
+from monitoring.models import Alert, Device, Incident, Reading
+
+T0 = datetime(2024, 1, 1, tzinfo=dt_timezone.utc)
+STEP = timedelta(minutes=5)
+
+
+def iso(i):
+    return (T0 + STEP * i).isoformat().replace('+00:00', 'Z')
+
+
+class ImportReadingsTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+    def write(self, name, lines):
+        path = os.path.join(self.directory, name)
+        with open(path, 'w') as f:
+            f.write(''.join(f'{line}\n' for line in lines))
+        return path
+
+    def csv(self, rows, name='readings.csv'):
+        return self.write(name, ['device_id,temperature,humidity,power_status,battery_level,timestamp'] + rows)
+
+    def run_import(self, path, *args):
+        out = StringIO()
+        call_command('import_readings', path, *args, stdout=out)
+        return out.getvalue()
+
+    def test_valid_rows_are_stored_and_invalid_rows_rejected(self):
+        path = self.csv([
+            f'IMP_1,5.0,40.0,AC,100,{iso(0)}',
+            f'IMP_1,5.5,41.0,battery,80,{iso(1)}',
+            f'IMP_2,6.0,42.0,,,{iso(0)}',
+            f',5.0,40.0,AC,100,{iso(2)}',
+            f'{"X" * 101},5.0,40.0,AC,100,{iso(2)}',
+            f'IMP_1,warm,40.0,AC,100,{iso(2)}',
+            f'IMP_1,500,40.0,AC,100,{iso(3)}',
+            f'IMP_1,5.0,140.0,AC,100,{iso(4)}',
+            f'IMP_1,5.0,40.0,SOLAR,100,{iso(5)}',
+            'IMP_1,5.0,40.0,AC,100,yesterday',
+            'IMP_1,5.0,40.0,AC,100,1999-12-31T23:00:00Z',
+            'IMP_1,5.0,40.0,AC,100,2999-01-01T00:00:00Z',
+        ])
+        out = self.run_import(path)
+        self.assertIn('Imported 3 readings (0 duplicates skipped, 9 rejected)', out)
+
+        self.assertEqual(
+            list(Reading.objects.filter(device_id__startswith='IMP_').order_by('device_id', 'timestamp').values_list(
+                'device_id', 'temperature', 'power_status', 'battery_level', 'timestamp', 'suspect'
+            )),
+            [
+                ('IMP_1', 5.0, 'AC', 100.0, T0, ''),
+                ('IMP_1', 5.5, 'BATTERY', 80.0, T0 + STEP, ''),
+                ('IMP_2', 6.0, 'AC', 100.0, T0, ''),
+            ]
+        )
+        self.assertEqual(Device.objects.get(device_id='IMP_2').name, 'ESP8266 Sensor IMP_2')
+
+    def test_duplicates_are_skipped(self):
+        Reading.objects.create(device_id='IMP_3', temperature=4.0, humidity=40.0, timestamp=T0)
+        path = self.csv([
+            f'IMP_3,5.0,40.0,AC,100,{iso(0)}',
+            f'IMP_3,5.1,40.0,AC,100,{iso(1)}',
+            f'IMP_3,5.2,40.0,AC,100,{iso(1)}',
+            f'IMP_3,5.3,40.0,AC,100,{iso(2)}',
+        ])
+        out = self.run_import(path, '--chunk-size', '2')
+        self.assertIn('Imported 2 readings (2 duplicates skipped, 0 rejected)', out)
+        self.assertEqual(
+            list(Reading.objects.filter(device_id='IMP_3').order_by('timestamp').values_list('temperature', flat=True)),
+            [4.0, 5.1, 5.3]
+        )
+
+    def test_ndjson_with_epoch_timestamps(self):
+        epoch = int(T0.timestamp())
+        path = self.write('readings.ndjson', [
+            json.dumps({'device_id': 'IMP_4', 'temperature': 5.0, 'humidity': 40.0, 'timestamp': epoch}),
+            json.dumps({'device_id': 'IMP_4', 'temperature': 5.2, 'humidity': 41.0, 'timestamp': epoch + 300,
+                        'power_status': 'BATTERY', 'battery_level': 90}),
+            'not json',
+            '[1, 2]',
+        ])
+        out = self.run_import(path)
+        self.assertIn('Imported 2 readings (0 duplicates skipped, 2 rejected)', out)
+        self.assertEqual(
+            list(Reading.objects.filter(device_id='IMP_4').order_by('timestamp').values_list(
+                'timestamp', 'power_status', 'battery_level'
+            )),
+            [(T0, 'AC', 100.0), (T0 + STEP, 'BATTERY', 90.0)]
+        )
+
+    def test_missing_csv_column_is_an_error(self):
+        path = self.write('readings.csv', ['device_id,temperature,timestamp', f'IMP_5,5.0,{iso(0)}'])
+        with self.assertRaisesMessage(CommandError, 'CSV is missing required columns: humidity'):
+            self.run_import(path)
+
+    def test_interrupted_import_resumes_from_its_checkpoint(self):
+        path = self.csv([f'IMP_6,{5.0 + i / 10},40.0,AC,100,{iso(i)}' for i in range(5)])
+        load_chunk = Command._load_chunk
+        calls = []
+
+        def fail_on_second_chunk(command, valid):
+            calls.append(len(valid['device_id']))
+            if len(calls) == 2:
+                raise RuntimeError('connection lost')
+            return load_chunk(command, valid)
+
+        with mock.patch.object(Command, '_load_chunk', fail_on_second_chunk):
+            with self.assertRaises(RuntimeError):
+                self.run_import(path, '--chunk-size', '2')
+        with open(f'{path}.checkpoint.json') as f:
+            checkpoint = json.load(f)
+        self.assertEqual((checkpoint['rows_read'], checkpoint['inserted'], checkpoint['import_done']), (2, 2, False))
+        self.assertEqual(Reading.objects.filter(device_id='IMP_6').count(), 2)
+
+        out = self.run_import(path, '--chunk-size', '2')
+        self.assertIn('Resuming after 2 rows', out)
+        self.assertIn('Imported 5 readings (0 duplicates skipped, 0 rejected)', out)
+        self.assertEqual(Reading.objects.filter(device_id='IMP_6').count(), 5)
+
+        out = self.run_import(path)
+        self.assertIn('Import already completed according to checkpoint', out)
+        self.assertEqual(Reading.objects.filter(device_id='IMP_6').count(), 5)
+
+    def test_changed_file_needs_restart(self):
+        rows = [f'IMP_7,5.0,40.0,AC,100,{iso(i)}' for i in range(3)]
+        path = self.csv(rows)
+        self.run_import(path)
+
+        self.csv(rows + [f'IMP_7,5.0,40.0,AC,100,{iso(3)}'])
+        with self.assertRaisesMessage(CommandError, 'rerun with --restart'):
+            self.run_import(path)
+
+        out = self.run_import(path, '--restart')
+        self.assertIn('Imported 1 readings (3 duplicates skipped, 0 rejected)', out)
+        self.assertEqual(Reading.objects.filter(device_id='IMP_7').count(), 4)
+
+    def test_evaluate_rebuilds_alerts_and_incidents(self):
+        temperatures = [5.0, 5.1, 9.0, 9.5, 5.0, 5.1, 1.0, 5.0]
+        path = self.csv([f'IMP_8,{t},40.0,AC,100,{iso(i)}' for i, t in enumerate(temperatures)])
+        out = self.run_import(path, '--evaluate', '--chunk-size', '3')
+        self.assertIn(f'Evaluated {len(temperatures)} readings for IMP_8', out)
+
+        self.assertEqual(
+            list(Alert.objects.filter(device__device_id='IMP_8').order_by('timestamp').values_list(
+                'alert_type', 'timestamp', 'sample_count', 'peak_temperature'
+            )),
+            [('high_temperature', T0 + STEP * 2, 2, 9.5), ('low_temperature', T0 + STEP * 6, 1, 1.0)]
+        )
+        self.assertEqual(
+            list(Incident.objects.filter(device__device_id='IMP_8').values_list('status', flat=True)),
+            ['resolved', 'resolved']
+        )
+
+        # Evaluation already ran to the end, so a rerun does not duplicate alerts
+        self.run_import(path, '--evaluate')
+        self.assertEqual(Alert.objects.filter(device__device_id='IMP_8').count(), 2)
@@ -0,0 +1,132 @@
+from datetime import datetime, timedelta, timezone as dt_timezone
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core import mail
+from django.db import connection, transaction
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from monitoring.models import Alert, Incident, IncidentTimelineEvent
+from monitoring.services.incident_events import IncidentEventWriter
+from monitoring.services.reading_service import ReadingService
+from notifications.models import Notification, Operator
+
+T0 = datetime(2024, 1, 1, tzinfo=dt_timezone.utc)
+STEP = timedelta(minutes=5)
+
+
+class IncidentEventWriterTests(TestCase):
+    def setUp(self):
+        self.operators = [
+            Operator.objects.create(
+                user=get_user_model().objects.create_user(f'primary{i}@example.com', 'password'), name=f'Primary {i}'
+            )
+            for i in range(3)
+        ]
+
+    def test_notifications_and_events_are_written_in_bulk_and_sent_on_commit(self):
+        with self.captureOnCommitCallbacks() as callbacks, CaptureQueriesContext(connection) as queries:
+            ReadingService().ingest([('EVT_1', 12.0, 40.0, 'AC', 100.0, timezone.now())])
+        inserts = [query['sql'] for query in queries if query['sql'].startswith('INSERT')]
+        for model in (Notification, IncidentTimelineEvent):
+            self.assertEqual(sum(f'"{model._meta.db_table}"' in sql.split('(')[0] for sql in inserts), 1)
+
+        incident = Incident.objects.get(device__device_id='EVT_1')
+        notifications = Notification.objects.filter(incident=incident)
+        events = IncidentTimelineEvent.objects.filter(incident=incident)
+        self.assertEqual(set(notifications.values_list('status', flat=True)), {'PENDING'})
+        self.assertEqual(mail.outbox, [])
+        # Nothing has been sent yet, so the timeline says nothing about it
+        self.assertEqual(list(events.values_list('event_type', flat=True)), ['alert_created'])
+
+        for callback in callbacks:
+            callback()
+        self.assertEqual(set(notifications.values_list('status', flat=True)), {'SENT'})
+        self.assertEqual(len(mail.outbox), 3)
+        self.assertEqual(
+            sorted(events.values_list('event_type', flat=True)), ['alert_created'] + ['notification_sent'] * 3
+        )
+
+    def test_rolled_back_step_pages_nobody(self):
+        ReadingService(notify=False).ingest([('EVT_2', 12.0, 40.0, 'AC', 100.0, timezone.now())])
+        incident = Incident.objects.get(device__device_id='EVT_2')
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            try:
+                with transaction.atomic():
+                    writer = IncidentEventWriter()
+                    writer.notify(incident, self.operators[0], 'x', 1)
+                    writer.write()
+                    raise RuntimeError
+            except RuntimeError:
+                pass
+        self.assertEqual(callbacks, [])
+        self.assertFalse(Notification.objects.filter(incident=incident).exists())
+        self.assertEqual(mail.outbox, [])
+
+    def test_failed_delivery_is_recorded(self):
+        ReadingService(notify=False).ingest([('EVT_3', 12.0, 40.0, 'AC', 100.0, timezone.now())])
+        incident = Incident.objects.get(device__device_id='EVT_3')
+        writer = IncidentEventWriter()
+        for operator in self.operators[:2]:
+            writer.notify(incident, operator, 'x', 1)
+        with mock.patch('notifications.services.email_service.send_mail', side_effect=[OSError, 1]):
+            with self.captureOnCommitCallbacks(execute=True):
+                writer.write()
+        self.assertEqual(
+            list(Notification.objects.filter(incident=incident).order_by('operator').values_list(
+                'status', 'retry_count'
+            )),
+            [('FAILED', 1), ('SENT', 0)]
+        )
+        # Only the notification that went out is in the timeline
+        self.assertEqual(
+            list(IncidentTimelineEvent.objects.filter(incident=incident, event_type='notification_sent').values_list(
+                'operator', flat=True
+            )),
+            [self.operators[1].pk]
+        )
+
+    def inserts(self, queries, model):
+        return sum(
+            query['sql'].startswith('INSERT') and f'"{model._meta.db_table}"' in query['sql'].split('(')[0]
+            for query in queries
+        )
+
+    def test_sensor_fault_is_written_through_the_writer(self):
+        records = [('EVT_4', 5.0 + 0.1 * (i % 2), 40.0, 'AC', 100.0, T0 + STEP * i) for i in range(6)]
+        ReadingService().ingest(records)
+        with self.captureOnCommitCallbacks() as callbacks, CaptureQueriesContext(connection) as queries:
+            ReadingService().ingest([('EVT_4', 15.0, 40.0, 'AC', 100.0, T0 + STEP * 6)])
+        incident = Incident.objects.get(device__device_id='EVT_4', alert__alert_type='sensor_fault')
+        self.assertEqual((self.inserts(queries, IncidentTimelineEvent), self.inserts(queries, Notification)), (1, 1))
+        self.assertEqual(
+            set(Notification.objects.filter(incident=incident).values_list('status', flat=True)), {'PENDING'}
+        )
+        for callback in callbacks:
+            callback()
+        self.assertTrue(IncidentTimelineEvent.objects.filter(
+            incident=incident, event_type='notification_sent', operator=self.operators[0]
+        ).exists())
+
+        # A second spike is added to the same incident, again in one bulk write
+        with CaptureQueriesContext(connection) as queries:
+            ReadingService().ingest([('EVT_4', 16.0, 40.0, 'AC', 100.0, T0 + STEP * 7)])
+        incident.refresh_from_db()
+        self.assertEqual(incident.alert_count, 2)
+        self.assertEqual(self.inserts(queries, IncidentTimelineEvent), 1)
+
+    def test_power_alert_notifications_are_stored_in_bulk(self):
+        with CaptureQueriesContext(connection) as queries:
+            ReadingService().ingest([('EVT_5', 5.0, 40.0, 'BATTERY', 90.0, timezone.now())])
+        alert = Alert.objects.get(device__device_id='EVT_5', alert_type='power_failure')
+        self.assertEqual(self.inserts(queries, Notification), 1)
+        self.assertEqual(
+            sorted(Notification.objects.filter(alert=alert).values_list('operator', 'status')),
+            [(operator.pk, 'PENDING') for operator in self.operators]
+        )
+
+        ReadingService(notify=False).ingest([('EVT_6', 5.0, 40.0, 'BATTERY', 90.0, timezone.now())])
+        self.assertTrue(Alert.objects.filter(device__device_id='EVT_6', alert_type='power_failure').exists())
+        self.assertFalse(Notification.objects.filter(alert__device__device_id='EVT_6').exists())
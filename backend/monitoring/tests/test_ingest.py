@@ -0,0 +1,89 @@
+from datetime import datetime, timezone as dt_timezone
+
+from django.test import SimpleTestCase
+from rest_framework.test import APITestCase
+
+from monitoring.ingest import (
+    ACK, BINARY_MEDIA_TYPE, DEVICE_ID_MAX_LENGTH, decode_payload, decode_readings, encode_ack, encode_reading,
+    validate_reading
+)
+from monitoring.models import Reading
+
+
+class BinaryCodecTests(SimpleTestCase):
+    def test_round_trip(self):
+        payload = (
+            encode_reading('ESP_1', 4.25, 41.5, 'AC', 97, 1700000000)
+            + encode_reading('ESP_2', -3.5, 60.0, 'BATTERY', 12)
+        )
+        records, rejected = decode_readings(payload)
+        self.assertEqual(rejected, 0)
+        self.assertEqual(records, [
+            ('ESP_1', 4.25, 41.5, 'AC', 97.0, datetime.fromtimestamp(1700000000, tz=dt_timezone.utc)),
+            ('ESP_2', -3.5, 60.0, 'BATTERY', 12.0, None),
+        ])
+
+    def test_out_of_range_records_are_rejected(self):
+        payload = encode_reading('ESP_1', 5.0, 40.0) + encode_reading('ESP_1', 5.0, 40.0, battery_level=200)
+        records, rejected = decode_readings(payload)
+        self.assertEqual((len(records), rejected), (1, 1))
+
+    def test_over_long_device_id_is_rejected(self):
+        payload = encode_reading('x' * (DEVICE_ID_MAX_LENGTH + 1), 5.0, 40.0) + encode_reading('ESP_1', 5.0, 40.0)
+        records, rejected = decode_readings(payload)
+        self.assertEqual(rejected, 1)
+        self.assertEqual([record[0] for record in records], ['ESP_1'])
+
+    def test_longest_device_id_is_accepted(self):
+        records, rejected = decode_readings(encode_reading('x' * DEVICE_ID_MAX_LENGTH, 5.0, 40.0))
+        self.assertEqual((len(records), rejected), (1, 0))
+
+    def test_truncated_payload_raises(self):
+        with self.assertRaises(ValueError):
+            decode_readings(encode_reading('ESP_1', 5.0, 40.0)[:-1])
+
+    def test_decode_payload_json_takes_device_id_from_caller(self):
+        records, rejected = decode_payload(b'[{"temperature": 5, "humidity": 40}, {"temperature": "x"}]', 'ESP_9')
+        self.assertEqual(rejected, 1)
+        self.assertEqual(records[0][:3], ('ESP_9', 5.0, 40.0))
+
+    def test_validate_reading(self):
+        self.assertEqual(
+            validate_reading({'device_id': 'ESP_1', 'temperature': 5, 'humidity': 40})[:5],
+            ('ESP_1', 5.0, 40.0, 'AC', 100.0)
+        )
+        for bad in ({'temperature': 5, 'humidity': 40},
+                    {'device_id': 'ESP_1', 'temperature': 500, 'humidity': 40},
+                    {'device_id': 'ESP_1', 'temperature': 5, 'humidity': 40, 'power_status': 'SOLAR'}):
+            with self.assertRaises(ValueError):
+                validate_reading(bad)
+
+
+class BinaryBatchEndpointTests(APITestCase):
+    url = '/api/monitoring/esp/readings/batch/'
+
+    def post(self, payload):
+        return self.client.post(self.url, data=payload, content_type=BINARY_MEDIA_TYPE)
+
+    def test_stores_valid_records_and_acknowledges_counts(self):
+        response = self.post(
+            encode_reading('BIN_1', 5.0, 40.0, timestamp=1700000000)
+            + encode_reading('BIN_1', 5.5, 40.0, timestamp=1700000060)
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(ACK.unpack(response.content), (2, 0))
+        self.assertEqual(Reading.objects.filter(device_id='BIN_1').count(), 2)
+
+    def test_over_long_device_id_does_not_fail_the_batch(self):
+        response = self.post(
+            encode_reading('x' * 200, 5.0, 40.0, timestamp=1700000000)
+            + encode_reading('BIN_2', 5.0, 40.0, timestamp=1700000000)
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.content, encode_ack(1, 1))
+        self.assertEqual(list(Reading.objects.values_list('device_id', flat=True)), ['BIN_2'])
+
+    def test_truncated_payload_is_a_bad_request(self):
+        response = self.post(encode_reading('BIN_3', 5.0, 40.0)[:-2])
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Reading.objects.exists())
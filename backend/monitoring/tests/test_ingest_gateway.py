@@ -0,0 +1,201 @@
+import asyncio
+import json
+import socket
+import struct
+from io import StringIO
+from unittest import mock
+
+from asgiref.sync import sync_to_async
+from django.db import DatabaseError, connections
+from django.test import TransactionTestCase
+
+from monitoring.ingest import encode_reading
+from monitoring.management.commands.ingest_gateway import (
+    CONNACK, CONNECT, PUBACK, PUBLISH, SUBACK, SUBSCRIBE, Command, _mqtt_packet, _mqtt_string
+)
+from monitoring.models import Reading
+from monitoring.services.reading_service import ReadingService
+
+
+async def read_packet(reader):
+    header = await reader.readexactly(1)
+    length, multiplier = 0, 1
+    while True:
+        byte = (await reader.readexactly(1))[0]
+        length += (byte & 0x7F) * multiplier
+        multiplier *= 128
+        if not byte & 0x80:
+            break
+    return header[0] >> 4, header[0] & 0x0F, await reader.readexactly(length)
+
+
+class FakeBroker:
+    """Accepts one subscriber, publishes `messages` to it at QoS 1 and records its PUBACKs"""
+
+    def __init__(self, messages):
+        self.messages = messages
+        self.connect = None
+        self.subscription = None
+        self.acked = []
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle, '127.0.0.1', 0)
+        return self.server.sockets[0].getsockname()[1]
+
+    async def handle(self, reader, writer):
+        packet_type, _, self.connect = await read_packet(reader)
+        assert packet_type == CONNECT
+        writer.write(_mqtt_packet(CONNACK, 0, b'\x00\x00'))
+
+        packet_type, flags, body = await read_packet(reader)
+        assert (packet_type, flags) == (SUBSCRIBE, 0x02)
+        topic_length = struct.unpack_from('!H', body, 2)[0]
+        self.subscription = (body[4:4 + topic_length].decode(), body[4 + topic_length])
+        writer.write(_mqtt_packet(SUBACK, 0, body[:2] + b'\x01'))
+
+        for packet_id, (topic, payload) in enumerate(self.messages, 1):
+            writer.write(_mqtt_packet(PUBLISH, 0x02, _mqtt_string(topic) + struct.pack('!H', packet_id) + payload))
+        try:
+            while True:
+                packet_type, _, body = await read_packet(reader)
+                if packet_type == PUBACK:
+                    self.acked.append(struct.unpack('!H', body)[0])
+        except asyncio.IncompleteReadError:
+            pass
+
+    def close(self):
+        self.server.close()
+
+
+def free_udp_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def reading(device_id=None, temperature=5.0, timestamp='2024-01-01T00:00:00Z'):
+    item = {'temperature': temperature, 'humidity': 40.0, 'timestamp': timestamp}
+    if device_id:
+        item['device_id'] = device_id
+    return item
+
+
+class IngestGatewayTests(TransactionTestCase):
+    """Runs the gateway command's event loop against a local broker and UDP sender"""
+
+    def gateway(self, *args):
+        command = Command(stdout=StringIO())
+        command.options = vars(command.create_parser('manage.py', 'ingest_gateway').parse_args(
+            ['--duration', '1', '--max-delay', '100', '--report-every', '60'] + list(args)
+        ))
+        return command
+
+    async def run_gateway(self, command):
+        await command._run()
+        # Readings are stored from asgiref's worker thread, which has its own connection
+        await sync_to_async(connections.close_all)()
+
+    def run_with_broker(self, messages, *args):
+        async def scenario():
+            broker = FakeBroker(messages)
+            port = await broker.start()
+            command = self.gateway('--mqtt-host', '127.0.0.1', '--mqtt-port', str(port), *args)
+            await self.run_gateway(command)
+            broker.close()
+            return command, broker
+        return asyncio.run(scenario())
+
+    def stored(self):
+        return sorted(Reading.objects.values_list('device_id', 'temperature'))
+
+    def test_mqtt_readings_are_stored_and_acknowledged(self):
+        batch = [reading(temperature=4 + i / 100, timestamp=f'2024-01-01T00:{i // 60:02d}:{i % 60:02d}Z')
+                 for i in range(300)]
+        command, broker = self.run_with_broker([
+            ('sensors/MQ_1/reading', json.dumps(reading()).encode()),
+            # Over 16 KB: a three byte remaining length
+            ('sensors/MQ_2/reading', json.dumps(batch).encode()),
+            ('sensors/MQ_3/reading', encode_reading('MQ_3', 6.5, 40.0, timestamp=1700000000)),
+        ], '--mqtt-client-id', 'test-gateway')
+
+        client_id_length = struct.unpack_from('!H', broker.connect, 10)[0]
+        self.assertEqual(broker.connect[:7], _mqtt_string('MQTT') + b'\x04')
+        self.assertEqual(broker.connect[12:12 + client_id_length], b'test-gateway')
+        self.assertEqual(broker.subscription, ('sensors/+/reading', 1))
+        self.assertEqual(sorted(broker.acked), [1, 2, 3])
+        self.assertEqual(Reading.objects.filter(device_id='MQ_1').count(), 1)
+        self.assertEqual(Reading.objects.filter(device_id='MQ_2').count(), 300)
+        self.assertEqual(list(Reading.objects.filter(device_id='MQ_3').values_list('temperature', flat=True)), [6.5])
+        self.assertEqual(command.stats['stored'], 302)
+
+    def test_messages_arriving_together_are_written_as_one_batch(self):
+        messages = [(f'sensors/MB_{i}/reading', json.dumps(reading()).encode()) for i in range(5)]
+        command, broker = self.run_with_broker(messages)
+        self.assertEqual(command.stats['batches'], 1)
+        self.assertEqual(len(self.stored()), 5)
+
+        Reading.objects.all().delete()
+        command, broker = self.run_with_broker(messages, '--batch-size', '2')
+        self.assertEqual(command.stats['batches'], 3)
+        self.assertEqual(sorted(broker.acked), [1, 2, 3, 4, 5])
+
+    def test_invalid_readings_are_rejected_without_holding_back_the_message(self):
+        command, broker = self.run_with_broker([
+            ('sensors/BAD_1/reading', json.dumps([reading(), reading(temperature=500)]).encode()),
+            ('sensors/BAD_2/reading', b'not a reading'),
+        ])
+        self.assertEqual(sorted(broker.acked), [1, 2])
+        self.assertEqual(self.stored(), [('BAD_1', 5.0)])
+        self.assertEqual(command.stats['rejected'], 2)
+
+    def test_nothing_is_acknowledged_when_the_batch_cannot_be_stored(self):
+        with mock.patch.object(ReadingService, 'ingest', side_effect=DatabaseError('database is down')):
+            command, broker = self.run_with_broker([
+                ('sensors/DOWN_1/reading', json.dumps(reading()).encode()),
+                ('sensors/DOWN_2/reading', json.dumps(reading()).encode()),
+            ])
+        self.assertEqual(broker.acked, [])
+        self.assertEqual(command.stats['failed'], 2)
+        self.assertEqual(self.stored(), [])
+
+    def test_a_reading_the_database_refuses_does_not_fail_the_batch(self):
+        ingest = ReadingService.ingest
+
+        def refuse_poison(service, records):
+            if any(record[0] == 'POISON' for record in records):
+                raise DatabaseError('value too long')
+            return ingest(service, records)
+
+        with mock.patch.object(ReadingService, 'ingest', autospec=True, side_effect=refuse_poison):
+            command, broker = self.run_with_broker([
+                ('sensors/OK_1/reading', json.dumps(reading()).encode()),
+                ('sensors/POISON/reading', json.dumps(reading()).encode()),
+                ('sensors/OK_2/reading', json.dumps(reading()).encode()),
+            ])
+        self.assertEqual(sorted(broker.acked), [1, 2, 3])
+        self.assertEqual(self.stored(), [('OK_1', 5.0), ('OK_2', 5.0)])
+        self.assertEqual((command.stats['rejected'], command.stats['failed']), (1, 0))
+
+    def test_udp_datagrams_are_stored(self):
+        port = free_udp_port()
+
+        async def scenario():
+            command = self.gateway('--udp-bind', f'127.0.0.1:{port}')
+            task = asyncio.create_task(self.run_gateway(command))
+            await asyncio.sleep(0.2)
+            transport, _ = await asyncio.get_running_loop().create_datagram_endpoint(
+                asyncio.DatagramProtocol, remote_addr=('127.0.0.1', port)
+            )
+            transport.sendto(json.dumps(reading('UDP_1')).encode())
+            transport.sendto(
+                encode_reading('UDP_2', 3.0, 40.0, timestamp=1700000000)
+                + encode_reading('UDP_2', 3.5, 40.0, timestamp=1700000060)
+            )
+            transport.sendto(b'\x05UDP')  # truncated
+            transport.close()
+            await task
+            return command
+
+        command = asyncio.run(scenario())
+        self.assertEqual(self.stored(), [('UDP_1', 5.0), ('UDP_2', 3.0), ('UDP_2', 3.5)])
+        self.assertEqual((command.stats['received'], command.stats['rejected']), (3, 1))
@@ -0,0 +1,65 @@
+from io import StringIO
+from unittest import skipUnless
+
+from django.core.management import call_command
+from django.db import connection
+from django.test import TransactionTestCase
+
+from monitoring.models import Alert, Device, Incident, IncidentTimelineEvent, Reading
+from monitoring.services.replay import replay_devices
+
+SCALE = ['--devices', '3', '--days', '2', '--interval', '600', '--excursion-rate', '0.02', '--seed', '7']
+
+
+def history():
+    alerts = Alert.objects.order_by('device__device_id', 'timestamp').values_list(
+        'device__device_id', 'reading_id', 'alert_type', 'severity', 'timestamp', 'last_timestamp',
+        'peak_temperature', 'sample_count'
+    )
+    incidents = Incident.objects.order_by('device__device_id', 'start_time').values_list(
+        'device__device_id', 'alert__reading_id', 'status', 'start_time', 'end_time', 'alert_count'
+    )
+    return list(alerts), list(incidents)
+
+
+class ScaleModeTests(TransactionTestCase):
+    """The command truncates tables, which PostgreSQL refuses in a transaction with FK checks pending"""
+
+    def populate(self, *args):
+        call_command('populate_test_data', *SCALE, '--workers', '1', *args, stdout=StringIO())
+
+    def test_history_is_generated_for_every_device(self):
+        self.populate()
+        self.assertEqual(Device.objects.count(), 3)
+        self.assertEqual(Reading.objects.count(), 3 * 288)
+        self.assertEqual(Reading.objects.filter(device_id='ESP8266_2').count(), 288)
+        self.assertGreater(Alert.objects.count(), 0)
+        self.assertEqual(Incident.objects.count(), Alert.objects.count())
+        self.assertEqual(IncidentTimelineEvent.objects.count(), Incident.objects.count())
+        # Sequences were moved past the generated ids
+        reading = Reading.objects.create(device_id='ESP8266_1', temperature=5.0, humidity=40.0,
+                                         timestamp=Reading.objects.latest('timestamp').timestamp)
+        self.assertEqual(reading.pk, 3 * 288 + 1)
+
+    def test_same_seed_same_history(self):
+        self.populate()
+        first = list(Reading.objects.order_by('id').values_list('id', 'temperature'))
+        self.populate()
+        self.assertEqual(list(Reading.objects.order_by('id').values_list('id', 'temperature')), first)
+
+    def test_alerts_and_incidents_follow_the_live_rules(self):
+        self.populate()
+        generated = history()
+        replay_devices(Device.objects.all())
+        self.assertEqual(history(), generated)
+
+
+@skipUnless(connection.vendor == 'postgresql', 'Parallel COPY loading runs on PostgreSQL only')
+class ParallelScaleModeTests(TransactionTestCase):
+    def test_workers_load_disjoint_devices(self):
+        call_command('populate_test_data', *SCALE, '--workers', '2', '--devices-per-job', '1', stdout=StringIO())
+        self.assertEqual(Reading.objects.count(), 3 * 288)
+        self.assertEqual(
+            set(Reading.objects.values_list('device_id', flat=True).distinct()),
+            {'ESP8266_1', 'ESP8266_2', 'ESP8266_3'}
+        )
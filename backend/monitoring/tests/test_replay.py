@@ -0,0 +1,113 @@
+from datetime import datetime, timedelta, timezone as dt_timezone
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import TestCase
+
+from monitoring.models import Alert, Device, EscalationDeadline, Incident, IncidentTimelineEvent, Reading
+from monitoring.services.reading_service import ReadingService
+from monitoring.services.replay import ReplayService, replay_devices
+from settings import models as settings_models
+from settings.models import SystemSettings
+
+DAY = datetime(2024, 1, 1, tzinfo=dt_timezone.utc)
+STEP = timedelta(minutes=5)
+
+
+def day_of_temperatures():
+    """A day of readings every 5 minutes with four short excursions outside 3-7 °C"""
+    temperatures = [5.0 + 0.1 * (i % 2) for i in range(288)]
+    # Critical high, severe high, critical low, severe low (critical range 1-9 °C)
+    for start, excursion in ((30, [7.5, 7.8]), (100, [9.5, 8.0]), (200, [2.5, 2.0]), (250, [0.5])):
+        temperatures[start:start + len(excursion)] = excursion
+    return temperatures
+
+
+def history(device_id):
+    alerts = Alert.objects.filter(device__device_id=device_id).order_by('timestamp').values_list(
+        'alert_type', 'severity', 'message', 'reading_id', 'timestamp', 'last_timestamp',
+        'peak_temperature', 'sample_count'
+    )
+    incidents = Incident.objects.filter(device__device_id=device_id).order_by('start_time').values_list(
+        'alert__timestamp', 'description', 'status', 'start_time', 'end_time', 'alert_count',
+        'current_escalation_level'
+    )
+    events = IncidentTimelineEvent.objects.filter(incident__device__device_id=device_id).order_by(
+        'timestamp', 'id'
+    ).values_list('incident__start_time', 'timestamp', 'event_type', 'description', 'temperature')
+    return list(alerts), list(incidents), list(events)
+
+
+class ReplayTests(TestCase):
+    def setUp(self):
+        # Thresholds other than the defaults, so ingest and replay must both read them from SystemSettings
+        cache.clear()
+        self.addCleanup(cache.clear)
+        patcher = mock.patch.object(settings_models, '_local', None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        with self.captureOnCommitCallbacks(execute=True):
+            settings = SystemSettings.get_settings()
+            settings.normal_temp_min, settings.normal_temp_max = 3.0, 7.0
+            settings.critical_temp_min, settings.critical_temp_max = 1.0, 9.0
+            settings.save()
+
+    def ingest_live(self, device_id, temperatures):
+        """Ingest readings one by one, each arriving at its own timestamp"""
+        service = ReadingService(notify=False)
+        for i, temperature in enumerate(temperatures):
+            timestamp = DAY + STEP * i
+            with mock.patch('django.utils.timezone.now', return_value=timestamp):
+                service.ingest([(device_id, temperature, 40.0, 'AC', 100.0, timestamp)])
+            # The event timestamp default is bound to the real clock, not the patched one
+            IncidentTimelineEvent.objects.filter(
+                incident__device__device_id=device_id, timestamp__gt=timestamp
+            ).update(timestamp=timestamp)
+
+    def test_replaying_a_stored_day_rebuilds_identical_alerts_and_incidents(self):
+        self.ingest_live('REPLAY_1', day_of_temperatures())
+        live = history('REPLAY_1')
+        self.assertEqual([alert[:2] for alert in live[0]], [
+            ('high_temperature', 'critical'), ('high_temperature', 'severe'),
+            ('low_temperature', 'critical'), ('low_temperature', 'severe'),
+        ])
+
+        counts = replay_devices(Device.objects.filter(device_id='REPLAY_1'), start=DAY)
+        self.assertEqual((counts['readings'], counts['alerts'], counts['incidents']), (288, 4, 4))
+        self.assertEqual(history('REPLAY_1'), live)
+
+    def test_replay_from_inside_an_excursion_continues_its_incident(self):
+        self.ingest_live('REPLAY_2', day_of_temperatures())
+        live = history('REPLAY_2')
+
+        replay_devices(Device.objects.filter(device_id='REPLAY_2'), start=DAY + STEP * 101)
+        self.assertEqual(history('REPLAY_2'), live)
+
+    def test_unacknowledged_excursion_escalates_at_the_scheduler_times(self):
+        device = Device.objects.create(device_id='REPLAY_3', name='x', location='x')
+        temperatures = [5.0, 5.1] + [8.0] * 12 + [5.0]
+        Reading.objects.bulk_create(
+            Reading(device_id='REPLAY_3', temperature=temperature, humidity=40.0, timestamp=DAY + STEP * i)
+            for i, temperature in enumerate(temperatures)
+        )
+        service = ReplayService(flush_size=1)
+        self.assertEqual(service.replay(device, Reading.objects.filter(device_id='REPLAY_3')), len(temperatures))
+
+        incident = Incident.objects.get(device=device)
+        self.assertEqual((incident.status, incident.current_escalation_level), ('resolved', 3))
+        self.assertEqual((incident.alert.sample_count, incident.end_time), (12, DAY + STEP * 14))
+        escalations = IncidentTimelineEvent.objects.filter(
+            incident=incident, event_type='escalation_changed'
+        ).order_by('timestamp').values_list('timestamp', flat=True)
+        started = DAY + STEP * 2
+        self.assertEqual(list(escalations), [started + timedelta(minutes=15), started + timedelta(minutes=45)])
+        self.assertFalse(EscalationDeadline.objects.filter(incident=incident).exists())
+
+    def test_thresholds_are_read_once_per_replay(self):
+        service = ReplayService()
+        with self.captureOnCommitCallbacks(execute=True):
+            settings = SystemSettings.get_settings()
+            settings.normal_temp_max = 8.0
+            settings.save()
+        self.assertEqual(service.thresholds(), (3.0, 7.0, 1.0, 9.0))
+        self.assertEqual(ReplayService().thresholds(), (3.0, 8.0, 1.0, 9.0))
@@ -0,0 +1,61 @@
+import json
+import os
+import random
+import tempfile
+from io import StringIO
+
+from django.core.management import CommandError, call_command
+from django.test import LiveServerTestCase, SimpleTestCase
+
+from monitoring.management.commands.simulate_fleet import AMBIENT_TEMPERATURE, VirtualDevice
+from monitoring.models import Reading
+
+
+class VirtualDeviceTests(SimpleTestCase):
+    def device(self, profile, sim_duration=36000):
+        return VirtualDevice('SIM_X', profile, random.Random(1), sim_duration)
+
+    def test_stable_device_stays_near_its_base_temperature(self):
+        device = self.device('stable')
+        temperatures = [device.sample(t)['temperature'] for t in range(0, 36000, 600)]
+        self.assertLess(max(abs(t - device.base_temperature) for t in temperatures), 1.0)
+
+    def test_hvac_failure_warms_toward_ambient(self):
+        device = self.device('hvac_failure')
+        self.assertAlmostEqual(device.sample(device.event_at)['temperature'], device.base_temperature, delta=1.0)
+        warm = device.sample(device.event_at + 10 * device.warmup_tau)['temperature']
+        self.assertAlmostEqual(warm, AMBIENT_TEMPERATURE, delta=1.0)
+
+    def test_power_loss_drains_the_battery_until_the_device_goes_silent(self):
+        device = self.device('power_loss')
+        self.assertEqual(device.sample(0)['power_status'], 'AC')
+        reading = device.sample(device.event_at + 1800)
+        self.assertEqual(reading['power_status'], 'BATTERY')
+        self.assertAlmostEqual(reading['battery_level'], 100 - device.drain_per_hour / 2, delta=0.1)
+        self.assertIsNone(device.sample(device.event_at + 100 / device.drain_per_hour * 3600 + 1))
+
+    def test_unknown_profile_is_rejected(self):
+        with self.assertRaises(CommandError):
+            call_command('simulate_fleet', '--profiles', 'stable=1,melting=1', stdout=StringIO())
+
+
+class SimulateFleetTests(LiveServerTestCase):
+    def test_fleet_drives_the_ingest_endpoint(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        output = os.path.join(directory.name, 'report.json')
+        # Cabinets warm about 1 °C per reading and leave the normal range within the run
+        call_command(
+            'simulate_fleet', '--base-url', f'{self.live_server_url}/api/monitoring', '--devices', '3',
+            '--interval', '0.2', '--duration', '4', '--time-scale', '500', '--profiles', 'hvac_failure=1',
+            '--dropout-rate', '0', '--concurrency', '3', '--report-every', '60', '--seed', '1',
+            '--output', output, stdout=StringIO()
+        )
+        with open(output) as f:
+            report = json.load(f)
+
+        self.assertGreater(report['sent'], 0)
+        self.assertEqual((report['ok'], report['error_rate'], report['exceptions']), (report['sent'], 0, 0))
+        self.assertEqual(Reading.objects.filter(device_id__startswith='SIM_').count(), report['ok'])
+        self.assertEqual(report['alert_latency_ms']['excursions'], 3)
+        self.assertEqual(report['alert_latency_ms']['alerted'], 3)
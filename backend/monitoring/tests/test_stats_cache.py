@@ -0,0 +1,104 @@
+from datetime import timedelta
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import TestCase
+from django.utils import timezone
+from rest_framework.test import APITestCase
+
+from monitoring.services import stats_cache
+from monitoring.services.reading_service import ReadingService
+from monitoring.services.stats_cache import StatsCache
+
+
+def store(device_id, temperature, timestamp):
+    ReadingService(notify=False).ingest([(device_id, temperature, 40.0, 'AC', 100.0, timestamp)])
+
+
+def temperatures(response):
+    return [reading['temperature'] for reading in response['readings']]
+
+
+class StatsCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.now = timezone.now()
+
+    def test_live_window_is_brought_up_to_date(self):
+        store('SC_1', 4.0, self.now - timedelta(hours=2))
+        store('SC_1', 5.0, self.now - timedelta(hours=30))
+        self.assertEqual(temperatures(StatsCache('SC_1').for_period('24h')), [4.0])
+
+        store('SC_1', 6.0, self.now - timedelta(hours=1))
+        response = StatsCache('SC_1').for_period('24h')
+        self.assertEqual(temperatures(response), [4.0, 6.0])
+        self.assertEqual((response['average_temperature'], response['max_temperature']), (5.0, 6.0))
+
+    def test_late_reading_is_merged_in_timestamp_order(self):
+        store('SC_2', 4.0, self.now - timedelta(hours=1))
+        StatsCache('SC_2').for_period('24h')
+        store('SC_2', 6.0, self.now - timedelta(hours=3))
+        self.assertEqual(temperatures(StatsCache('SC_2').for_period('24h')), [6.0, 4.0])
+
+    def test_windows_are_cached_per_device(self):
+        store('SC_3', 4.0, self.now - timedelta(hours=1))
+        store('SC_4', 7.0, self.now - timedelta(hours=1))
+        self.assertEqual(temperatures(StatsCache('SC_3').for_period('24h')), [4.0])
+        self.assertEqual(temperatures(StatsCache('SC_4').for_period('24h')), [7.0])
+        self.assertEqual(sorted(temperatures(StatsCache().for_period('24h'))), [4.0, 7.0])
+
+    def test_past_window_is_served_until_a_backfill_overlaps_it(self):
+        start, end = self.now - timedelta(days=3), self.now - timedelta(days=2)
+        store('SC_5', 4.0, start + timedelta(hours=1))
+        self.assertEqual(temperatures(StatsCache('SC_5').for_range(start, end)), [4.0])
+
+        with self.assertNumQueries(0):
+            StatsCache('SC_5').for_range(start, end)
+
+        # Outside the window: the cached response still stands
+        store('SC_5', 9.0, end + timedelta(hours=1))
+        with self.assertNumQueries(0):
+            StatsCache('SC_5').for_range(start, end)
+
+        store('SC_5', 6.0, start + timedelta(hours=2))
+        self.assertEqual(temperatures(StatsCache('SC_5').for_range(start, end)), [4.0, 6.0])
+
+    def test_waiting_worker_takes_the_entry_another_one_computed(self):
+        key = 'stats:SC_6:24h'
+        cache.add(f'{key}:lock', 'another worker')
+        entry = {'version': 'current'}
+
+        def computed_meanwhile(seconds):
+            cache.set(key, entry)
+
+        with mock.patch.object(stats_cache.time, 'sleep', side_effect=computed_meanwhile):
+            result = StatsCache('SC_6')._single_flight(key, mock.Mock(), lambda entry: entry['version'] == 'current')
+        self.assertEqual(result, entry)
+
+    def test_worker_computes_itself_once_the_lock_expires(self):
+        key = 'stats:SC_7:24h'
+        cache.add(f'{key}:lock', 'stuck worker')
+        compute = mock.Mock(return_value={'version': 'current'})
+        with mock.patch.object(stats_cache, 'LOCK_TIMEOUT', 0), mock.patch.object(stats_cache.time, 'sleep'):
+            result = StatsCache('SC_7')._single_flight(key, compute, lambda entry: True)
+        self.assertEqual(result, {'version': 'current'})
+        compute.assert_called_once_with()
+        # The lock still belongs to the other worker
+        self.assertEqual(cache.get(f'{key}:lock'), 'stuck worker')
+
+
+class TemperatureStatsViewTests(APITestCase):
+    url = '/api/monitoring/temperature/stats/'
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_authenticate(get_user_model().objects.create_user('viewer@example.com', 'password'))
+
+    def test_period_and_range(self):
+        store('SC_8', 5.0, timezone.now() - timedelta(hours=1))
+        response = self.client.get(self.url, {'period': '24h', 'device_id': 'SC_8'})
+        self.assertEqual(temperatures(response.data), [5.0])
+        self.assertEqual(self.client.get(self.url, {'period': '1y'}).status_code, 400)
+        response = self.client.get(self.url, {'start_date': 'yesterday', 'end_date': 'today'})
+        self.assertEqual(response.status_code, 400)
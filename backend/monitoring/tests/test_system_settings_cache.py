@@ -0,0 +1,58 @@
+from unittest import mock
+
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from settings import models as settings_models
+from settings.models import CACHE_KEY, SystemSettings
+
+
+@override_settings(SYSTEM_SETTINGS_CHECK_INTERVAL=60)
+class SystemSettingsCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        patcher = mock.patch.object(settings_models, '_local', None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_settings_are_served_from_the_process_copy(self):
+        SystemSettings.get_settings()
+        with CaptureQueriesContext(connection) as queries:
+            SystemSettings.get_settings()
+        self.assertEqual(len(queries), 0)
+
+    def test_other_processes_load_a_new_version_from_the_shared_cache(self):
+        stale = SystemSettings.get_settings()
+        with self.captureOnCommitCallbacks(execute=True):
+            updated = SystemSettings.objects.get(pk=1)
+            updated.normal_temp_max = 7.0
+            updated.save()
+
+        # Another process: its copy is the old version and due for a check
+        settings_models._local = (0, stale, -1e9)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(SystemSettings.get_settings().normal_temp_max, 7.0)
+        self.assertEqual(len(queries), 0)
+
+    def test_an_unchanged_version_keeps_the_process_copy(self):
+        SystemSettings.get_settings()
+        cache.delete(CACHE_KEY)
+        with override_settings(SYSTEM_SETTINGS_CHECK_INTERVAL=0):
+            with CaptureQueriesContext(connection) as queries:
+                SystemSettings.get_settings()
+        self.assertEqual(len(queries), 0)
+
+    def test_rolled_back_changes_are_not_published(self):
+        SystemSettings.get_settings()
+        try:
+            with self.captureOnCommitCallbacks(execute=True), transaction.atomic():
+                rolled_back = SystemSettings.objects.get(pk=1)
+                rolled_back.normal_temp_max = 9.5
+                rolled_back.save()
+                raise RuntimeError
+        except RuntimeError:
+            pass
+        settings_models._local = None
+        self.assertEqual(SystemSettings.get_settings().normal_temp_max, 8.0)
@@ -0,0 +1,186 @@
+from datetime import datetime, timedelta, timezone as dt_timezone
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import TestCase
+from django.utils import timezone
+from rest_framework.test import APITestCase
+
+from monitoring.models import Alert, Device, Incident, Reading
+from monitoring.services.reading_service import ReadingService
+from monitoring.services.simulation import ThresholdSimulator, simulate_settings
+from settings import models as settings_models
+from settings.models import SystemSettings
+
+T0 = datetime(2024, 1, 1, tzinfo=dt_timezone.utc)
+STEP = timedelta(minutes=10)
+NORMAL = [5.0, 5.1, 5.0, 5.1]
+# Normal 2-6 °C, critical 0-7 °C: 6.5 is critical, 7.5 severe and 1.5 critical again
+TEMPERATURES = NORMAL + [6.5, 6.6] + NORMAL + [7.5, 7.2] + NORMAL + [1.5] + NORMAL
+
+
+def series(device_id, temperatures, start=T0):
+    return [(device_id, temperature, 40.0, 'AC', 100.0, start + STEP * i) for i, temperature in enumerate(temperatures)]
+
+
+def store(device_id, temperatures, start=T0, **fields):
+    """Store readings directly, without evaluating them"""
+    Device.objects.get_or_create(device_id=device_id, defaults={'name': 'x', 'location': 'x'})
+    Reading.objects.bulk_create(
+        Reading(device_id=device_id, temperature=temperature, humidity=40.0, timestamp=start + STEP * i, **fields)
+        for i, temperature in enumerate(temperatures)
+    )
+
+
+def candidate(normal_max, critical_max):
+    return {
+        'normal_temp_min': 2.0, 'normal_temp_max': normal_max,
+        'critical_temp_min': 0.0, 'critical_temp_max': critical_max,
+    }
+
+
+def counts(readings, alerts=0, severe_alerts=0, incidents=0, escalations=0, open_incidents=0):
+    return {
+        'readings': readings, 'alerts': alerts, 'severe_alerts': severe_alerts, 'incidents': incidents,
+        'escalations': escalations, 'open_incidents': open_incidents,
+    }
+
+
+def override_settings_cache(test):
+    """Read SystemSettings from the test database, not from a copy cached by an earlier test"""
+    cache.clear()
+    test.addCleanup(cache.clear)
+    patcher = mock.patch.object(settings_models, '_local', None)
+    patcher.start()
+    test.addCleanup(patcher.stop)
+
+
+class SettingsThresholdTests(TestCase):
+    """Ingest judges readings by the thresholds in SystemSettings"""
+
+    def setUp(self):
+        override_settings_cache(self)
+        with self.captureOnCommitCallbacks(execute=True):
+            settings = SystemSettings.get_settings()
+            settings.normal_temp_max = 6.0
+            settings.critical_temp_max = 7.0
+            settings.save()
+
+    def test_alerts_follow_the_saved_thresholds(self):
+        self.assertEqual(ReadingService().thresholds(), (2.0, 6.0, 0.0, 7.0))
+        service = ReadingService(notify=False)
+        service.ingest(series('LIMIT_1', NORMAL + [6.5]))
+        alert = Alert.objects.get(device__device_id='LIMIT_1')
+        self.assertEqual((alert.alert_type, alert.severity), ('high_temperature', 'critical'))
+
+        service.ingest(series('LIMIT_1', [7.5, 5.0], start=T0 + STEP * 5))
+        alert.refresh_from_db()
+        self.assertEqual((alert.severity, alert.sample_count, alert.peak_temperature), ('severe', 2, 7.5))
+        self.assertEqual(Incident.objects.get(device__device_id='LIMIT_1').status, 'resolved')
+
+    def test_simulator_baseline_matches_live_alerts(self):
+        ReadingService(notify=False).ingest(series('LIMIT_2', TEMPERATURES))
+        alerts = Alert.objects.filter(device__device_id='LIMIT_2')
+        self.assertEqual(alerts.count(), 3)
+
+        simulator = ThresholdSimulator(T0, T0 + STEP * len(TEMPERATURES), ['LIMIT_2'])
+        totals, per_device = simulator.run({'current': SystemSettings.get_settings()})
+        self.assertEqual(totals['current']['readings'], len(TEMPERATURES))
+        self.assertEqual(totals['current']['alerts'], alerts.count())
+        self.assertEqual(totals['current']['severe_alerts'], alerts.filter(severity='severe').count())
+        self.assertEqual(totals['current']['incidents'], Incident.objects.filter(device__device_id='LIMIT_2').count())
+        self.assertEqual(totals['current']['open_incidents'], 0)
+
+
+class ThresholdSimulatorTests(TestCase):
+    """Counts under candidate settings, from stored readings only"""
+
+    def setUp(self):
+        # Two 10 minute steps apart: a 40 minute excursion, a severe one and one still open at the end
+        store('SIM_1', [5.0, 5.0, 9.0, 9.0, 9.0, 9.0, 5.0, 5.0, 11.0, 5.0] + [5.0] * 5 + [9.0])
+        store('SIM_2', [5.0, 5.1, 5.0, 5.1])
+        # Sensor faults and readings outside the period are not evaluated
+        store('SIM_2', [30.0], start=T0 + STEP * 5, suspect='spike')
+        store('SIM_2', [30.0], start=T0 + STEP * 16)
+        # 50 minutes out of range reaches level 3
+        store('SIM_3', [9.0] * 5 + [5.0])
+        self.simulator = ThresholdSimulator(T0, T0 + STEP * 16)
+
+    def test_every_candidate_is_counted_on_the_same_readings(self):
+        totals, per_device = self.simulator.run({
+            'current': candidate(8.0, 10.0),
+            'wider': candidate(10.0, 12.0),
+        })
+        self.assertEqual(per_device['SIM_1'], {
+            'current': counts(16, alerts=3, severe_alerts=1, incidents=3, escalations=1, open_incidents=1),
+            'wider': counts(16, alerts=1, incidents=1),
+        })
+        self.assertEqual(per_device['SIM_2'], {'current': counts(4), 'wider': counts(4)})
+        self.assertEqual(per_device['SIM_3']['current'], counts(6, alerts=1, incidents=1, escalations=2))
+        self.assertEqual(totals['current'], counts(26, alerts=4, severe_alerts=1, incidents=4, escalations=3,
+                                                   open_incidents=1))
+        self.assertEqual(totals['wider'], counts(26, alerts=1, incidents=1))
+
+    def test_excursions_close_together_open_incidents_as_on_ingest(self):
+        override_settings_cache(self)
+        # The second excursion starts 20 minutes after the first was resolved, within alert_reset_time
+        temperatures = [5.0, 5.1, 8.5, 9.0, 5.0, 5.1, 9.5, 5.0, 5.1]
+        ReadingService(notify=False).ingest(series('SIM_4', temperatures))
+        incidents = Incident.objects.filter(
+            device__device_id='SIM_4', alert__alert_type__in=ReadingService.EXCURSION_ALERT_TYPES
+        )
+        self.assertEqual(incidents.count(), 2)
+
+        simulator = ThresholdSimulator(T0, T0 + STEP * len(temperatures), ['SIM_4'])
+        totals, _ = simulator.run({'current': SystemSettings.get_settings()})
+        self.assertEqual(totals['current']['incidents'], incidents.count())
+
+    def test_settings_instances_and_device_filter(self):
+        override_settings_cache(self)
+        simulator = ThresholdSimulator(T0, T0 + STEP * 16, ['SIM_3'])
+        totals, per_device = simulator.run({'current': SystemSettings.get_settings()})
+        self.assertEqual(list(per_device), ['SIM_3'])
+        self.assertEqual(totals['current'], counts(6, alerts=1, incidents=1, escalations=2))
+
+
+class SimulateSettingsTests(APITestCase):
+    def setUp(self):
+        override_settings_cache(self)
+        # Defaults: normal 2-8 °C, critical 0-10 °C
+        store('SIMV_1', [5.0, 9.0, 9.0, 5.0, 11.0, 5.0], start=timezone.now() - timedelta(hours=1))
+        self.expected_current = counts(6, alerts=2, severe_alerts=1, incidents=2, escalations=1)
+        self.expected_proposed = counts(6, alerts=1, incidents=1)
+
+    def test_simulate_settings(self):
+        proposed = candidate(10.0, 12.0)
+        result = simulate_settings(proposed, SystemSettings.get_settings(), days=1, device_ids=['SIMV_1'])
+        self.assertEqual(result['end'] - result['start'], timedelta(days=1))
+        self.assertEqual(result['proposed']['settings'], proposed)
+        self.assertEqual(result['current']['totals'], self.expected_current)
+        self.assertEqual(result['proposed']['totals'], self.expected_proposed)
+        self.assertEqual(result['devices'], [
+            {'device_id': 'SIMV_1', 'current': self.expected_current, 'proposed': self.expected_proposed}
+        ])
+
+    def test_simulate_endpoint_saves_nothing(self):
+        self.client.force_authenticate(get_user_model().objects.create_superuser('admin@example.com', 'password'))
+        response = self.client.post('/api/settings/simulate/', {
+            'normal_temp_max': 10.0, 'critical_temp_max': 12.0, 'days': 1, 'device_id': 'SIMV_1',
+        }, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['current']['totals'], self.expected_current)
+        self.assertEqual(response.data['proposed']['totals'], self.expected_proposed)
+        self.assertEqual(response.data['proposed']['settings']['normal_temp_max'], 10.0)
+        self.assertEqual(SystemSettings.objects.get().normal_temp_max, 8.0)
+
+    def test_simulate_endpoint_rejects_bad_input(self):
+        self.client.force_authenticate(get_user_model().objects.create_superuser('admin@example.com', 'password'))
+        for data in ({'days': 0}, {'days': 'week'}, {'normal_temp_min': 9.0}):
+            response = self.client.post('/api/settings/simulate/', data, format='json')
+            self.assertEqual(response.status_code, 400, data)
+
+    def test_simulate_endpoint_is_for_admins(self):
+        self.client.force_authenticate(get_user_model().objects.create_user('viewer@example.com', 'password'))
+        response = self.client.post('/api/settings/simulate/', {'days': 1}, format='json')
+        self.assertEqual(response.status_code, 403)
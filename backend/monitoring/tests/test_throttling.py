@@ -0,0 +1,164 @@
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import SimpleTestCase, override_settings
+from rest_framework.test import APIRequestFactory, APITestCase
+
+from monitoring import throttling
+from monitoring.models import Device, Reading
+from monitoring.services import backlog
+from monitoring.services.backlog import ingest_backlog
+from monitoring.services.reading_service import ReadingService
+from monitoring.throttling import CacheTokenBuckets, LocalTokenBuckets, SourceIPRateThrottle, known_devices
+
+RATE_LIMIT = {
+    'DEVICE_RATE': 0.001, 'DEVICE_BURST': 3, 'IP_RATE': 0.001, 'IP_BURST': 5,
+    'STORE': 'local', 'MAX_BACKLOG': 5000, 'UNKNOWN_DEVICE_TTL': 60,
+    'REGISTER_RATE': 1000.0, 'REGISTER_BURST': 1000, 'REGISTER_GLOBAL_RATE': 1000.0, 'REGISTER_GLOBAL_BURST': 1000,
+}
+
+
+def readings(*device_ids):
+    return [{'device_id': device_id, 'temperature': 5.0, 'humidity': 40.0} for device_id in device_ids]
+
+
+class TokenBucketTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+
+    def check_buckets(self, buckets):
+        self.assertEqual(buckets.take('a', 2, 0.001, 3), 0)
+        self.assertGreater(buckets.take('a', 2, 0.001, 3), 0)
+        self.assertEqual(buckets.take('a', 1, 0.001, 3), 0)
+
+        # Nothing is taken from "b" when "c" cannot pay
+        self.assertEqual(buckets.take('c', 3, 0.001, 3), 0)
+        self.assertGreater(buckets.take_all({'b': 3, 'c': 1}, 0.001, 3), 0)
+        self.assertEqual(buckets.take('b', 3, 0.001, 3), 0)
+
+    def test_local_buckets(self):
+        self.check_buckets(LocalTokenBuckets())
+
+    def test_cache_buckets(self):
+        self.check_buckets(CacheTokenBuckets())
+
+    def test_local_buckets_refill(self):
+        buckets = LocalTokenBuckets()
+        with mock.patch('monitoring.throttling.time.monotonic', return_value=100):
+            buckets.take('a', 3, 1, 3)
+            self.assertAlmostEqual(buckets.take('a', 2, 1, 3), 2)
+        with mock.patch('monitoring.throttling.time.monotonic', return_value=102):
+            self.assertEqual(buckets.take('a', 2, 1, 3), 0)
+
+    def test_local_buckets_only_evict_refilled_buckets(self):
+        buckets = LocalTokenBuckets(max_keys=2)
+        with mock.patch('monitoring.throttling.time.monotonic', return_value=100):
+            buckets.take('a', 3, 1, 3)
+            # Fresh keys do not push out the drained bucket of "a"
+            for key in 'bcd':
+                buckets.take(key, 1, 1, 3)
+            self.assertGreater(buckets.take('a', 1, 1, 3), 0)
+        with mock.patch('monitoring.throttling.time.monotonic', return_value=110):
+            buckets.take('e', 1, 1, 3)
+        self.assertEqual(list(buckets.buckets), ['a', 'e'])
+
+
+@override_settings(INGEST_RATE_LIMIT=RATE_LIMIT)
+class SourceAddressTests(SimpleTestCase):
+    def ident(self, **meta):
+        return SourceIPRateThrottle().get_ident(APIRequestFactory().post('/', **meta))
+
+    def test_client_supplied_forwarded_for_is_ignored(self):
+        self.assertEqual(self.ident(REMOTE_ADDR='10.0.0.1', HTTP_X_FORWARDED_FOR='1.2.3.4'), '10.0.0.1')
+
+    def test_forwarded_for_is_used_behind_configured_proxies(self):
+        with override_settings(REST_FRAMEWORK={'NUM_PROXIES': 1}):
+            self.assertEqual(
+                self.ident(REMOTE_ADDR='10.0.0.1', HTTP_X_FORWARDED_FOR='1.2.3.4, 192.0.2.7'), '192.0.2.7'
+            )
+
+
+@override_settings(INGEST_RATE_LIMIT=RATE_LIMIT)
+class IngestThrottleTests(APITestCase):
+    url = '/api/monitoring/esp/readings/batch/'
+
+    def setUp(self):
+        patcher = mock.patch.object(throttling, '_local_buckets', LocalTokenBuckets())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def post(self, items, **meta):
+        return self.client.post(self.url, items, format='json', **meta)
+
+    def test_device_over_its_burst_gets_429_with_retry_after(self):
+        self.assertEqual(self.post(readings('RL_1', 'RL_1', 'RL_1')).status_code, 201)
+        response = self.post(readings('RL_1'))
+        self.assertEqual(response.status_code, 429)
+        self.assertGreater(int(response['Retry-After']), 0)
+
+    def test_refused_batch_does_not_charge_other_devices(self):
+        self.post(readings('RL_2', 'RL_2', 'RL_2'))
+        self.assertEqual(self.post(readings('RL_3', 'RL_3', 'RL_2')).status_code, 429)
+        self.assertEqual(self.post(readings('RL_3', 'RL_3', 'RL_3'), REMOTE_ADDR='10.0.0.2').status_code, 201)
+
+    def test_forwarded_for_does_not_reset_the_address_bucket(self):
+        for i in range(5):
+            response = self.post(readings(f'RL_IP_{i}'), HTTP_X_FORWARDED_FOR=f'198.51.100.{i}')
+            self.assertEqual(response.status_code, 201)
+        response = self.post(readings('RL_IP_5'), HTTP_X_FORWARDED_FOR='198.51.100.99')
+        self.assertEqual(response.status_code, 429)
+
+    def test_backlog_of_other_workers_sheds_ingests(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        cache.set('ingest-backlog:other-host:1', 5000)
+        cache.set(backlog.REGISTRY_KEY, ['ingest-backlog:other-host:1'])
+        with mock.patch.object(ingest_backlog, 'checked_at', None):
+            response = self.post(readings('RL_4'))
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '2')
+        self.assertFalse(Reading.objects.exists())
+
+    def test_ingest_publishes_its_backlog(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        seen = []
+        ingest = ReadingService._ingest
+
+        def record_backlog(service, records):
+            seen.append(cache.get(ingest_backlog._key()))
+            return ingest(service, records)
+
+        with mock.patch.object(ReadingService, '_ingest', record_backlog), \
+                mock.patch.object(ingest_backlog, 'registered_at', None):
+            self.assertEqual(self.post(readings('RL_5', 'RL_6')).status_code, 201)
+        self.assertEqual(seen, [2])
+        self.assertEqual(cache.get(ingest_backlog._key()), 0)
+        self.assertIn(ingest_backlog._key(), cache.get(backlog.REGISTRY_KEY))
+
+    @override_settings(INGEST_RATE_LIMIT=dict(RATE_LIMIT, REGISTER_RATE=0.001, REGISTER_BURST=3))
+    def test_registration_is_rate_limited_per_address(self):
+        self.assertEqual(self.post(readings('RL_NEW_1', 'RL_NEW_2', 'RL_NEW_3')).status_code, 201)
+        response = self.post(readings('RL_NEW_4', 'RL_NEW_1'))
+        self.assertEqual(response.status_code, 429)
+        self.assertGreater(int(response['Retry-After']), 0)
+        self.assertFalse(Device.objects.filter(device_id='RL_NEW_4').exists())
+        self.assertFalse(known_devices.contains('RL_NEW_4'))
+
+        # Registered devices keep reporting, and other addresses have their own allowance
+        self.assertEqual(self.post(readings('RL_NEW_1')).status_code, 201)
+        self.assertEqual(self.post(readings('RL_NEW_4'), REMOTE_ADDR='10.0.0.3').status_code, 201)
+
+    @override_settings(INGEST_RATE_LIMIT=dict(RATE_LIMIT, REGISTER_GLOBAL_RATE=0.001, REGISTER_GLOBAL_BURST=2))
+    def test_registration_is_rate_limited_overall(self):
+        for i in range(2):
+            self.assertEqual(self.post(readings(f'RL_ALL_{i}'), REMOTE_ADDR=f'10.0.1.{i}').status_code, 201)
+        self.assertEqual(self.post(readings('RL_ALL_2'), REMOTE_ADDR='10.0.1.2').status_code, 429)
+        self.assertFalse(Device.objects.filter(device_id='RL_ALL_2').exists())
+
+    @override_settings(INGEST_AUTO_REGISTER_DEVICES=False)
+    def test_unknown_devices_are_refused_without_auto_registration(self):
+        Device.objects.create(device_id='RL_KNOWN', name='x', location='x')
+        self.addCleanup(known_devices.forget, 'RL_UNKNOWN')
+        self.assertEqual(self.post(readings('RL_UNKNOWN')).status_code, 403)
+        self.assertEqual(self.post(readings('RL_KNOWN')).status_code, 201)
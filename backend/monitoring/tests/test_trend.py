@@ -0,0 +1,115 @@
+from datetime import datetime, timedelta, timezone as dt_timezone
+from unittest import mock
+
+from django.test import SimpleTestCase, TestCase
+
+from monitoring.models import Incident, Reading
+from monitoring.services.reading_service import ReadingService
+from monitoring.services.trend import TrendPredictor
+
+T0 = datetime(2024, 1, 1, tzinfo=dt_timezone.utc)
+STEP = timedelta(minutes=5)
+
+
+def readings(device_id, temperatures, start=T0):
+    return [
+        Reading(device_id=device_id, temperature=temperature, timestamp=start + STEP * i)
+        for i, temperature in enumerate(temperatures)
+    ]
+
+
+# 0.3 °C every 5 minutes: 8 °C is 25 minutes away at the sixth reading
+RISING = [5.0, 5.3, 5.6, 5.9, 6.2, 6.5]
+
+
+class TrendPredictorTests(SimpleTestCase):
+    def setUp(self):
+        self.predictor = TrendPredictor()
+
+    def observe_each(self, items):
+        return [self.predictor.observe([reading], 2.0, 8.0) for reading in items]
+
+    def test_warns_once_a_significant_trend_will_cross_within_the_horizon(self):
+        results = self.observe_each(readings('A', RISING + [6.8]))
+        self.assertEqual([bool(warn) for warn, clear in results], [False] * 5 + [True, False])
+        bound, seconds, reading = results[5][0]['A']
+        self.assertEqual((bound, reading.temperature), (8.0, 6.5))
+        self.assertAlmostEqual(seconds, 25 * 60)
+
+    def test_falling_trend_heads_for_the_lower_bound(self):
+        warn, clear = self.predictor.observe(readings('B', [4.5, 4.2, 3.9, 3.6, 3.3, 3.0]), 2.0, 8.0)
+        bound, seconds, reading = warn['B']
+        self.assertEqual(bound, 2.0)
+        # 1 °C at 0.06 °C a minute
+        self.assertAlmostEqual(seconds, 1000)
+
+    def test_no_warning_for_noise_or_a_distant_crossing(self):
+        warn, clear = self.predictor.observe(readings('C', [5.0, 5.4, 4.8, 5.3, 4.9, 5.2, 5.1]), 2.0, 8.0)
+        self.assertEqual(warn, {})
+        warn, clear = self.predictor.observe(readings('D', [3.0, 3.05, 3.1, 3.15, 3.2, 3.25]), 2.0, 8.0)
+        self.assertEqual(warn, {})
+
+    def test_warning_is_withdrawn_when_the_trend_levels_off(self):
+        results = self.observe_each(readings('E', RISING + [6.5] * 12))
+        cleared = [i for i, (warn, clear) in enumerate(results) if clear]
+        self.assertEqual(len(cleared), 1)
+        self.assertEqual(results[cleared[0]][1][0][0], 'E')
+
+    def test_warned_devices_are_only_touched_under_the_lock(self):
+        lock = self.predictor.lock
+
+        class GuardedSet(set):
+            def __contains__(self, item):
+                assert lock.locked(), 'warned read without the lock'
+                return super().__contains__(item)
+
+            def add(self, item):
+                assert lock.locked(), 'warned changed without the lock'
+                super().add(item)
+
+            def discard(self, item):
+                assert lock.locked(), 'warned changed without the lock'
+                super().discard(item)
+
+        with mock.patch.object(self.predictor, 'warned', GuardedSet()):
+            results = self.observe_each(readings('L', RISING + [6.5] * 12 + [8.5]))
+        self.assertEqual([bool(warn) for warn, clear in results].count(True), 1)
+        self.assertEqual([bool(clear) for warn, clear in results].count(True), 1)
+
+    def test_out_of_range_reading_restarts_the_fit(self):
+        self.predictor.observe(readings('F', RISING), 2.0, 8.0)
+        self.predictor.observe(readings('F', [8.5], start=T0 + STEP * 6), 2.0, 8.0)
+        warn, clear = self.predictor.observe(readings('F', RISING[1:], start=T0 + STEP * 7), 2.0, 8.0)
+        # Five readings since the excursion: not enough to fit
+        self.assertEqual(warn, {})
+
+    def test_late_readings_are_ignored(self):
+        self.predictor.observe(readings('G', RISING), 2.0, 8.0)
+        warn, clear = self.predictor.observe(readings('G', [2.5], start=T0 + STEP), 2.0, 8.0)
+        self.assertEqual((warn, clear), ({}, []))
+
+
+class TrendAlertTests(TestCase):
+    def records(self, device_id, temperatures, start=T0):
+        return [
+            (reading.device_id, reading.temperature, 40.0, 'AC', 100.0, reading.timestamp)
+            for reading in readings(device_id, temperatures, start)
+        ]
+
+    def test_pre_alert_opens_an_incident_and_is_withdrawn(self):
+        service = ReadingService(notify=False)
+        service.ingest(self.records('TREND_1', RISING))
+        incident = Incident.objects.get(device__device_id='TREND_1')
+        self.assertEqual((incident.alert.alert_type, incident.alert.severity), ('temperature_trend', 'warning'))
+        self.assertIn('trending above 8.0°C within 25 min', incident.alert.message)
+
+        service.ingest(self.records('TREND_1', [6.5] * 12, start=T0 + STEP * 6))
+        incident.refresh_from_db()
+        self.assertEqual(incident.status, 'resolved')
+        self.assertEqual(Incident.objects.filter(device__device_id='TREND_1').count(), 1)
+
+    def test_normal_readings_do_not_resolve_a_pre_alert(self):
+        service = ReadingService(notify=False)
+        service.ingest(self.records('TREND_2', RISING))
+        service.ingest(self.records('TREND_2', [6.8], start=T0 + STEP * 6))
+        self.assertEqual(Incident.objects.get(device__device_id='TREND_2').status, 'open')
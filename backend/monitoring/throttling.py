@@ -0,0 +1,275 @@
+"""
+Rate limiting and load shedding for the unauthenticated device ingest endpoints.
+
+Token buckets are keyed by device id and by source IP and charged one token per
+reading, so a batch costs as much as the same readings posted one by one. When
+a bucket is empty, too many readings are already waiting to be stored across
+the workers, or too many new devices are registering, DRF answers 429 with a
+Retry-After header the firmware can sleep on.
+"""
+import math
+import threading
+import time
+from collections import Counter, OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from rest_framework.exceptions import PermissionDenied, Throttled
+from rest_framework.permissions import BasePermission
+from rest_framework.throttling import BaseThrottle
+
+from .models import Device
+from .services.backlog import ingest_backlog
+
+DEFAULT_RATE_LIMIT = {
+    'DEVICE_RATE': 1.0,         # sustained readings per second per device
+    'DEVICE_BURST': 1000,       # bucket size; lets a device upload a full catch-up batch
+    'IP_RATE': 200.0,           # sustained readings per second per source address
+    'IP_BURST': 5000,
+    'STORE': 'local',           # 'cache' shares buckets between workers through Django's cache
+    'MAX_BACKLOG': 5000,        # readings being stored, across all workers, before new ingests are shed
+    'REGISTER_RATE': 0.1,       # sustained new devices per second per source address
+    'REGISTER_BURST': 100,      # lets one gateway or NAT bring up a fleet at once
+    'REGISTER_GLOBAL_RATE': 1.0,    # sustained new devices per second from all addresses together
+    'REGISTER_GLOBAL_BURST': 1000,
+    'UNKNOWN_DEVICE_TTL': 60,   # seconds an unknown device id is remembered as unknown
+}
+
+
+def rate_limit_setting(name):
+    return getattr(settings, 'INGEST_RATE_LIMIT', {}).get(name, DEFAULT_RATE_LIMIT[name])
+
+
+class LocalTokenBuckets:
+    """
+    Token buckets held in this process. Past max_keys the least recently used
+    buckets are dropped, but only once they have refilled: a dropped bucket is
+    then recreated exactly as it was, so cycling through fresh keys cannot
+    reset a bucket that is still draining. The map may therefore grow past
+    max_keys while many buckets are draining at once.
+    """
+
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys
+        self.buckets = OrderedDict()
+        self.lock = threading.Lock()
+
+    def take(self, key, cost, rate, burst):
+        """Take `cost` tokens; returns 0 when allowed, otherwise seconds until they are available"""
+        return self.take_all({key: cost}, rate, burst)
+
+    def take_all(self, costs, rate, burst):
+        """
+        Take costs[key] tokens from every bucket, or none at all unless each
+        has enough; returns 0 when allowed, otherwise the longest wait
+        """
+        now = time.monotonic()
+        with self.lock:
+            refilled = {}
+            for key, cost in costs.items():
+                tokens, updated, _ = self.buckets.pop(key, (burst, now, now))
+                refilled[key] = min(burst, tokens + (now - updated) * rate)
+            wait = max([0] + [(cost - refilled[key]) / rate for key, cost in costs.items()])
+            for key, tokens in refilled.items():
+                tokens = tokens if wait else tokens - costs[key]
+                self.buckets[key] = (tokens, now, now + (burst - tokens) / rate)
+            while len(self.buckets) > self.max_keys:
+                oldest = next(iter(self.buckets))
+                if self.buckets[oldest][2] > now:
+                    break
+                del self.buckets[oldest]
+        return wait
+
+
+class CacheTokenBuckets:
+    """
+    Token buckets in Django's cache, shared by every worker using the same cache.
+    Read-modify-write is not atomic, so concurrent requests for one key can
+    overdraw a bucket slightly; that is acceptable for flood protection.
+    """
+
+    def take(self, key, cost, rate, burst):
+        return self.take_all({key: cost}, rate, burst)
+
+    def take_all(self, costs, rate, burst):
+        now = time.time()
+        stored = cache.get_many([f'ingest-bucket:{key}' for key in costs])
+        refilled = {}
+        for key in costs:
+            tokens, updated = stored.get(f'ingest-bucket:{key}') or (burst, now)
+            refilled[key] = min(burst, tokens + (now - updated) * rate)
+        wait = max([0] + [(cost - refilled[key]) / rate for key, cost in costs.items()])
+        cache.set_many({
+            f'ingest-bucket:{key}': (tokens if wait else tokens - costs[key], now)
+            for key, tokens in refilled.items()
+        }, timeout=math.ceil(burst / rate) + 1)
+        return wait
+
+
+_local_buckets = LocalTokenBuckets()
+_cache_buckets = CacheTokenBuckets()
+
+
+def get_buckets():
+    return _cache_buckets if rate_limit_setting('STORE') == 'cache' else _local_buckets
+
+
+def payload_device_counts(request):
+    """Readings per device id in a JSON, JSON list or packed ingest body"""
+    data = request.data
+    if isinstance(data, tuple):
+        records, _ = data
+        return Counter(record[0] for record in records)
+    if isinstance(data, dict) and 'readings' in data:
+        data = data['readings']
+    if isinstance(data, list):
+        return Counter(item.get('device_id') for item in data if isinstance(item, dict))
+    device_id = data.get('device_id') if hasattr(data, 'get') else None
+    return Counter([device_id]) if device_id else Counter()
+
+
+class DeviceRateThrottle(BaseThrottle):
+    """Token bucket per device id, charged one token per reading"""
+
+    def allow_request(self, request, view):
+        rate = rate_limit_setting('DEVICE_RATE')
+        burst = rate_limit_setting('DEVICE_BURST')
+        costs = {
+            f'device:{device_id}': count
+            for device_id, count in payload_device_counts(request).items() if device_id is not None
+        }
+        # A refused batch costs nothing, even for the devices whose buckets had room
+        self.wait_time = get_buckets().take_all(costs, rate, burst)
+        return not self.wait_time
+
+    def wait(self):
+        return math.ceil(self.wait_time)
+
+
+class SourceIPRateThrottle(BaseThrottle):
+    """
+    Token bucket per client address, charged one token per reading. The
+    address is REMOTE_ADDR or, behind NUM_PROXIES trusted proxies, the
+    address the outermost of them recorded in X-Forwarded-For (see
+    get_ident), so clients cannot pick a fresh bucket by sending their own
+    X-Forwarded-For.
+    """
+
+    def allow_request(self, request, view):
+        cost = max(1, sum(payload_device_counts(request).values()))
+        self.wait_time = get_buckets().take(
+            f'ip:{self.get_ident(request)}', cost,
+            rate_limit_setting('IP_RATE'), rate_limit_setting('IP_BURST')
+        )
+        return not self.wait_time
+
+    def wait(self):
+        return math.ceil(self.wait_time)
+
+
+class IngestBacklogThrottle(BaseThrottle):
+    """
+    Sheds new ingests while more than MAX_BACKLOG readings are being written or
+    evaluated, or waiting for a group commit, in all workers together (see
+    services.backlog).
+    """
+
+    def allow_request(self, request, view):
+        self.backlog = ingest_backlog.total()
+        return self.backlog < rate_limit_setting('MAX_BACKLOG')
+
+    def wait(self):
+        # Spread retries out further the deeper the backlog is
+        return min(30, 1 + self.backlog // max(1, rate_limit_setting('MAX_BACKLOG')))
+
+
+class KnownDevices:
+    """
+    In-process cache of which device ids exist, so floods of made-up ids are
+    refused without a database query per request. Known ids are kept until the
+    device is deleted; unknown ids are re-checked after UNKNOWN_DEVICE_TTL.
+    """
+
+    def __init__(self):
+        self.known = set()
+        self.unknown = {}
+        self.lock = threading.Lock()
+
+    def contains(self, device_id):
+        if device_id in self.known:
+            return True
+        expires = self.unknown.get(device_id)
+        if expires and expires > time.monotonic():
+            return False
+
+        exists = Device.objects.filter(device_id=device_id).exists()
+        with self.lock:
+            if exists:
+                self.known.add(device_id)
+                self.unknown.pop(device_id, None)
+            else:
+                self.unknown[device_id] = time.monotonic() + rate_limit_setting('UNKNOWN_DEVICE_TTL')
+                if len(self.unknown) > 100000:
+                    self.unknown.clear()
+        return exists
+
+    def add(self, device_ids):
+        """Remember ids being registered, so their next requests are not charged again"""
+        with self.lock:
+            self.known.update(device_ids)
+            for device_id in device_ids:
+                self.unknown.pop(device_id, None)
+
+    def forget(self, device_id):
+        with self.lock:
+            self.known.discard(device_id)
+            self.unknown.pop(device_id, None)
+
+
+known_devices = KnownDevices()
+
+
+@receiver([post_save, post_delete], sender=Device)
+def _forget_device(sender, instance, **kwargs):
+    known_devices.forget(instance.device_id)
+
+
+class KnownDevicePermission(BasePermission):
+    """
+    With INGEST_AUTO_REGISTER_DEVICES disabled, only readings from registered
+    devices are accepted. Otherwise unknown devices are registered on first
+    contact, at most REGISTER_RATE per second per source address and
+    REGISTER_GLOBAL_RATE overall, so a flood of made-up ids cannot create a
+    Device row and a fresh rate-limit bucket for each of them. Checked here
+    rather than in a throttle because DRF checks permissions first, and a
+    refused id must not get a bucket.
+    """
+    message = 'Unknown device'
+
+    def has_permission(self, request, view):
+        auto_register = getattr(settings, 'INGEST_AUTO_REGISTER_DEVICES', True)
+        unknown = [
+            device_id for device_id in payload_device_counts(request)
+            if device_id is None and not auto_register
+            or device_id is not None and not known_devices.contains(device_id)
+        ]
+        if not unknown:
+            return True
+        if not auto_register:
+            # Raised rather than returned: DRF turns a refusal of a request without device credentials into 401
+            raise PermissionDenied(self.message)
+
+        buckets = get_buckets()
+        wait = buckets.take(
+            f'register-ip:{SourceIPRateThrottle().get_ident(request)}', len(unknown),
+            rate_limit_setting('REGISTER_RATE'), rate_limit_setting('REGISTER_BURST')
+        ) or buckets.take(
+            'register:all', len(unknown),
+            rate_limit_setting('REGISTER_GLOBAL_RATE'), rate_limit_setting('REGISTER_GLOBAL_BURST')
+        )
+        if wait:
+            raise Throttled(wait=math.ceil(wait))
+        known_devices.add(unknown)
+        return True
@@ -2,7 +2,8 @@ from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 from .views import (
     ReadingViewSet, AlertViewSet, IncidentViewSet, DeviceViewSet,
-    TemperatureStatsView, ESPDataCollectionView
+    TemperatureStatsView, ESPDataCollectionView, ESPBatchCollectionView, FleetSnapshotView,
+    ComplianceReportView, AvailabilityReportView
 )
 
 router = DefaultRouter()
@@ -14,5 +15,9 @@ router.register(r'devices', DeviceViewSet)
 urlpatterns = [
     path('', include(router.urls)),
     path('temperature/stats/', TemperatureStatsView.as_view(), name='temperature-stats'),
+    path('fleet/snapshot/', FleetSnapshotView.as_view(), name='fleet-snapshot'),
+    path('analytics/compliance/', ComplianceReportView.as_view(), name='compliance-report'),
+    path('analytics/availability/', AvailabilityReportView.as_view(), name='availability-report'),
     path('esp/reading/', ESPDataCollectionView.as_view(), name='esp-reading'),
+    path('esp/readings/batch/', ESPBatchCollectionView.as_view(), name='esp-readings-batch'),
 ]
\ No newline at end of file
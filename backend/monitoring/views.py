@@ -3,20 +3,38 @@ from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.permissions import IsAdminUser
 from django.utils import timezone
-from datetime import timedelta
+from django.conf import settings
 from django.contrib.auth.models import User
 from .models import Reading, Alert, Incident, IncidentComment, IncidentTimelineEvent, Device
 from .serializers import ReadingSerializer, AlertSerializer, IncidentSerializer, IncidentCommentSerializer, IncidentTimelineEventSerializer, DeviceSerializer
 from notifications.services.notification_service import NotificationService
+from .services.reading_service import ReadingService
+from .services.group_commit import get_group_committer
+from .services.fleet import FleetSnapshotService
+from .services.compliance import ComplianceReport, invalidate_rollups
+from .services.availability import AvailabilityReport, invalidate_gaps
+from .services.escalation import cancel_escalation
+from .services.incident_events import IncidentEventWriter
+from .services.stats_cache import StatsCache, PERIODS as STATS_PERIODS
+from .device_auth import DeviceKeyAuthentication, DeviceKeyPermission
+from .conditional import (
+    conditional, bump_resource_version, READINGS, readings_etag, latest_reading_etag,
+    incidents_etag, incidents_last_modified
+)
+from .throttling import KnownDevicePermission, IngestBacklogThrottle, DeviceRateThrottle, SourceIPRateThrottle
+from .ingest import BINARY_MEDIA_TYPE, BinaryReadingParser, validate_reading, record_from_validated, encode_ack
 from settings.models import SystemSettings
 import logging
 from django.db import transaction
 from notifications.models import Operator
 from rest_framework.views import APIView
-from django.db.models import Min, Max, Avg
+from rest_framework.settings import api_settings
+from rest_framework.exceptions import ParseError
+from django.db.models import Q
 from django.db.models.functions import TruncDate
 from django.core.exceptions import PermissionDenied
 import csv
+from bisect import bisect_right
 from django.http import HttpResponse
 import json
 import io
@@ -31,29 +49,45 @@ class ReadingViewSet(viewsets.ModelViewSet):
     def get_queryset(self):
         queryset = Reading.objects.all()
         device_id = self.request.query_params.get('device_id', None)
-        if device_id:
+        if device_id and device_id != 'ALL':
             queryset = queryset.filter(device_id=device_id)
         return queryset.order_by('-timestamp')
 
+    @conditional(readings_etag)
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
+    def perform_update(self, serializer):
+        previous_device, previous_time = serializer.instance.device_id, serializer.instance.timestamp
+        super().perform_update(serializer)
+        bump_resource_version(READINGS)
+        reading = serializer.instance
+        earliest, latest = min(previous_time, reading.timestamp), max(previous_time, reading.timestamp)
+        invalidate_rollups({previous_device, reading.device_id}, earliest, latest)
+        invalidate_gaps({previous_device, reading.device_id}, earliest, latest)
+
+    def perform_destroy(self, instance):
+        super().perform_destroy(instance)
+        bump_resource_version(READINGS)
+        invalidate_rollups([instance.device_id], instance.timestamp, instance.timestamp)
+        invalidate_gaps([instance.device_id], instance.timestamp, instance.timestamp)
+
     @action(detail=False, methods=['get'])
+    @conditional(latest_reading_etag)
     def latest(self, request):
         """Get the latest temperature reading."""
         try:
-            device_id = request.query_params.get('device_id', None)
-            queryset = self.get_queryset()
-            
-            if device_id and device_id != 'ALL':
-                queryset = queryset.filter(device_id=device_id)
+            # Already ordered by -timestamp and filtered by device_id in get_queryset
+            readings = list(self.get_queryset()[:2])
             
-            latest_reading = queryset.first()  # Already ordered by -timestamp from get_queryset
-            
-            if not latest_reading:
+            if not readings:
                 return Response({
                     'error': 'No readings available'
                 }, status=status.HTTP_404_NOT_FOUND)
             
             # Get previous reading for trend
-            previous_reading = queryset[1] if queryset.count() > 1 else None
+            latest_reading = readings[0]
+            previous_reading = readings[1] if len(readings) > 1 else None
             
             # Calculate trend
             trend = 'stable'
@@ -100,193 +134,18 @@ class ReadingViewSet(viewsets.ModelViewSet):
     def create(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
-        reading = serializer.save()
-        
-        # Check temperature limits
-        self._check_temperature(reading)
         
-        # Check power status
-        self._check_power_status(reading)
+        # Store and check temperature limits; a resent reading is stored only once
+        record = record_from_validated(serializer.validated_data)
+        reading = ReadingService().ingest([record])[0]
+        if reading is None:
+            reading = Reading.objects.get(device_id=record[0], timestamp=record[5])
+            return Response(self.get_serializer(reading).data, status=status.HTTP_200_OK)
         
+        serializer = self.get_serializer(reading)
         headers = self.get_success_headers(serializer.data)
         return Response(serializer.data, status=status.HTTP_201_CREATED, headers=headers)
 
-    def _check_temperature(self, reading):
-        """
-        Check temperature against thresholds and create alerts if needed:
-        - Normal: 2°C to 8°C
-        - Critical: 0°C to 2°C or 8°C to 10°C
-        - Severe: Outside these ranges
-        """
-        try:
-            temperature = reading.temperature
-            
-            # Define temperature ranges
-            NORMAL_MIN, NORMAL_MAX = 2.0, 8.0
-            CRITICAL_MIN, CRITICAL_MAX = 0.0, 10.0
-            
-            # Get or create device
-            device, created = Device.objects.get_or_create(
-                device_id=reading.device_id,
-                defaults={
-                    'name': f'Device {reading.device_id}',
-                    'location': 'Unknown',
-                    'status': 'online'
-                }
-            )
-            
-            # Update device status and last reading
-            device.status = 'online'
-            device.last_reading = timezone.now()
-            device.save()
-            
-            # Determine alert type and severity
-            if NORMAL_MIN <= temperature <= NORMAL_MAX:
-                # Temperature is normal, resolve any active incidents
-                active_incidents = Incident.objects.filter(
-                    device=device,
-                    status__in=['open', 'acknowledged', 'investigating']
-                )
-                
-                for incident in active_incidents:
-                    incident.status = 'resolved'
-                    incident.end_time = timezone.now()
-                    incident.save()
-                    
-                    IncidentTimelineEvent.objects.create(
-                        incident=incident,
-                        event_type='status_changed',
-                        description=f"Temperature returned to normal range: {temperature}°C",
-                        temperature=temperature
-                    )
-                
-                return  # No need to create alert for normal temperature
-            
-            # Temperature is outside normal range
-            severity = 'critical' if CRITICAL_MIN <= temperature <= CRITICAL_MAX else 'severe'
-            alert_type = 'high_temperature' if temperature > NORMAL_MAX else 'low_temperature'
-            
-            # Create alert with transaction to ensure it's created successfully
-            with transaction.atomic():
-                # Create alert
-                alert = Alert.objects.create(
-                    device=device,
-                    reading=reading,
-                    alert_type=alert_type,
-                    severity=severity,
-                    message=f"Temperature {alert_type.replace('_', ' ')}: {temperature}°C"
-                )
-                
-                # Save the alert to ensure it has an ID
-                alert.save()
-                
-                # Get or create incident
-                active_incident = Incident.objects.filter(
-                    device=device,
-                    status__in=['open', 'acknowledged', 'investigating']
-                ).first()
-                
-                if active_incident:
-                    # Update existing incident
-                    active_incident.alert_count += 1
-                    active_incident.save()
-                    
-                    # Check for escalation
-                    if active_incident.alert_count == 4:
-                        active_incident.current_escalation_level = 2
-                        self._notify_operators(active_incident, level=2)
-                    elif active_incident.alert_count == 7:
-                        active_incident.current_escalation_level = 3
-                        self._notify_operators(active_incident, level=3)
-                else:
-                    # Create new incident
-                    incident = Incident.objects.create(
-                        device=device,
-                        alert=alert,  # Now we're sure the alert exists and has an ID
-                        description=f"Temperature {alert_type.replace('_', ' ')} incident",
-                        status='open',
-                        current_escalation_level=1
-                    )
-                    
-                    # Notify primary operators
-                    self._notify_operators(incident, level=1)
-                    
-                    # Create initial timeline event
-                    IncidentTimelineEvent.objects.create(
-                        incident=incident,
-                        event_type='alert_created',
-                        description=f"Initial alert: Temperature {alert_type.replace('_', ' ')} ({temperature}°C)",
-                        temperature=temperature
-                    )
-            
-        except Exception as e:
-            logger.error(f"Error processing ESP8266 data: {str(e)}")
-            raise
-
-    def _notify_operators(self, incident, level):
-        """Notify operators based on escalation level"""
-        operators = Operator.objects.filter(priority=level, is_active=True)
-        
-        for operator in operators:
-            try:
-                # Create notification (implement your notification logic here)
-                NotificationService().notify_operator(
-                    operator=operator,
-                    incident=incident,
-                    message=f"Temperature alert - Level {level} escalation"
-                )
-                
-                # Log notification in timeline
-                IncidentTimelineEvent.objects.create(
-                    incident=incident,
-                    event_type='notification_sent',
-                    description=f"Notification sent to {operator.name} (Level {level})",
-                    operator=operator
-                )
-                
-            except Exception as e:
-                logger.error(f"Failed to notify operator {operator.id}: {str(e)}")
-
-    def _check_power_status(self, reading):
-        last_reading = Reading.objects.filter(
-            timestamp__lt=reading.timestamp
-        ).first()
-
-        if last_reading and last_reading.power_status != reading.power_status:
-            if not reading.power_status:
-                self._create_alert(reading, 'POWER_OUT', severity=3)
-            else:
-                self._create_alert(reading, 'POWER_RESTORED', severity=1)
-
-    def _create_alert(self, reading, alert_type, severity=2):
-        print(f"\n=== Creating alert ===")
-        print(f"Type: {alert_type}")
-        print(f"Severity: {severity}")
-        
-        settings = SystemSettings.get_settings()
-        
-        try:
-            # Create the alert
-            alert = Alert.objects.create(
-                type=alert_type,
-                severity=severity,
-                reading=reading,
-                message=f"Alert: {alert_type} at {reading.timestamp}"
-            )
-            print(f"Alert created with ID: {alert.id}")
-            
-            # Create notifications using notification service
-            notification_service = NotificationService()
-            notifications = notification_service.process_alert(alert)
-            print(f"Notifications created: {notifications}")
-            
-            return alert
-            
-        except Exception as e:
-            print(f"Error creating alert: {str(e)}")
-            logger.error(f"Failed to create alert: {str(e)}")
-            raise
-
     @action(detail=False, methods=['get'])
     def export(self, request):
         """Export readings in CSV format."""
@@ -357,6 +216,17 @@ class AlertViewSet(viewsets.ReadOnlyModelViewSet):
             'total': total
         })
 
+    @action(detail=True)
+    def readings(self, request, pk=None):
+        """The readings of the excursion an alert covers, oldest first"""
+        alert = self.get_object()
+        readings = Reading.objects.filter(
+            device_id=alert.device.device_id,
+            timestamp__gte=alert.timestamp,
+            timestamp__lte=alert.last_timestamp or alert.timestamp
+        ).order_by('timestamp')
+        return Response(ReadingSerializer(readings, many=True).data)
+
     @action(detail=True, methods=['post'])
     def resolve(self, request, pk=None):
         alert = self.get_object()
@@ -385,6 +255,10 @@ class IncidentViewSet(viewsets.ModelViewSet):
             
         return queryset
 
+    @conditional(incidents_etag, incidents_last_modified)
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
     def _get_operator_or_fail(self):
         """Get operator for current user or raise appropriate error"""
         try:
@@ -441,6 +315,7 @@ class IncidentViewSet(viewsets.ModelViewSet):
                 if serializer.validated_data.get('action_taken', False):
                     incident.status = 'acknowledged'
                     incident.save()
+                    cancel_escalation(incident)
                     
                     # Create additional timeline event for action taken
                     IncidentTimelineEvent.objects.create(
@@ -481,6 +356,7 @@ class IncidentViewSet(viewsets.ModelViewSet):
                 incident.acknowledged_by = operator
                 incident.acknowledged_at = timezone.now()
                 incident.save()
+                cancel_escalation(incident)
                 
                 # Create comment
                 IncidentComment.objects.create(
@@ -593,17 +469,20 @@ class IncidentViewSet(viewsets.ModelViewSet):
             if alert and alert.reading:
                 temperature = alert.reading.temperature
                 severity = self._determine_severity(temperature)
+                events = IncidentEventWriter()
                 
                 # Notify operators based on severity and escalation level
                 if severity >= 3:  # Severe - notify all operators
-                    self._notify_operators(incident, level=1)  # Primary
-                    self._notify_operators(incident, level=2)  # Secondary
-                    self._notify_operators(incident, level=3)  # Tertiary
+                    self._notify_operators(incident, level=1, events=events)  # Primary
+                    self._notify_operators(incident, level=2, events=events)  # Secondary
+                    self._notify_operators(incident, level=3, events=events)  # Tertiary
                 elif severity == 2:  # Critical - notify primary and secondary
-                    self._notify_operators(incident, level=1)  # Primary
-                    self._notify_operators(incident, level=2)  # Secondary
+                    self._notify_operators(incident, level=1, events=events)  # Primary
+                    self._notify_operators(incident, level=2, events=events)  # Secondary
                 else:  # Normal - notify only primary
-                    self._notify_operators(incident, level=1)  # Primary
+                    self._notify_operators(incident, level=1, events=events)  # Primary
+                # Sent once the notifications are stored
+                events.write()
 
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         except Exception as e:
@@ -622,30 +501,11 @@ class IncidentViewSet(viewsets.ModelViewSet):
         else:
             return 1  # Normal range
 
-    def _notify_operators(self, incident, level):
+    def _notify_operators(self, incident, level, events):
         """Notify operators based on escalation level"""
         operators = Operator.objects.filter(priority=level, is_active=True)
-        notification_service = NotificationService()
-        
         for operator in operators:
-            try:
-                # Create notification
-                notification_service.notify_operator(
-                    operator=operator,
-                    incident=incident,
-                    message=self._get_notification_message(incident, level)
-                )
-                
-                # Log notification in timeline
-                IncidentTimelineEvent.objects.create(
-                    incident=incident,
-                    event_type='notification_sent',
-                    description=f"Notification sent to {operator.name} (Level {level})",
-                    operator=operator
-                )
-                
-            except Exception as e:
-                logger.error(f"Failed to notify operator {operator.id}: {str(e)}")
+            events.notify(incident, operator, self._get_notification_message(incident, level), level)
 
     def _get_notification_message(self, incident, level):
         temperature = incident.alert.reading.temperature if incident.alert and incident.alert.reading else None
@@ -680,9 +540,23 @@ class DeviceViewSet(viewsets.ModelViewSet):
         
         return Response(self.get_serializer(device).data)
 
+    @action(detail=True, methods=['post'], permission_classes=[IsAdminUser])
+    def rotate_key(self, request, pk=None):
+        """Issue a new API key for the device; the previous key stops working immediately"""
+        device = self.get_object()
+        return Response({'device_id': device.device_id, 'api_key': device.rotate_api_key()})
+
+def is_binary_request(request):
+    return request.content_type.split(';')[0].strip() == BINARY_MEDIA_TYPE
+
+def binary_ack(accepted, rejected, status_code):
+    return HttpResponse(encode_ack(accepted, rejected), content_type=BINARY_MEDIA_TYPE, status=status_code)
+
 class ESPDataCollectionView(APIView):
-    authentication_classes = []  # Allow unauthenticated access
-    permission_classes = []  # Allow unauthenticated access
+    authentication_classes = [DeviceKeyAuthentication]  # Device keys only, no user accounts
+    permission_classes = [DeviceKeyPermission, KnownDevicePermission]
+    throttle_classes = [IngestBacklogThrottle, DeviceRateThrottle, SourceIPRateThrottle]
+    parser_classes = api_settings.DEFAULT_PARSER_CLASSES + [BinaryReadingParser]
     
     def post(self, request):
         """
@@ -695,8 +569,22 @@ class ESPDataCollectionView(APIView):
             "power_status": "AC",
             "battery_level": 100
         }
+        or a single packed record sent as application/vnd.tempmonitor.reading
+        (see monitoring.ingest), which is answered with a binary ack.
         """
         try:
+            if is_binary_request(request):
+                records, rejected = request.data
+                if len(records) + rejected != 1:
+                    return Response(
+                        {'error': 'Expected exactly one reading, use esp/readings/batch/ for more'},
+                        status=status.HTTP_400_BAD_REQUEST
+                    )
+                if not records:
+                    return binary_ack(0, rejected, status.HTTP_400_BAD_REQUEST)
+                reading = self._store(records[0])
+                return binary_ack(1, 0, status.HTTP_201_CREATED if reading else status.HTTP_200_OK)
+
             # Validate required fields
             required_fields = ['device_id', 'temperature', 'humidity']
             for field in required_fields:
@@ -706,39 +594,32 @@ class ESPDataCollectionView(APIView):
                         status=status.HTTP_400_BAD_REQUEST
                     )
             
-            # Get or create device
-            device, _ = Device.objects.get_or_create(
-                device_id=request.data['device_id'],
-                defaults={
-                    'name': f'ESP8266 Sensor {request.data["device_id"]}',
-                    'location': 'Default Location'
-                }
-            )
-            
-            # Update device status
-            device.status = 'online'
-            device.last_reading = timezone.now()
-            device.save()
-            
             # Create reading
             serializer = ReadingSerializer(data={
                 'device_id': request.data['device_id'],
                 'temperature': request.data['temperature'],
                 'humidity': request.data['humidity'],
                 'power_status': request.data.get('power_status', 'AC'),
-                'battery_level': request.data.get('battery_level', 100)
+                'battery_level': request.data.get('battery_level', 100),
+                'timestamp': request.data.get('timestamp', timezone.now())
             })
             
-            if serializer.is_valid():
-                reading = serializer.save()
-                
-                # Check temperature limits and create alerts if needed
-                self._check_temperature(reading)
-                
-                return Response(serializer.data, status=status.HTTP_201_CREATED)
-            
-            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+            if not serializer.is_valid():
+                return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+            # Stores the reading, refreshes the device heartbeat and checks temperature limits
+            data = serializer.validated_data
+            reading = self._store(record_from_validated(data))
+
+            if reading is None:
+                # Retry of a reading that is already stored: acknowledge it without evaluating again
+                reading = Reading.objects.get(device_id=data['device_id'], timestamp=data['timestamp'])
+                return Response(ReadingSerializer(reading).data, status=status.HTTP_200_OK)
+
+            return Response(ReadingSerializer(reading).data, status=status.HTTP_201_CREATED)
             
+        except ParseError as e:
+            return Response({'error': str(e.detail)}, status=status.HTTP_400_BAD_REQUEST)
         except Exception as e:
             logger.error(f"Error processing ESP8266 data: {str(e)}")
             return Response(
@@ -746,141 +627,12 @@ class ESPDataCollectionView(APIView):
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
 
-    def _check_temperature(self, reading):
-        """
-        Check temperature against thresholds and create alerts if needed:
-        - Normal: 2°C to 8°C
-        - Critical: 0°C to 2°C or 8°C to 10°C
-        - Severe: Outside these ranges
-        """
-        try:
-            temperature = reading.temperature
-            
-            # Define temperature ranges
-            NORMAL_MIN, NORMAL_MAX = 2.0, 8.0
-            CRITICAL_MIN, CRITICAL_MAX = 0.0, 10.0
-            
-            # Get or create device
-            device, created = Device.objects.get_or_create(
-                device_id=reading.device_id,
-                defaults={
-                    'name': f'Device {reading.device_id}',
-                    'location': 'Unknown',
-                    'status': 'online'
-                }
-            )
-            
-            # Update device status and last reading
-            device.status = 'online'
-            device.last_reading = timezone.now()
-            device.save()
-            
-            # Determine alert type and severity
-            if NORMAL_MIN <= temperature <= NORMAL_MAX:
-                # Temperature is normal, resolve any active incidents
-                active_incidents = Incident.objects.filter(
-                    device=device,
-                    status__in=['open', 'acknowledged', 'investigating']
-                )
-                
-                for incident in active_incidents:
-                    incident.status = 'resolved'
-                    incident.end_time = timezone.now()
-                    incident.save()
-                    
-                    IncidentTimelineEvent.objects.create(
-                        incident=incident,
-                        event_type='status_changed',
-                        description=f"Temperature returned to normal range: {temperature}°C",
-                        temperature=temperature
-                    )
-                
-                return  # No need to create alert for normal temperature
-            
-            # Temperature is outside normal range
-            severity = 'critical' if CRITICAL_MIN <= temperature <= CRITICAL_MAX else 'severe'
-            alert_type = 'high_temperature' if temperature > NORMAL_MAX else 'low_temperature'
-            
-            # Create alert with transaction to ensure it's created successfully
-            with transaction.atomic():
-                # Create alert
-                alert = Alert.objects.create(
-                    device=device,
-                    reading=reading,
-                    alert_type=alert_type,
-                    severity=severity,
-                    message=f"Temperature {alert_type.replace('_', ' ')}: {temperature}°C"
-                )
-                
-                # Save the alert to ensure it has an ID
-                alert.save()
-                
-                # Get or create incident
-                active_incident = Incident.objects.filter(
-                    device=device,
-                    status__in=['open', 'acknowledged', 'investigating']
-                ).first()
-                
-                if active_incident:
-                    # Update existing incident
-                    active_incident.alert_count += 1
-                    active_incident.save()
-                    
-                    # Check for escalation
-                    if active_incident.alert_count == 4:
-                        active_incident.current_escalation_level = 2
-                        self._notify_operators(active_incident, level=2)
-                    elif active_incident.alert_count == 7:
-                        active_incident.current_escalation_level = 3
-                        self._notify_operators(active_incident, level=3)
-                else:
-                    # Create new incident
-                    incident = Incident.objects.create(
-                        device=device,
-                        alert=alert,  # Now we're sure the alert exists and has an ID
-                        description=f"Temperature {alert_type.replace('_', ' ')} incident",
-                        status='open',
-                        current_escalation_level=1
-                    )
-                    
-                    # Notify primary operators
-                    self._notify_operators(incident, level=1)
-                    
-                    # Create initial timeline event
-                    IncidentTimelineEvent.objects.create(
-                        incident=incident,
-                        event_type='alert_created',
-                        description=f"Initial alert: Temperature {alert_type.replace('_', ' ')} ({temperature}°C)",
-                        temperature=temperature
-                    )
-            
-        except Exception as e:
-            logger.error(f"Error processing ESP8266 data: {str(e)}")
-            raise
-
-    def _notify_operators(self, incident, level):
-        """Notify operators based on escalation level"""
-        operators = Operator.objects.filter(priority=level, is_active=True)
-        
-        for operator in operators:
-            try:
-                # Create notification (implement your notification logic here)
-                NotificationService().notify_operator(
-                    operator=operator,
-                    incident=incident,
-                    message=f"Temperature alert - Level {level} escalation"
-                )
-                
-                # Log notification in timeline
-                IncidentTimelineEvent.objects.create(
-                    incident=incident,
-                    event_type='notification_sent',
-                    description=f"Notification sent to {operator.name} (Level {level})",
-                    operator=operator
-                )
-                
-            except Exception as e:
-                logger.error(f"Failed to notify operator {operator.id}: {str(e)}")
+    def _store(self, record):
+        """Store one reading tuple, grouped with concurrent requests when group commit is enabled"""
+        committer = get_group_committer()
+        if committer:
+            return committer.submit(record)
+        return ReadingService().ingest([record])[0]
 
     def _determine_severity(self, temperature):
         settings = SystemSettings.get_settings()
@@ -893,16 +645,84 @@ class ESPDataCollectionView(APIView):
         else:
             return 1  # Low severity for normal range (shouldn't typically occur)
 
+class ESPBatchCollectionView(APIView):
+    authentication_classes = [DeviceKeyAuthentication]  # Device keys only, no user accounts
+    permission_classes = [DeviceKeyPermission, KnownDevicePermission]
+    throttle_classes = [IngestBacklogThrottle, DeviceRateThrottle, SourceIPRateThrottle]
+    parser_classes = api_settings.DEFAULT_PARSER_CLASSES + [BinaryReadingParser]
+
+    MAX_BATCH_SIZE = 1000
+
+    def post(self, request):
+        """
+        Batch endpoint for devices that buffer readings.
+        Accepts a JSON list of readings (or {"readings": [...]}) in the
+        ESPDataCollectionView format, or back to back packed records sent as
+        application/vnd.tempmonitor.reading. Valid readings are stored even if
+        some are rejected.
+        """
+        try:
+            if is_binary_request(request):
+                records, rejected = request.data
+                if len(records) + rejected > self.MAX_BATCH_SIZE:
+                    return binary_ack(0, len(records) + rejected, status.HTTP_400_BAD_REQUEST)
+                ReadingService().ingest(records)
+                return binary_ack(
+                    len(records), rejected,
+                    status.HTTP_201_CREATED if records or not rejected else status.HTTP_400_BAD_REQUEST
+                )
+
+            items = request.data.get('readings') if isinstance(request.data, dict) else request.data
+            if not isinstance(items, list):
+                return Response(
+                    {'error': 'Expected a list of readings'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            if len(items) > self.MAX_BATCH_SIZE:
+                return Response(
+                    {'error': f'Batch too large, maximum is {self.MAX_BATCH_SIZE} readings'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+
+            records = []
+            rejected = []
+            for index, item in enumerate(items):
+                try:
+                    records.append(validate_reading(item))
+                except ValueError as e:
+                    rejected.append({'index': index, 'error': str(e)})
+
+            readings = ReadingService().ingest(records)
+
+            # Readings already stored (resent batches) count as accepted
+            return Response(
+                {
+                    'accepted': len(records),
+                    'duplicates': sum(reading is None for reading in readings),
+                    'rejected': rejected
+                },
+                status=status.HTTP_201_CREATED if records or not rejected else status.HTTP_400_BAD_REQUEST
+            )
+
+        except ParseError as e:
+            return Response({'error': str(e.detail)}, status=status.HTTP_400_BAD_REQUEST)
+        except Exception as e:
+            logger.error(f"Error processing ESP8266 batch: {str(e)}")
+            return Response(
+                {'error': 'Internal server error'},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+
 class TemperatureStatsView(APIView):
     def get(self, request):
         period = request.query_params.get('period', '24h')
         start_date = request.query_params.get('start_date')
         end_date = request.query_params.get('end_date')
         device_id = request.query_params.get('device_id')
-        
-        # Get current time as reference point instead of latest reading
-        reference_time = timezone.now()
-        
+
+        # Readings and aggregates come from a response cache shared by everyone viewing the same window
+        stats = StatsCache(device_id)
+
         if start_date and end_date:
             try:
                 start_time = timezone.datetime.fromisoformat(start_date.replace('Z', '+00:00'))
@@ -912,60 +732,110 @@ class TemperatureStatsView(APIView):
                     {'error': 'Invalid date format. Use ISO format (YYYY-MM-DDTHH:mm:ss)'},
                     status=status.HTTP_400_BAD_REQUEST
                 )
-        else:
-            if period == '24h':
-                start_time = reference_time - timedelta(hours=24)
-            elif period == '7d':
-                start_time = reference_time - timedelta(days=7)
-            elif period == '30d':
-                start_time = reference_time - timedelta(days=30)
-            else:
-                return Response(
-                    {'error': 'Invalid period. Must be 24h, 7d, or 30d'},
-                    status=status.HTTP_400_BAD_REQUEST
-                )
-            end_time = reference_time
+            if timezone.is_naive(start_time):
+                start_time = timezone.make_aware(start_time)
+            if timezone.is_naive(end_time):
+                end_time = timezone.make_aware(end_time)
+            return Response(stats.for_range(start_time, end_time))
 
-        # Get readings for the period, order by timestamp ascending
-        readings = Reading.objects.filter(
-            timestamp__gte=start_time,
-            timestamp__lte=end_time
-        )
+        if period not in STATS_PERIODS:
+            return Response(
+                {'error': 'Invalid period. Must be 24h, 7d, or 30d'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        return Response(stats.for_period(period))
 
-        # Filter by device_id if provided
-        if device_id:
-            readings = readings.filter(device_id=device_id)
+class FleetSnapshotView(APIView):
+    permission_classes = [permissions.IsAuthenticated]
 
-        readings = readings.order_by('timestamp')  # Changed to ascending order
+    def get(self, request):
+        """Latest reading, trend, active incident and last contact for every device"""
+        try:
+            return Response(FleetSnapshotService().snapshot())
+        except Exception as e:
+            logger.error(f"Error building fleet snapshot: {str(e)}")
+            return Response(
+                {'error': 'Failed to build fleet snapshot'},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
 
-        if not readings.exists():
-            return Response({
-                'readings': [],
-                'average_temperature': 0,
-                'max_temperature': 0,
-                'min_temperature': 0
-            })
+class ComplianceReportView(APIView):
+    permission_classes = [permissions.IsAuthenticated]
 
-        # Calculate statistics
-        stats = readings.aggregate(
-            avg_temp=Avg('temperature'),
-            max_temp=Max('temperature'),
-            min_temp=Min('temperature')
-        )
+    def get(self, request):
+        """Mean Kinetic Temperature, time out of range and longest excursion per device"""
+        try:
+            start = timezone.datetime.fromisoformat(request.query_params['start'].replace('Z', '+00:00'))
+            end = timezone.datetime.fromisoformat(request.query_params['end'].replace('Z', '+00:00'))
+        except KeyError:
+            return Response({'error': 'start and end are required'}, status=status.HTTP_400_BAD_REQUEST)
+        except ValueError:
+            return Response(
+                {'error': 'Invalid date format. Use ISO format (YYYY-MM-DDTHH:mm:ss)'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if timezone.is_naive(start):
+            start = timezone.make_aware(start)
+        if timezone.is_naive(end):
+            end = timezone.make_aware(end)
+        if start >= end:
+            return Response({'error': 'start must be before end'}, status=status.HTTP_400_BAD_REQUEST)
+
+        system_settings = SystemSettings.get_settings()
+        try:
+            range_min = float(request.query_params.get('range_min', system_settings.normal_temp_min))
+            range_max = float(request.query_params.get('range_max', system_settings.normal_temp_max))
+        except ValueError:
+            return Response({'error': 'range_min and range_max must be numbers'}, status=status.HTTP_400_BAD_REQUEST)
+        device_ids = [d for d in request.query_params.get('device_id', '').split(',') if d and d != 'ALL']
+
+        devices = ComplianceReport(start, end, range_min, range_max, device_ids).run()
+        return Response({
+            'start': start,
+            'end': end,
+            'range_min': range_min,
+            'range_max': range_max,
+            'devices': devices,
+        })
 
-        # Serialize the readings
-        serializer = ReadingSerializer(readings, many=True)
+class AvailabilityReportView(APIView):
+    permission_classes = [permissions.IsAuthenticated]
 
+    def get(self, request):
+        """Uptime per device and day, and the gaps in each device's readings"""
+        try:
+            start = timezone.datetime.fromisoformat(request.query_params['start'].replace('Z', '+00:00'))
+            end = timezone.datetime.fromisoformat(request.query_params['end'].replace('Z', '+00:00'))
+        except KeyError:
+            return Response({'error': 'start and end are required'}, status=status.HTTP_400_BAD_REQUEST)
+        except ValueError:
+            return Response(
+                {'error': 'Invalid date format. Use ISO format (YYYY-MM-DDTHH:mm:ss)'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if timezone.is_naive(start):
+            start = timezone.make_aware(start)
+        if timezone.is_naive(end):
+            end = timezone.make_aware(end)
+        if start >= end:
+            return Response({'error': 'start must be before end'}, status=status.HTTP_400_BAD_REQUEST)
+
+        device_ids = [d for d in request.query_params.get('device_id', '').split(',') if d and d != 'ALL']
+        devices = AvailabilityReport(start, end, device_ids).run()
         return Response({
-            'readings': serializer.data,
-            'average_temperature': round(stats['avg_temp'], 2) if stats['avg_temp'] else 0,
-            'max_temperature': round(stats['max_temp'], 2) if stats['max_temp'] else 0,
-            'min_temperature': round(stats['min_temp'], 2) if stats['min_temp'] else 0
+            'start': start,
+            'end': end,
+            'gap_intervals': settings.READING_GAP_INTERVALS,
+            'devices': devices,
         })
 
 class ReadingExportView(APIView):
     permission_classes = [permissions.IsAuthenticated]
 
+    def perform_content_negotiation(self, request, force=False):
+        # ?format=csv|pdf selects the export type, not a DRF renderer
+        return super().perform_content_negotiation(request, force=True)
+
     def get(self, request):
         try:
             # Get parameters from query params
@@ -997,6 +867,7 @@ class ReadingExportView(APIView):
             if device_id:
                 queryset = queryset.filter(device_id=device_id)
 
+            self.alert_status = self._alert_statuses(start_time, end_time, device_id)
             if export_format == 'csv':
                 return self._export_csv(queryset)
             elif export_format == 'json':
@@ -1020,6 +891,38 @@ class ReadingExportView(APIView):
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
 
+    def _alert_statuses(self, start_time, end_time, device_id):
+        """
+        Function giving the alert status of an exported reading: the type of
+        an alert raised by it, or of the temperature excursion it is part of.
+        """
+        alerts = Alert.objects.filter(timestamp__lte=end_time).filter(
+            Q(timestamp__gte=start_time) | Q(last_timestamp__gte=start_time)
+        ).select_related('device').order_by('timestamp')
+        if device_id:
+            alerts = alerts.filter(device__device_id=device_id)
+        by_reading, excursions = {}, {}
+        for alert in alerts:
+            by_reading.setdefault(alert.reading_id, alert.get_alert_type_display())
+            if alert.alert_type in ReadingService.EXCURSION_ALERT_TYPES:
+                excursions.setdefault(alert.device.device_id, []).append(
+                    (alert.timestamp, alert.last_timestamp or alert.timestamp, alert.get_alert_type_display())
+                )
+
+        starts = {device: [started for started, _, _ in spans] for device, spans in excursions.items()}
+
+        def alert_status(reading):
+            if reading.id in by_reading:
+                return by_reading[reading.id]
+            # A device's excursions do not overlap: only the last one starting by then can cover it
+            index = bisect_right(starts.get(reading.device_id, ()), reading.timestamp) - 1
+            if index >= 0:
+                _, ended, display = excursions[reading.device_id][index]
+                if reading.timestamp <= ended:
+                    return display
+            return 'Normal'
+        return alert_status
+
     def _export_csv(self, queryset):
         response = HttpResponse(content_type='text/csv')
         response['Content-Disposition'] = 'attachment; filename="temperature_readings.csv"'
@@ -1029,8 +932,7 @@ class ReadingExportView(APIView):
                         'Power Status', 'Battery Level (%)', 'Alert Status'])
 
         for reading in queryset:
-            alert = reading.alert_set.first()
-            alert_status = alert.get_type_display() if alert else 'Normal'
+            alert_status = self.alert_status(reading)
             
             writer.writerow([
                 reading.timestamp.strftime('%Y-%m-%d %H:%M:%S'),
@@ -1047,8 +949,7 @@ class ReadingExportView(APIView):
     def _export_json(self, queryset):
         data = []
         for reading in queryset:
-            alert = reading.alert_set.first()
-            alert_status = alert.get_type_display() if alert else 'Normal'
+            alert_status = self.alert_status(reading)
             
             data.append({
                 'timestamp': reading.timestamp.strftime('%Y-%m-%d %H:%M:%S'),
@@ -1096,8 +997,7 @@ class ReadingExportView(APIView):
                 y = 800
                 p.setFont("Helvetica", 10)
 
-            alert = reading.alert_set.first()
-            alert_status = alert.get_type_display() if alert else 'Normal'
+            alert_status = self.alert_status(reading)
             
             p.drawString(100, y, f"Timestamp: {reading.timestamp.strftime('%Y-%m-%d %H:%M:%S')}")
             y -= 15
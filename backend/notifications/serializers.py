@@ -1,7 +1,7 @@
 from rest_framework import serializers
 from django.contrib.auth import get_user_model
 from .models import Operator, Notification
-from monitoring.serializers import AlertSerializer
+from monitoring.serializers import AlertSerializer, BatteryForecastListSerializer
 
 User = get_user_model()
 
@@ -65,6 +65,9 @@ class OperatorSerializer(serializers.ModelSerializer):
             )
         return value
 
+class NotificationListSerializer(BatteryForecastListSerializer):
+    device_path = ('alert', 'device')
+
 class NotificationSerializer(serializers.ModelSerializer):
     operator = OperatorSerializer(read_only=True)
     alert = AlertSerializer(read_only=True)
@@ -83,4 +86,5 @@ class NotificationSerializer(serializers.ModelSerializer):
             'id', 'operator', 'alert', 'notification_type', 'status',
             'sent_at', 'delivered_at', 'read_at', 'retry_count',
             'created_at', 'updated_at'
-        ]
\ No newline at end of file
+        ]
+        list_serializer_class = NotificationListSerializer
\ No newline at end of file
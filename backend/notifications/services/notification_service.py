@@ -39,6 +39,13 @@ class NotificationService:
             logger.error(f"Failed to process alert: {str(e)}")
             raise
 
+    def alert_notifications(self, alert):
+        """Unsaved PENDING notifications process_alert would create, for callers storing them in bulk"""
+        return [
+            Notification(operator=operator, alert=alert, status='PENDING')
+            for operator in self._get_operators_for_alert(alert)
+        ]
+
     def _get_operators_for_alert(self, alert):
         """Get operators based on alert severity"""
         print(f"\n=== Getting operators for alert severity {alert.severity} ===")
@@ -160,29 +167,37 @@ Priority: {operator.get_priority_display()}
                 notification_type='EMAIL',
                 status='PENDING'
             )
-            
-            # Send email
-            email_success = self.email_service.send_email(
-                operator=operator,
-                subject=f"Incident Alert: {incident.description}",
-                message=self._format_incident_message(incident, operator, message),
-                incident=incident
-            )
-            
-            if email_success:
-                notification.status = 'SENT'
-                notification.sent_at = timezone.now()
-                notification.save()
-                return True
-            else:
-                notification.status = 'FAILED'
-                notification.retry_count = 1
-                notification.save()
-                return False
-            
+            success = self.deliver(notification)
+            notification.save()
+            return success
+
         except Exception as e:
             logger.error(f"Failed to notify operator {operator.id}: {str(e)}")
             return False
+
+    def deliver(self, notification):
+        """
+        Send a stored incident notification and record the outcome on it
+        (status, sent_at, retry_count) without saving it
+        Returns:
+            bool: True if notification was successful
+        """
+        operator, incident = notification.operator, notification.incident
+        email_success = self.email_service.send_email(
+            operator=operator,
+            subject=f"Incident Alert: {incident.description}",
+            message=self._format_incident_message(incident, operator, notification.message),
+            incident=incident
+        )
+
+        if email_success:
+            notification.status = 'SENT'
+            notification.sent_at = timezone.now()
+            return True
+        else:
+            notification.status = 'FAILED'
+            notification.retry_count = 1
+            return False
             
     def _format_incident_message(self, incident, operator, message):
         """Format an incident notification message"""
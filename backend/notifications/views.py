@@ -7,6 +7,9 @@ from .serializers import OperatorSerializer, NotificationSerializer
 from .permissions import IsAdminUser, IsOperatorOwner
 from .services.notification_service import NotificationService
 from django.utils import timezone
+from monitoring.conditional import (
+    conditional, bump_resource_version, INCIDENTS, notifications_etag, notifications_last_modified
+)
 
 User = get_user_model()
 
@@ -71,7 +74,9 @@ class OperatorViewSet(viewsets.ModelViewSet):
         Notification.objects.filter(
             operator=operator,
             status='PENDING'
-        ).update(status='CANCELLED')
+        ).update(status='CANCELLED', updated_at=timezone.now())
+        # Bulk updates send no signals
+        bump_resource_version(INCIDENTS)
         
         return Response({'status': 'alerts reset successfully'})
 
@@ -82,7 +87,14 @@ class NotificationViewSet(viewsets.ReadOnlyModelViewSet):
     def get_queryset(self):
         if self.request.user.is_staff:
             return Notification.objects.all()
-        return Notification.objects.filter(operator__user=self.request.user)
+        # The operator comes with the authenticated user, so filter on its id without a join
+        if not hasattr(self.request.user, 'operator'):
+            return Notification.objects.none()
+        return Notification.objects.filter(operator_id=self.request.user.operator.id)
+
+    @conditional(notifications_etag, notifications_last_modified)
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
 
     @action(detail=True, methods=['post'])
     def read(self, request, pk=None):
@@ -113,17 +113,89 @@ DEFAULT_FROM_EMAIL = EMAIL_HOST_USER
 # Add telegram settings
 TELEGRAM_BOT_TOKEN = os.environ.get('TELEGRAM_BOT_TOKEN')
 
+# Group commit for concurrent single-reading ingests (monitoring.services.group_commit)
+READING_GROUP_COMMIT = os.environ.get('READING_GROUP_COMMIT', 'False').lower() in ('1', 'true')
+READING_GROUP_COMMIT_DELAY_MS = float(os.environ.get('READING_GROUP_COMMIT_DELAY_MS', 5))
+READING_GROUP_COMMIT_MAX_BATCH = int(os.environ.get('READING_GROUP_COMMIT_MAX_BATCH', 200))
+
+# Device ingest protection (monitoring.throttling); rates are readings per second
+INGEST_RATE_LIMIT = {
+    'DEVICE_RATE': float(os.environ.get('INGEST_DEVICE_RATE', 1.0)),
+    'DEVICE_BURST': int(os.environ.get('INGEST_DEVICE_BURST', 1000)),
+    'IP_RATE': float(os.environ.get('INGEST_IP_RATE', 200.0)),
+    'IP_BURST': int(os.environ.get('INGEST_IP_BURST', 5000)),
+    'STORE': os.environ.get('INGEST_RATE_LIMIT_STORE', 'local'),
+    'MAX_BACKLOG': int(os.environ.get('INGEST_MAX_BACKLOG', 5000)),
+    # New devices registered on first contact, per source address and overall
+    'REGISTER_RATE': float(os.environ.get('INGEST_REGISTER_RATE', 0.1)),
+    'REGISTER_BURST': int(os.environ.get('INGEST_REGISTER_BURST', 100)),
+    'REGISTER_GLOBAL_RATE': float(os.environ.get('INGEST_REGISTER_GLOBAL_RATE', 1.0)),
+    'REGISTER_GLOBAL_BURST': int(os.environ.get('INGEST_REGISTER_GLOBAL_BURST', 1000)),
+    'UNKNOWN_DEVICE_TTL': 60,
+}
+# When disabled, readings are only accepted from devices that already exist
+INGEST_AUTO_REGISTER_DEVICES = os.environ.get('INGEST_AUTO_REGISTER_DEVICES', 'True').lower() in ('1', 'true')
+
+# Per-device ingest credentials (monitoring.device_auth)
+INGEST_REQUIRE_DEVICE_KEY = os.environ.get('INGEST_REQUIRE_DEVICE_KEY', 'False').lower() in ('1', 'true')
+DEVICE_SIGNATURE_MAX_SKEW = int(os.environ.get('DEVICE_SIGNATURE_MAX_SKEW', 300))  # seconds
+DEVICE_KEY_CACHE_TTL = int(os.environ.get('DEVICE_KEY_CACHE_TTL', 300))  # seconds
+# Seconds a process trusts its copy of the device keys before checking the shared cache for rotations
+DEVICE_KEY_CHECK_INTERVAL = float(os.environ.get('DEVICE_KEY_CHECK_INTERVAL', 1.0))
+
+# Power and battery monitoring (monitoring.services.power)
+LOW_BATTERY_LEVEL = float(os.environ.get('LOW_BATTERY_LEVEL', 20))  # percent, while on battery
+BATTERY_FORECAST_WINDOW = int(os.environ.get('BATTERY_FORECAST_WINDOW', 24))  # hours of readings to fit drain to
+
+# Sensor plausibility checks on ingest (monitoring.services.anomaly)
+SENSOR_FAULT_DETECTION = {
+    'SPIKE_DELTA': float(os.environ.get('SENSOR_SPIKE_DELTA', 5.0)),  # °C from the recent median
+    'SPIKE_SIGMAS': float(os.environ.get('SENSOR_SPIKE_SIGMAS', 6.0)),
+    'FLATLINE_SECONDS': int(os.environ.get('SENSOR_FLATLINE_SECONDS', 3 * 3600)),
+    'DRIFT_DELTA': float(os.environ.get('SENSOR_DRIFT_DELTA', 1.5)),  # °C between fast and slow averages
+}
+
+# Minutes ahead a predicted departure from the normal range raises a pre-alert (monitoring.services.trend)
+PREDICTIVE_ALERT_HORIZON = int(os.environ.get('PREDICTIVE_ALERT_HORIZON', 30))
+
+# Readings further apart than this many reading intervals are a gap (monitoring.services.availability)
+READING_GAP_INTERVALS = float(os.environ.get('READING_GAP_INTERVALS', 3))
+
+# Minutes an incident may stay unacknowledged before escalating to level 2 and 3 operators
+# (monitoring.services.escalation), counted from the start of the excursion
+ESCALATION_LEVEL2_AFTER = float(os.environ.get('ESCALATION_LEVEL2_AFTER', 15))
+ESCALATION_LEVEL3_AFTER = float(os.environ.get('ESCALATION_LEVEL3_AFTER', 45))
+# Seconds between full reloads of the escalation scheduler's pending deadlines
+ESCALATION_RESYNC_INTERVAL = float(os.environ.get('ESCALATION_RESYNC_INTERVAL', 300))
+
+# Cache shared by all workers (system settings, authenticated users, rate limits).
+# Without REDIS_URL every process falls back to its own local memory cache.
+REDIS_URL = os.environ.get('REDIS_URL')
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        }
+    }
+
+# Seconds a process serves its copy of SystemSettings before checking for a newer version
+SYSTEM_SETTINGS_CHECK_INTERVAL = float(os.environ.get('SYSTEM_SETTINGS_CHECK_INTERVAL', 1.0))
+
 # Add to your existing settings
 AUTH_USER_MODEL = 'authentication.User'
 
 # Add REST Framework settings
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'authentication.backends.CachedJWTAuthentication',
     ],
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
     ],
+    # Reverse proxies in front of the app. Client addresses (monitoring.throttling) come from REMOTE_ADDR,
+    # or from X-Forwarded-For as appended by the last of these proxies; never from what the client sends
+    'NUM_PROXIES': int(os.environ.get('NUM_PROXIES', 0)),
 }
 
 # JWT Settings
@@ -132,6 +204,8 @@ SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(hours=1),
     'REFRESH_TOKEN_LIFETIME': timedelta(days=1),
 }
+# Seconds an authenticated user (and operator) is served from the cache
+AUTH_USER_CACHE_TTL = int(os.environ.get('AUTH_USER_CACHE_TTL', 60))
 
 
 # Password validation
@@ -1,7 +1,16 @@
-from django.db import models
+import time
+from django.conf import settings as django_settings
+from django.db import models, transaction
 from django.core.validators import MinValueValidator, MaxValueValidator
 from django.core.cache import cache
 
+# Shared (L2) cache keys; the version changes on every save
+CACHE_KEY = 'system_settings'
+VERSION_CACHE_KEY = 'system_settings:version'
+
+# Process-local (L1) copy: (version, settings, monotonic time last checked against the version)
+_local = None
+
 class SystemSettings(models.Model):
     # Temperature Thresholds
     normal_temp_min = models.FloatField(
@@ -42,14 +51,45 @@ class SystemSettings(models.Model):
         verbose_name_plural = 'System Settings'
 
     def save(self, *args, **kwargs):
-        cache.delete('system_settings')
         super().save(*args, **kwargs)
+        # Publish once committed, so no worker can pick up settings that are rolled back
+        transaction.on_commit(self._publish)
+
+    def _publish(self):
+        global _local
+        version = time.time_ns()
+        cache.set(CACHE_KEY, (version, self), timeout=None)
+        cache.set(VERSION_CACHE_KEY, version, timeout=None)
+        _local = (version, self, time.monotonic())
 
     @classmethod
     def get_settings(cls):
-        """Get settings from cache or database"""
-        settings = cache.get('system_settings')
-        if not settings:
+        """
+        Get settings from this process' copy. At most every
+        SYSTEM_SETTINGS_CHECK_INTERVAL seconds the copy's version is compared with
+        the shared cache, where save() publishes new versions, and reloaded if it
+        changed.
+        """
+        global _local
+        now = time.monotonic()
+        if _local and now - _local[2] < django_settings.SYSTEM_SETTINGS_CHECK_INTERVAL:
+            return _local[1]
+
+        version = cache.get(VERSION_CACHE_KEY)
+        if _local and version is not None and version == _local[0]:
+            _local = (version, _local[1], now)
+            return _local[1]
+
+        cached = cache.get(CACHE_KEY)
+        if version is not None and cached and cached[0] == version:
+            settings = cached[1]
+        else:
             settings, _ = cls.objects.get_or_create(pk=1)
-            cache.set('system_settings', settings, timeout=3600)
-        return settings 
\ No newline at end of file
+            if version is None:
+                # Nothing published yet (or evicted): start a version every process will share
+                cache.add(VERSION_CACHE_KEY, time.time_ns(), timeout=None)
+                version = cache.get(VERSION_CACHE_KEY)
+            cache.set(CACHE_KEY, (version, settings), timeout=None)
+
+        _local = (version, settings, now)
+        return settings
@@ -7,4 +7,5 @@ urlpatterns = [
         'put': 'update',
         'patch': 'partial_update'
     })),
+    path('simulate/', SystemSettingsViewSet.as_view({'post': 'simulate'})),
 ] 
\ No newline at end of file
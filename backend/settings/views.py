@@ -4,6 +4,10 @@ from rest_framework.permissions import IsAdminUser
 from rest_framework.decorators import action
 from .models import SystemSettings
 from .serializers import SystemSettingsSerializer
+from monitoring.services.simulation import SETTINGS_FIELDS, simulate_settings
+
+# Longest history a what-if simulation replays
+MAX_SIMULATION_DAYS = 90
 
 class SystemSettingsViewSet(viewsets.GenericViewSet,
                           mixins.ListModelMixin,
@@ -24,7 +28,8 @@ class SystemSettingsViewSet(viewsets.GenericViewSet,
     def update(self, request, *args, **kwargs):
         """Update settings"""
         partial = kwargs.pop('partial', False)
-        instance = self.get_object()
+        # Update a fresh row, not the copy shared by every request in this process
+        instance, _ = SystemSettings.objects.get_or_create(pk=1)
         serializer = self.get_serializer(instance, data=request.data, partial=partial)
         serializer.is_valid(raise_exception=True)
         serializer.save()
@@ -33,4 +38,31 @@ class SystemSettingsViewSet(viewsets.GenericViewSet,
     def partial_update(self, request, *args, **kwargs):
         """Partial update settings"""
         kwargs['partial'] = True
-        return self.update(request, *args, **kwargs)
\ No newline at end of file
+        return self.update(request, *args, **kwargs)
+
+    def simulate(self, request):
+        """
+        Alerts, incidents and escalations the submitted settings would have
+        produced over the last `days` days (default 30), next to the current ones.
+        Nothing is saved.
+        """
+        try:
+            days = int(request.data.get('days', 30))
+        except (TypeError, ValueError):
+            return Response({'error': 'days must be a whole number'}, status=status.HTTP_400_BAD_REQUEST)
+        if not 1 <= days <= MAX_SIMULATION_DAYS:
+            return Response(
+                {'error': f'days must be between 1 and {MAX_SIMULATION_DAYS}'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        current = self.get_object()
+        serializer = self.get_serializer(current, data=request.data, partial=True)
+        serializer.is_valid(raise_exception=True)
+        proposed = {field: serializer.validated_data.get(field, getattr(current, field)) for field in SETTINGS_FIELDS}
+        if proposed['normal_temp_min'] >= proposed['normal_temp_max'] or proposed['critical_temp_min'] >= proposed['critical_temp_max']:
+            return Response({'error': 'Minimum temperatures must be less than maximums'}, status=status.HTTP_400_BAD_REQUEST)
+
+        device_id = request.data.get('device_id')
+        device_ids = [d for d in device_id.split(',') if d and d != 'ALL'] if device_id else None
+        return Response(simulate_settings(proposed, current, days, device_ids))